@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Metadata Backfill for Objects Already in the Media Bucket
+
+Objects uploaded before upload_media.py applied its CDN caching policy (including
+the cdn.lqdev.tech assets referenced from _src/media and _src/albums) have no
+Content-Type, Cache-Control or Content-Disposition. This command rewrites their
+metadata in place with the same per-type policy as new uploads (object_headers in
+upload_media.py):
+
+1. Lists objects under a prefix, one page at a time (list_objects_v2 pagination)
+2. HEADs each object and compares its headers with the policy
+3. Rewrites objects that differ with copy_object onto the same key
+   (MetadataDirective=REPLACE), several in parallel. Headers the policy does not
+   manage (Content-Encoding, Content-Language, ...) are sent again so the copy
+   keeps them
+
+Precompressed copies (logo.svg.gz, logo.svg.br) follow the policy of their
+original and keep their Content-Encoding.
+
+Progress is checkpointed after every page, so a long backfill can be stopped and
+resumed. --dry-run only reports what would change.
+
+Usage:
+    python backfill_media_metadata.py [--prefix files/] [--dry-run] [--workers 8]
+                                      [--checkpoint PATH] [--restart] [--report PATH]
+
+Uses the same LINODE_STORAGE_* environment variables as upload_media.py.
+"""
+
+import os
+import sys
+import json
+import argparse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from media_journal import write_text_atomic
+from media_throttle import GuardedS3Client, configure_host_guard, print_throttle_report
+from upload_media import (
+    MAX_COPY_SIZE, create_s3_client, get_media_type_folder, object_headers, precompressed_original
+)
+
+
+DEFAULT_PREFIX = 'files/'
+DEFAULT_WORKERS = 8
+DEFAULT_PAGE_SIZE = 1000
+DEFAULT_CHECKPOINT = 'media-metadata-backfill.json'
+
+# Headers copy_object drops with MetadataDirective=REPLACE unless they are sent again,
+# as named in head_object responses
+CARRIED_HEADERS = (
+    'ContentType', 'CacheControl', 'ContentDisposition', 'ContentEncoding', 'ContentLanguage',
+    'Expires', 'WebsiteRedirectLocation',
+)
+
+
+def policy_headers(s3_key, immutable=True):
+    """Headers the policy wants on s3_key; precompressed copies follow their original."""
+    original = precompressed_original(s3_key)
+    if original is None:
+        return object_headers(s3_key, immutable=immutable)
+    base_key, encoding = original
+    return dict(object_headers(base_key, immutable=immutable), ContentEncoding=encoding)
+
+
+def planned_changes(s3_key, head, immutable=True):
+    """
+    Compare an object's current headers with the policy.
+    Returns {header: (current, wanted)} for every header that differs.
+    """
+    wanted = policy_headers(s3_key, immutable)
+    return {
+        name: (head.get(name), value)
+        for name, value in wanted.items()
+        if head.get(name) != value
+    }
+
+
+def rewrite_object_metadata(s3_client, bucket_name, s3_key, immutable=True, dry_run=False):
+    """
+    Bring one object's headers in line with the policy.
+
+    User metadata (x-amz-meta-*) and headers outside the policy are carried over.
+    Returns (status, changes) where status is 'unchanged', 'updated', 'would-update'
+    or 'skipped'.
+    """
+    head = s3_client.head_object(Bucket=bucket_name, Key=s3_key)
+    changes = planned_changes(s3_key, head, immutable)
+    if not changes:
+        return 'unchanged', changes
+    if head.get('ContentLength', 0) > MAX_COPY_SIZE:
+        # A single copy_object cannot rewrite objects this large
+        return 'skipped', changes
+    if dry_run:
+        return 'would-update', changes
+    headers = {name: head[name] for name in CARRIED_HEADERS if head.get(name) is not None}
+    headers.update((name, wanted) for name, (_, wanted) in changes.items())
+    s3_client.copy_object(
+        Bucket=bucket_name,
+        Key=s3_key,
+        CopySource={'Bucket': bucket_name, 'Key': s3_key},
+        MetadataDirective='REPLACE',
+        Metadata=head.get('Metadata', {}),
+        ACL='public-read',  # copy_object does not carry the ACL over
+        **headers
+    )
+    return 'updated', changes
+
+
+def load_checkpoint(path, prefix):
+    """Return the saved checkpoint for prefix, or a fresh one."""
+    fresh = {'prefix': prefix, 'last_key': None, 'counts': {}}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            checkpoint = json.load(f)
+    except FileNotFoundError:
+        return fresh
+    except (OSError, ValueError) as e:
+        print(f"⚠️  Ignoring unreadable checkpoint {path}: {e}")
+        return fresh
+    if checkpoint.get('prefix') != prefix:
+        print(f"⚠️  Checkpoint {path} is for prefix '{checkpoint.get('prefix')}'; starting over")
+        return fresh
+    return checkpoint
+
+
+def iter_object_pages(s3_client, bucket_name, prefix, start_after=None, page_size=DEFAULT_PAGE_SIZE):
+    """Yield lists of object keys under prefix, in key order, one list_objects_v2 page at a time."""
+    kwargs = {'Bucket': bucket_name, 'Prefix': prefix, 'MaxKeys': page_size}
+    if start_after:
+        kwargs['StartAfter'] = start_after
+    while True:
+        response = s3_client.list_objects_v2(**kwargs)
+        keys = [obj['Key'] for obj in response.get('Contents', [])]
+        if keys:
+            yield keys
+        if not response.get('IsTruncated'):
+            return
+        kwargs.pop('StartAfter', None)
+        kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+
+def backfill(s3_client, bucket_name, prefix=DEFAULT_PREFIX, workers=DEFAULT_WORKERS, dry_run=False,
+             immutable=True, checkpoint_path=None, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Rewrite metadata for every object under prefix. Returns a report dict with
+    per-status counts, per-folder counts of changed objects and the planned changes.
+
+    With checkpoint_path, the last key of every finished page is saved so an
+    interrupted backfill resumes after it. The checkpoint never moves past a failed
+    object, so a rerun retries it. Dry runs never write a checkpoint.
+    """
+    checkpoint = load_checkpoint(checkpoint_path, prefix) if checkpoint_path else {'last_key': None, 'counts': {}}
+    counts = Counter(checkpoint.get('counts', {}))
+    if checkpoint.get('last_key'):
+        print(f"📍 Resuming after {checkpoint['last_key']} ({sum(counts.values())} object(s) already done)")
+
+    folders = Counter()
+    changes_report = {}
+    checkpoint_blocked = False
+
+    def process(s3_key):
+        try:
+            return s3_key, rewrite_object_metadata(s3_client, bucket_name, s3_key, immutable, dry_run), None
+        except Exception as e:
+            return s3_key, None, e
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for keys in iter_object_pages(s3_client, bucket_name, prefix, checkpoint.get('last_key'), page_size):
+            done_through = checkpoint.get('last_key')
+            for s3_key, result, error in executor.map(process, keys):
+                if error is not None:
+                    counts['failed'] += 1
+                    checkpoint_blocked = True
+                    print(f"  ❌ {s3_key}: {error}")
+                    continue
+                if not checkpoint_blocked:
+                    done_through = s3_key
+                status, changes = result
+                counts[status] += 1
+                if changes:
+                    folders[get_media_type_folder(s3_key, os.path.basename(s3_key))] += 1
+                    changes_report[s3_key] = {'status': status, 'changes': changes}
+                    summary = ', '.join(f"{name} {old!r} → {new!r}" for name, (old, new) in changes.items())
+                    print(f"  {'📝' if status != 'skipped' else '⚠️ '} {status}: {s3_key}: {summary}")
+
+            if checkpoint_path and not dry_run:
+                checkpoint['last_key'] = done_through
+                checkpoint['counts'] = dict(counts)
+                write_text_atomic(checkpoint_path, json.dumps(checkpoint, indent=2))
+            print(f"📄 Page done through {keys[-1]} ({sum(counts.values())} object(s) checked)")
+
+    return {'counts': dict(counts), 'folders': dict(folders), 'changes': changes_report}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill CDN caching metadata on existing media objects.")
+    parser.add_argument('--prefix', default=DEFAULT_PREFIX, help="Key prefix to backfill (default: files/)")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="Parallel copy_object calls (default: 8)")
+    parser.add_argument('--dry-run', action='store_true', help="Report what would change without rewriting anything")
+    parser.add_argument('--revalidate', action='store_true',
+                        help="Use a short max-age instead of immutable caching (for keys that get overwritten)")
+    parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT, help="Checkpoint file for resuming")
+    parser.add_argument('--restart', action='store_true', help="Ignore an existing checkpoint")
+    parser.add_argument('--report', help="Write the report as JSON to this path")
+    args = parser.parse_args()
+
+    access_key = os.environ.get('LINODE_STORAGE_ACCESS_KEY_ID')
+    secret_key = os.environ.get('LINODE_STORAGE_SECRET_ACCESS_KEY')
+    endpoint_url = os.environ.get('LINODE_STORAGE_ENDPOINT_URL')
+    bucket_name = os.environ.get('LINODE_STORAGE_BUCKET_NAME')
+    if not all([access_key, secret_key, endpoint_url, bucket_name]):
+        print("❌ Missing required environment variables:")
+        print("   - LINODE_STORAGE_ACCESS_KEY_ID")
+        print("   - LINODE_STORAGE_SECRET_ACCESS_KEY")
+        print("   - LINODE_STORAGE_ENDPOINT_URL")
+        print("   - LINODE_STORAGE_BUCKET_NAME")
+        sys.exit(1)
+
+    if args.restart and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+
+    s3_client = create_s3_client(endpoint_url, access_key, secret_key, max_pool_connections=max(10, args.workers))
+    host = urlparse(endpoint_url).hostname or endpoint_url
+    s3_client = GuardedS3Client(s3_client, configure_host_guard(host, max_concurrency=max(1, args.workers)))
+
+    mode = "Dry run" if args.dry_run else "Backfilling"
+    print(f"🔧 {mode}: metadata for s3://{bucket_name}/{args.prefix} with {args.workers} worker(s)")
+    report = backfill(
+        s3_client, bucket_name, args.prefix, args.workers, args.dry_run,
+        immutable=not args.revalidate, checkpoint_path=args.checkpoint
+    )
+
+    print("\n📊 Backfill report:")
+    for status, count in sorted(report['counts'].items()):
+        print(f"  - {status}: {count}")
+    for folder, count in sorted(report['folders'].items()):
+        print(f"  - {folder}/: {count} object(s) {'to change' if args.dry_run else 'changed'}")
+    print_throttle_report()
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"📄 Report written to {args.report}")
+
+    if not args.dry_run and not report['counts'].get('failed'):
+        # Finished cleanly - the next run should start from the beginning
+        if os.path.exists(args.checkpoint):
+            os.remove(args.checkpoint)
+    sys.exit(1 if report['counts'].get('failed') else 0)
+
+
+if __name__ == '__main__':
+    main()
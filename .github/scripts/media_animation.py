@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Animated GIF Conversion
+
+Screen recordings dragged into an issue as GIFs are often 10-30 MB: GIF stores
+every frame as a 256-color LZW image. upload_media.py uses this module to
+transcode animated GIFs to a format browsers play at a fraction of the size:
+
+- animated WebP, with Pillow
+- a muted, looping H.264 MP4, when ffmpeg is installed (MEDIA_UPLOAD_FFMPEG
+  names another binary)
+
+Every available format is encoded in the shared image process pool and the
+smallest result wins, provided it is smaller than the GIF. The GIF itself is
+still uploaded and becomes the fallback of the :::media item. Still GIFs are
+left alone.
+"""
+
+import io
+import os
+import time
+import shutil
+import tempfile
+import subprocess
+from dataclasses import dataclass
+
+from media_images import get_image_pool
+
+try:
+    from PIL import Image, ImageSequence, features
+except ImportError:  # Animated WebP is skipped without Pillow
+    Image = None
+
+
+ANIMATION_FORMATS = {
+    'webp': {'extension': '.webp', 'content_type': 'image/webp', 'media_type': 'image'},
+    'mp4': {'extension': '.mp4', 'content_type': 'video/mp4', 'media_type': 'video'},
+}
+
+ANIMATED_WEBP_QUALITY = 75
+
+# Longest an ffmpeg run may take before the GIF is uploaded as it is
+FFMPEG_TIMEOUT = 300
+
+# H.264 needs even dimensions; muted, faststart, widely playable pixel format
+FFMPEG_ARGS = (
+    '-an', '-movflags', '+faststart', '-pix_fmt', 'yuv420p',
+    '-vf', 'scale=trunc(iw/2)*2:trunc(ih/2)*2', '-c:v', 'libx264', '-crf', '23',
+)
+
+GIF_TRAILER = 0x3B
+GIF_EXTENSION = 0x21
+GIF_IMAGE = 0x2C
+
+
+@dataclass
+class ConvertedAnimation:
+    """The smallest encoding of an animated GIF."""
+    format: str
+    data: bytes
+    original_size: int
+
+    @property
+    def extension(self):
+        return ANIMATION_FORMATS[self.format]['extension']
+
+    @property
+    def content_type(self):
+        return ANIMATION_FORMATS[self.format]['content_type']
+
+    @property
+    def media_type(self):
+        return ANIMATION_FORMATS[self.format]['media_type']
+
+
+def _skip_sub_blocks(data, pos):
+    """Position just past a chain of GIF data sub-blocks."""
+    while pos < len(data):
+        length = data[pos]
+        pos += 1 + length
+        if length == 0:
+            break
+    return pos
+
+
+def gif_frame_count(data, limit=None):
+    """
+    Number of images in a GIF, counted from the block structure without
+    decoding anything. Stops early once limit frames are found. 0 for non-GIFs.
+    """
+    if data[:6] not in (b'GIF87a', b'GIF89a') or len(data) < 13:
+        return 0
+    pos = 13
+    if data[10] & 0x80:
+        pos += 3 * (2 << (data[10] & 0x07))  # Global color table
+    frames = 0
+    while pos < len(data):
+        block = data[pos]
+        if block == GIF_IMAGE:
+            frames += 1
+            if limit is not None and frames >= limit:
+                break
+            if pos + 10 > len(data):
+                break
+            flags = data[pos + 9]
+            pos += 10
+            if flags & 0x80:
+                pos += 3 * (2 << (flags & 0x07))  # Local color table
+            pos = _skip_sub_blocks(data, pos + 1)  # LZW minimum code size, then image data
+        elif block == GIF_EXTENSION:
+            pos = _skip_sub_blocks(data, pos + 2)
+        else:
+            break  # Trailer or corrupt data
+    return frames
+
+
+def is_animated_gif(data):
+    """True when data is a GIF with more than one frame."""
+    return gif_frame_count(data, limit=2) >= 2
+
+
+def is_animation_source(filename):
+    """True when filename is a GIF that may be converted."""
+    return os.path.splitext(filename)[1].lower() == '.gif'
+
+
+def animation_s3_key(s3_key, extension):
+    """Key of a converted animation, stored next to the GIF: a/b/clip.gif -> a/b/clip.mp4."""
+    stem, _ = os.path.splitext(s3_key)
+    return f"{stem}{extension}"
+
+
+def ffmpeg_path():
+    """Path of the ffmpeg binary, or None when it is not installed."""
+    return shutil.which(os.environ.get('MEDIA_UPLOAD_FFMPEG') or 'ffmpeg')
+
+
+def available_animation_formats():
+    """Formats animated GIFs can be converted to with the installed tools."""
+    formats = []
+    if Image is not None and features.check('webp'):
+        formats.append('webp')
+    if ffmpeg_path() is not None:
+        formats.append('mp4')
+    return formats
+
+
+def encode_animated_webp(data):
+    """Re-encode an animated GIF as animated WebP, keeping each frame's duration."""
+    with Image.open(io.BytesIO(data)) as img:
+        durations = [frame.info.get('duration', 100) or 100 for frame in ImageSequence.Iterator(img)]
+        img.seek(0)
+        out = io.BytesIO()
+        img.save(out, format='WEBP', save_all=True, duration=durations, loop=img.info.get('loop', 0),
+                 quality=ANIMATED_WEBP_QUALITY, method=4)
+        return out.getvalue()
+
+
+def encode_mp4(data, ffmpeg):
+    """Transcode an animated GIF to a muted H.264 MP4 with ffmpeg."""
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'source.gif')
+        target = os.path.join(tmp, 'animation.mp4')
+        with open(source, 'wb') as f:
+            f.write(data)
+        subprocess.run([ffmpeg, '-loglevel', 'error', '-y', '-i', source, *FFMPEG_ARGS, target],
+                       check=True, capture_output=True, timeout=FFMPEG_TIMEOUT)
+        with open(target, 'rb') as f:
+            return f.read()
+
+
+def encode_animation(data, format_name, ffmpeg=None):
+    """
+    Encode an animated GIF in one format. Runs in a worker process; returns
+    (bytes, seconds), or None when the encoder fails.
+    """
+    started = time.perf_counter()
+    try:
+        if format_name == 'mp4':
+            encoded = encode_mp4(data, ffmpeg)
+        else:
+            encoded = encode_animated_webp(data)
+    except (OSError, ValueError, subprocess.SubprocessError):
+        return None
+    return encoded, time.perf_counter() - started
+
+
+def convert_gif(data, formats=None, pool=None):
+    """
+    Convert an animated GIF to the smallest available format.
+
+    Returns a ConvertedAnimation, or None for still GIFs, when no encoder is
+    available, or when no result is smaller than the GIF.
+    """
+    if not is_animated_gif(data):
+        return None
+    formats = available_animation_formats() if formats is None else formats
+    if not formats:
+        return None
+    ffmpeg = ffmpeg_path() if 'mp4' in formats else None
+    pool = pool or get_image_pool()
+    futures = [(name, pool.submit(encode_animation, data, name, ffmpeg)) for name in formats]
+    results = {name: future.result() for name, future in futures}
+    results = {name: result for name, result in results.items() if result is not None}
+    if not results:
+        print("  ⚠️  Could not convert the animated GIF; uploading it as it is")
+        return None
+
+    summary = ', '.join(f"{name} {len(encoded)} bytes in {seconds:.2f}s" for name, (encoded, seconds) in results.items())
+    best = min(results, key=lambda name: len(results[name][0]))
+    encoded = results[best][0]
+    if len(encoded) >= len(data):
+        print(f"  🎞️  Animated GIF kept; no conversion was smaller ({summary})")
+        return None
+    print(f"  🎞️  Animated GIF: {len(data)} -> {len(encoded)} bytes as {best} "
+          f"({(len(data) - len(encoded)) * 100 / len(data):.1f}% saved; {summary})")
+    return ConvertedAnimation(best, encoded, len(data))
@@ -0,0 +1,488 @@
+#!/usr/bin/env python3
+"""
+Audio Metadata
+
+Reads duration, bitrate and embedded cover art from the headers of an audio
+file, so upload_media.py can describe an audio attachment in its :::media item
+and upload the artwork as a small poster image:
+
+- MP3: ID3v2 tag (APIC cover), then the Xing/Info or VBRI header of the first
+  frame; constant bitrate files fall back to the file size and frame bitrate
+- FLAC: STREAMINFO and PICTURE metadata blocks
+- Ogg Opus and Ogg Vorbis: identification header, METADATA_BLOCK_PICTURE in the
+  comment header, and the granule position of the last page
+- WAV: fmt and data chunks
+
+probe_audio() reads through read_at(offset, length), like media_probe.probe_movie,
+so it works on local files, bytes in memory and HTTP Range requests. Only the
+headers are read, plus the last few KB for Ogg and ID3v1; sequential header
+walks (FLAC blocks, Ogg pages) are served from 64 KB blocks. AudioProbe is fed a
+download chunk by chunk and keeps just the start and the end of the file.
+"""
+
+import base64
+import struct
+from dataclasses import dataclass
+
+
+# AudioProbe keeps this much of the start of a stream (ID3 tags with cover art)...
+DEFAULT_AUDIO_PREFIX = 4 * 1024 * 1024
+# ...and this much of the end (ID3v1 tag, last Ogg page)
+AUDIO_TAIL_SIZE = 64 * 1024
+
+# Embedded pictures larger than this are ignored
+MAX_COVER_SIZE = 8 * 1024 * 1024
+
+# How far past the ID3 tag to look for the first MPEG audio frame
+FRAME_SYNC_SCAN = 64 * 1024
+
+# Random access reads are served from blocks of this size
+READ_BLOCK_SIZE = 64 * 1024
+
+# RFC 6381 codecs values (WAV has no single codec string)
+AUDIO_CODECS = {'mp3': 'mp3', 'flac': 'flac', 'opus': 'opus', 'vorbis': 'vorbis'}
+
+# ID3/FLAC picture type of the front cover
+FRONT_COVER = 3
+
+MPEG_VERSIONS = {0: 2.5, 2: 2, 3: 1}
+MPEG_LAYERS = {1: 3, 2: 2, 3: 1}
+MPEG_SAMPLE_RATES = {1: (44100, 48000, 32000), 2: (22050, 24000, 16000), 2.5: (11025, 12000, 8000)}
+MPEG_BITRATES = {
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+
+
+@dataclass
+class AudioInfo:
+    """What the headers say about an audio file."""
+    format: str
+    duration: float = 0.0
+    bitrate: int = 0  # Bits per second
+    sample_rate: int = 0
+    channels: int = 0
+    cover: bytes = None
+
+    @property
+    def codecs(self):
+        return AUDIO_CODECS.get(self.format)
+
+
+@dataclass
+class MpegFrame:
+    version: float
+    layer: int
+    bitrate: int  # Bits per second
+    sample_rate: int
+    channels: int
+    samples: int
+    length: int
+
+
+def is_audio(head):
+    """True when head starts like an MP3, FLAC, Ogg or WAV file."""
+    return (head[:3] == b'ID3' or head[:4] in (b'fLaC', b'OggS')
+            or (head[:4] == b'RIFF' and head[8:12] == b'WAVE')
+            or parse_mpeg_frame(head[:4]) is not None)
+
+
+class _BlockReader:
+    """Serves small reads from cached blocks, so walking headers costs few underlying reads."""
+
+    def __init__(self, read_at, block_size=READ_BLOCK_SIZE):
+        self.read_at = read_at
+        self.block_size = block_size
+        self.blocks = {}
+
+    def __call__(self, offset, length):
+        if length > self.block_size:
+            return self.read_at(offset, length)
+        out = bytearray()
+        while length > 0:
+            index, skip = divmod(offset, self.block_size)
+            if index not in self.blocks:
+                if len(self.blocks) >= 8:
+                    self.blocks.pop(next(iter(self.blocks)))
+                self.blocks[index] = self.read_at(index * self.block_size, self.block_size)
+            piece = self.blocks[index][skip:skip + length]
+            if not piece:
+                break
+            out += piece
+            offset += len(piece)
+            length -= len(piece)
+        return bytes(out)
+
+
+def _syncsafe(data):
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def parse_mpeg_frame(header):
+    """Decode a 4-byte MPEG audio frame header; None when it is not a valid one."""
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+    version = MPEG_VERSIONS.get((header[1] >> 3) & 0x03)
+    layer = MPEG_LAYERS.get((header[1] >> 1) & 0x03)
+    bitrate_index, rate_index = header[2] >> 4, (header[2] >> 2) & 0x03
+    if version is None or layer is None or bitrate_index in (0, 15) or rate_index == 3:
+        return None  # Free-format streams are not supported
+    bitrate = MPEG_BITRATES[(1 if version == 1 else 2, layer)][bitrate_index] * 1000
+    sample_rate = MPEG_SAMPLE_RATES[version][rate_index]
+    padding = (header[2] >> 1) & 0x01
+    samples = 384 if layer == 1 else (1152 if layer == 2 or version == 1 else 576)
+    if layer == 1:
+        length = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        length = samples // 8 * bitrate // sample_rate + padding
+    channels = 1 if header[3] >> 6 == 3 else 2
+    return MpegFrame(version, layer, bitrate, sample_rate, channels, samples, length)
+
+
+def _parse_picture(block):
+    """(picture type, image bytes) from a FLAC PICTURE block (also used by Ogg comments)."""
+    pos = 4
+    (mime_length,) = struct.unpack_from('>I', block, pos)
+    pos += 4 + mime_length
+    (description_length,) = struct.unpack_from('>I', block, pos)
+    pos += 4 + description_length + 16  # width, height, depth and colors
+    (data_length,) = struct.unpack_from('>I', block, pos)
+    return struct.unpack_from('>I', block, 0)[0], bytes(block[pos + 4:pos + 4 + data_length])
+
+
+def _pick_cover(pictures):
+    """The front cover if there is one, otherwise the first picture."""
+    for picture_type, data in pictures:
+        if picture_type == FRONT_COVER:
+            return data
+    return pictures[0][1] if pictures else None
+
+
+def _id3_frames(tag):
+    """Yield (frame id, data) from a complete ID3v2 tag."""
+    major, flags = tag[3], tag[5]
+    body = tag[10:]
+    if flags & 0x80 and major < 4:
+        body = body.replace(b'\xff\x00', b'\xff')  # Tag-wide unsynchronisation
+    pos = 0
+    if flags & 0x40:  # Extended header
+        pos = _syncsafe(body[:4]) if major == 4 else struct.unpack('>I', body[:4])[0] + 4
+    header_size = 6 if major == 2 else 10
+    while pos + header_size <= len(body):
+        if major == 2:
+            frame_id, size, frame_flags = body[pos:pos + 3], int.from_bytes(body[pos + 3:pos + 6], 'big'), 0
+        else:
+            frame_id = body[pos:pos + 4]
+            raw_size = body[pos + 4:pos + 8]
+            size = _syncsafe(raw_size) if major == 4 else int.from_bytes(raw_size, 'big')
+            frame_flags = int.from_bytes(body[pos + 8:pos + 10], 'big')
+        if not frame_id.strip(b'\x00'):
+            return  # Padding
+        data = body[pos + header_size:pos + header_size + size]
+        pos += header_size + size
+        if major == 4:
+            if frame_flags & 0x000C:
+                continue  # Compressed or encrypted
+            if frame_flags & 0x0001:
+                data = data[4:]  # Data length indicator
+            if frame_flags & 0x0002:
+                data = data.replace(b'\xff\x00', b'\xff')
+        elif major == 3 and frame_flags & 0x00C0:
+            continue
+        yield frame_id, data
+
+
+def _parse_apic(data, v22=False):
+    """(picture type, image bytes) from an ID3 APIC (or v2.2 PIC) frame."""
+    encoding = data[0]
+    if v22:
+        pos = 4  # Three-letter image format instead of a MIME type
+    else:
+        pos = data.index(b'\x00', 1) + 1
+    picture_type = data[pos]
+    pos += 1
+    if encoding in (1, 2):
+        # UTF-16 description ends with a two-byte null on an even boundary
+        while data[pos:pos + 2] != b'\x00\x00':
+            pos += 2
+        pos += 2
+    else:
+        pos = data.index(b'\x00', pos) + 1
+    return picture_type, bytes(data[pos:])
+
+
+def _id3_cover(tag):
+    pictures = []
+    for frame_id, data in _id3_frames(tag):
+        if frame_id in (b'APIC', b'PIC'):
+            try:
+                pictures.append(_parse_apic(data, v22=frame_id == b'PIC'))
+            except (ValueError, IndexError):
+                continue
+    return _pick_cover(pictures)
+
+
+def _probe_mp3(read_at, size, covers):
+    pos, cover = 0, None
+    header = read_at(0, 10)
+    if header[:3] == b'ID3':
+        tag_size = 10 + _syncsafe(header[6:10]) + (10 if header[5] & 0x10 else 0)
+        if covers and tag_size <= MAX_COVER_SIZE:
+            cover = _id3_cover(read_at(0, tag_size))
+        pos = tag_size
+
+    # First frame header, confirmed by a second one right after it
+    window = read_at(pos, FRAME_SYNC_SCAN)
+    frame, start = None, -1
+    while frame is None:
+        start = window.find(b'\xff', start + 1)
+        if start == -1 or start + 4 > len(window):
+            return None
+        frame = parse_mpeg_frame(window[start:start + 4])
+        if frame is not None and start + frame.length + 4 <= len(window):
+            if parse_mpeg_frame(window[start + frame.length:start + frame.length + 4]) is None:
+                frame = None
+    audio_start = pos + start
+    data = window[start:start + 200]
+    info = AudioInfo('mp3', bitrate=frame.bitrate, sample_rate=frame.sample_rate,
+                     channels=frame.channels, cover=cover)
+
+    audio_end = size
+    if size is not None and size >= 128 and read_at(size - 128, 3) == b'TAG':
+        audio_end = size - 128  # ID3v1 tag
+    audio_bytes = audio_end - audio_start if audio_end is not None else None
+
+    # Xing/Info sits after the side information; VBRI at a fixed offset
+    side_info = (32 if frame.channels == 2 else 17) if frame.version == 1 else (17 if frame.channels == 2 else 9)
+    frames = None
+    xing = 4 + side_info
+    if data[xing:xing + 4] in (b'Xing', b'Info'):
+        (flags,) = struct.unpack_from('>I', data, xing + 4)
+        field = xing + 8
+        if flags & 0x01:
+            (frames,) = struct.unpack_from('>I', data, field)
+            field += 4
+        if flags & 0x02:
+            (audio_bytes,) = struct.unpack_from('>I', data, field)
+    elif data[36:40] == b'VBRI':
+        audio_bytes, frames = struct.unpack_from('>II', data, 46)
+
+    if frames:
+        info.duration = frames * frame.samples / frame.sample_rate
+        if audio_bytes:
+            info.bitrate = round(audio_bytes * 8 / info.duration)
+    elif audio_bytes:
+        info.duration = audio_bytes * 8 / frame.bitrate
+    return info
+
+
+def _probe_flac(read_at, size, covers):
+    info = AudioInfo('flac')
+    blocks = _BlockReader(read_at)
+    pictures = []
+    pos = 4
+    while True:
+        header = blocks(pos, 4)
+        if len(header) < 4:
+            return None
+        last, block_type = header[0] & 0x80, header[0] & 0x7F
+        length = int.from_bytes(header[1:4], 'big')
+        if block_type == 0:
+            block = blocks(pos + 4, length)
+            info.sample_rate = (block[10] << 12) | (block[11] << 4) | (block[12] >> 4)
+            info.channels = ((block[12] >> 1) & 0x07) + 1
+            total_samples = ((block[13] & 0x0F) << 32) | int.from_bytes(block[14:18], 'big')
+            if info.sample_rate:
+                info.duration = total_samples / info.sample_rate
+        elif block_type == 6 and covers and length <= MAX_COVER_SIZE:
+            pictures.append(_parse_picture(blocks(pos + 4, length)))
+        pos += 4 + length
+        if last:
+            break
+    info.cover = _pick_cover(pictures)
+    if size is not None and info.duration:
+        info.bitrate = round((size - pos) * 8 / info.duration)
+    return info
+
+
+def _ogg_pages(read_at, pos=0):
+    """Yield (serial, granule, lacing, body) for consecutive Ogg pages."""
+    while True:
+        header = read_at(pos, 27)
+        if len(header) < 27 or header[:4] != b'OggS':
+            return
+        granule, serial = struct.unpack_from('<qI', header, 6)
+        lacing = read_at(pos + 27, header[26])
+        body = read_at(pos + 27 + len(lacing), sum(lacing))
+        yield serial, granule, lacing, body
+        pos += 27 + len(lacing) + len(body)
+
+
+def _ogg_packets(read_at, count, limit):
+    """First count packets of the first logical stream (with its serial number)."""
+    packets, current, serial = [], bytearray(), None
+    for page_serial, _granule, lacing, body in _ogg_pages(_BlockReader(read_at)):
+        serial = page_serial if serial is None else serial
+        if page_serial != serial:
+            continue
+        pos = 0
+        for value in lacing:
+            current += body[pos:pos + value]
+            pos += value
+            if value < 255:
+                packets.append(bytes(current))
+                current = bytearray()
+                if len(packets) == count:
+                    return serial, packets
+        if len(current) > limit:
+            break
+    return serial, packets
+
+
+def _vorbis_comment_cover(packet, offset):
+    """Cover from METADATA_BLOCK_PICTURE (or legacy COVERART) in a Vorbis comment list."""
+    (vendor_length,) = struct.unpack_from('<I', packet, offset)
+    pos = offset + 4 + vendor_length
+    (count,) = struct.unpack_from('<I', packet, pos)
+    pos += 4
+    pictures = []
+    for _ in range(count):
+        (length,) = struct.unpack_from('<I', packet, pos)
+        comment = packet[pos + 4:pos + 4 + length]
+        pos += 4 + length
+        name, _, value = comment.partition(b'=')
+        try:
+            if name.upper() == b'METADATA_BLOCK_PICTURE':
+                pictures.append(_parse_picture(base64.b64decode(value)))
+            elif name.upper() == b'COVERART':
+                pictures.append((FRONT_COVER, base64.b64decode(value)))
+        except (ValueError, struct.error):
+            continue
+    return _pick_cover(pictures)
+
+
+def _probe_ogg(read_at, size, covers):
+    serial, packets = _ogg_packets(read_at, 2 if covers else 1, 2 * MAX_COVER_SIZE)
+    if not packets:
+        return None
+    ident = packets[0]
+    if ident[:8] == b'OpusHead':
+        # Opus granules always count 48 kHz samples, after pre_skip priming samples
+        info = AudioInfo('opus', channels=ident[9], sample_rate=48000)
+        pre_skip, rate, comment_offset = struct.unpack_from('<H', ident, 10)[0], 48000, 8
+    elif ident[:7] == b'\x01vorbis':
+        channels, rate, _maximum, nominal = struct.unpack_from('<BIii', ident, 11)
+        info = AudioInfo('vorbis', channels=channels, sample_rate=rate, bitrate=max(0, nominal))
+        pre_skip, comment_offset = 0, 7
+    else:
+        return None  # Ogg Theora, FLAC-in-Ogg and others
+    if covers and len(packets) > 1:
+        info.cover = _vorbis_comment_cover(packets[1], comment_offset)
+
+    if size is not None and rate:
+        tail_start = max(0, size - AUDIO_TAIL_SIZE)
+        tail = read_at(tail_start, size - tail_start)
+        pos = tail.rfind(b'OggS', 0, len(tail) - 17)
+        while pos != -1:
+            granule, page_serial = struct.unpack_from('<qI', tail, pos + 6)
+            if page_serial == serial and granule > 0:
+                info.duration = max(0, granule - pre_skip) / rate
+                info.bitrate = round(size * 8 / info.duration) if info.duration else info.bitrate
+                break
+            pos = tail.rfind(b'OggS', 0, pos)
+    return info
+
+
+def _probe_wav(read_at, size, covers):
+    info = AudioInfo('wav')
+    byte_rate, pos = 0, 12
+    while True:
+        header = read_at(pos, 8)
+        if len(header) < 8:
+            return None
+        chunk_id, length = header[:4], struct.unpack('<I', header[4:8])[0]
+        if chunk_id == b'fmt ':
+            _tag, info.channels, info.sample_rate, byte_rate = struct.unpack('<HHII', read_at(pos + 8, 12))
+            info.bitrate = byte_rate * 8
+        elif chunk_id == b'data':
+            if size is not None and (length == 0xFFFFFFFF or pos + 8 + length > size):
+                length = size - pos - 8  # Streamed recordings leave the size unset
+            if byte_rate:
+                info.duration = length / byte_rate
+            return info
+        pos += 8 + length + (length & 1)
+
+
+def probe_audio(read_at, size=None, covers=True):
+    """
+    Read an audio file's duration, bitrate and cover art from its headers.
+
+    read_at(offset, length) returns up to length bytes at offset. size is the
+    file size when known (needed for constant bitrate MP3s, FLAC bitrate and the
+    Ogg duration). covers=False skips reading embedded artwork. Returns AudioInfo,
+    or None for unknown or corrupt files.
+    """
+    head = read_at(0, 12)
+    try:
+        if head[:4] == b'fLaC':
+            return _probe_flac(read_at, size, covers)
+        if head[:4] == b'OggS':
+            return _probe_ogg(read_at, size, covers)
+        if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+            return _probe_wav(read_at, size, covers)
+        if head[:3] == b'ID3' or parse_mpeg_frame(head[:4]) is not None:
+            return _probe_mp3(read_at, size, covers)
+    except (struct.error, IndexError, ValueError, ZeroDivisionError):
+        return None
+    return None
+
+
+class AudioProbe:
+    """
+    Reads audio metadata from a stream: keeps the start of the file (for the
+    headers and artwork) and its last few KB, and parses them at the end.
+    """
+
+    def __init__(self, prefix=DEFAULT_AUDIO_PREFIX, tail=AUDIO_TAIL_SIZE):
+        self.prefix = prefix
+        self.tail = tail
+        self.result = None
+        self.done = False
+        self.size = 0
+        self._head = bytearray()
+        self._tail = bytearray()
+
+    def feed(self, chunk):
+        """Add the next chunk; the result is only known after finish()."""
+        if self.done:
+            return self.result
+        self.size += len(chunk)
+        if len(self._head) < self.prefix:
+            self._head += chunk[:self.prefix - len(self._head)]
+        self._tail += chunk[-self.tail:]
+        del self._tail[:-self.tail]
+        return None
+
+    def finish(self):
+        """Parse what was kept; returns the AudioInfo or None."""
+        if not self.done:
+            head, tail, size = bytes(self._head), bytes(self._tail), self.size
+
+            tail_start = size - len(tail)
+            if tail_start <= len(head):
+                # Short file: head and tail together hold all of it
+                head, tail_start = head + tail[len(head) - tail_start:], size
+
+            def read_at(offset, length):
+                if offset >= tail_start:
+                    return tail[offset - tail_start:offset - tail_start + length]
+                return head[offset:offset + length]  # Empty between the head and the tail
+
+            self.result = probe_audio(read_at, size)
+            self.done = True
+            self._head, self._tail = bytearray(), bytearray()
+        return self.result
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Content-Addressed Download Cache for GitHub Attachments
+
+Reopened issues and retried jobs make upload_media.py download every attachment
+again. This cache keeps the bytes on disk, keyed two ways:
+- by attachment URL, so a rerun can skip the network entirely
+- by SHA-256 of the content, so the same file behind two URLs is stored once
+
+Layout under the cache root:
+
+    objects/<sha[:2]>/<sha>        file bytes
+    objects/<sha[:2]>/<sha>.json   {sha256, size, extension, content_type}
+    urls/<sha256(url)>.json        {url, sha256}
+    .lock                          cross-process lock file
+
+The object file's mtime is refreshed on every hit and the least recently used
+objects are evicted once the cache grows past its size cap. All writes go
+through temp files and os.replace under an exclusive lock, so concurrent runs
+(or worker threads) never see half-written entries.
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to the in-process lock only
+    fcntl = None
+
+
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024  # 2 GiB
+
+
+@dataclass
+class CacheEntry:
+    """A cached download: where the bytes live and what was sniffed about them."""
+    path: str
+    sha256: str
+    size: int
+    extension: str = None
+    content_type: str = ''
+
+
+def _url_key(url):
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+
+def _write_json_atomic(path, data):
+    directory = os.path.dirname(path)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+
+class DownloadCache:
+    """On-disk cache of downloaded attachments with an LRU size cap."""
+
+    def __init__(self, root, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.objects_dir = os.path.join(root, 'objects')
+        self.urls_dir = os.path.join(root, 'urls')
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.urls_dir, exist_ok=True)
+        self._lock_path = os.path.join(root, '.lock')
+        self._thread_lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    @contextmanager
+    def lock(self):
+        """Exclusive lock across threads and processes sharing this cache directory."""
+        with self._thread_lock:
+            with open(self._lock_path, 'a') as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _object_path(self, sha256):
+        return os.path.join(self.objects_dir, sha256[:2], sha256)
+
+    def _load_entry(self, sha256):
+        path = self._object_path(sha256)
+        try:
+            with open(path + '.json', 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not os.path.exists(path):
+            return None
+        # Refresh recency for LRU eviction
+        os.utime(path, None)
+        return CacheEntry(path, sha256, meta['size'], meta.get('extension'), meta.get('content_type', ''))
+
+    def lookup_hash(self, sha256):
+        """Return the CacheEntry for a content hash, or None."""
+        with self.lock():
+            return self._load_entry(sha256)
+
+    def lookup_url(self, url):
+        """Return the CacheEntry previously stored for url, or None."""
+        with self.lock():
+            try:
+                with open(os.path.join(self.urls_dir, _url_key(url) + '.json'), 'r', encoding='utf-8') as f:
+                    sha256 = json.load(f)['sha256']
+            except (OSError, ValueError, KeyError):
+                entry = None
+            else:
+                entry = self._load_entry(sha256)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def read(self, entry):
+        with open(entry.path, 'rb') as f:
+            return f.read()
+
+    def iter_chunks(self, entry, chunk_size=64 * 1024):
+        """Yield a cached file in chunks, for the streaming upload path."""
+        with open(entry.path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    def new_temp_file(self):
+        """Open a temp file inside the cache (same filesystem, so commits are a rename)."""
+        fd, temp_path = tempfile.mkstemp(dir=self.objects_dir, suffix='.incoming')
+        return os.fdopen(fd, 'wb'), temp_path
+
+    def commit_file(self, url, temp_path, sha256, extension=None, content_type=''):
+        """Move a fully written temp file into the cache and index it under url."""
+        size = os.path.getsize(temp_path)
+        path = self._object_path(sha256)
+        with self.lock():
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if os.path.exists(path):
+                os.remove(temp_path)  # Same content already cached under another URL
+            else:
+                os.replace(temp_path, path)
+            _write_json_atomic(path + '.json', {
+                'sha256': sha256,
+                'size': size,
+                'extension': extension,
+                'content_type': content_type or '',
+            })
+            if url:
+                _write_json_atomic(os.path.join(self.urls_dir, _url_key(url) + '.json'), {
+                    'url': url,
+                    'sha256': sha256,
+                })
+            self._evict()
+            return CacheEntry(path, sha256, size, extension, content_type or '')
+
+    def store(self, url, content, extension=None, content_type=''):
+        """Cache bytes downloaded from url. Returns the CacheEntry."""
+        f, temp_path = self.new_temp_file()
+        with f:
+            f.write(content)
+        return self.commit_file(url, temp_path, hashlib.sha256(content).hexdigest(), extension, content_type)
+
+    def _evict(self):
+        """Delete least recently used objects until the cache fits under max_bytes."""
+        objects = []
+        total = 0
+        for shard in os.listdir(self.objects_dir):
+            shard_dir = os.path.join(self.objects_dir, shard)
+            if not os.path.isdir(shard_dir):
+                continue
+            for name in os.listdir(shard_dir):
+                if name.endswith('.json'):
+                    continue
+                path = os.path.join(shard_dir, name)
+                stat = os.stat(path)
+                objects.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        if total <= self.max_bytes:
+            return
+        for _, size, path in sorted(objects):
+            os.remove(path)
+            if os.path.exists(path + '.json'):
+                os.remove(path + '.json')
+            total -= size
+            print(f"  🗑️  Evicted {os.path.basename(path)[:16]}... from download cache")
+            if total <= self.max_bytes:
+                break
+        # URL entries pointing at evicted objects are treated as misses on lookup
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_download_cache():
+    """
+    Return the process-wide DownloadCache, or None when caching is disabled.
+    Enabled by setting MEDIA_UPLOAD_CACHE_DIR; MEDIA_UPLOAD_CACHE_MAX_MB sets the size cap.
+    """
+    global _cache
+    root = os.environ.get('MEDIA_UPLOAD_CACHE_DIR')
+    if not root:
+        return None
+    with _cache_lock:
+        if _cache is None or _cache.root != root:
+            max_mb = os.environ.get('MEDIA_UPLOAD_CACHE_MAX_MB')
+            max_bytes = int(max_mb) * 1024 * 1024 if max_mb and max_mb.isdigit() else DEFAULT_MAX_BYTES
+            _cache = DownloadCache(root, max_bytes)
+        return _cache
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+MP4 Faststart
+
+Phones often write the moov box (the index of every sample) after the mdat box
+that holds the samples. A browser playing such a file from the CDN has to fetch
+the end of the file, or all of it, before the first frame. upload_media.py uses
+this module to move moov in front of mdat before uploading:
+
+1. The top-level box headers show whether moov comes after the first mdat
+2. The moov box is copied out and every stco/co64 chunk offset that points into
+   the data moving down the file is increased by the size of moov
+3. The file is memory-mapped and rewritten in place: the data is shifted with
+   mmap.move() and the patched moov is written into the gap
+
+Samples are never decoded or re-encoded, and only moov is held in memory.
+Fragmented files (moof boxes) and files whose offsets would no longer fit in
+32-bit stco tables are left as they are.
+
+Usage:
+    python media_faststart.py VIDEO [--output PATH]
+    python media_faststart.py VIDEO --benchmark [--mbps 10]
+
+--benchmark works on a temporary copy and reports how many bytes a player has to
+download before it can show the first frame, before and after the rewrite.
+"""
+
+import os
+import sys
+import mmap
+import time
+import shutil
+import struct
+import argparse
+import tempfile
+from array import array
+
+from media_probe import DEFAULT_MAX_MOOV, file_reader, is_movie, iter_boxes, iter_top_level_boxes
+
+# Bytes of a download inspected to decide whether a file needs rewriting
+FASTSTART_SNIFF_SIZE = 64 * 1024
+
+# Chunk size used when reading a rewritten spool file back out
+SPOOL_CHUNK_SIZE = 1024 * 1024
+
+# Boxes on the path from moov to the chunk offset tables
+CONTAINER_BOXES = frozenset({b'trak', b'mdia', b'minf', b'stbl'})
+
+MOVIE_EXTENSIONS = ('.mp4', '.mov', '.m4v', '.m4a')
+
+
+def layout(read_at, size=None):
+    """
+    Top-level boxes of a movie as {type: (offset, header_size, box_size)} for the
+    first moov and mdat, plus 'fragmented' when moof boxes are present.
+    """
+    boxes = {}
+    for box_type, offset, header_size, box_size in iter_top_level_boxes(read_at, size):
+        if box_type in (b'moov', b'mdat') and box_type not in boxes:
+            boxes[box_type] = (offset, header_size, box_size)
+        elif box_type == b'moof':
+            boxes['fragmented'] = True
+    return boxes
+
+
+def needs_faststart(head):
+    """
+    True when the start of a file shows an mdat box before any moov box.
+    head is a prefix of the file; only the headers it contains are looked at.
+    """
+    if not is_movie(head):
+        return False
+    for box_type, _offset, _header_size, _box_size in iter_top_level_boxes(
+            lambda offset, length: head[offset:offset + length]):
+        if box_type == b'moov':
+            return False
+        if box_type == b'mdat':
+            return True
+    return False
+
+
+def _offset_tables(moov, start, end):
+    """Yield (type, entries_start, count) for each stco/co64 box in moov[start:end]."""
+    for box_type, payload, box_end in iter_boxes(moov, start, end):
+        if box_type in CONTAINER_BOXES:
+            yield from _offset_tables(moov, payload, box_end)
+        elif box_type in (b'stco', b'co64'):
+            (count,) = struct.unpack_from('>I', moov, payload + 4)
+            width = 4 if box_type == b'stco' else 8
+            if payload + 8 + count * width > box_end:
+                raise ValueError(f"{box_type.decode()} table runs past its box")
+            yield box_type, payload + 8, count
+
+
+def _read_table(moov, box_type, entries, count):
+    table = array('I' if box_type == b'stco' else 'Q')
+    table.frombytes(moov[entries:entries + count * table.itemsize])
+    if sys.byteorder == 'little':
+        table.byteswap()  # Tables are big-endian
+    return table
+
+
+def shift_chunk_offsets(moov, header_size, shift, start, end):
+    """
+    Add shift to every chunk offset in moov (a bytearray holding the whole box)
+    that points into [start, end). Returns the number of offsets changed.
+
+    Raises OverflowError, without changing anything, when a 32-bit stco offset
+    would no longer fit.
+    """
+    tables = []
+    for box_type, entries, count in _offset_tables(moov, header_size, len(moov)):
+        table = _read_table(moov, box_type, entries, count)
+        limit = 0xFFFFFFFF if box_type == b'stco' else 0xFFFFFFFFFFFFFFFF
+        moved = [i for i, offset in enumerate(table) if start <= offset < end]
+        if any(table[i] + shift > limit for i in moved):
+            raise OverflowError("chunk offsets no longer fit in a 32-bit stco table")
+        tables.append((entries, table, moved))
+
+    changed = 0
+    for entries, table, moved in tables:
+        for i in moved:
+            table[i] += shift
+        changed += len(moved)
+        if sys.byteorder == 'little':
+            table.byteswap()
+        moov[entries:entries + len(table) * table.itemsize] = table.tobytes()
+    return changed
+
+
+def faststart_file(f, max_moov=DEFAULT_MAX_MOOV):
+    """
+    Move the moov box of an open movie file (mode 'r+b') in front of its mdat, in place.
+    Returns True when the file was rewritten, False when it already starts with
+    moov or cannot be rewritten safely.
+    """
+    f.flush()
+    size = os.fstat(f.fileno()).st_size
+    boxes = layout(file_reader(f), size)
+    if b'moov' not in boxes or b'mdat' not in boxes:
+        return False
+    moov_offset, header_size, moov_size = boxes[b'moov']
+    insert = boxes[b'mdat'][0]
+    if moov_offset < insert:
+        return False
+    if boxes.get('fragmented'):
+        print("  ⚠️  Fragmented MP4; leaving the box order as is")
+        return False
+    if moov_size > max_moov:
+        print(f"  ⚠️  moov box is {moov_size} bytes; leaving the box order as is")
+        return False
+
+    started = time.monotonic()
+    with mmap.mmap(f.fileno(), 0) as mm:
+        moov = bytearray(mm[moov_offset:moov_offset + moov_size])
+        try:
+            shift_chunk_offsets(moov, header_size, moov_size, insert, moov_offset)
+        except (OverflowError, ValueError, struct.error) as e:
+            print(f"  ⚠️  Cannot move moov ({e}); leaving the box order as is")
+            return False
+        # Everything from the first mdat up to the old moov slides down by the size of moov
+        mm.move(insert + moov_size, insert, moov_offset - insert)
+        mm[insert:insert + moov_size] = moov
+        mm.flush()
+    print(f"  🎬 Moved moov ({moov_size} bytes) in front of mdat in {time.monotonic() - started:.2f}s")
+    return True
+
+
+def faststart_bytes(data, max_moov=DEFAULT_MAX_MOOV):
+    """Return data with moov moved in front of mdat (data itself when nothing changes)."""
+    if not needs_faststart(data[:FASTSTART_SNIFF_SIZE]):
+        return data
+    with tempfile.TemporaryFile() as f:
+        f.write(data)
+        if not faststart_file(f, max_moov):
+            return data
+        f.seek(0)
+        return f.read()
+
+
+def faststart_chunks(chunks, spool_dir=None):
+    """
+    Pass a streamed movie through, moving moov to the front when it comes last.
+
+    The first chunks are inspected; a file that needs rewriting is spooled to a
+    temporary file on disk, rewritten in place and then read back in chunks, so
+    memory use does not grow with the size of the video. Anything else is yielded
+    unchanged as it arrives.
+    """
+    chunks = iter(chunks)
+    head = bytearray()
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= FASTSTART_SNIFF_SIZE:
+            break
+    if not needs_faststart(bytes(head)):
+        if head:
+            yield bytes(head)
+        yield from chunks
+        return
+
+    with tempfile.TemporaryFile(dir=spool_dir) as spool:
+        spool.write(head)
+        for chunk in chunks:
+            spool.write(chunk)
+        faststart_file(spool)
+        spool.seek(0)
+        while True:
+            chunk = spool.read(SPOOL_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+def _find(moov, start, end, path):
+    """(payload_start, box_end) of the first box along path within moov[start:end], or None."""
+    for box_type, payload, box_end in iter_boxes(moov, start, end):
+        if box_type == path[0]:
+            return (payload, box_end) if len(path) == 1 else _find(moov, payload, box_end, path[1:])
+    return None
+
+
+def _first_sample_end(moov, stbl):
+    """File offset just past the first sample of a track, from its stco/co64 and stsz tables."""
+    for box_type in (b'stco', b'co64'):
+        table = _find(moov, *stbl, [box_type])
+        if table is not None:
+            break
+    else:
+        return None
+    stsz = _find(moov, *stbl, [b'stsz'])
+    count = struct.unpack_from('>I', moov, table[0] + 4)[0]
+    if stsz is None or not count:
+        return None
+    offset = _read_table(moov, box_type, table[0] + 8, 1)[0]
+    sample_size, sample_count = struct.unpack_from('>II', moov, stsz[0] + 4)
+    if not sample_size and sample_count:
+        (sample_size,) = struct.unpack_from('>I', moov, stsz[0] + 12)
+    return offset + sample_size
+
+
+def first_frame_bytes(read_at, size):
+    """
+    Bytes a player reading from the start of the file must receive before it
+    can show the first frame: everything up to the end of moov and of the first
+    video sample. Returns None when the file has no moov box.
+    """
+    boxes = layout(read_at, size)
+    if b'moov' not in boxes:
+        return None
+    moov_offset, header_size, moov_size = boxes[b'moov']
+    moov = read_at(moov_offset, moov_size)
+    needed = moov_offset + moov_size
+    for box_type, payload, box_end in iter_boxes(moov, header_size):
+        hdlr = _find(moov, payload, box_end, [b'mdia', b'hdlr']) if box_type == b'trak' else None
+        if hdlr is None or moov[hdlr[0] + 8:hdlr[0] + 12] != b'vide':
+            continue
+        stbl = _find(moov, payload, box_end, [b'mdia', b'minf', b'stbl'])
+        sample_end = _first_sample_end(moov, stbl) if stbl is not None else None
+        if sample_end is not None:
+            needed = max(needed, sample_end)
+        break
+    return needed
+
+
+def benchmark(path, mbps=10.0):
+    """Rewrite a copy of path and compare the bytes needed for the first frame."""
+    with tempfile.TemporaryDirectory() as tmp:
+        copy = os.path.join(tmp, os.path.basename(path))
+        shutil.copyfile(path, copy)
+        with open(copy, 'r+b') as f:
+            size = os.fstat(f.fileno()).st_size
+            before = first_frame_bytes(file_reader(f), size)
+            started = time.perf_counter()
+            rewritten = faststart_file(f)
+            elapsed = time.perf_counter() - started
+            after = first_frame_bytes(file_reader(f), size)
+    if before is None:
+        print(f"❌ {path} has no moov box")
+        return 1
+
+    def seconds(count):
+        return count * 8 / (mbps * 1_000_000)
+
+    print(f"🎬 {path}: {size} bytes")
+    print(f"  Before: {before} bytes to first frame ({seconds(before):.2f}s at {mbps:g} Mbps)")
+    if not rewritten:
+        print("  Already faststart (or not rewritable); nothing to compare")
+        return 0
+    print(f"  After:  {after} bytes to first frame ({seconds(after):.2f}s at {mbps:g} Mbps)")
+    print(f"  Rewrite took {elapsed * 1000:.1f} ms ({size / max(elapsed, 1e-9) / 1_000_000:.0f} MB/s)")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move the moov box of an MP4/MOV file in front of its media data.")
+    parser.add_argument('video', help="MP4, MOV, M4V or M4A file")
+    parser.add_argument('--output', help="Write the result here instead of rewriting the file in place")
+    parser.add_argument('--benchmark', action='store_true',
+                        help="Rewrite a temporary copy and report bytes to first frame before and after")
+    parser.add_argument('--mbps', type=float, default=10.0, help="Bandwidth used for the time estimate (default: 10)")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        sys.exit(benchmark(args.video, args.mbps))
+
+    target = args.video
+    if args.output:
+        shutil.copyfile(args.video, args.output)
+        target = args.output
+    with open(target, 'r+b') as f:
+        rewritten = faststart_file(f)
+    print(f"✅ Moved moov to the front of {target}" if rewritten else f"ℹ️  {target} left unchanged")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Media Format Registry
+
+One table of the media formats upload_media.py handles: extension, canonical
+Content-Type, other Content-Types downloads report for it, and the bucket
+folder it is stored in (files/images/, files/videos/, files/audio/). Folder
+lookup, Content-Type detection and the Content-Type stored with each upload
+are all derived from it.
+
+A second table lists file signatures: one or more (offset, magic bytes) checks
+and the resulting extension, optionally refined by a sub-parser:
+
+- ISO-BMFF files (ftyp) are told apart by brand: MP4, M4V, M4A, QuickTime, and
+  HEIC/HEIF/AVIF stills from phones. Generic HEIF brands (mif1) are resolved
+  through the compatible brand list
+- EBML files are told apart by DocType: WebM, which browsers play natively,
+  and other Matroska files
+
+Detection runs over a memoryview of the first SIGNATURE_PREFIX bytes, so
+checking a signature never copies the download head. The bytes at the offsets
+signatures start from select the few candidate signatures, so a file is only
+compared against signatures that can match it.
+
+Usage (time detection on the first bytes of real files):
+    python media_formats.py FILE [FILE ...] [--rounds 20000]
+"""
+
+import sys
+import time
+import argparse
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+
+
+@dataclass(frozen=True)
+class MediaFormat:
+    """A file extension, how it is served and where it is stored."""
+    extension: str
+    content_type: str
+    folder: str
+    # Other Content-Types a download may report for this format
+    aliases: tuple = ()
+
+
+FORMATS = (
+    MediaFormat('.jpg', 'image/jpeg', 'images', ('image/jpg',)),
+    MediaFormat('.jpeg', 'image/jpeg', 'images'),
+    MediaFormat('.png', 'image/png', 'images'),
+    MediaFormat('.gif', 'image/gif', 'images'),
+    MediaFormat('.webp', 'image/webp', 'images'),
+    MediaFormat('.avif', 'image/avif', 'images'),
+    MediaFormat('.heic', 'image/heic', 'images', ('image/heic-sequence',)),
+    MediaFormat('.heif', 'image/heif', 'images', ('image/heif-sequence',)),
+    MediaFormat('.bmp', 'image/bmp', 'images'),
+    MediaFormat('.svg', 'image/svg+xml', 'images'),
+    MediaFormat('.ico', 'image/x-icon', 'images'),
+    MediaFormat('.mp4', 'video/mp4', 'videos', ('video/mpeg',)),
+    MediaFormat('.m4v', 'video/mp4', 'videos', ('video/x-m4v',)),
+    MediaFormat('.webm', 'video/webm', 'videos'),
+    MediaFormat('.mov', 'video/quicktime', 'videos'),
+    MediaFormat('.avi', 'video/x-msvideo', 'videos'),
+    MediaFormat('.mkv', 'video/x-matroska', 'videos'),
+    MediaFormat('.flv', 'video/x-flv', 'videos'),
+    MediaFormat('.wmv', 'video/x-ms-wmv', 'videos'),
+    MediaFormat('.mp3', 'audio/mpeg', 'audio', ('audio/mp3',)),
+    MediaFormat('.wav', 'audio/wav', 'audio', ('audio/wave', 'audio/x-wav')),
+    MediaFormat('.ogg', 'audio/ogg', 'audio'),
+    MediaFormat('.m4a', 'audio/mp4', 'audio', ('audio/x-m4a',)),
+    MediaFormat('.flac', 'audio/flac', 'audio'),
+    MediaFormat('.aac', 'audio/aac', 'audio'),
+    MediaFormat('.wma', 'audio/x-ms-wma', 'audio'),
+    MediaFormat('.txt', 'text/plain; charset=utf-8', 'files'),
+)
+
+FORMATS_BY_EXTENSION = {fmt.extension: fmt for fmt in FORMATS}
+
+# Folders whose formats are recognised from a download's Content-Type
+MEDIA_FOLDERS = ('images', 'videos', 'audio')
+
+# Content-Type (without parameters) -> extension; the first format listing a type wins
+CONTENT_TYPE_EXTENSIONS = {}
+for _fmt in FORMATS:
+    if _fmt.folder in MEDIA_FOLDERS:
+        for _content_type in (_fmt.content_type, *_fmt.aliases):
+            CONTENT_TYPE_EXTENSIONS.setdefault(_content_type, _fmt.extension)
+
+# Bytes of a download inspected for a signature, including the ftyp brands and EBML header
+SIGNATURE_PREFIX = 256
+
+# ftyp brand -> extension. Brands missing here are treated as MP4.
+FTYP_BRANDS = {
+    b'isom': '.mp4', b'iso2': '.mp4', b'mp41': '.mp4', b'mp42': '.mp4', b'avc1': '.mp4', b'dash': '.mp4',
+    b'M4V ': '.m4v', b'M4VH': '.m4v', b'M4VP': '.m4v',
+    b'M4A ': '.m4a', b'M4B ': '.m4a', b'M4P ': '.m4a',
+    b'qt  ': '.mov',
+    b'avif': '.avif', b'avis': '.avif',
+    b'heic': '.heic', b'heix': '.heic', b'heim': '.heic', b'heis': '.heic', b'hevc': '.heic', b'hevx': '.heic',
+    b'mif1': '.heif', b'msf1': '.heif',
+}
+
+# Stills a generic HEIF brand is refined to from the compatible brands
+HEIF_REFINEMENTS = ('.avif', '.heic')
+
+EBML_DOCTYPE_ID = 0x4282
+EBML_DOCTYPES = {b'webm': '.webm', b'matroska': '.mkv'}
+
+
+def ftyp_extension(view):
+    """Extension from the major brand of an ftyp box, refining generic HEIF through its compatible brands."""
+    extension = FTYP_BRANDS.get(bytes(view[8:12]), '.mp4')
+    if extension != '.heif':
+        return extension
+    box_end = min(int.from_bytes(view[0:4], 'big'), len(view))
+    for pos in range(16, box_end - 3, 4):
+        compatible = FTYP_BRANDS.get(bytes(view[pos:pos + 4]))
+        if compatible in HEIF_REFINEMENTS:
+            return compatible
+    return extension
+
+
+def _read_vint(view, pos, keep_marker=False):
+    """EBML variable-length integer at pos: (value, next_pos), or None when it does not fit."""
+    if pos >= len(view) or view[pos] == 0:
+        return None
+    first = view[pos]
+    length = 8 - first.bit_length() + 1
+    if pos + length > len(view):
+        return None
+    value = first if keep_marker else first & ((1 << (8 - length)) - 1)
+    for byte in view[pos + 1:pos + length]:
+        value = (value << 8) | byte
+    return value, pos + length
+
+
+def ebml_extension(view):
+    """Extension from the DocType in an EBML header: .webm for WebM, .mkv otherwise."""
+    header = _read_vint(view, 4)
+    if header is None:
+        return None
+    size, pos = header
+    end = min(pos + size, len(view))
+    while pos < end:
+        element = _read_vint(view, pos, keep_marker=True)
+        length = _read_vint(view, element[1]) if element else None
+        if length is None:
+            return None
+        (element_id, _), (element_size, data) = element, length
+        if element_id == EBML_DOCTYPE_ID:
+            return EBML_DOCTYPES.get(bytes(view[data:data + element_size]).rstrip(b'\x00'))
+        pos = data + element_size
+    return None
+
+
+@dataclass(frozen=True)
+class Signature:
+    """
+    A file signature: every (offset, magic) check must match. parser, when set,
+    refines the extension from the bytes; extension is used when it returns None.
+    """
+    checks: tuple
+    extension: str
+    parser: object = None
+
+
+SIGNATURES = (
+    Signature(((4, b'ftyp'),), '.mp4', ftyp_extension),
+    Signature(((0, b'\x1a\x45\xdf\xa3'),), '.mkv', ebml_extension),
+    Signature(((0, b'RIFF'), (8, b'AVI ')), '.avi'),
+    Signature(((0, b'RIFF'), (8, b'WEBP')), '.webp'),
+    Signature(((0, b'RIFF'), (8, b'WAVE')), '.wav'),
+    # QuickTime files without ftyp start with one of these atoms (type after the 4-byte size)
+    Signature(((4, b'moov'),), '.mov'),
+    Signature(((4, b'mdat'),), '.mov'),
+    Signature(((4, b'wide'),), '.mov'),
+    Signature(((4, b'free'),), '.mov'),
+    Signature(((0, b'FLV\x01'),), '.flv'),
+    Signature(((0, b'\x30\x26\xb2\x75\x8e\x66\xcf\x11'),), '.wmv'),  # ASF header object
+    Signature(((0, b'\xff\xd8\xff'),), '.jpg'),
+    Signature(((0, b'\x89PNG\r\n\x1a\n'),), '.png'),
+    Signature(((0, b'GIF87a'),), '.gif'),
+    Signature(((0, b'GIF89a'),), '.gif'),
+    Signature(((0, b'ID3'),), '.mp3'),
+    Signature(((0, b'\xff\xfb'),), '.mp3'),
+    Signature(((0, b'\xff\xf3'),), '.mp3'),
+    Signature(((0, b'\xff\xf2'),), '.mp3'),
+    Signature(((0, b'\xff\xf1'),), '.aac'),  # ADTS, MPEG-4
+    Signature(((0, b'\xff\xf9'),), '.aac'),  # ADTS, MPEG-2
+    Signature(((0, b'OggS'),), '.ogg'),
+    Signature(((0, b'fLaC'),), '.flac'),
+    # Two bytes only, so it is checked after every longer signature
+    Signature(((0, b'BM'),), '.bmp'),
+)
+
+
+# Offsets of the first check of each signature; their bytes select the candidate signatures
+LEAD_OFFSETS = tuple(sorted({signature.checks[0][0] for signature in SIGNATURES}))
+
+
+@lru_cache(maxsize=None)
+def _candidates(lead):
+    """Signatures whose first check starts with the bytes at LEAD_OFFSETS, in table order."""
+    first_bytes = dict(zip(LEAD_OFFSETS, lead))
+    return tuple(signature for signature in SIGNATURES
+                 if first_bytes[signature.checks[0][0]] == signature.checks[0][1][0])
+
+
+def detect_extension(content):
+    """Extension of a file from its first bytes, or None when no signature matches."""
+    if not content:
+        return None
+    view = memoryview(content)[:SIGNATURE_PREFIX]
+    lead = tuple(view[offset] if offset < len(view) else None for offset in LEAD_OFFSETS)
+    for signature in _candidates(lead):
+        for offset, magic in signature.checks:
+            if view[offset:offset + len(magic)] != magic:
+                break
+        else:
+            if signature.parser is not None:
+                return signature.parser(view) or signature.extension
+            return signature.extension
+    return None
+
+
+def extension_for_content_type(content_type):
+    """Extension for a media Content-Type header (parameters ignored), or None."""
+    if not content_type:
+        return None
+    return CONTENT_TYPE_EXTENSIONS.get(content_type.split(';')[0].strip().lower())
+
+
+def folder_for_extension(extension):
+    """Bucket folder for an extension; 'files' when it is not a known media format."""
+    fmt = FORMATS_BY_EXTENSION.get(extension.lower())
+    return fmt.folder if fmt is not None else 'files'
+
+
+def benchmark(samples, rounds=20000):
+    """
+    Time detect_extension on each sample head ({name: bytes}).
+    Returns {name: (extension, nanoseconds per call)}.
+    """
+    results = {}
+    for name, head in samples.items():
+        started = time.perf_counter_ns()
+        for _ in range(rounds):
+            extension = detect_extension(head)
+        results[name] = (extension, (time.perf_counter_ns() - started) / rounds)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detect media formats from file signatures and time the detection.")
+    parser.add_argument('files', nargs='+', help="Files to detect")
+    parser.add_argument('--rounds', type=int, default=20000, help="Detections timed per file (default: 20000)")
+    args = parser.parse_args()
+
+    samples = {}
+    for path in args.files:
+        with open(path, 'rb') as f:
+            samples[path] = f.read(SIGNATURE_PREFIX)
+    for path, (extension, nanoseconds) in benchmark(samples, args.rounds).items():
+        fmt = FORMATS_BY_EXTENSION.get(extension)
+        description = f"{extension} ({fmt.content_type}, {fmt.folder}/)" if fmt else "unknown"
+        print(f"  {Path(path).name}: {description} in {nanoseconds:,.0f} ns")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
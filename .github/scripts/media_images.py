@@ -0,0 +1,533 @@
+#!/usr/bin/env python3
+"""
+Responsive Image Derivatives
+
+Photos arrive at full camera resolution. upload_media.py uses this module to
+build smaller copies of each photo at a few fixed widths, so the site can offer
+a srcset and phones stop downloading 4-8 MB JPEGs:
+
+- WebP at every width, plus AVIF when the installed Pillow can encode it
+- widths at or above the original are skipped (no upscaling)
+- EXIF orientation is applied before resizing, so portrait phone shots stay upright
+
+Encoding is CPU bound, so it runs in a shared process pool. Attachments are
+processed by several threads, and each one submits its encodes to the same pool,
+so the photos of a multi-photo post are encoded in parallel instead of one after
+another. Each job decodes the source once and produces every width of one format.
+
+The same encoder turns cover art embedded in audio files into a small WebP
+poster (encode_poster).
+
+Before upload, JPEG and PNG originals can be optimized losslessly (optimize_photo):
+- JPEGs go through jpegtran, which rewrites the entropy coding (progressive, with
+  optimized Huffman tables) without decoding the pixels. EXIF orientation is applied
+  with jpegtran's lossless -rotate/-flip under -perfect; when the image size does
+  not allow a perfect transform the photo is left unrotated and keeps its
+  orientation flag. Only the ICC profile and the Copyright/Artist EXIF tags are
+  copied back in.
+- PNGs are recompressed with Pillow in the image process pool; every pixel stays
+  the same.
+The optimized file is only used when it is smaller or had to be rotated.
+
+Pillow and jpegtran are optional. Without Pillow no derivatives or posters are
+generated and PNGs are uploaded as they are; without jpegtran JPEGs are.
+"""
+
+import io
+import os
+import time
+import shutil
+import threading
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+try:
+    from PIL import Image, ImageOps, PngImagePlugin, features
+except ImportError:  # Derivatives are skipped without Pillow
+    Image = None
+
+
+DEFAULT_VARIANT_WIDTHS = (480, 960, 1600)
+
+# Browsers take the first <source> they support, so the smallest format goes first
+VARIANT_FORMATS = {
+    'avif': {'pillow': 'AVIF', 'extension': '.avif', 'content_type': 'image/avif', 'quality': 55},
+    'webp': {'pillow': 'WEBP', 'extension': '.webp', 'content_type': 'image/webp', 'quality': 80},
+}
+
+# Raster photos only: SVG is already resolution independent and GIFs may be animated
+SOURCE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+
+# Layout hint for the browser when picking a srcset candidate (the content column is 768px wide)
+DEFAULT_SIZES = '(max-width: 768px) 100vw, 768px'
+
+# EXIF orientations that swap width and height
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+# Cover art embedded in audio files becomes a WebP poster at most this wide
+POSTER_WIDTH = 512
+
+# Originals rewritten by optimize_photo, and the format each one is
+OPTIMIZE_FORMATS = {'.jpg': 'JPEG', '.jpeg': 'JPEG', '.png': 'PNG'}
+
+# Lossless jpegtran transform that undoes each EXIF orientation
+JPEGTRAN_TRANSFORMS = {
+    2: ('-flip', 'horizontal'),
+    3: ('-rotate', '180'),
+    4: ('-flip', 'vertical'),
+    5: ('-transpose',),
+    6: ('-rotate', '90'),
+    7: ('-transverse',),
+    8: ('-rotate', '270'),
+}
+JPEGTRAN_TIMEOUT = 60  # seconds
+
+# Larger files are uploaded as they are
+MAX_OPTIMIZE_SIZE = 64 * 1024 * 1024
+
+# Metadata kept by optimize_photo besides the ICC profile
+KEPT_EXIF_TAGS = {0x8298: 'Copyright', 0x013B: 'Artist'}
+ORIENTATION_TAG = 0x0112
+# Bytes per value of each TIFF field type
+TIFF_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8}
+KEPT_PNG_TEXT = ('Copyright', 'Author')
+
+
+@dataclass
+class OptimizedImage:
+    """A rewritten original and what it took to produce it."""
+    data: bytes
+    original_size: int
+    rotated: bool = False
+    timings: dict = None  # Seconds per stage
+
+    @property
+    def saved(self):
+        return self.original_size - len(self.data)
+
+
+@dataclass
+class ImageVariant:
+    """One encoded derivative of a source image."""
+    width: int
+    height: int
+    format: str
+    data: bytes
+
+    @property
+    def extension(self):
+        return VARIANT_FORMATS[self.format]['extension']
+
+    @property
+    def content_type(self):
+        return VARIANT_FORMATS[self.format]['content_type']
+
+
+def available_formats():
+    """Variant formats the installed Pillow can encode, in <source> preference order."""
+    if Image is None:
+        return []
+    return [name for name in VARIANT_FORMATS if features.check(name)]
+
+
+def is_derivative_source(filename):
+    """True when filename is a raster photo that gets responsive derivatives."""
+    return Image is not None and Path(filename).suffix.lower() in SOURCE_EXTENSIONS
+
+
+def image_dimensions(data):
+    """Displayed (width, height) of an image, reading only its header. Returns None if unreadable."""
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            width, height = img.size
+            orientation = img.getexif().get(0x0112)
+    except Exception:
+        return None
+    if orientation in TRANSPOSED_ORIENTATIONS:
+        return height, width
+    return width, height
+
+
+def planned_widths(source_width, widths=DEFAULT_VARIANT_WIDTHS):
+    """Variant widths worth generating for a source this wide (never upscaled)."""
+    return sorted({w for w in widths if 0 < w < source_width})
+
+
+def variant_s3_key(s3_key, width, extension):
+    """Key of a derivative, stored next to the original: a/b/photo.jpg -> a/b/photo-w960.webp."""
+    stem, _ = os.path.splitext(s3_key)
+    return f"{stem}-w{width}{extension}"
+
+
+def poster_s3_key(s3_key):
+    """Key of an audio file's cover art poster: a/b/song.mp3 -> a/b/song-poster.webp."""
+    stem, _ = os.path.splitext(s3_key)
+    return f"{stem}-poster.webp"
+
+
+def encode_poster(data, width=POSTER_WIDTH):
+    """
+    Encode embedded cover art as a small WebP image. Returns (bytes, width, height),
+    or None when Pillow is not installed or the picture cannot be read.
+    """
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            img.draft('RGB', (width, width))
+            img = ImageOps.exif_transpose(img).convert('RGB')
+            if img.width > width:
+                img = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+            out = io.BytesIO()
+            img.save(out, format='WEBP', quality=VARIANT_FORMATS['webp']['quality'])
+            return out.getvalue(), img.width, img.height
+    except Exception:
+        return None
+
+
+def jpegtran_path():
+    """Path of the jpegtran binary (MEDIA_UPLOAD_JPEGTRAN overrides it), or None when it is not installed."""
+    return shutil.which(os.environ.get('MEDIA_UPLOAD_JPEGTRAN') or 'jpegtran')
+
+
+def is_optimizable(extension):
+    """True when originals with this extension are rewritten by optimize_photo."""
+    format_name = OPTIMIZE_FORMATS.get(extension.lower())
+    if format_name == 'JPEG':
+        return jpegtran_path() is not None
+    return format_name == 'PNG' and Image is not None
+
+
+def jpeg_segments(data):
+    """(marker, payload) of every segment before the scan data of a JPEG. Raises ValueError if it is not one."""
+    if data[:2] != b'\xff\xd8':
+        raise ValueError("not a JPEG")
+    segments = []
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            raise ValueError(f"bad JPEG marker at byte {pos}")
+        marker = data[pos + 1]
+        if marker == 0xFF:  # Fill byte
+            pos += 1
+            continue
+        if marker in (0xDA, 0xD9):  # Start of scan, end of image
+            break
+        length = int.from_bytes(data[pos + 2:pos + 4], 'big')
+        segments.append((marker, data[pos + 4:pos + 2 + length]))
+        pos += 2 + length
+    return segments
+
+
+def _ifd0_entries(tiff):
+    """Byte order and {tag: (type, count, value bytes)} of the first IFD of an EXIF TIFF block."""
+    order = {b'II': 'little', b'MM': 'big'}.get(tiff[:2])
+    if order is None:
+        raise ValueError("bad EXIF byte order")
+    offset = int.from_bytes(tiff[4:8], order)
+    entries = {}
+    for i in range(int.from_bytes(tiff[offset:offset + 2], order)):
+        entry = tiff[offset + 2 + 12 * i:offset + 14 + 12 * i]
+        tag, field_type = int.from_bytes(entry[0:2], order), int.from_bytes(entry[2:4], order)
+        count = int.from_bytes(entry[4:8], order)
+        size = TIFF_TYPE_SIZES.get(field_type, 1) * count
+        if size <= 4:
+            value = entry[8:8 + size]
+        else:
+            start = int.from_bytes(entry[8:12], order)
+            value = tiff[start:start + size]
+        entries[tag] = (field_type, count, value)
+    return order, entries
+
+
+def _exif_segment(order, entries):
+    """APP1 payload with a single IFD holding entries, in the original byte order."""
+    ifd = len(entries).to_bytes(2, order)
+    extra = b''
+    data_offset = 8 + 2 + 12 * len(entries) + 4
+    for tag in sorted(entries):
+        field_type, count, value = entries[tag]
+        ifd += tag.to_bytes(2, order) + field_type.to_bytes(2, order) + count.to_bytes(4, order)
+        if len(value) <= 4:
+            ifd += value.ljust(4, b'\0')
+        else:
+            ifd += (data_offset + len(extra)).to_bytes(4, order)
+            extra += value + b'\0' * (len(value) % 2)
+    header = (b'II' if order == 'little' else b'MM') + (42).to_bytes(2, order) + (8).to_bytes(4, order)
+    return b'Exif\0\0' + header + ifd + (0).to_bytes(4, order) + extra
+
+
+def jpeg_metadata(data):
+    """
+    EXIF orientation and the segments optimize_jpeg copies back: the ICC profile
+    chunks and the Copyright/Artist tags. Returns (orientation, kept_entries,
+    byte_order, icc_segments).
+    """
+    orientation, kept, order, icc = 1, {}, 'big', []
+    exif_seen = False
+    for marker, payload in jpeg_segments(data):
+        if marker == 0xE1 and payload.startswith(b'Exif\0\0') and not exif_seen:
+            exif_seen = True
+            try:
+                order, entries = _ifd0_entries(payload[6:])
+            except (ValueError, IndexError):
+                continue
+            if ORIENTATION_TAG in entries:
+                orientation = int.from_bytes(entries[ORIENTATION_TAG][2][:2], order) or 1
+            kept = {tag: entries[tag] for tag in KEPT_EXIF_TAGS if tag in entries}
+        elif marker == 0xE2 and payload.startswith(b'ICC_PROFILE\0'):
+            icc.append(payload)
+    icc.sort(key=lambda payload: payload[12])  # Chunk sequence number
+    return orientation, kept, order, icc
+
+
+def insert_jpeg_segments(data, segments):
+    """Insert (marker, payload) segments after the SOI and JFIF header of a JPEG."""
+    pos = 2
+    if data[2:4] == b'\xff\xe0':
+        pos += 2 + int.from_bytes(data[4:6], 'big')
+    encoded = b''.join(
+        b'\xff' + bytes([marker]) + (len(payload) + 2).to_bytes(2, 'big') + payload
+        for marker, payload in segments if len(payload) + 2 <= 0xFFFF
+    )
+    return data[:pos] + encoded + data[pos:]
+
+
+def run_jpegtran(jpegtran, data, transform=()):
+    """Lossless jpegtran rewrite without metadata; None when jpegtran fails (or -perfect is impossible)."""
+    args = [jpegtran, '-copy', 'none', '-optimize', '-progressive']
+    if transform:
+        args += [*transform, '-perfect']
+    try:
+        result = subprocess.run(args, input=data, check=True, capture_output=True, timeout=JPEGTRAN_TIMEOUT)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout or None
+
+
+def optimize_jpeg(data, jpegtran):
+    """
+    Rewrite one JPEG with jpegtran: progressive with optimized Huffman tables,
+    orientation applied by a lossless transform when a perfect one exists, and only
+    the ICC profile and Copyright/Artist kept. The DCT coefficients are never
+    requantized. Returns an OptimizedImage, or None when the file cannot be read.
+    """
+    timings = {}
+    started = time.perf_counter()
+    try:
+        orientation, kept, order, icc = jpeg_metadata(data)
+    except ValueError:
+        return None
+    timings['parse'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    transform = JPEGTRAN_TRANSFORMS.get(orientation)
+    out = run_jpegtran(jpegtran, data, transform) if transform else None
+    rotated = out is not None
+    if out is None:
+        # No perfect transform for this size: leave the pixels and keep the orientation flag
+        out = run_jpegtran(jpegtran, data)
+        if out is None:
+            return None
+        if transform:
+            kept[ORIENTATION_TAG] = (3, 1, orientation.to_bytes(2, order))
+    timings['jpegtran'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    segments = [(0xE1, _exif_segment(order, kept))] if kept else []
+    segments += [(0xE2, payload) for payload in icc]
+    out = insert_jpeg_segments(out, segments)
+    timings['metadata'] = time.perf_counter() - started
+
+    return OptimizedImage(out, len(data), rotated, timings)
+
+
+def _kept_exif(exif):
+    kept = Image.Exif()
+    for tag in KEPT_EXIF_TAGS:
+        if tag in exif:
+            kept[tag] = exif[tag]
+    return kept
+
+
+def optimize_png(data):
+    """
+    Recompress one PNG without changing a pixel; EXIF orientation is applied by
+    transposing the pixels. Runs in a worker process; returns an OptimizedImage,
+    or None when the file cannot be read.
+    """
+    timings = {}
+    started = time.perf_counter()
+    try:
+        img = Image.open(io.BytesIO(data))
+        img.load()
+    except Exception:
+        return None
+    if img.format != 'PNG' or getattr(img, 'is_animated', False):
+        return None
+    exif = img.getexif()
+    orientation = exif.get(ORIENTATION_TAG, 1)
+    icc_profile = img.info.get('icc_profile')
+    save_args = {'icc_profile': icc_profile} if icc_profile else {}
+    kept = _kept_exif(exif)
+    text = PngImagePlugin.PngInfo()
+    for key in KEPT_PNG_TEXT:
+        if isinstance(img.info.get(key), str):
+            text.add_text(key, img.info[key])
+    save_args.update(optimize=True, pnginfo=text)
+    if kept:
+        save_args['exif'] = kept
+    timings['decode'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    rotated = orientation not in (None, 1)
+    if rotated:
+        img = ImageOps.exif_transpose(img)
+    timings['orient'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    out = io.BytesIO()
+    img.save(out, format='PNG', **save_args)
+    timings['encode'] = time.perf_counter() - started
+
+    return OptimizedImage(out.getvalue(), len(data), rotated, timings)
+
+
+def optimize_photo(data, extension, pool=None):
+    """
+    Losslessly optimize a JPEG (optimize_jpeg) or PNG (optimize_png) original
+    before upload and report the bytes saved and the time spent per stage. Returns
+    the bytes to upload: data itself for other files, unreadable images, files over
+    MAX_OPTIMIZE_SIZE, or when jpegtran (JPEG) or Pillow (PNG) is not installed.
+    """
+    if not is_optimizable(extension) or len(data) > MAX_OPTIMIZE_SIZE:
+        return data
+    if OPTIMIZE_FORMATS[extension.lower()] == 'JPEG':
+        # jpegtran is a separate process already; the image pool is not needed
+        result = optimize_jpeg(data, jpegtran_path())
+    else:
+        pool = pool or get_image_pool()
+        result = pool.submit(optimize_png, data).result()
+    if result is None:
+        print(f"  ⚠️  Could not read {extension} image; uploading it unchanged")
+        return data
+    stages = ', '.join(f"{stage} {seconds * 1000:.0f} ms" for stage, seconds in result.timings.items())
+    if result.saved <= 0 and not result.rotated:
+        print(f"  🗜️  Original {extension} kept; optimizing saved nothing ({stages})")
+        return data
+    percent = result.saved * 100 / result.original_size
+    rotated = ", orientation applied" if result.rotated else ""
+    print(f"  🗜️  Optimized {extension}: {result.original_size} -> {len(result.data)} bytes "
+          f"({percent:.1f}% saved{rotated}; {stages})")
+    return result.data
+
+
+def optimize_chunks(chunks, extension, pool=None):
+    """
+    Streaming version of optimize_photo: collects the chunks of a photo (up to
+    MAX_OPTIMIZE_SIZE), optimizes it and yields the result. Larger files pass
+    through unchanged as they arrive.
+    """
+    chunks = iter(chunks)
+    buffered = bytearray()
+    for chunk in chunks:
+        buffered += chunk
+        if len(buffered) > MAX_OPTIMIZE_SIZE:
+            yield bytes(buffered)
+            yield from chunks
+            return
+    if buffered:
+        yield optimize_photo(bytes(buffered), extension, pool)
+
+
+def encode_variants(data, widths, format_name):
+    """
+    Decode data once and encode it at each width in one format.
+    Runs in a worker process; returns [(width, height, bytes)].
+    """
+    spec = VARIANT_FORMATS[format_name]
+    with Image.open(io.BytesIO(data)) as img:
+        # Let the JPEG decoder scale down by a power of two while decoding
+        img.draft('RGB', (max(widths), max(widths)))
+        img = ImageOps.exif_transpose(img)
+        has_alpha = img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info)
+        img = img.convert('RGBA' if has_alpha else 'RGB')
+        results = []
+        for width in sorted(widths, reverse=True):
+            height = max(1, round(img.height * width / img.width))
+            resized = img.resize((width, height), Image.LANCZOS)
+            out = io.BytesIO()
+            resized.save(out, format=spec['pillow'], quality=spec['quality'])
+            results.append((width, height, out.getvalue()))
+            # Later (smaller) widths resize from this copy, which is cheaper than the original
+            img = resized
+    return sorted(results)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_image_pool():
+    """Process pool shared by all attachments; MEDIA_UPLOAD_IMAGE_PROCESSES sets its size."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            value = os.environ.get('MEDIA_UPLOAD_IMAGE_PROCESSES', '')
+            workers = int(value) if value.isdigit() and int(value) > 0 else (os.cpu_count() or 1)
+            _pool = ProcessPoolExecutor(max_workers=workers)
+        return _pool
+
+
+def shutdown_image_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+
+def generate_variants(data, filename, widths=DEFAULT_VARIANT_WIDTHS, formats=None, pool=None):
+    """
+    Build the responsive derivatives of one image.
+
+    Returns a list of ImageVariant sorted by format preference and width. Returns
+    an empty list for non-photos, images narrower than every width, unreadable
+    files, or when Pillow is not installed.
+    """
+    if not is_derivative_source(filename):
+        return []
+    dimensions = image_dimensions(data)
+    if dimensions is None:
+        print(f"  ⚠️  Could not read {filename} as an image; skipping derivatives")
+        return []
+    targets = planned_widths(dimensions[0], widths)
+    formats = available_formats() if formats is None else formats
+    if not targets or not formats:
+        return []
+
+    pool = pool or get_image_pool()
+    futures = [(name, pool.submit(encode_variants, data, targets, name)) for name in formats]
+    return [
+        ImageVariant(width, height, name, encoded)
+        for name, future in futures
+        for width, height, encoded in future.result()
+    ]
+
+
+def srcset_fields(variants, url_for):
+    """
+    :::media fields describing variants: one srcset per format, plus sizes.
+    url_for maps a variant to its public URL.
+    """
+    fields = {}
+    for name in VARIANT_FORMATS:
+        candidates = [v for v in variants if v.format == name]
+        if candidates:
+            field = 'srcset' + name.capitalize()
+            fields[field] = ', '.join(f"{url_for(v)} {v.width}w" for v in candidates)
+    if fields:
+        fields['sizes'] = DEFAULT_SIZES
+    return fields
@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+"""
+Media Bucket Inventory
+
+Keeps a local SQLite snapshot of what is in the media bucket and reports how it
+lines up with the site content:
+
+1. Discovers the folders under a prefix (files/images/, files/videos/, ...) with a
+   delimited listing and pages through each folder's list_objects_v2 concurrently
+2. Stores key, size, ETag and last-modified per object. Later runs apply only the
+   difference (added, changed and removed keys) to the existing snapshot
+3. Cross-references every URL inside :::media blocks under _src and reports
+   orphaned objects (in the bucket, never referenced), missing objects (referenced,
+   not in the bucket) and total bytes per media folder
+
+upload_media.py reads the snapshot when MEDIA_UPLOAD_INVENTORY points at it: the
+deduplication check for content-addressed keys then looks the key up locally
+instead of sending a HEAD request per upload.
+
+Usage:
+    python media_inventory.py [--db media-inventory.sqlite] [--prefix files/] [--workers 8]
+                              [--src _src] [--host cdn.lqdev.tech] [--no-sync] [--report PATH]
+
+Uses the same LINODE_STORAGE_* environment variables as upload_media.py.
+"""
+
+import os
+import re
+import sys
+import json
+import sqlite3
+import argparse
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from urllib.parse import urlparse
+
+
+DEFAULT_DB = 'media-inventory.sqlite'
+DEFAULT_PREFIX = 'files/'
+DEFAULT_WORKERS = 8
+DEFAULT_PAGE_SIZE = 1000
+DEFAULT_SRC_DIR = '_src'
+
+# Precompressed copies stored next to their original (see upload_precompressed_variants)
+VARIANT_SUFFIXES = ('.gz', '.br')
+
+MEDIA_BLOCK_PATTERN = re.compile(r':::media\s*\n(.*?)\n\s*:::media', re.DOTALL)
+URL_PATTERN = re.compile(r'https?://[^\s"\'<>)]+')
+ITEM_FIELD_PATTERN = re.compile(r'^\s*(-\s+)?(\w+):\s*(.*?)\s*$')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    key TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    folder TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS syncs (
+    prefix TEXT PRIMARY KEY,
+    synced_at TEXT NOT NULL,
+    objects INTEGER NOT NULL
+);
+"""
+
+
+def key_folder(s3_key, prefix=DEFAULT_PREFIX):
+    """Media folder of a key: the path segment right after prefix ('images' for files/images/a.jpg)."""
+    rest = s3_key[len(prefix):] if s3_key.startswith(prefix) else s3_key
+    return rest.split('/', 1)[0] if '/' in rest else ''
+
+
+def _timestamp(value):
+    """LastModified as an ISO string, whether boto3 returned a datetime or a backend returned a string."""
+    if value is None:
+        return None
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+
+class MediaInventory:
+    """SQLite snapshot of the objects in a bucket, safe to share between threads."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def covers(self, s3_key):
+        """True when a synced prefix includes s3_key, so a missing row means a missing object."""
+        with self._lock:
+            rows = self._db.execute('SELECT prefix FROM syncs').fetchall()
+        return any(s3_key.startswith(prefix) for (prefix,) in rows)
+
+    def lookup(self, s3_key):
+        """Return the stored object as head_object-style fields, or None when it is not in the snapshot."""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT size, etag, last_modified FROM objects WHERE key = ?', (s3_key,)
+            ).fetchone()
+        if row is None:
+            return None
+        size, etag, last_modified = row
+        return {'ContentLength': size, 'ETag': etag, 'LastModified': last_modified}
+
+    def keys(self, prefix=''):
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT key FROM objects WHERE substr(key, 1, ?) = ? ORDER BY key', (len(prefix), prefix)
+            ).fetchall()
+        return [key for (key,) in rows]
+
+    def bytes_by_folder(self, prefix=''):
+        """{folder: (object_count, total_bytes)} for objects under prefix."""
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT folder, COUNT(*), SUM(size) FROM objects WHERE substr(key, 1, ?) = ? '
+                'GROUP BY folder ORDER BY folder', (len(prefix), prefix)
+            ).fetchall()
+        return {folder: (count, total) for folder, count, total in rows}
+
+    def sync(self, s3_client, bucket_name, prefix=DEFAULT_PREFIX, workers=DEFAULT_WORKERS,
+             page_size=DEFAULT_PAGE_SIZE):
+        """
+        Bring the snapshot of prefix up to date with the bucket.
+
+        Each folder under prefix is listed by its own worker. The listing is then
+        diffed against the stored rows and only added, changed and removed keys are
+        written, in one transaction. Returns counts for each of those plus 'unchanged'.
+        """
+        partitions, listed = discover_partitions(s3_client, bucket_name, prefix, page_size)
+        print(f"🗂️  Listing {len(partitions)} folder(s) under {prefix} with {workers} worker(s)")
+
+        def list_partition(partition):
+            return list(iter_objects(s3_client, bucket_name, partition, page_size))
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for objects in executor.map(list_partition, partitions):
+                listed.extend(objects)
+
+        current = {obj['Key']: obj for obj in listed}
+        stats = Counter()
+        with self._lock:
+            stored = {
+                key: (size, etag)
+                for key, size, etag in self._db.execute(
+                    'SELECT key, size, etag FROM objects WHERE substr(key, 1, ?) = ?', (len(prefix), prefix)
+                )
+            }
+            with self._db:
+                for key, obj in current.items():
+                    row = (obj.get('Size', 0), str(obj.get('ETag') or '').strip('"'))
+                    if stored.get(key) == row:
+                        stats['unchanged'] += 1
+                        continue
+                    stats['updated' if key in stored else 'added'] += 1
+                    self._db.execute(
+                        'INSERT OR REPLACE INTO objects (key, size, etag, last_modified, folder) '
+                        'VALUES (?, ?, ?, ?, ?)',
+                        (key, row[0], row[1], _timestamp(obj.get('LastModified')), key_folder(key, prefix))
+                    )
+                removed = [(key,) for key in stored if key not in current]
+                self._db.executemany('DELETE FROM objects WHERE key = ?', removed)
+                stats['removed'] = len(removed)
+                self._db.execute(
+                    'INSERT OR REPLACE INTO syncs (prefix, synced_at, objects) VALUES (?, ?, ?)',
+                    (prefix, datetime.now(timezone.utc).isoformat(), len(current))
+                )
+        return {name: stats[name] for name in ('added', 'updated', 'removed', 'unchanged')}
+
+
+def iter_objects(s3_client, bucket_name, prefix, page_size=DEFAULT_PAGE_SIZE, delimiter=None):
+    """Yield list_objects_v2 entries under prefix across all pages."""
+    kwargs = {'Bucket': bucket_name, 'Prefix': prefix, 'MaxKeys': page_size}
+    if delimiter:
+        kwargs['Delimiter'] = delimiter
+    while True:
+        response = s3_client.list_objects_v2(**kwargs)
+        yield from response.get('Contents', [])
+        for common in response.get('CommonPrefixes', []):
+            yield {'Prefix': common['Prefix']}
+        if not response.get('IsTruncated'):
+            return
+        kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+
+def discover_partitions(s3_client, bucket_name, prefix, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Split prefix into its immediate sub-prefixes for concurrent listing.
+    Returns (sub_prefixes, objects_directly_under_prefix).
+    """
+    partitions, direct = [], []
+    for entry in iter_objects(s3_client, bucket_name, prefix, page_size, delimiter='/'):
+        if 'Prefix' in entry:
+            partitions.append(entry['Prefix'])
+        else:
+            direct.append(entry)
+    return partitions, direct
+
+
+def find_media_references(src_dir=DEFAULT_SRC_DIR):
+    """Return {url: [relative source paths]} for every URL inside :::media blocks under src_dir."""
+    references = {}
+    root = Path(src_dir)
+    for path in sorted(root.rglob('*.md')):
+        try:
+            text = path.read_text(encoding='utf-8')
+        except (OSError, UnicodeDecodeError):
+            continue
+        if ':::media' not in text:
+            continue
+        for block in MEDIA_BLOCK_PATTERN.findall(text):
+            for url in URL_PATTERN.findall(block):
+                references.setdefault(url, []).append(str(path.relative_to(root)))
+    return references
+
+
+def _scalar(raw):
+    """A :::media field value: quoted strings unquoted, bare numbers as int or float."""
+    if len(raw) >= 2 and raw[0] == raw[-1] and raw[0] in '"\'':
+        return raw[1:-1]
+    for convert in (int, float):
+        try:
+            return convert(raw)
+        except ValueError:
+            pass
+    return raw
+
+
+def parse_media_items(block):
+    """Fields of each item in the body of a :::media block, as a list of {name: value} dicts."""
+    items = []
+    for line in block.splitlines():
+        match = ITEM_FIELD_PATTERN.match(line)
+        if match is None:
+            continue
+        dash, name, raw = match.groups()
+        if dash:
+            items.append({})
+        if items:
+            items[-1][name] = _scalar(raw)
+    return items
+
+
+def find_media_items(src_dir=DEFAULT_SRC_DIR):
+    """Return {url: fields} for every item in :::media blocks under src_dir (first use wins)."""
+    items = {}
+    for path in sorted(Path(src_dir).rglob('*.md')):
+        try:
+            text = path.read_text(encoding='utf-8')
+        except (OSError, UnicodeDecodeError):
+            continue
+        if ':::media' not in text:
+            continue
+        for block in MEDIA_BLOCK_PATTERN.findall(text):
+            for item in parse_media_items(block):
+                if isinstance(item.get('url'), str):
+                    items.setdefault(item['url'], item)
+    return items
+
+
+def reference_key(url, prefix=DEFAULT_PREFIX, hosts=None):
+    """Object key a media URL points at, or None when it is not an object in this bucket."""
+    parsed = urlparse(url)
+    if hosts and parsed.hostname not in hosts:
+        return None
+    key = parsed.path.lstrip('/')
+    return key if key.startswith(prefix) else None
+
+
+def build_report(inventory, references, prefix=DEFAULT_PREFIX, hosts=None):
+    """
+    Cross-reference the snapshot with the :::media URLs found in the content.
+
+    Precompressed .gz/.br copies count as referenced when their original is.
+    Returns a dict with orphaned keys, missing keys (with the files that use them)
+    and objects/bytes per folder.
+    """
+    referenced = {}
+    for url, sources in references.items():
+        key = reference_key(url, prefix, hosts)
+        if key is not None:
+            referenced.setdefault(key, []).extend(sources)
+
+    stored = set(inventory.keys(prefix))
+    orphaned = []
+    for key in sorted(stored - set(referenced)):
+        base, ext = os.path.splitext(key)
+        if ext in VARIANT_SUFFIXES and base in referenced:
+            continue
+        orphaned.append(key)
+    missing = {key: sorted(set(sources)) for key, sources in sorted(referenced.items()) if key not in stored}
+
+    folders = {
+        folder or '(root)': {'objects': count, 'bytes': total}
+        for folder, (count, total) in inventory.bytes_by_folder(prefix).items()
+    }
+    return {
+        'objects': len(stored),
+        'referenced': len(referenced),
+        'orphaned': orphaned,
+        'missing': missing,
+        'folders': folders,
+    }
+
+
+_inventory = None
+_inventory_lock = threading.Lock()
+
+
+def get_media_inventory():
+    """
+    Return the process-wide MediaInventory, or None when no snapshot is configured.
+    Enabled by pointing MEDIA_UPLOAD_INVENTORY at a snapshot written by this command.
+    """
+    global _inventory
+    path = os.environ.get('MEDIA_UPLOAD_INVENTORY')
+    if not path or not os.path.exists(path):
+        return None
+    with _inventory_lock:
+        if _inventory is None or _inventory.path != path:
+            _inventory = MediaInventory(path)
+        return _inventory
+
+
+def format_bytes(size):
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024 or unit == 'GiB':
+            return f"{size:.1f} {unit}" if unit != 'B' else f"{size} B"
+        size /= 1024
+
+
+def main():
+    # Imported here so the snapshot classes stay usable from upload_media.py without a cycle
+    from media_storage import public_object_url
+    from media_throttle import GuardedS3Client, configure_host_guard, print_throttle_report
+    from upload_media import create_s3_client
+
+    parser = argparse.ArgumentParser(description="Snapshot the media bucket and report orphaned and missing objects.")
+    parser.add_argument('--db', default=DEFAULT_DB, help="SQLite snapshot path (default: media-inventory.sqlite)")
+    parser.add_argument('--prefix', default=DEFAULT_PREFIX, help="Key prefix to inventory (default: files/)")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="Folders listed in parallel (default: 8)")
+    parser.add_argument('--src', default=DEFAULT_SRC_DIR, help="Content directory to scan for :::media blocks")
+    parser.add_argument('--host', action='append', default=[],
+                        help="Hostname that serves the bucket (repeatable; default: custom domain and bucket host)")
+    parser.add_argument('--no-sync', action='store_true', help="Report from the existing snapshot without listing")
+    parser.add_argument('--report', help="Write the report as JSON to this path")
+    args = parser.parse_args()
+
+    access_key = os.environ.get('LINODE_STORAGE_ACCESS_KEY_ID')
+    secret_key = os.environ.get('LINODE_STORAGE_SECRET_ACCESS_KEY')
+    endpoint_url = os.environ.get('LINODE_STORAGE_ENDPOINT_URL')
+    bucket_name = os.environ.get('LINODE_STORAGE_BUCKET_NAME')
+    custom_domain = os.environ.get('LINODE_STORAGE_CUSTOM_DOMAIN')
+    if not args.no_sync and not all([access_key, secret_key, endpoint_url, bucket_name]):
+        print("❌ Missing required environment variables:")
+        print("   - LINODE_STORAGE_ACCESS_KEY_ID")
+        print("   - LINODE_STORAGE_SECRET_ACCESS_KEY")
+        print("   - LINODE_STORAGE_ENDPOINT_URL")
+        print("   - LINODE_STORAGE_BUCKET_NAME")
+        sys.exit(1)
+
+    hosts = set(args.host)
+    if not hosts and bucket_name and endpoint_url:
+        hosts.add(urlparse(public_object_url('', endpoint_url, bucket_name)).hostname)
+        if custom_domain:
+            hosts.add(urlparse(custom_domain).hostname)
+
+    inventory = MediaInventory(args.db)
+    if not args.no_sync:
+        s3_client = create_s3_client(endpoint_url, access_key, secret_key, max_pool_connections=max(10, args.workers))
+        host = urlparse(endpoint_url).hostname or endpoint_url
+        s3_client = GuardedS3Client(s3_client, configure_host_guard(host, max_concurrency=max(1, args.workers)))
+        stats = inventory.sync(s3_client, bucket_name, args.prefix, args.workers)
+        print(f"🔄 Synced {args.db}: " + ', '.join(f"{count} {name}" for name, count in stats.items()))
+        print_throttle_report()
+
+    report = build_report(inventory, find_media_references(args.src), args.prefix, hosts or None)
+    inventory.close()
+
+    print(f"\n📊 Inventory of {args.prefix}: {report['objects']} object(s), "
+          f"{report['referenced']} referenced from {args.src}")
+    for folder, totals in report['folders'].items():
+        print(f"  - {folder}/: {totals['objects']} object(s), {format_bytes(totals['bytes'])}")
+    print(f"🧹 Orphaned objects: {len(report['orphaned'])}")
+    for key in report['orphaned']:
+        print(f"  - {key}")
+    print(f"❓ Missing objects: {len(report['missing'])}")
+    for key, sources in report['missing'].items():
+        print(f"  - {key} (used in {', '.join(sources)})")
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"📄 Report written to {args.report}")
+    sys.exit(1 if report['missing'] else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Crash-Safe Run Journal for upload_media.py
+
+If one attachment fails, upload_media.py exits with status 1 and leaves the content
+file untouched. Without a record of what already finished, a rerun downloads and
+uploads everything again and orphans the objects from the first attempt.
+
+The journal is a small JSON file next to the content file:
+
+    <content-file>.upload-journal.json
+
+CI runners throw the content file away after every job, so MEDIA_UPLOAD_JOURNAL_DIR
+moves the journal into a directory the workflow caches between runs, named after
+MEDIA_UPLOAD_JOURNAL_KEY (the issue number) and the content file:
+
+    $MEDIA_UPLOAD_JOURNAL_DIR/<key>-<content-file-name>.upload-journal.json
+
+    {
+      "version": 1,
+      "target": "<endpoint>/<bucket>",
+      "entries": {
+        "<github_url>": {
+          "step": "uploaded",
+          "size": 123, "extension": ".jpg",
+          "s3_key": "files/images/...", "permanent_url": "https://...", "media_type": "image",
+          "updated": "2025-01-01T00:00:00+00:00"
+        }
+      }
+    }
+
+It is rewritten atomically (temp file, fsync, rename) after every step, so a crash
+at any point leaves either the previous or the next version on disk, never a torn
+file. A rerun replays the uploaded entries and continues from the failure point.
+A journal next to the content file is deleted once the content file has been
+rewritten; one in MEDIA_UPLOAD_JOURNAL_DIR is kept, so a reopened issue whose
+content is rebuilt from the issue body replays its attachments too.
+"""
+
+import os
+import json
+import tempfile
+import threading
+from datetime import datetime, timezone
+
+
+JOURNAL_VERSION = 1
+JOURNAL_SUFFIX = '.upload-journal.json'
+
+
+def write_text_atomic(path, text):
+    """
+    Replace path with text atomically: write a temp file in the same directory,
+    fsync it, then rename it over the target.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class RunJournal:
+    """
+    Per-attachment progress for one content file. Thread-safe; workers record
+    their own steps and every update is flushed to disk before returning.
+    """
+
+    def __init__(self, path, target='', persistent=False):
+        self.path = path
+        self.target = target
+        # Kept after a successful run (lives in MEDIA_UPLOAD_JOURNAL_DIR, not next to the content file)
+        self.persistent = persistent
+        self.entries = {}
+        self.replayed = 0
+        self._lock = threading.Lock()
+        self._load()
+
+    @classmethod
+    def for_content_file(cls, content_file, target=''):
+        return cls(content_file + JOURNAL_SUFFIX, target)
+
+    @classmethod
+    def for_run(cls, content_file, target=''):
+        """
+        Journal for this run: in MEDIA_UPLOAD_JOURNAL_DIR (keyed by MEDIA_UPLOAD_JOURNAL_KEY)
+        when it is set, otherwise next to the content file.
+        """
+        directory = os.environ.get('MEDIA_UPLOAD_JOURNAL_DIR')
+        if not directory:
+            return cls.for_content_file(content_file, target)
+        os.makedirs(directory, exist_ok=True)
+        name = os.path.basename(content_file)
+        key = os.environ.get('MEDIA_UPLOAD_JOURNAL_KEY', '').strip()
+        if key:
+            name = f"{key}-{name}"
+        return cls(os.path.join(directory, name + JOURNAL_SUFFIX), target, persistent=True)
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"⚠️  Ignoring unreadable run journal {self.path}: {e}")
+            return
+        if data.get('version') != JOURNAL_VERSION or data.get('target') != self.target:
+            # Written for another bucket or by an incompatible version - start over
+            print(f"⚠️  Run journal {self.path} belongs to a different target; starting fresh")
+            return
+        self.entries = data.get('entries', {})
+        uploaded = sum(1 for entry in self.entries.values() if entry.get('step') == 'uploaded')
+        if uploaded:
+            print(f"📒 Resuming from run journal: {uploaded} attachment(s) already uploaded")
+
+    def _save(self):
+        write_text_atomic(self.path, json.dumps({
+            'version': JOURNAL_VERSION,
+            'target': self.target,
+            'entries': self.entries,
+        }, indent=2))
+
+    def record(self, url, step, **fields):
+        """Record that url finished step ('downloaded' or 'uploaded') and flush to disk."""
+        with self._lock:
+            entry = self.entries.setdefault(url, {})
+            entry.update(fields)
+            entry['step'] = step
+            entry['updated'] = datetime.now(timezone.utc).isoformat(timespec='seconds')
+            self._save()
+
+    def completed(self, url):
+        """Return (permanent_url, media_type) if url was uploaded by an earlier run, else None."""
+        with self._lock:
+            entry = self.entries.get(url)
+            if not entry or entry.get('step') != 'uploaded':
+                return None
+            self.replayed += 1
+            return entry['permanent_url'], entry['media_type']
+
+    def details(self, url):
+        """Extra :::media fields (srcset, ...) recorded with url's upload, or {}."""
+        with self._lock:
+            return dict(self.entries.get(url, {}).get('details') or {})
+
+    def remove(self):
+        """Delete the journal once the run has fully completed."""
+        with self._lock:
+            self.entries = {}
+            if os.path.exists(self.path):
+                os.remove(self.path)
@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+"""
+Near-Duplicate Image Detection
+
+The same photo is often posted again after GitHub or a phone has recompressed
+or resized it, so neither its bytes nor its content-addressed key match the
+copy already on the site. upload_media.py uses this module to recognise such
+photos and reuse the CDN URL of the existing copy instead of uploading again:
+
+1. Each image gets a 64-bit DCT hash (pHash: the lowest frequencies of a
+   32x32 grayscale thumbnail compared to their median; JPEGs are scaled down
+   while decoding), which survives heavy recompression. Cheaper gradient
+   hashes (dHash) are not used: unrelated text screenshots land within a bit
+   or two of each other, so a match on them would swap in the wrong photo
+2. The index is a SQLite file with the hash of every image referenced from
+   :::media blocks under _src, plus the fields of its :::media item
+3. Lookups go through an in-memory multi-index: each hash is split into four
+   16-bit chunks with a table per chunk, so a search probes a few hundred
+   table slots instead of comparing against every image (well under a
+   millisecond at tens of thousands of images)
+
+upload_media.py reads the index when MEDIA_UPLOAD_PHASH_INDEX points at it;
+NumPy and Pillow are required.
+
+Usage (build or refresh the index; only new images are downloaded):
+    python media_phash.py [--db media-phash.sqlite] [--src _src] [--prefix files/]
+                          [--workers 8] [--host cdn.lqdev.tech]
+
+Uses the same LINODE_STORAGE_* environment variables as upload_media.py.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from collections import Counter
+from functools import lru_cache
+from itertools import combinations
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from urllib.parse import urlparse
+
+from media_images import get_image_pool, shutdown_image_pool
+from media_inventory import DEFAULT_PREFIX, DEFAULT_SRC_DIR, find_media_items, reference_key
+
+try:
+    import numpy as np
+except ImportError:  # Near-duplicate detection is skipped without NumPy
+    np = None
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Near-duplicate detection is skipped without Pillow
+    Image = None
+
+
+DEFAULT_DB = 'media-phash.sqlite'
+DEFAULT_WORKERS = 8
+
+# Bits (out of 64) two hashes may differ by and still count as the same photo.
+# Recompressed, resized and re-encoded photos stay within it; unrelated photos
+# are 20 or more bits apart, and unrelated text screenshots 10 or more.
+DEFAULT_MAX_DISTANCE = 6
+
+# Side of the grayscale thumbnail the hashes are computed from
+THUMBNAIL_SIZE = 32
+HASH_SIZE = 8
+
+# :::media fields that describe the post rather than the image
+POST_FIELDS = ('url', 'mediaType', 'caption', 'alt')
+
+# Bumped when the table changes; older index files are emptied and rebuilt
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    phash TEXT NOT NULL,
+    details TEXT NOT NULL
+);
+"""
+
+
+@dataclass
+class NearDuplicate:
+    """An indexed image that matches an upload."""
+    key: str
+    url: str
+    distance: int
+    details: dict = field(default_factory=dict)
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+def _bits(values):
+    result = 0
+    for value in values:
+        result = (result << 1) | bool(value)
+    return result
+
+
+def _dct_matrix(n):
+    k = np.arange(n)
+    return np.cos(np.pi * np.outer(k, 2 * k + 1) / (2 * n))
+
+
+def phash(thumbnail):
+    """DCT hash of a grayscale image: the 8x8 lowest frequencies (without DC) against their median."""
+    pixels = np.asarray(thumbnail, dtype=np.float64)
+    dct = _dct_matrix(pixels.shape[0])
+    low = (dct @ pixels @ dct.T)[:HASH_SIZE, :HASH_SIZE].flatten()
+    return _bits(low > np.median(low[1:]))
+
+
+def hashing_available():
+    """True when NumPy and Pillow are installed, so images can be hashed."""
+    return np is not None and Image is not None
+
+
+def image_hash(data):
+    """pHash of an image, upright; None when NumPy or Pillow is missing or the image cannot be read."""
+    if not hashing_available():
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            img.draft('L', (THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+            img = ImageOps.exif_transpose(img)
+            thumbnail = img.convert('L').resize((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.BOX)
+    except Exception:
+        return None
+    return phash(thumbnail)
+
+
+@lru_cache(maxsize=None)
+def _flip_masks(bits, radius):
+    """Every mask of up to radius set bits within a bits-wide chunk, the empty mask first."""
+    masks = []
+    for count in range(radius + 1):
+        for positions in combinations(range(bits), count):
+            masks.append(sum(1 << p for p in positions))
+    return masks
+
+
+class HammingIndex:
+    """
+    Multi-index hashing over 64-bit hashes.
+
+    Each hash is split into CHUNKS chunks of 16 bits, and each chunk position has
+    its own table. Two hashes at most d bits apart agree within d // CHUNKS bits on
+    at least one chunk (pigeonhole), so a search only probes the chunk values that
+    close to the query's and checks the few entries it finds, instead of every hash.
+    """
+
+    CHUNKS = 4
+    CHUNK_BITS = 16
+
+    def __init__(self):
+        self._entries = []
+        self._tables = [{} for _ in range(self.CHUNKS)]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _chunks(self, value):
+        mask = (1 << self.CHUNK_BITS) - 1
+        return [(value >> (i * self.CHUNK_BITS)) & mask for i in range(self.CHUNKS)]
+
+    def add(self, value, item):
+        entry = len(self._entries)
+        self._entries.append((value, item))
+        for table, chunk in zip(self._tables, self._chunks(value)):
+            table.setdefault(chunk, []).append(entry)
+
+    def search(self, value, max_distance):
+        """(distance, item) pairs within max_distance of value, closest first."""
+        masks = _flip_masks(self.CHUNK_BITS, max_distance // self.CHUNKS)
+        seen = set()
+        found = []
+        for table, chunk in zip(self._tables, self._chunks(value)):
+            for mask in masks:
+                for entry in table.get(chunk ^ mask, ()):
+                    if entry in seen:
+                        continue
+                    seen.add(entry)
+                    indexed, item = self._entries[entry]
+                    distance = hamming(value, indexed)
+                    if distance <= max_distance:
+                        found.append((distance, item))
+        found.sort(key=lambda pair: pair[0])
+        return found
+
+
+class PhashIndex:
+    """SQLite file of image hashes, searched through an in-memory multi-index; safe to share between threads."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        if self._db.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            self._db.execute('DROP TABLE IF EXISTS images')
+            self._db.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        self._db.executescript(SCHEMA)
+        self._db.commit()
+        # Loaded on the first lookup
+        self._search = None
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM images').fetchone()[0]
+
+    def keys(self):
+        with self._lock:
+            return {key for (key,) in self._db.execute('SELECT key FROM images')}
+
+    def _load(self):
+        """Build the in-memory index from the stored rows (caller holds the lock)."""
+        started = time.perf_counter()
+        self._search = HammingIndex()
+        for key, url, phash_hex, details in self._db.execute(
+                'SELECT key, url, phash, details FROM images ORDER BY key'):
+            self._search.add(int(phash_hex, 16), (key, url, details))
+        print(f"🔎 Loaded {len(self._search)} perceptual hash(es) from {self.path} "
+              f"in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    def add(self, key, url, image_phash, details=None):
+        """Store (or replace) the hash and :::media fields of the image at key."""
+        details = json.dumps({name: value for name, value in (details or {}).items() if name not in POST_FIELDS})
+        with self._lock:
+            with self._db:
+                replaced = self._db.execute('SELECT 1 FROM images WHERE key = ?', (key,)).fetchone()
+                self._db.execute(
+                    'INSERT OR REPLACE INTO images (key, url, phash, details) VALUES (?, ?, ?, ?)',
+                    (key, url, f"{image_phash:016x}", details)
+                )
+            if replaced:
+                self._search = None
+            elif self._search is not None:
+                self._search.add(image_phash, (key, url, details))
+
+    def remove(self, keys):
+        """Delete rows by key; the in-memory index is rebuilt on the next lookup."""
+        with self._lock:
+            with self._db:
+                self._db.executemany('DELETE FROM images WHERE key = ?', [(key,) for key in keys])
+            self._search = None
+
+    def find(self, image_phash, max_distance=DEFAULT_MAX_DISTANCE):
+        """The closest indexed image within max_distance bits of image_phash, or None."""
+        with self._lock:
+            if self._search is None:
+                self._load()
+            candidates = self._search.search(image_phash, max_distance)
+        if not candidates:
+            return None
+        distance, (key, url, details) = candidates[0]
+        return NearDuplicate(key, url, distance, json.loads(details))
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_phash_index():
+    """
+    Return the process-wide PhashIndex, or None when no index is configured.
+    Enabled by pointing MEDIA_UPLOAD_PHASH_INDEX at an index written by this command.
+    """
+    global _index
+    path = os.environ.get('MEDIA_UPLOAD_PHASH_INDEX')
+    if not path or not os.path.exists(path) or not hashing_available():
+        return None
+    with _index_lock:
+        if _index is None or _index.path != path:
+            _index = PhashIndex(path)
+        return _index
+
+
+def read_object(s3_client, bucket_name, key):
+    """Bytes of a stored object, from a media_storage backend or a boto3 client."""
+    get_bytes = getattr(s3_client, 'get_object_bytes', None)
+    if callable(get_bytes):
+        return get_bytes(key)
+    return s3_client.get_object(Bucket=bucket_name, Key=key)['Body'].read()
+
+
+def indexed_images(items, prefix, hosts=None):
+    """{key: item fields} for the image items of find_media_items() stored under prefix."""
+    images = {}
+    for url, item in items.items():
+        if item.get('mediaType') != 'image':
+            continue
+        key = reference_key(url, prefix, hosts)
+        if key is not None:
+            images.setdefault(key, item)
+    return images
+
+
+def build_index(index, s3_client, bucket_name, images, workers=DEFAULT_WORKERS, pool=None):
+    """
+    Bring the index up to date with images ({key: :::media item fields}).
+
+    Keys that are no longer referenced are dropped. New keys are downloaded by
+    worker threads and hashed in the image process pool. Returns counts of
+    added, removed, unchanged and failed images.
+    """
+    stats = Counter()
+    stored = index.keys()
+    removed = stored - set(images)
+    index.remove(removed)
+    stats['removed'] = len(removed)
+    pending = [key for key in sorted(images) if key not in stored]
+    stats['unchanged'] = len(images) - len(pending)
+    pool = pool or get_image_pool()
+    print(f"🔎 Hashing {len(pending)} new image(s) with {workers} download worker(s)")
+
+    def hash_image(key):
+        try:
+            data = read_object(s3_client, bucket_name, key)
+        except Exception as e:
+            print(f"  ⚠️  Could not read {key}: {e}")
+            return False
+        image_phash = pool.submit(image_hash, data).result()
+        if image_phash is None:
+            print(f"  ⚠️  Could not hash {key}")
+            return False
+        index.add(key, images[key]['url'], image_phash, images[key])
+        return True
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for ok in executor.map(hash_image, pending):
+            stats['added' if ok else 'failed'] += 1
+    return {name: stats[name] for name in ('added', 'removed', 'unchanged', 'failed')}
+
+
+def main():
+    # Imported here so the index classes stay usable from upload_media.py without a cycle
+    from media_storage import public_object_url
+    from media_throttle import GuardedS3Client, configure_host_guard, print_throttle_report
+    from upload_media import create_s3_client
+
+    parser = argparse.ArgumentParser(description="Build the perceptual hash index of images referenced from the site.")
+    parser.add_argument('--db', default=DEFAULT_DB, help="SQLite index path (default: media-phash.sqlite)")
+    parser.add_argument('--src', default=DEFAULT_SRC_DIR, help="Content directory to scan for :::media blocks")
+    parser.add_argument('--prefix', default=DEFAULT_PREFIX, help="Key prefix of indexed objects (default: files/)")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="Images downloaded in parallel (default: 8)")
+    parser.add_argument('--host', action='append', default=[],
+                        help="Hostname that serves the bucket (repeatable; default: custom domain and bucket host)")
+    args = parser.parse_args()
+
+    if not hashing_available():
+        print("❌ NumPy and Pillow are required to hash images")
+        sys.exit(1)
+
+    access_key = os.environ.get('LINODE_STORAGE_ACCESS_KEY_ID')
+    secret_key = os.environ.get('LINODE_STORAGE_SECRET_ACCESS_KEY')
+    endpoint_url = os.environ.get('LINODE_STORAGE_ENDPOINT_URL')
+    bucket_name = os.environ.get('LINODE_STORAGE_BUCKET_NAME')
+    custom_domain = os.environ.get('LINODE_STORAGE_CUSTOM_DOMAIN')
+    if not all([access_key, secret_key, endpoint_url, bucket_name]):
+        print("❌ Missing required environment variables:")
+        print("   - LINODE_STORAGE_ACCESS_KEY_ID")
+        print("   - LINODE_STORAGE_SECRET_ACCESS_KEY")
+        print("   - LINODE_STORAGE_ENDPOINT_URL")
+        print("   - LINODE_STORAGE_BUCKET_NAME")
+        sys.exit(1)
+
+    hosts = set(args.host)
+    if not hosts:
+        hosts.add(urlparse(public_object_url('', endpoint_url, bucket_name)).hostname)
+        if custom_domain:
+            hosts.add(urlparse(custom_domain).hostname)
+
+    images = indexed_images(find_media_items(args.src), args.prefix, hosts)
+    print(f"🖼️  {len(images)} image(s) referenced from {args.src}")
+
+    s3_client = create_s3_client(endpoint_url, access_key, secret_key, max_pool_connections=max(10, args.workers))
+    host = urlparse(endpoint_url).hostname or endpoint_url
+    s3_client = GuardedS3Client(s3_client, configure_host_guard(host, max_concurrency=max(1, args.workers)))
+
+    index = PhashIndex(args.db)
+    try:
+        stats = build_index(index, s3_client, bucket_name, images, args.workers)
+    finally:
+        shutdown_image_pool()
+    print(f"🔄 Updated {args.db}: " + ', '.join(f"{count} {name}" for name, count in stats.items()))
+    print(f"📊 {len(index)} image(s) indexed")
+    index.close()
+    print_throttle_report()
+    sys.exit(1 if stats['failed'] else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Image Placeholders (BlurHash)
+
+Album pages show blank boxes until each photo loads. upload_media.py uses this
+module to compute a BlurHash (https://blurha.sh) for every uploaded image and
+stores it in the :::media item, so the site can paint a blurred preview
+straight away:
+
+1. The image is decoded at a reduced size (the JPEG decoder scales down by a
+   power of two while decoding) and shrunk to at most 32 px
+2. The pixels are converted to linear light and projected onto a few cosine
+   basis functions; the DCT is one NumPy einsum over the whole image
+3. The coefficients are quantised and written as a ~30 character base83 string
+
+The first coefficient is the image's average color, which the site uses as the
+background of the <img> before any script runs.
+
+NumPy and Pillow are optional. Without them no placeholders are computed.
+"""
+
+import io
+import time
+
+try:
+    import numpy as np
+except ImportError:  # Placeholders are skipped without NumPy
+    np = None
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+
+BASE83_ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~'
+
+# Pixels on the longer side of the image the hash is computed from
+PLACEHOLDER_SIZE = 32
+
+# Cosine components along the longer and the shorter side
+BLURHASH_COMPONENTS = (4, 3)
+
+
+def placeholders_available():
+    """True when NumPy and Pillow are installed."""
+    return np is not None and Image is not None
+
+
+def encode_base83(value, length):
+    chars = []
+    for _ in range(length):
+        value, digit = divmod(value, 83)
+        chars.append(BASE83_ALPHABET[digit])
+    return ''.join(reversed(chars))
+
+
+def _srgb_to_linear_table():
+    v = np.arange(256) / 255.0
+    return np.where(v <= 0.04045, v / 12.92, ((v + 0.055) / 1.055) ** 2.4)
+
+
+def _linear_to_srgb(value):
+    v = min(max(value, 0.0), 1.0)
+    if v <= 0.0031308:
+        return int(v * 12.92 * 255 + 0.5)
+    return int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def blurhash_encode(pixels, components_x=4, components_y=3):
+    """
+    BlurHash of an RGB image given as a (height, width, 3) uint8 array,
+    with components_x by components_y cosine components (1-9 each).
+    """
+    height, width, _ = pixels.shape
+    linear = _srgb_to_linear_table()[pixels]
+    basis_x = np.cos(np.pi * np.outer(np.arange(components_x), np.arange(width)) / width)
+    basis_y = np.cos(np.pi * np.outer(np.arange(components_y), np.arange(height)) / height)
+    # factors[j, i] = mean over pixels of basis_y[j, y] * basis_x[i, x] * linear[y, x]
+    factors = np.einsum('jy,ix,yxc->jic', basis_y, basis_x, linear) / (width * height)
+    factors = factors.reshape(-1, 3)  # Row-major: the DC component first, then x fastest
+    factors[1:] *= 2
+
+    dc, ac = factors[0], factors[1:]
+    size_flag = (components_x - 1) + (components_y - 1) * 9
+    result = encode_base83(size_flag, 1)
+    if len(ac):
+        quantised_max = int(max(0, min(82, np.floor(np.abs(ac).max() * 166 - 0.5))))
+        maximum = (quantised_max + 1) / 166
+    else:
+        quantised_max, maximum = 0, 1
+    result += encode_base83(quantised_max, 1)
+    r, g, b = (_linear_to_srgb(c) for c in dc)
+    result += encode_base83((r << 16) + (g << 8) + b, 4)
+
+    # Signed square root, scaled to 0..18 per channel
+    scaled = np.sign(ac) * np.sqrt(np.abs(ac / maximum))
+    quantised = np.clip(np.floor(scaled * 9 + 9.5), 0, 18).astype(int)
+    for qr, qg, qb in quantised:
+        result += encode_base83(qr * 19 * 19 + qg * 19 + qb, 2)
+    return result
+
+
+def placeholder_pixels(data, size=PLACEHOLDER_SIZE):
+    """Decode an image at most size pixels on its longer side, upright, as an RGB array."""
+    with Image.open(io.BytesIO(data)) as img:
+        img.draft('RGB', (size, size))
+        img = ImageOps.exif_transpose(img)
+        if img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info):
+            # Transparent areas show the page background, which is white
+            img = img.convert('RGBA')
+            background = Image.new('RGBA', img.size, (255, 255, 255, 255))
+            img = Image.alpha_composite(background, img)
+        img = img.convert('RGB')
+        img.thumbnail((size, size), Image.BOX)
+        return np.asarray(img)
+
+
+def placeholder_fields(data):
+    """
+    :::media fields with the BlurHash of an image ({} when NumPy or Pillow is
+    missing or the image cannot be read).
+    """
+    if not placeholders_available():
+        return {}
+    started = time.perf_counter()
+    try:
+        pixels = placeholder_pixels(data)
+    except Exception:
+        return {}
+    height, width, _ = pixels.shape
+    long_side, short_side = BLURHASH_COMPONENTS
+    components = (long_side, short_side) if width >= height else (short_side, long_side)
+    blurhash = blurhash_encode(pixels, *components)
+    print(f"  🌫️  BlurHash {blurhash} ({(time.perf_counter() - started) * 1000:.1f} ms)")
+    return {'blurhash': blurhash}
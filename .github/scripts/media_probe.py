@@ -0,0 +1,793 @@
+#!/usr/bin/env python3
+"""
+Header-Only Media Probing
+
+Reads image dimensions from the first few KB of a file without decoding any
+pixels, so upload_media.py can write width, height and a real aspectRatio into
+each :::media item (the site uses them to reserve space and avoid layout shift).
+
+Supported headers:
+- JPEG: SOFn marker, plus the EXIF orientation from APP1
+- PNG: IHDR chunk
+- GIF: logical screen descriptor
+- WebP: VP8, VP8L and VP8X chunks
+- AVIF/HEIF: ispe (and irot) properties inside the ISO-BMFF meta box
+
+probe_image() works on any prefix of a file. ImageProbe is fed chunk by chunk
+as a download streams past and stops as soon as it has an answer.
+
+MP4, MOV and M4A files keep their metadata in the moov box, which may sit
+before or after the (much larger) mdat box holding the samples. The movie
+probes walk the top-level boxes, skip mdat without reading it, and parse
+moov/mvhd (duration) and each trak's tkhd and stsd (display size, rotation
+and codec):
+- probe_movie() uses random access, e.g. a local file or HTTP Range requests
+  (see http_range_reader) for media that is already hosted elsewhere
+- MovieProbe is fed a download chunk by chunk and buffers only ftyp and moov
+
+Audio files are handled by media_audio.py. MediaProbe sniffs the first bytes
+of a stream and hands it to the image, movie or audio probe.
+"""
+
+import os
+import struct
+from dataclasses import dataclass
+
+from media_audio import AudioProbe, is_audio, probe_audio
+
+
+# Stop looking once this much of a file has been seen without finding its size
+DEFAULT_PROBE_LIMIT = 512 * 1024
+
+# EXIF orientations that swap width and height (rotated 90 or 270 degrees)
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+# ftyp brands of still images stored in ISO-BMFF (HEIF family)
+HEIF_BRANDS = (b'avif', b'avis', b'heic', b'heix', b'heim', b'heis', b'mif1', b'msf1')
+
+# ISO-BMFF boxes that start with a version byte and 24 bits of flags
+FULL_BOXES = frozenset({b'meta', b'ispe'})
+
+# Largest moov box the movie probes will buffer (hours of video stay well below this)
+DEFAULT_MAX_MOOV = 64 * 1024 * 1024
+
+# Top-level boxes the movie probes need; everything else is skipped unread
+MOVIE_BOXES = (b'ftyp', b'moov')
+
+# Sample entries that carry pixel dimensions, and codec strings without profile details
+VISUAL_SAMPLE_ENTRIES = frozenset({
+    b'avc1', b'avc3', b'hvc1', b'hev1', b'av01', b'vp08', b'vp09', b'mp4v',
+    b'apcn', b'apch', b'apcs', b'apco', b'ap4h', b'jpeg', b'mjpa',
+})
+
+# JPEG start-of-frame markers (SOF0-SOF15 except DHT, JPG and DAC)
+JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# Markers without a length field
+JPEG_STANDALONE_MARKERS = frozenset(range(0xD0, 0xD9)) | {0x01}
+
+
+class NeedMoreData(Exception):
+    """The prefix ends before the header that holds the dimensions."""
+
+
+@dataclass
+class ImageInfo:
+    """Dimensions as stored in the file, plus the rotation viewers apply when displaying it."""
+    format: str
+    width: int
+    height: int
+    transposed: bool = False
+
+    @property
+    def display_size(self):
+        """(width, height) as displayed, after EXIF orientation or irot rotation."""
+        return (self.height, self.width) if self.transposed else (self.width, self.height)
+
+
+def aspect_ratio_name(width, height):
+    """
+    :::media aspectRatio for a displayed size, using the same thresholds as
+    detectAspectRatioFromDimensions in MediaTypes.fs.
+    """
+    if width <= 0 or height <= 0:
+        return 'unknown'
+    ratio = width / height
+    if abs(ratio - 1.0) < 0.1:
+        return 'square'
+    if ratio > 2.0:
+        return 'cinematic'
+    if ratio > 1.2:
+        return 'landscape'
+    if ratio < 0.8:
+        return 'portrait'
+    return 'unknown'
+
+
+def media_fields(info):
+    """
+    :::media fields for a probe result: aspectRatio, width and height for
+    anything with pixels, plus duration (seconds), codecs and bitrate (kbps)
+    for movies and audio.
+    """
+    fields = {}
+    width, height = getattr(info, 'display_size', (0, 0))
+    if width and height:
+        fields.update(aspectRatio=aspect_ratio_name(width, height), width=width, height=height)
+    if getattr(info, 'duration', 0):
+        fields['duration'] = round(info.duration, 3)
+    if getattr(info, 'codecs', None):
+        fields['codecs'] = info.codecs
+    if getattr(info, 'bitrate', 0):
+        fields['bitrate'] = round(info.bitrate / 1000)
+    return fields
+
+
+def describe(fields):
+    """One-line summary of media_fields() for the upload log."""
+    parts = []
+    if 'width' in fields:
+        parts.append(f"{fields['width']}x{fields['height']} ({fields['aspectRatio']})")
+    if 'duration' in fields:
+        parts.append(format_duration(fields['duration']))
+    if 'codecs' in fields:
+        parts.append(fields['codecs'])
+    if 'bitrate' in fields:
+        parts.append(f"{fields['bitrate']} kbps")
+    return ', '.join(parts)
+
+
+def format_duration(seconds):
+    """m:ss (or h:mm:ss), the way the site shows durations."""
+    total = int(round(seconds))
+    hours, rest = divmod(total, 3600)
+    minutes, secs = divmod(rest, 60)
+    return f"{hours}:{minutes:02d}:{secs:02d}" if hours else f"{minutes}:{secs:02d}"
+
+
+def _need(data, end):
+    if len(data) < end:
+        raise NeedMoreData()
+
+
+def _probe_png(data):
+    _need(data, 24)
+    if data[12:16] != b'IHDR':
+        return None
+    width, height = struct.unpack('>II', data[16:24])
+    return ImageInfo('png', width, height)
+
+
+def _probe_gif(data):
+    _need(data, 10)
+    width, height = struct.unpack('<HH', data[6:10])
+    return ImageInfo('gif', width, height)
+
+
+def _probe_webp(data):
+    _need(data, 30)
+    chunk = data[12:16]
+    if chunk == b'VP8 ':
+        # Lossy: keyframe start code, then 14-bit width and height
+        if data[23:26] != b'\x9d\x01\x2a':
+            return None
+        width, height = struct.unpack('<HH', data[26:30])
+        return ImageInfo('webp', width & 0x3FFF, height & 0x3FFF)
+    if chunk == b'VP8L':
+        # Lossless: signature byte, then width-1 and height-1 as 14-bit fields
+        if data[20] != 0x2F:
+            return None
+        bits = int.from_bytes(data[21:25], 'little')
+        return ImageInfo('webp', (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1)
+    if chunk == b'VP8X':
+        # Extended: 24-bit canvas width-1 and height-1
+        width = int.from_bytes(data[24:27], 'little') + 1
+        height = int.from_bytes(data[27:30], 'little') + 1
+        return ImageInfo('webp', width, height)
+    return None
+
+
+def _exif_orientation(tiff):
+    """Orientation tag (0x0112) from IFD0 of an EXIF TIFF block, or 1."""
+    if len(tiff) < 8 or tiff[:2] not in (b'II', b'MM'):
+        return 1
+    endian = '<' if tiff[:2] == b'II' else '>'
+    (ifd_offset,) = struct.unpack(endian + 'I', tiff[4:8])
+    if ifd_offset + 2 > len(tiff):
+        return 1
+    (count,) = struct.unpack(endian + 'H', tiff[ifd_offset:ifd_offset + 2])
+    for i in range(count):
+        entry = ifd_offset + 2 + i * 12
+        if entry + 12 > len(tiff):
+            break
+        tag, _type, _count = struct.unpack(endian + 'HHI', tiff[entry:entry + 8])
+        if tag == 0x0112:
+            (value,) = struct.unpack(endian + 'H', tiff[entry + 8:entry + 10])
+            return value
+    return 1
+
+
+def _probe_jpeg(data):
+    orientation = 1
+    pos = 2
+    while True:
+        _need(data, pos + 2)
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1  # Fill byte
+            continue
+        if marker in JPEG_STANDALONE_MARKERS:
+            pos += 2
+            continue
+        if marker in (0xD9, 0xDA):
+            return None  # End of image or start of scan before any frame header
+        _need(data, pos + 4)
+        (length,) = struct.unpack('>H', data[pos + 2:pos + 4])
+        segment = pos + 4
+        if marker == 0xE1 and data[segment:segment + 6] == b'Exif\x00\x00':
+            _need(data, pos + 2 + length)
+            orientation = _exif_orientation(data[segment + 6:pos + 2 + length])
+        elif marker in JPEG_SOF_MARKERS:
+            _need(data, segment + 5)
+            height, width = struct.unpack('>HH', data[segment + 1:segment + 5])
+            return ImageInfo('jpeg', width, height, orientation in TRANSPOSED_ORIENTATIONS)
+        pos += 2 + length
+
+
+def iter_boxes(data, start=0, end=None):
+    """
+    Yield (type, payload_start, box_end) for the ISO-BMFF boxes in data[start:end].
+    box_end may lie past the end of data when the prefix is truncated.
+    """
+    end = len(data) if end is None else end
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack('>I4s', data[pos:pos + 8])
+        header = 8
+        if size == 1:
+            _need(data, pos + 16)
+            (size,) = struct.unpack('>Q', data[pos + 8:pos + 16])
+            header = 16
+        elif size == 0:
+            size = end - pos  # Box runs to the end of its parent
+        if size < header:
+            return
+        yield box_type, pos + header, pos + size
+        pos += size
+
+
+def _find_box(data, path, start=0, end=None):
+    """
+    Return (payload_start, box_end) of the first box along path (e.g. [b'meta', b'iprp']).
+    Full boxes listed in FULL_BOXES have their version/flags skipped.
+    """
+    for box_type, payload, box_end in iter_boxes(data, start, end):
+        if box_type != path[0]:
+            continue
+        _need(data, box_end)
+        if box_type in FULL_BOXES:
+            payload += 4
+        if len(path) == 1:
+            return payload, box_end
+        return _find_box(data, path[1:], payload, box_end)
+    if end is None:
+        # Top level: the box may still follow in the rest of the stream
+        raise NeedMoreData()
+    return None
+
+
+def _probe_heif(data):
+    ipco = _find_box(data, [b'meta', b'iprp', b'ipco'])
+    if ipco is None:
+        return None
+    sizes, transposed = [], False
+    for box_type, payload, box_end in iter_boxes(data, *ipco):
+        if box_type == b'ispe':
+            sizes.append(struct.unpack('>II', data[payload + 4:payload + 12]))
+        elif box_type == b'irot' and not transposed:
+            transposed = (data[payload] & 0x03) % 2 == 1
+    if not sizes:
+        return None
+    # Grid images also list their tiles; the primary image is the largest
+    width, height = max(sizes, key=lambda size: size[0] * size[1])
+    brand = data[8:12]
+    return ImageInfo('avif' if brand in (b'avif', b'avis') else 'heif', width, height, transposed)
+
+
+def probe_image(data, partial=False):
+    """
+    Read an image's dimensions from its header.
+
+    Returns ImageInfo, or None for unknown or corrupt files. When the header is
+    cut off, returns None, or raises NeedMoreData if partial is True (data is
+    the start of a longer stream).
+    """
+    try:
+        if data[:8] == b'\x89PNG\r\n\x1a\n':
+            return _probe_png(data)
+        if data[:6] in (b'GIF87a', b'GIF89a'):
+            return _probe_gif(data)
+        if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+            return _probe_webp(data)
+        if data[:3] == b'\xff\xd8\xff':
+            return _probe_jpeg(data)
+        if data[4:8] == b'ftyp' and data[8:12] in HEIF_BRANDS:
+            return _probe_heif(data)
+        if len(data) < 12:
+            raise NeedMoreData()
+        return None
+    except NeedMoreData:
+        if partial:
+            raise
+        return None
+    except (struct.error, IndexError):
+        return None
+
+
+class ImageProbe:
+    """Finds an image's dimensions while its bytes stream past, keeping only the prefix it needs."""
+
+    def __init__(self, limit=DEFAULT_PROBE_LIMIT):
+        self.limit = limit
+        self.result = None
+        self.done = False
+        self._buffer = bytearray()
+
+    def feed(self, chunk):
+        """Add the next chunk; returns the ImageInfo once known (None until then)."""
+        if self.done:
+            return self.result
+        self._buffer += chunk
+        try:
+            self.result = probe_image(bytes(self._buffer), partial=True)
+            self.done = True
+        except NeedMoreData:
+            self.done = len(self._buffer) >= self.limit
+        if self.done:
+            self._buffer = bytearray()
+        return self.result
+
+    def finish(self):
+        """Probe whatever was received; for streams shorter than the header."""
+        if not self.done:
+            self.result = probe_image(bytes(self._buffer))
+            self.done = True
+            self._buffer = bytearray()
+        return self.result
+
+
+@dataclass
+class MovieInfo:
+    """What the moov box says about an MP4/MOV/M4A file."""
+    brand: str
+    duration: float = 0.0
+    width: int = 0
+    height: int = 0
+    transposed: bool = False
+    video_codec: str = None
+    audio_codec: str = None
+
+    @property
+    def display_size(self):
+        """(width, height) of the video track as displayed, after its rotation matrix."""
+        return (self.height, self.width) if self.transposed else (self.width, self.height)
+
+    @property
+    def codecs(self):
+        """RFC 6381 codecs list, as used in a <source type="..."> attribute."""
+        return ', '.join(c for c in (self.video_codec, self.audio_codec) if c)
+
+
+def _version(data, payload):
+    """(version, start of the fields) of a full box."""
+    return data[payload], payload + 4
+
+
+def _child(data, span, box_type):
+    """(payload_start, box_end) of the first box_type child within span, or None."""
+    for child_type, payload, box_end in iter_boxes(data, *span):
+        if child_type == box_type:
+            return payload, box_end
+    return None
+
+
+def _descriptor(data, pos):
+    """(tag, payload_start, payload_end) of an MPEG-4 descriptor (used inside esds)."""
+    tag = data[pos]
+    pos += 1
+    length = 0
+    for _ in range(4):
+        byte = data[pos]
+        pos += 1
+        length = (length << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            break
+    return tag, pos, pos + length
+
+
+def _mp4a_codec(data, span):
+    """mp4a.40.2 style codec string from an esds box, or plain mp4a."""
+    esds = _child(data, span, b'esds')
+    if esds is None:
+        return 'mp4a'
+    _, pos = _version(data, esds[0])
+    tag, pos, end = _descriptor(data, pos)
+    if tag != 0x03:  # ES_Descriptor
+        return 'mp4a'
+    flags = data[pos + 2]
+    pos += 3
+    if flags & 0x80:
+        pos += 2  # dependsOn_ES_ID
+    if flags & 0x40:
+        pos += 1 + data[pos]  # URL
+    if flags & 0x20:
+        pos += 2  # OCR_ES_ID
+    tag, pos, end = _descriptor(data, pos)
+    if tag != 0x04:  # DecoderConfigDescriptor
+        return 'mp4a'
+    object_type = data[pos]
+    if pos + 13 < end:
+        tag, info, _ = _descriptor(data, pos + 13)
+        if tag == 0x05 and object_type == 0x40:  # AudioSpecificConfig
+            return f"mp4a.40.{data[info] >> 3}"
+    return f"mp4a.{object_type:02x}"
+
+
+def _sample_entry_codec(data, stsd, handler):
+    """Codec string of a track's first sample entry."""
+    _, pos = _version(data, stsd[0])
+    entries = iter_boxes(data, pos + 4, stsd[1])
+    entry_type, payload, entry_end = next(entries, (None, 0, 0))
+    if entry_type is None:
+        return None
+    fourcc = entry_type.decode('latin-1')
+    if handler == b'vide' and entry_type in (b'avc1', b'avc3'):
+        # VisualSampleEntry has 78 bytes of fields before its child boxes
+        avcc = _child(data, (payload + 78, entry_end), b'avcC')
+        if avcc is not None:
+            profile = data[avcc[0] + 1:avcc[0] + 4]
+            return f"{fourcc}.{profile.hex().upper()}"
+    if handler == b'soun' and entry_type == b'mp4a':
+        # AudioSampleEntry has 28 bytes of fields; QuickTime v1/v2 entries add 16/36
+        version = struct.unpack('>H', data[payload + 8:payload + 10])[0]
+        children = payload + 28 + {1: 16, 2: 36}.get(version, 0)
+        return _mp4a_codec(data, (children, entry_end))
+    return fourcc
+
+
+def _apply_track(data, trak, info):
+    mdia = _child(data, trak, b'mdia')
+    hdlr = mdia and _child(data, mdia, b'hdlr')
+    if hdlr is None:
+        return
+    handler = data[hdlr[0] + 8:hdlr[0] + 12]
+    if handler not in (b'vide', b'soun'):
+        return
+    stsd = None
+    minf = _child(data, mdia, b'minf')
+    stbl = minf and _child(data, minf, b'stbl')
+    if stbl is not None:
+        stsd = _child(data, stbl, b'stsd')
+    codec = _sample_entry_codec(data, stsd, handler) if stsd is not None else None
+
+    if handler == b'soun':
+        info.audio_codec = info.audio_codec or codec
+        return
+    if info.video_codec is not None:
+        return  # Only the first video track describes the player
+    info.video_codec = codec
+    tkhd = _child(data, trak, b'tkhd')
+    if tkhd is not None:
+        version, pos = _version(data, tkhd[0])
+        matrix = pos + (48 if version == 1 else 36)
+        a, b, _u, c, d = struct.unpack('>5i', data[matrix:matrix + 20])
+        # tkhd holds the display size as 16.16 fixed point
+        width, height = struct.unpack('>II', data[matrix + 36:matrix + 44])
+        info.width, info.height = width >> 16, height >> 16
+        info.transposed = a == 0 and d == 0 and b != 0 and c != 0
+    if not (info.width and info.height) and stsd is not None:
+        # Fall back to the coded size in the VisualSampleEntry
+        _, pos = _version(data, stsd[0])
+        entry = pos + 4
+        if data[entry + 4:entry + 8] in VISUAL_SAMPLE_ENTRIES:
+            info.width, info.height = struct.unpack('>HH', data[entry + 32:entry + 36])
+
+
+def parse_movie(moov, brand=''):
+    """
+    Read a moov box payload (without its header) into MovieInfo.
+    Returns None when the box is malformed.
+    """
+    try:
+        info = MovieInfo(brand)
+        mvhd = _child(moov, (0, len(moov)), b'mvhd')
+        if mvhd is not None:
+            version, pos = _version(moov, mvhd[0])
+            if version == 1:
+                timescale, duration = struct.unpack('>IQ', moov[pos + 16:pos + 28])
+            else:
+                timescale, duration = struct.unpack('>II', moov[pos + 8:pos + 16])
+            # All ones means the duration is unknown (e.g. a fragmented file)
+            if timescale and duration not in (0xFFFFFFFF, 0xFFFFFFFFFFFFFFFF):
+                info.duration = duration / timescale
+        for box_type, payload, box_end in iter_boxes(moov):
+            if box_type == b'trak':
+                _apply_track(moov, (payload, box_end), info)
+        return info
+    except (NeedMoreData, struct.error, IndexError):
+        return None
+
+
+def is_movie(data):
+    """True when data starts like an ISO-BMFF movie (ftyp that is not a HEIF still image, or moov)."""
+    if data[4:8] == b'ftyp':
+        return data[8:12] not in HEIF_BRANDS
+    return data[4:8] in (b'moov', b'free', b'wide', b'mdat')
+
+
+def iter_top_level_boxes(read_at, size=None):
+    """
+    Yield (type, offset, header_size, box_size) for each top-level box, reading
+    only the box headers. Stops at the end of the file or at a corrupt header.
+    """
+    pos = 0
+    while size is None or pos + 8 <= size:
+        header = read_at(pos, 16)
+        if len(header) < 8:
+            return
+        box_size, box_type = struct.unpack('>I4s', header[:8])
+        header_size = 8
+        if box_size == 1:
+            if len(header) < 16:
+                return
+            box_size = struct.unpack('>Q', header[8:16])[0]
+            header_size = 16
+        elif box_size == 0:
+            if size is None:
+                return  # Runs to the end of an unknown length: nothing after it
+            box_size = size - pos
+        if box_size < header_size:
+            return  # Corrupt, or not a movie after all
+        yield box_type, pos, header_size, box_size
+        pos += box_size
+
+
+def probe_movie(read_at, size=None, max_moov=DEFAULT_MAX_MOOV):
+    """
+    Find and parse the moov box with random access reads.
+
+    read_at(offset, length) returns up to length bytes at offset (fewer at the
+    end of the file). Only box headers, ftyp and moov are read, so a remote
+    file costs a few small Range requests however large its mdat is.
+    Returns MovieInfo, or None when there is no usable moov box.
+    """
+    brand = ''
+    for box_type, offset, header_size, box_size in iter_top_level_boxes(read_at, size):
+        if box_type not in MOVIE_BOXES:
+            continue
+        length = box_size - header_size
+        if length > max_moov:
+            return None
+        payload = read_at(offset + header_size, length)
+        if len(payload) < length:
+            return None
+        if box_type == b'ftyp':
+            brand = payload[:4].decode('latin-1').strip()
+        else:
+            return parse_movie(payload, brand)
+    return None
+
+
+def file_reader(f):
+    """read_at for a seekable file object."""
+    def read_at(offset, length):
+        f.seek(offset)
+        return f.read(length)
+    return read_at
+
+
+class HttpRangeReader:
+    """
+    read_at for a remote file using HTTP Range requests. size is the total
+    length from Content-Range, known after the first read.
+    Raises requests.HTTPError when the server refuses the request.
+    """
+
+    def __init__(self, session, url, timeout=10):
+        self.session = session
+        self.url = url
+        self.timeout = timeout
+        self.size = None
+
+    def __call__(self, offset, length):
+        if length <= 0:
+            return b''
+        response = self.session.get(self.url, headers={'Range': f"bytes={offset}-{offset + length - 1}"},
+                                    timeout=self.timeout, stream=True)
+        try:
+            if response.status_code == 416:
+                return b''  # Offset past the end of the file
+            response.raise_for_status()
+            if response.status_code != 206:
+                # The server ignored Range; reading on would download the whole file
+                raise ValueError(f"{self.url} does not support Range requests")
+            total = response.headers.get('Content-Range', '').rpartition('/')[2]
+            if total.isdigit():
+                self.size = int(total)
+            return response.raw.read(length, decode_content=True)
+        finally:
+            response.close()
+
+
+class MovieProbe:
+    """
+    Finds a movie's moov box while its bytes stream past.
+
+    Boxes other than ftyp and moov are counted past without being kept, so the
+    probe works whether moov comes before or after mdat and holds at most the
+    moov box in memory.
+    """
+
+    def __init__(self, max_moov=DEFAULT_MAX_MOOV):
+        self.max_moov = max_moov
+        self.result = None
+        self.done = False
+        self._brand = ''
+        self._header = bytearray()
+        self._skip = 0
+        self._box = None
+        self._payload = bytearray()
+        self._wanted = 0
+
+    def _give_up(self):
+        self.done = True
+        self._payload = bytearray()
+        self._header = bytearray()
+
+    def feed(self, chunk):
+        """Add the next chunk; returns the MovieInfo once moov has been parsed (None until then)."""
+        view = memoryview(chunk)
+        while view and not self.done:
+            if self._skip:
+                step = min(self._skip, len(view))
+                self._skip -= step
+                view = view[step:]
+            elif self._box is not None:
+                step = min(self._wanted - len(self._payload), len(view))
+                self._payload += view[:step]
+                view = view[step:]
+                if len(self._payload) == self._wanted:
+                    self._box_complete()
+            else:
+                self._read_header(view[:16 - len(self._header)])
+                view = view[self._consumed:]
+        return self.result
+
+    def _read_header(self, view):
+        before = len(self._header)
+        self._header += view
+        self._consumed = len(view)
+        if len(self._header) < 8:
+            return
+        box_size, box_type = struct.unpack('>I4s', self._header[:8])
+        header_size = 16 if box_size == 1 else 8
+        if len(self._header) < header_size:
+            return
+        if box_size == 1:
+            box_size = struct.unpack('>Q', self._header[8:16])[0]
+        # Hand back the bytes past this header; they belong to the payload
+        self._consumed = header_size - before
+        self._header = bytearray()
+        if box_size == 0 or box_size < header_size:
+            self._give_up()  # Runs to the end of the stream, or corrupt
+            return
+        length = box_size - header_size
+        if box_type not in MOVIE_BOXES:
+            self._skip = length
+        elif length > self.max_moov:
+            self._give_up()
+        else:
+            self._box, self._wanted, self._payload = box_type, length, bytearray()
+            if not length:
+                self._box_complete()
+
+    def _box_complete(self):
+        payload, box_type = bytes(self._payload), self._box
+        self._box, self._payload = None, bytearray()
+        if box_type == b'ftyp':
+            self._brand = payload[:4].decode('latin-1').strip()
+        else:
+            self.result = parse_movie(payload, self._brand)
+            self._give_up()
+
+    def finish(self):
+        """Stop probing; returns the result found so far."""
+        self._give_up()
+        return self.result
+
+
+class MediaProbe:
+    """
+    Streaming probe for any upload: hands the bytes to an ImageProbe, a
+    MovieProbe or an AudioProbe depending on how the file starts.
+    """
+
+    def __init__(self, limit=DEFAULT_PROBE_LIMIT, max_moov=DEFAULT_MAX_MOOV):
+        self.limit = limit
+        self.max_moov = max_moov
+        self.result = None
+        self.done = False
+        self._inner = None
+        self._head = bytearray()
+
+    def feed(self, chunk):
+        """Add the next chunk; returns ImageInfo or MovieInfo once known (None until then)."""
+        if self.done:
+            return self.result
+        if self._inner is None:
+            self._head += chunk
+            if len(self._head) < 12:
+                return None
+            chunk, self._head = bytes(self._head), bytearray()
+            if is_movie(chunk):
+                self._inner = MovieProbe(self.max_moov)
+            elif is_audio(chunk):
+                self._inner = AudioProbe()
+            else:
+                self._inner = ImageProbe(self.limit)
+        self.result = self._inner.feed(chunk)
+        self.done = self._inner.done
+        return self.result
+
+    def finish(self):
+        """Probe whatever was received; returns the result or None."""
+        if not self.done:
+            if self._inner is None:
+                self._inner = ImageProbe(self.limit)
+                self._inner.feed(bytes(self._head))
+            self.result = self._inner.finish()
+            self.done = True
+        return self.result
+
+    def read_file(self, path):
+        """Probe a complete local file instead of a stream (e.g. a cached download)."""
+        self.result = probe_file(path, self.limit)
+        self.done = True
+        return self.result
+
+
+def probe_bytes(data, limit=DEFAULT_PROBE_LIMIT):
+    """Probe a file held in memory: images from their header, movies and audio by random access."""
+    view = memoryview(data)
+
+    def read_at(offset, length):
+        return view[offset:offset + length].tobytes()
+
+    if is_movie(data):
+        return probe_movie(read_at, len(data))
+    if is_audio(data):
+        return probe_audio(read_at, len(data))
+    return probe_image(data[:limit])
+
+
+def probe_file(path, limit=DEFAULT_PROBE_LIMIT):
+    """Probe a local file: images from their header, movies and audio by seeking."""
+    with open(path, 'rb') as f:
+        head = f.read(limit)
+        if is_movie(head):
+            return probe_movie(file_reader(f), os.fstat(f.fileno()).st_size)
+        if is_audio(head):
+            return probe_audio(file_reader(f), os.fstat(f.fileno()).st_size)
+    return probe_image(head)
+
+
+def probe_remote(reader):
+    """
+    Probe a remote movie or audio file through an HttpRangeReader, without
+    downloading the media data or embedded artwork.
+    """
+    head = reader(0, 16)
+    if is_audio(head):
+        return probe_audio(reader, reader.size, covers=False)
+    return probe_movie(reader, reader.size)
@@ -0,0 +1,565 @@
+#!/usr/bin/env python3
+"""
+Pluggable Storage Backends for upload_media.py
+
+The upload pipeline talks to storage through the small subset of the boto3 S3
+client API it actually uses:
+
+    put_object, create_multipart_upload, upload_part, complete_multipart_upload,
+    abort_multipart_upload, list_multipart_uploads, head_object, list_objects_v2,
+    copy_object, delete_object
+
+plus url(key), which returns the public URL of an object. Every backend here
+implements that interface, so the transfer code (upload_to_s3, upload_stream_to_s3,
+the async engine, the metadata backfill) runs unchanged against any of them:
+
+- S3Backend: Linode Object Storage through a (guarded) boto3 client
+- LocalDirectoryBackend: files under a directory, for previewing media posts with
+  the site build and for offline end-to-end runs
+- InMemoryBackend: a dict, for tests and throughput benchmarks without credentials
+- MirroredStorage: fans writes out to a primary and N mirror targets at once
+
+Backends are selected with MEDIA_UPLOAD_STORAGE=s3|local|memory; mirrors are
+configured with MEDIA_UPLOAD_MIRRORS.
+"""
+
+import os
+import json
+import uuid
+import contextvars
+import hashlib
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from urllib.parse import urlparse
+
+
+STORAGE_KINDS = ('s3', 'local', 'memory')
+DEFAULT_LOCAL_DIR = os.path.join(tempfile.gettempdir(), 'upload-media-local')
+
+
+class ObjectNotFoundError(Exception):
+    """Raised by head_object for a missing key; shaped like botocore's 404 ClientError."""
+
+    def __init__(self, key):
+        super().__init__(f"Not Found: {key}")
+        self.response = {'Error': {'Code': 'NoSuchKey'}, 'ResponseMetadata': {'HTTPStatusCode': 404}}
+
+
+def public_object_url(s3_key, endpoint_url, bucket_name, custom_domain=None):
+    """Public URL of an object in Linode Object Storage, or under custom_domain when set."""
+    if custom_domain:
+        # Use custom domain (e.g., https://cdn.luisquintanilla.me/files/images/...)
+        return f"{custom_domain.rstrip('/')}/{s3_key}"
+    # Use standard Linode URL (e.g., https://bucket-name.us-east-1.linodeobjects.com/files/...)
+    # Extract region from endpoint URL
+    hostname = urlparse(endpoint_url).netloc
+    # Expected format: us-east-1.linodeobjects.com
+    return f"https://{bucket_name}.{hostname}/{s3_key}"
+
+
+def _etag(data):
+    return f'"{hashlib.md5(data).hexdigest()}"'
+
+
+def _multipart_etag(part_etags):
+    digests = b''.join(bytes.fromhex(etag.strip('"')) for etag in part_etags)
+    return f'"{hashlib.md5(digests).hexdigest()}-{len(part_etags)}"'
+
+
+class S3Backend:
+    """
+    Linode Object Storage. Every API call is passed straight to the wrapped boto3
+    client (usually a GuardedS3Client); url() builds the public CDN URL.
+    """
+
+    def __init__(self, client, bucket_name, endpoint_url, custom_domain=None):
+        self._client = client
+        self.bucket_name = bucket_name
+        self.endpoint_url = endpoint_url
+        self.custom_domain = custom_domain
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def url(self, key):
+        return public_object_url(key, self.endpoint_url, self.bucket_name, self.custom_domain)
+
+
+class StorageBackend:
+    """
+    Base for non-S3 backends: multipart bookkeeping and listing on top of a few
+    primitives implemented by subclasses (_write, _read, _read_meta, _delete, _keys).
+    The Bucket argument of every call is accepted and ignored.
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self._lock = threading.Lock()
+        self._uploads = {}  # upload id -> {'Key', 'Initiated', 'Headers', 'Parts': {n: (etag, bytes)}}
+
+    # -- Primitives --------------------------------------------------------------
+
+    def _write(self, key, data, meta):
+        raise NotImplementedError
+
+    def _read_meta(self, key):
+        """Return the stored metadata dict for key, or None if it does not exist."""
+        raise NotImplementedError
+
+    def _read(self, key):
+        raise NotImplementedError
+
+    def _delete(self, key):
+        raise NotImplementedError
+
+    def _keys(self):
+        raise NotImplementedError
+
+    # -- Objects -----------------------------------------------------------------
+
+    def _store(self, key, data, etag, headers):
+        meta = {
+            'ContentLength': len(data),
+            'ETag': etag,
+            'LastModified': datetime.now(timezone.utc).isoformat(),
+            'Metadata': headers.pop('Metadata', {}),
+        }
+        meta.update({k: v for k, v in headers.items() if k not in ('ACL', 'ContentMD5')})
+        self._write(key, data, meta)
+        return {'ETag': etag}
+
+    def put_object(self, Bucket, Key, Body, **headers):
+        data = Body if isinstance(Body, bytes) else bytes(Body)
+        return self._store(Key, data, _etag(data), headers)
+
+    def head_object(self, Bucket, Key):
+        meta = self._read_meta(Key)
+        if meta is None:
+            raise ObjectNotFoundError(Key)
+        return dict(meta)
+
+    def get_object_bytes(self, Key):
+        """Return the bytes of an object (not part of the S3 subset; used by tests and previews)."""
+        if self._read_meta(Key) is None:
+            raise ObjectNotFoundError(Key)
+        return self._read(Key)
+
+    def copy_object(self, Bucket, Key, CopySource, MetadataDirective='COPY', **headers):
+        source = self.head_object(Bucket, CopySource['Key'])
+        data = self._read(CopySource['Key'])
+        if MetadataDirective != 'REPLACE':
+            headers = {k: v for k, v in source.items() if k not in ('ContentLength', 'ETag', 'LastModified')}
+        return self._store(Key, data, source['ETag'], dict(headers))
+
+    def delete_object(self, Bucket, Key):
+        self._delete(Key)
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix='', MaxKeys=1000, StartAfter=None, ContinuationToken=None,
+                        Delimiter=None):
+        keys = sorted(k for k in self._keys() if k.startswith(Prefix))
+        start = ContinuationToken or StartAfter
+        if start:
+            # A token that is a common prefix resumes after everything under it
+            rolled_up = bool(Delimiter) and start.endswith(Delimiter)
+            keys = [k for k in keys if k > start and not (rolled_up and k.startswith(start))]
+        if Delimiter:
+            # Roll keys below the next delimiter up into one common prefix each
+            entries = []
+            for key in keys:
+                cut = key.find(Delimiter, len(Prefix))
+                entry = key[:cut + len(Delimiter)] if cut >= 0 else key
+                if not entries or entries[-1] != entry:
+                    entries.append(entry)
+            keys = entries
+        page = keys[:MaxKeys]
+        contents, common_prefixes = [], []
+        for key in page:
+            if Delimiter and key.endswith(Delimiter):
+                common_prefixes.append({'Prefix': key})
+                continue
+            meta = self._read_meta(key) or {}
+            contents.append({'Key': key, 'Size': meta.get('ContentLength', 0), 'ETag': meta.get('ETag'),
+                             'LastModified': meta.get('LastModified')})
+        response = {'Contents': contents, 'KeyCount': len(page), 'IsTruncated': len(keys) > MaxKeys}
+        if common_prefixes:
+            response['CommonPrefixes'] = common_prefixes
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = page[-1]
+        return response
+
+    # -- Multipart ---------------------------------------------------------------
+
+    def create_multipart_upload(self, Bucket, Key, **headers):
+        upload_id = uuid.uuid4().hex
+        with self._lock:
+            self._uploads[upload_id] = {
+                'Key': Key,
+                'Initiated': datetime.now(timezone.utc),
+                'Headers': headers,
+                'Parts': {},
+            }
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, ContentMD5=None):
+        data = Body if isinstance(Body, bytes) else bytes(Body)
+        etag = _etag(data)
+        with self._lock:
+            self._uploads[UploadId]['Parts'][PartNumber] = (etag, data)
+        return {'ETag': etag}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        with self._lock:
+            upload = self._uploads.pop(UploadId)
+        numbers = [part['PartNumber'] for part in MultipartUpload['Parts']]
+        data = b''.join(upload['Parts'][n][1] for n in numbers)
+        etag = _multipart_etag([upload['Parts'][n][0] for n in numbers])
+        return self._store(Key, data, etag, dict(upload['Headers']))
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        with self._lock:
+            self._uploads.pop(UploadId, None)
+        return {}
+
+    def list_multipart_uploads(self, Bucket, Prefix='', **kwargs):
+        with self._lock:
+            uploads = [
+                {'Key': u['Key'], 'UploadId': upload_id, 'Initiated': u['Initiated']}
+                for upload_id, u in self._uploads.items()
+                if u['Key'].startswith(Prefix)
+            ]
+        return {'Uploads': uploads, 'IsTruncated': False}
+
+    # -- URLs --------------------------------------------------------------------
+
+    def url(self, key):
+        return f"{self.base_url}/{key}"
+
+
+class InMemoryBackend(StorageBackend):
+    """Objects kept in a dict. Nothing touches the network or the disk."""
+
+    def __init__(self, base_url='memory://media'):
+        super().__init__(base_url)
+        self.objects = {}  # key -> (bytes, meta)
+
+    def _write(self, key, data, meta):
+        with self._lock:
+            self.objects[key] = (data, meta)
+
+    def _read_meta(self, key):
+        with self._lock:
+            entry = self.objects.get(key)
+        return entry[1] if entry else None
+
+    def _read(self, key):
+        with self._lock:
+            return self.objects[key][0]
+
+    def _delete(self, key):
+        with self._lock:
+            self.objects.pop(key, None)
+
+    def _keys(self):
+        with self._lock:
+            return list(self.objects)
+
+
+class LocalDirectoryBackend(StorageBackend):
+    """
+    Objects stored as files under root, with their headers in a sidecar JSON file
+    under root/.meta/. Without base_url, url() returns file:// URLs. Multipart
+    uploads in progress are kept in memory until they are completed.
+    """
+
+    META_DIR = '.meta'
+
+    def __init__(self, root, base_url=None):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+        super().__init__(base_url or Path(self.root).as_uri())
+
+    def _path(self, key):
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"Key escapes the storage directory: {key}")
+        return path
+
+    def _meta_path(self, key):
+        return os.path.join(self.root, self.META_DIR, key + '.json')
+
+    def _write(self, key, data, meta):
+        for path, payload, mode in ((self._path(key), data, 'wb'), (self._meta_path(key), json.dumps(meta), 'w')):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(temp_path, mode) as f:
+                f.write(payload)
+            os.replace(temp_path, path)
+
+    def _read_meta(self, key):
+        if not os.path.exists(self._path(key)):
+            return None
+        try:
+            with open(self._meta_path(key), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            # A file dropped into the directory by hand: describe it from the filesystem
+            stat = os.stat(self._path(key))
+            return {
+                'ContentLength': stat.st_size,
+                'ETag': _etag(self._read(key)),
+                'LastModified': datetime.fromtimestamp(stat.st_mtime, timezone.utc).isoformat(),
+                'Metadata': {},
+            }
+
+    def _read(self, key):
+        with open(self._path(key), 'rb') as f:
+            return f.read()
+
+    def _delete(self, key):
+        for path in (self._path(key), self._meta_path(key)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _keys(self):
+        keys = []
+        for directory, dirnames, filenames in os.walk(self.root):
+            if directory == self.root and self.META_DIR in dirnames:
+                dirnames.remove(self.META_DIR)
+            for name in filenames:
+                if name.endswith('.tmp'):
+                    continue
+                keys.append(os.path.relpath(os.path.join(directory, name), self.root).replace(os.sep, '/'))
+        return keys
+
+
+def create_storage_backend(kind, base_url=None, local_dir=None):
+    """
+    Create a local or in-memory backend. S3 backends are built by upload_media.main(),
+    which owns the credentials and the rate limiter.
+    """
+    if kind == 'memory':
+        return InMemoryBackend(base_url or 'memory://media')
+    if kind == 'local':
+        return LocalDirectoryBackend(local_dir or DEFAULT_LOCAL_DIR, base_url)
+    raise ValueError(f"Unknown storage backend '{kind}'; expected one of {', '.join(STORAGE_KINDS)}")
+
+
+class MirrorError(Exception):
+    """Raised when a required mirror target fails to store an object."""
+
+
+@dataclass
+class MirrorTarget:
+    """One storage target of a MirroredStorage: a backend, its bucket and its success policy."""
+    name: str
+    backend: object
+    bucket_name: str
+    required: bool = True
+
+
+class MirroredStorage:
+    """
+    Fans every write out to several targets at once.
+
+    The bytes of each put or multipart part are read once and handed to every
+    target, so a mirror never triggers a second download. The first target is the
+    primary: reads (head, list) and url() use it, and it is always required. Other
+    targets are required or best-effort; a best-effort failure is logged and
+    recorded in failures instead of failing the upload.
+
+    replicas maps every stored key to {target name: public URL}, so the site can
+    switch its CDN origin to a mirror without re-uploading anything. With
+    manifest_path, each new entry is merged into that JSON file as soon as the
+    object is stored, so replicas are on record even if the run fails later.
+    """
+
+    def __init__(self, primary, mirrors, max_workers=None, manifest_path=None):
+        self.targets = [MirrorTarget(primary.name, primary.backend, primary.bucket_name, True)] + list(mirrors)
+        self.primary = self.targets[0]
+        self.manifest_path = manifest_path
+        self.replicas = {}
+        self.failures = {}
+        self._lock = threading.Lock()
+        self._uploads = {}  # composite upload id -> {target name: upload id or None once failed}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or 4 * len(self.targets))
+
+    def _fan_out(self, key, operation, targets=None):
+        """
+        Run operation(target) on every target concurrently.
+        Returns {target name: result} for the targets that succeeded.
+        """
+        targets = targets if targets is not None else self.targets
+        # Each mirror runs in a copy of the caller's context so its output stays in the attachment's log
+        futures = {
+            target.name: self._executor.submit(contextvars.copy_context().run, operation, target)
+            for target in targets[1:]
+        }
+        results = {}
+        errors = {}
+        for target in targets[:1]:
+            # The first target runs in the calling thread while the others are in flight
+            try:
+                results[target.name] = operation(target)
+            except Exception as e:
+                errors[target.name] = e
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                errors[name] = e
+
+        for target in targets:
+            error = errors.get(target.name)
+            if error is None:
+                continue
+            if target.required:
+                raise MirrorError(f"{target.name}: {error}") from error
+            print(f"  ⚠️  Best-effort mirror {target.name} failed for {key}: {error}")
+            with self._lock:
+                self.failures.setdefault(key, {})[target.name] = str(error)
+        return results
+
+    def _record(self, key, names):
+        with self._lock:
+            replicas = self.replicas.setdefault(key, {})
+            for target in self.targets:
+                if target.name in names:
+                    replicas[target.name] = target.backend.url(key)
+            if self.manifest_path:
+                write_replica_manifest(self.manifest_path, {key: replicas})
+
+    # -- Writes (fanned out) -----------------------------------------------------
+
+    def put_object(self, Bucket, Key, Body, **headers):
+        results = self._fan_out(Key, lambda t: t.backend.put_object(Bucket=t.bucket_name, Key=Key, Body=Body, **headers))
+        self._record(Key, results)
+        return results[self.primary.name]
+
+    def create_multipart_upload(self, Bucket, Key, **headers):
+        results = self._fan_out(
+            Key, lambda t: t.backend.create_multipart_upload(Bucket=t.bucket_name, Key=Key, **headers)['UploadId']
+        )
+        upload_id = results[self.primary.name]
+        with self._lock:
+            # Per target: its own upload id and the ETag it returned for every part
+            self._uploads[upload_id] = {name: {'id': target_id, 'etags': {}} for name, target_id in results.items()}
+        return {'UploadId': upload_id}
+
+    def _active_targets(self, upload_id):
+        with self._lock:
+            upload = self._uploads[upload_id]
+            return [t for t in self.targets if t.name in upload], dict(upload)
+
+    def _abort_target(self, target, key, target_id):
+        try:
+            target.backend.abort_multipart_upload(Bucket=target.bucket_name, Key=key, UploadId=target_id)
+        except Exception as e:
+            if target.required:
+                raise
+            print(f"  ⚠️  Could not abort upload on mirror {target.name}: {e}")
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, ContentMD5=None):
+        targets, upload = self._active_targets(UploadId)
+        results = self._fan_out(Key, lambda t: t.backend.upload_part(
+            Bucket=t.bucket_name, Key=Key, UploadId=upload[t.name]['id'],
+            PartNumber=PartNumber, Body=Body, ContentMD5=ContentMD5
+        ), targets)
+        dropped = []
+        with self._lock:
+            for target in targets:
+                state = self._uploads[UploadId].get(target.name)
+                if state is None:
+                    continue
+                if target.name in results:
+                    state['etags'][PartNumber] = results[target.name]['ETag']
+                else:
+                    # A best-effort target that misses a part is dropped from this upload
+                    dropped.append((target, self._uploads[UploadId].pop(target.name)['id']))
+        for target, target_id in dropped:
+            self._abort_target(target, Key, target_id)
+        return results[self.primary.name]
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        targets, upload = self._active_targets(UploadId)
+        numbers = [part['PartNumber'] for part in MultipartUpload['Parts']]
+
+        def complete(target):
+            state = upload[target.name]
+            parts = [{'ETag': state['etags'][n], 'PartNumber': n} for n in numbers]
+            return target.backend.complete_multipart_upload(
+                Bucket=target.bucket_name, Key=Key, UploadId=state['id'], MultipartUpload={'Parts': parts}
+            )
+
+        results = self._fan_out(Key, complete, targets)
+        with self._lock:
+            self._uploads.pop(UploadId, None)
+        self._record(Key, results)
+        return results[self.primary.name]
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        with self._lock:
+            upload = self._uploads.pop(UploadId, None)
+        if upload is None:
+            # Not started through this wrapper (e.g. a stale upload found by listing)
+            return self.primary.backend.abort_multipart_upload(Bucket=self.primary.bucket_name, Key=Key, UploadId=UploadId)
+        for target in self.targets:
+            if target.name in upload:
+                self._abort_target(target, Key, upload[target.name]['id'])
+        return {}
+
+    def copy_object(self, Bucket, Key, CopySource, **kwargs):
+        results = self._fan_out(Key, lambda t: t.backend.copy_object(
+            Bucket=t.bucket_name, Key=Key, CopySource={'Bucket': t.bucket_name, 'Key': CopySource['Key']}, **kwargs
+        ))
+        self._record(Key, results)
+        return results[self.primary.name]
+
+    def delete_object(self, Bucket, Key):
+        results = self._fan_out(Key, lambda t: t.backend.delete_object(Bucket=t.bucket_name, Key=Key))
+        with self._lock:
+            self.replicas.pop(Key, None)
+            if self.manifest_path:
+                # Staging keys and reused near-duplicates must not point the failover origin at nothing
+                write_replica_manifest(self.manifest_path, {}, removed=[Key])
+        return results[self.primary.name]
+
+    # -- Reads (primary only) ----------------------------------------------------
+
+    def head_object(self, Bucket, Key):
+        return self.primary.backend.head_object(Bucket=self.primary.bucket_name, Key=Key)
+
+    def list_objects_v2(self, Bucket, **kwargs):
+        return self.primary.backend.list_objects_v2(Bucket=self.primary.bucket_name, **kwargs)
+
+    def list_multipart_uploads(self, Bucket, **kwargs):
+        return self.primary.backend.list_multipart_uploads(Bucket=self.primary.bucket_name, **kwargs)
+
+    def url(self, key):
+        return self.primary.backend.url(key)
+
+
+def write_replica_manifest(path, replicas, removed=()):
+    """
+    Merge {key: {target: url}} into the JSON manifest at path and drop the keys in
+    removed (deleted objects), atomically. Returns the number of keys in the manifest.
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        manifest = {}
+    for key, urls in replicas.items():
+        manifest.setdefault(key, {}).update(urls)
+    for key in removed:
+        manifest.pop(key, None)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(temp_path, path)
+    return len(manifest)
@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+"""
+Adaptive Rate Limiting and Circuit Breaking for Media Transfers
+
+Used by upload_media.py to stay polite with the two endpoints it hammers when
+attachments are processed concurrently:
+- the GitHub attachment CDN, which answers 429 with a Retry-After header
+- Linode Object Storage, which answers 503 SlowDown when a bucket is busy
+
+Each host gets a HostGuard that combines:
+- a token bucket limiting the request rate
+- an adaptive concurrency limit (halved on throttling, raised again by one
+  after a streak of successes)
+- a circuit breaker that fails fast once an endpoint is clearly down, instead of
+  burning the job timeout on retries
+
+Every guard keeps counters (requests, throttles, failures, rejected calls,
+seconds spent waiting) so worker counts can be tuned from real runs.
+"""
+
+import time
+import random
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+
+
+# Adaptive limiter defaults
+DEFAULT_RATE = 20.0           # requests per second
+DEFAULT_MAX_CONCURRENCY = 8
+MIN_RATE = 0.5
+SUCCESS_STREAK_TO_RAISE = 20
+DEFAULT_THROTTLE_RETRIES = 5
+DEFAULT_THROTTLE_WAIT = 1.0   # seconds, when the server sends no Retry-After
+MAX_THROTTLE_WAIT = 60.0
+ASYNC_SLOT_POLL = 0.05        # seconds between async checks for a free slot
+
+# Circuit breaker defaults
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_COOLDOWN = 30.0
+
+# S3 error codes that mean "slow down" rather than "broken"
+S3_THROTTLE_CODES = {
+    'SlowDown',
+    'Throttling',
+    'ThrottlingException',
+    'RequestLimitExceeded',
+    'RequestThrottled',
+    'TooManyRequests',
+}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an endpoint whose circuit breaker is open."""
+
+
+class ThrottledError(Exception):
+    """Raised when an endpoint keeps throttling after every allowed retry."""
+
+
+def parse_retry_after(value):
+    """Parse a Retry-After header (seconds or HTTP date) into seconds, or None."""
+    if not value:
+        return None
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class HostGuard:
+    """
+    Token bucket, adaptive concurrency limit and circuit breaker for one host.
+
+    Thread-safe; every worker thread shares the guard for the host it talks to.
+    """
+
+    def __init__(self, host, rate=DEFAULT_RATE, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 failure_threshold=DEFAULT_FAILURE_THRESHOLD, cooldown=DEFAULT_COOLDOWN,
+                 throttle_retries=DEFAULT_THROTTLE_RETRIES, clock=time.monotonic, sleep=time.sleep):
+        self.host = host
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.concurrency = self.max_concurrency
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.throttle_retries = throttle_retries
+        self._clock = clock
+        self._sleep = sleep
+        self._condition = threading.Condition()
+
+        # Token bucket
+        self._tokens = min(self.rate, float(self.max_concurrency))
+        self._last_refill = clock()
+        self._paused_until = 0.0
+        self._in_flight = 0
+        self._success_streak = 0
+
+        # Circuit breaker
+        self.state = 'closed'
+        self._consecutive_failures = 0
+        self._open_until = 0.0
+        self._half_open_trial = False
+
+        self.counters = {
+            'requests': 0,
+            'successes': 0,
+            'throttles': 0,
+            'failures': 0,
+            'circuit_opened': 0,
+            'circuit_rejections': 0,
+            'wait_seconds': 0.0,
+            'min_concurrency': self.concurrency,
+            'min_rate': self.rate,
+        }
+
+    # -- Circuit breaker -------------------------------------------------------
+
+    def _check_circuit(self, now):
+        if self.state == 'open':
+            if now < self._open_until:
+                self.counters['circuit_rejections'] += 1
+                raise CircuitOpenError(
+                    f"{self.host} circuit open after {self._consecutive_failures} consecutive failures; "
+                    f"retry in {self._open_until - now:.0f}s"
+                )
+            self.state = 'half-open'
+            self._half_open_trial = False
+        if self.state == 'half-open':
+            if self._half_open_trial:
+                self.counters['circuit_rejections'] += 1
+                raise CircuitOpenError(f"{self.host} circuit half-open; trial request in progress")
+            self._half_open_trial = True
+
+    # -- Slots and tokens ------------------------------------------------------
+
+    def _refill(self, now):
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._tokens = min(max(1.0, self.rate), self._tokens + elapsed * self.rate)
+
+    def _try_acquire(self, waited):
+        """
+        Take a slot and a token if both are free. Call with the condition held.
+
+        Returns (True, None) on success, otherwise (False, delay) where a delay of
+        None means waiting for a slot to be released.
+        """
+        now = self._clock()
+        self._check_circuit(now)
+        self._refill(now)
+        if now < self._paused_until:
+            delay = self._paused_until - now
+        elif self._in_flight >= self.concurrency:
+            delay = None
+        elif self._tokens < 1.0 - 1e-9:
+            delay = (1.0 - self._tokens) / self.rate
+        else:
+            self._tokens = max(0.0, self._tokens - 1.0)
+            self._in_flight += 1
+            self.counters['requests'] += 1
+            self.counters['wait_seconds'] += waited
+            return True, None
+        if self.state == 'half-open':
+            self._half_open_trial = False
+        return False, delay
+
+    def acquire(self):
+        """Wait for a concurrency slot and a token. Raises CircuitOpenError when open."""
+        waited = 0.0
+        with self._condition:
+            while True:
+                acquired, delay = self._try_acquire(waited)
+                if acquired:
+                    return
+                start = self._clock()
+                if delay is None:
+                    self._condition.wait(timeout=1.0)
+                else:
+                    self._condition.release()
+                    try:
+                        self._sleep(delay)
+                    finally:
+                        self._condition.acquire()
+                waited += self._clock() - start
+
+    async def acquire_async(self):
+        """
+        acquire() for the asyncio engine. Waits on the event loop rather than in a worker
+        thread, so slot holders never run short of threads for the calls that free them.
+        """
+        waited = 0.0
+        while True:
+            with self._condition:
+                acquired, delay = self._try_acquire(waited)
+            if acquired:
+                return
+            start = self._clock()
+            await asyncio.sleep(ASYNC_SLOT_POLL if delay is None else delay)
+            waited += self._clock() - start
+
+    def release(self):
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def _release_on_close(self, response, name):
+        """Wrap response.<name>() so the slot taken for the request is freed once it is closed."""
+        close = getattr(response, name)
+        pending = [True]
+
+        def release_once():
+            with self._condition:
+                if not pending:
+                    return
+                pending.clear()
+                self.release()
+
+        if asyncio.iscoroutinefunction(close):
+            async def close_and_release(*args, **kwargs):
+                try:
+                    return await close(*args, **kwargs)
+                finally:
+                    release_once()
+        else:
+            def close_and_release(*args, **kwargs):
+                try:
+                    return close(*args, **kwargs)
+                finally:
+                    release_once()
+        setattr(response, name, close_and_release)
+
+    # -- Feedback --------------------------------------------------------------
+
+    def record_success(self):
+        with self._condition:
+            self.counters['successes'] += 1
+            self._consecutive_failures = 0
+            if self.state != 'closed':
+                print(f"  ✅ {self.host} circuit closed again")
+            self.state = 'closed'
+            self._success_streak += 1
+            if self._success_streak >= SUCCESS_STREAK_TO_RAISE:
+                # Additive increase after a sustained run of successes
+                self._success_streak = 0
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+                self.rate = min(self.max_rate, self.rate * 1.25)
+            self._condition.notify_all()
+
+    def record_throttle(self, retry_after=None):
+        with self._condition:
+            self.counters['throttles'] += 1
+            self._success_streak = 0
+            # Multiplicative decrease on throttling
+            self.concurrency = max(1, self.concurrency // 2)
+            self.rate = max(MIN_RATE, self.rate / 2)
+            self._tokens = 0.0
+            wait = retry_after if retry_after is not None else DEFAULT_THROTTLE_WAIT * random.uniform(1.0, 2.0)
+            self._paused_until = max(self._paused_until, self._clock() + min(wait, MAX_THROTTLE_WAIT))
+            self.counters['min_concurrency'] = min(self.counters['min_concurrency'], self.concurrency)
+            self.counters['min_rate'] = min(self.counters['min_rate'], self.rate)
+            if self.state == 'half-open':
+                # A throttled trial still reached the host: close the breaker and let the pause pace retries
+                self.state = 'closed'
+                self._half_open_trial = False
+                self._consecutive_failures = 0
+                print(f"  ✅ {self.host} circuit closed again (trial request throttled)")
+            print(f"  🐢 {self.host} throttled; concurrency {self.concurrency}, "
+                  f"rate {self.rate:.1f}/s, pausing {min(wait, MAX_THROTTLE_WAIT):.1f}s")
+            self._condition.notify_all()
+
+    def record_failure(self):
+        with self._condition:
+            self.counters['failures'] += 1
+            self._success_streak = 0
+            self._consecutive_failures += 1
+            if self.state == 'half-open' or self._consecutive_failures >= self.failure_threshold:
+                if self.state != 'open':
+                    self.counters['circuit_opened'] += 1
+                    print(f"  🔌 {self.host} circuit opened after {self._consecutive_failures} "
+                          f"consecutive failure(s); failing fast for {self.cooldown:.0f}s")
+                self.state = 'open'
+                self._open_until = self._clock() + self.cooldown
+            self._condition.notify_all()
+
+    # -- Guarded calls ---------------------------------------------------------
+
+    def call(self, operation, classify, hold=False):
+        """
+        Run operation() under the limiter and breaker.
+
+        classify(result, error) returns (outcome, retry_after) where outcome is
+        'ok', 'throttle' or 'failure'. Throttled calls are retried after the pause
+        up to throttle_retries times; the last result is returned (or error raised).
+
+        The slot is normally freed as soon as operation() returns. With hold=True the
+        result is a streamed response and keeps its slot until response.close(), so
+        the concurrency limit covers reading the body and not just the request.
+        """
+        attempts = 0
+        while True:
+            self.acquire()
+            result, error, held = None, None, False
+            try:
+                result = operation()
+                if hold:
+                    self._release_on_close(result, 'close')
+                    held = True
+            except Exception as e:
+                error = e
+            finally:
+                if not held:
+                    self.release()
+
+            if not self._settle(result, error, classify, attempts):
+                return result
+            attempts += 1
+            if result is not None and hasattr(result, 'close'):
+                result.close()
+
+    async def call_async(self, operation, classify, hold=False):
+        """
+        Awaitable counterpart of call() for the asyncio engine; operation() returns an awaitable.
+
+        With hold=True the slot is freed by the response's aclose(). Throttled
+        responses are closed with aclose() before retrying.
+        """
+        attempts = 0
+        while True:
+            await self.acquire_async()
+            result, error, held = None, None, False
+            try:
+                result = await operation()
+                if hold:
+                    self._release_on_close(result, 'aclose')
+                    held = True
+            except Exception as e:
+                error = e
+            finally:
+                if not held:
+                    self.release()
+
+            if not self._settle(result, error, classify, attempts):
+                return result
+            attempts += 1
+            if result is not None and hasattr(result, 'aclose'):
+                await result.aclose()
+
+    def _settle(self, result, error, classify, attempts):
+        """Record the outcome of one attempt; True when a throttled call should be retried."""
+        outcome, retry_after = classify(result, error)
+        if outcome == 'throttle':
+            self.record_throttle(retry_after)
+            if attempts < self.throttle_retries:
+                return True
+            if error is None:
+                return False
+            raise ThrottledError(f"{self.host} still throttling after {attempts} retries: {error}") from error
+        if outcome == 'failure':
+            self.record_failure()
+        else:
+            self.record_success()
+        if error is not None:
+            raise error
+        return False
+
+
+def classify_http_response(response, error):
+    """Classify a requests call: 429 and 503+Retry-After throttle, 5xx and connection errors fail."""
+    if error is not None:
+        return 'failure', None
+    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+    if response.status_code == 429 or (response.status_code == 503 and retry_after is not None):
+        return 'throttle', retry_after
+    if response.status_code >= 500:
+        return 'failure', None
+    return 'ok', None
+
+
+def classify_s3_call(result, error):
+    """Classify a boto3 call: SlowDown/503/429 throttle, other 5xx and transport errors fail."""
+    if error is None:
+        return 'ok', None
+    response = getattr(error, 'response', None)
+    if not isinstance(response, dict):
+        return 'failure', None
+    code = response.get('Error', {}).get('Code', '')
+    metadata = response.get('ResponseMetadata', {})
+    status = metadata.get('HTTPStatusCode', 0)
+    if code in S3_THROTTLE_CODES or status in (429, 503):
+        return 'throttle', parse_retry_after(metadata.get('HTTPHeaders', {}).get('retry-after'))
+    if status >= 500:
+        return 'failure', None
+    # 4xx answers (NoSuchKey, 404 on HEAD, ...) mean the endpoint is healthy
+    return 'ok', None
+
+
+class GuardedS3Client:
+    """
+    Wraps a boto3 S3 client so every API call goes through a HostGuard.
+    Non-callable attributes (meta, exceptions) pass straight through.
+    """
+
+    def __init__(self, client, guard):
+        self._client = client
+        self.guard = guard
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr) or name in ('get_paginator', 'generate_presigned_url', 'can_paginate'):
+            return attr
+
+        def guarded(*args, **kwargs):
+            return self.guard.call(lambda: attr(*args, **kwargs), classify_s3_call)
+        return guarded
+
+
+_guards = {}
+_guards_lock = threading.Lock()
+
+
+def configure_host_guard(host, **settings):
+    """Create (or replace) the guard for a host with explicit settings."""
+    with _guards_lock:
+        guard = HostGuard(host, **settings)
+        _guards[host] = guard
+        return guard
+
+
+def get_host_guard(host):
+    """Return the shared guard for a host, creating one with default settings."""
+    with _guards_lock:
+        if host not in _guards:
+            _guards[host] = HostGuard(host)
+        return _guards[host]
+
+
+def throttle_report():
+    """Snapshot of every guard's counters: {host: counters}."""
+    with _guards_lock:
+        return {host: dict(guard.counters, state=guard.state) for host, guard in _guards.items()}
+
+
+def print_throttle_report():
+    """Print throttle counters for every host that saw traffic."""
+    report = throttle_report()
+    if not any(counters['requests'] for counters in report.values()):
+        return
+    print("\n📈 Transfer throttling report:")
+    for host, c in sorted(report.items()):
+        if not c['requests']:
+            continue
+        print(f"  - {host}: {c['requests']} request(s), {c['throttles']} throttle(s), "
+              f"{c['failures']} failure(s), {c['circuit_rejections']} rejected by breaker, "
+              f"waited {c['wait_seconds']:.1f}s, min concurrency {c['min_concurrency']}, "
+              f"min rate {c['min_rate']:.1f}/s")
@@ -14,6 +14,8 @@ import boto3
 from botocore.config import Config
 from urllib.parse import urlparse
 
+from upload_media import object_headers
+
 
 def mask_credential(value, show_chars=4):
     """Mask credentials for safe logging."""
@@ -152,14 +154,23 @@ def test_s3_connection():
             test_key = "test/connection_test.txt"
             test_content = b"S3 connection test successful!"
             
+            # Same header policy as real uploads; this key is reused, so no immutable caching
+            headers = object_headers(test_key, immutable=False)
             s3_client.put_object(
                 Bucket=bucket_name,
                 Key=test_key,
                 Body=test_content,
-                ACL='public-read'
+                ACL='public-read',
+                **headers
             )
             print(f"✅ Successfully uploaded test object: {test_key}")
             
+            head = s3_client.head_object(Bucket=bucket_name, Key=test_key)
+            print(f"   Content-Type: {head.get('ContentType')}")
+            print(f"   Cache-Control: {head.get('CacheControl')}")
+            if head.get('ContentType') != headers['ContentType'] or head.get('CacheControl') != headers['CacheControl']:
+                print("⚠️  Warning: object headers were not stored as sent")
+            
             # Test 4: Generate URL
             if custom_domain:
                 test_url = f"{custom_domain.rstrip('/')}/{test_key}"
@@ -13,14 +13,230 @@ This script:
 import os
 import sys
 import re
+import io
+import base64
+import hashlib
+import threading
+import contextvars
+import json
+import time
+import random
+import tempfile
+import uuid
+import gzip
 import requests
 import boto3
 from botocore.config import Config
-from datetime import datetime
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import brotli
+except ImportError:  # Optional dependency; only gzip copies are written without it
+    brotli = None
+
+from media_animation import animation_s3_key, available_animation_formats, convert_gif, is_animation_source
+from media_cache import get_download_cache
+from media_images import (
+    DEFAULT_VARIANT_WIDTHS,
+    available_formats,
+    encode_poster,
+    generate_variants,
+    is_derivative_source,
+    is_optimizable,
+    optimize_chunks,
+    optimize_photo,
+    poster_s3_key,
+    shutdown_image_pool,
+    srcset_fields,
+    variant_s3_key,
+)
+from media_faststart import MOVIE_EXTENSIONS, faststart_bytes, faststart_chunks
+from media_formats import FORMATS, detect_extension, extension_for_content_type, folder_for_extension
+from media_inventory import get_media_inventory
+from media_journal import RunJournal, write_text_atomic
+from media_phash import DEFAULT_MAX_DISTANCE, get_phash_index, image_hash
+from media_placeholder import placeholder_fields, placeholders_available
+from media_probe import HttpRangeReader, MediaProbe, describe, media_fields, probe_bytes, probe_remote
+from media_storage import (
+    MirroredStorage,
+    MirrorTarget,
+    S3Backend,
+    create_storage_backend,
+    public_object_url,
+)
+from media_throttle import (
+    DEFAULT_COOLDOWN,
+    DEFAULT_FAILURE_THRESHOLD,
+    DEFAULT_RATE,
+    GuardedS3Client,
+    classify_http_response,
+    configure_host_guard,
+    get_host_guard,
+    print_throttle_report,
+    throttle_report,
+)
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
 from urllib.parse import urlparse
 from pathlib import Path
 
 
+# Streaming upload settings
+# S3 multipart uploads require every part except the last to be at least 5 MiB
+MIN_PART_SIZE = 5 * 1024 * 1024
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+STREAM_CHUNK_SIZE = 64 * 1024
+SNIFF_SIZE = 4096
+
+# Parallel multipart uploads
+DEFAULT_MULTIPART_THRESHOLD = 16 * 1024 * 1024
+DEFAULT_PART_CONCURRENCY = 4
+DEFAULT_PART_RETRIES = 3
+MAX_PARTS = 10000  # S3 limit on parts per upload
+DEFAULT_STALE_UPLOAD_HOURS = 24
+MAX_COPY_SIZE = 5 * 1024 * 1024 * 1024  # S3 limit for a single copy_object
+
+# S3 key schemes: timestamp-prefixed names, or content-addressed by SHA-256
+KEY_SCHEMES = ('timestamp', 'content')
+
+# CDN caching policy
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60  # one year, for keys that are never reused
+REVALIDATE_MAX_AGE = 300                 # for keys that may be overwritten
+DEFAULT_CONTENT_TYPE = 'application/octet-stream'
+
+# Canonical Content-Type per extension, from the format registry in media_formats.py
+EXTENSION_CONTENT_TYPES = {fmt.extension: fmt.content_type for fmt in FORMATS}
+
+# Per media folder (see get_media_type_folder): how long caches may keep an object,
+# how browsers should present it, and whether precompressed copies are worthwhile
+CACHE_POLICIES = {
+    'images': {'max_age': IMMUTABLE_MAX_AGE, 'disposition': 'inline', 'precompress': ('.svg',)},
+    'videos': {'max_age': IMMUTABLE_MAX_AGE, 'disposition': 'inline', 'precompress': ()},
+    'audio': {'max_age': IMMUTABLE_MAX_AGE, 'disposition': 'inline', 'precompress': ()},
+    'files': {'max_age': 24 * 60 * 60, 'disposition': 'inline', 'precompress': ()},
+}
+
+# Suffix of a precompressed copy -> the Content-Encoding it is served with
+PRECOMPRESSED_ENCODINGS = {'.gz': 'gzip', '.br': 'br'}
+
+# Concurrent attachment processing
+DEFAULT_WORKERS = 4
+
+# Shared HTTP session for GitHub downloads
+DEFAULT_HTTP_RETRIES = 3
+DEFAULT_HTTP_BACKOFF = 0.5
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+HTTP_TIMEOUT = (10, 30)  # (connect, read) seconds
+
+# Resumable downloads
+DEFAULT_MAX_RESUMES = 5
+DEFAULT_LARGE_FILE_MB = 50
+RESUMABLE_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.Timeout,
+)
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+
+def env_flag(name, default=False):
+    """Read a boolean feature switch from the environment ('1', 'true', 'yes', 'on')."""
+    value = os.environ.get(name)
+    if value is None or value.strip() == '':
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def env_int(name, default):
+    """Read an integer setting from the environment, falling back to default when unset or invalid."""
+    value = os.environ.get(name)
+    if value is None or value.strip() == '':
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        print(f"⚠️  Ignoring invalid {name}={value!r}, using {default}")
+        return default
+
+
+def env_float(name, default):
+    """Read a float setting from the environment, falling back to default when unset or invalid."""
+    value = os.environ.get(name)
+    if value is None or value.strip() == '':
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        print(f"⚠️  Ignoring invalid {name}={value!r}, using {default}")
+        return default
+
+
+def submit_in_context(executor, fn, *args):
+    """
+    executor.submit() in a copy of the caller's context, so print() output from
+    nested worker threads stays in the calling attachment's log (AttachmentLogCapture).
+    """
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+class JitteredRetry(Retry):
+    """
+    urllib3 Retry with full jitter on the exponential backoff.
+    Spreads out retries from parallel workers so they do not hit GitHub in lockstep.
+    """
+    
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        return random.uniform(0, backoff) if backoff > 0 else 0
+
+
+def build_http_session(retries=DEFAULT_HTTP_RETRIES, backoff_factor=DEFAULT_HTTP_BACKOFF, pool_size=DEFAULT_WORKERS):
+    """
+    Build a requests session with pooled keep-alive connections and a retry policy.
+    
+    GitHub attachment URLs redirect from github.com to a second storage host, so the
+    session keeps a connection pool per host and reuses both across attachments.
+    Connection resets, read errors and 5xx responses are retried with jittered
+    exponential backoff.
+    """
+    retry = JitteredRetry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        respect_retry_after_header=True,
+        raise_on_status=False  # Hand the final response to raise_for_status()
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(1, pool_size), max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_http_session():
+    """
+    Return the process-wide HTTP session used for attachment downloads.
+    Created on first use from MEDIA_UPLOAD_HTTP_RETRIES / MEDIA_UPLOAD_HTTP_BACKOFF.
+    """
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            _http_session = build_http_session(
+                retries=max(0, env_int('MEDIA_UPLOAD_HTTP_RETRIES', DEFAULT_HTTP_RETRIES)),
+                backoff_factor=max(0.0, env_float('MEDIA_UPLOAD_HTTP_BACKOFF', DEFAULT_HTTP_BACKOFF)),
+                pool_size=max(DEFAULT_WORKERS, env_int('MEDIA_UPLOAD_WORKERS', DEFAULT_WORKERS))
+            )
+        return _http_session
+
+
 def sanitize_filename(filename):
     """
     Sanitize filename for S3 storage.
@@ -53,26 +269,7 @@ def get_media_type_folder(url, filename):
     Determine the media type folder based on file extension.
     Adapted from discord-publish-bot storage logic.
     """
-    # Get file extension
-    ext = Path(filename).suffix.lower()
-    
-    # Image extensions
-    image_exts = ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.svg', '.ico']
-    if ext in image_exts:
-        return 'images'
-    
-    # Video extensions
-    video_exts = ['.mp4', '.webm', '.mov', '.avi', '.mkv', '.flv', '.wmv', '.m4v']
-    if ext in video_exts:
-        return 'videos'
-    
-    # Audio extensions
-    audio_exts = ['.mp3', '.wav', '.ogg', '.m4a', '.flac', '.aac', '.wma']
-    if ext in audio_exts:
-        return 'audio'
-    
-    # Default to 'files' for unknown types
-    return 'files'
+    return folder_for_extension(Path(filename).suffix)
 
 
 def detect_file_extension_from_content(content):
@@ -80,75 +277,7 @@ def detect_file_extension_from_content(content):
     Detect file extension from file content using magic numbers (file signatures).
     Returns the detected extension (e.g., '.mp4', '.jpg') or None if unknown.
     """
-    if not content:
-        return None
-    
-    # Video file signatures
-    # MP4 files start with ftyp box (need at least 12 bytes)
-    if len(content) >= 12 and content[4:8] == b'ftyp':
-        # Check common MP4 subtypes
-        subtype = content[8:12]
-        if subtype in (b'isom', b'iso2', b'mp41', b'mp42', b'avc1', b'M4V ', b'M4A '):
-            return '.mp4'
-        elif subtype == b'M4V ':
-            return '.m4v'
-        elif subtype == b'M4A ':
-            return '.m4a'
-        return '.mp4'  # Default to .mp4 for other ftyp variants
-    
-    # WebM/MKV (Matroska) - need at least 4 bytes
-    if len(content) >= 4 and content[:4] == b'\x1a\x45\xdf\xa3':
-        return '.mkv'
-    
-    # AVI - need at least 12 bytes
-    if len(content) >= 12 and content[:4] == b'RIFF' and content[8:12] == b'AVI ':
-        return '.avi'
-    
-    # MOV (QuickTime) - similar to MP4 but with different atoms - need at least 4 bytes
-    if len(content) >= 4 and content[:4] in (b'moov', b'mdat', b'wide', b'free'):
-        return '.mov'
-    
-    # Image file signatures
-    # JPEG - need at least 3 bytes
-    if len(content) >= 3 and content[:3] == b'\xff\xd8\xff':
-        return '.jpg'
-    
-    # PNG - need at least 8 bytes
-    if len(content) >= 8 and content[:8] == b'\x89PNG\r\n\x1a\n':
-        return '.png'
-    
-    # GIF - need at least 6 bytes
-    if len(content) >= 6 and content[:6] in (b'GIF87a', b'GIF89a'):
-        return '.gif'
-    
-    # WebP - need at least 12 bytes
-    if len(content) >= 12 and content[:4] == b'RIFF' and content[8:12] == b'WEBP':
-        return '.webp'
-    
-    # BMP - need at least 2 bytes
-    if len(content) >= 2 and content[:2] == b'BM':
-        return '.bmp'
-    
-    # Audio file signatures
-    # MP3 - ID3 tag is 3 bytes, frame sync is 2 bytes
-    if len(content) >= 3 and content[:3] == b'ID3':
-        return '.mp3'
-    if len(content) >= 2 and content[:2] in (b'\xff\xfb', b'\xff\xf3', b'\xff\xf2'):
-        return '.mp3'
-    
-    # WAV - need at least 12 bytes
-    if len(content) >= 12 and content[:4] == b'RIFF' and content[8:12] == b'WAVE':
-        return '.wav'
-    
-    # OGG - need at least 4 bytes
-    if len(content) >= 4 and content[:4] == b'OggS':
-        return '.ogg'
-    
-    # FLAC - need at least 4 bytes
-    if len(content) >= 4 and content[:4] == b'fLaC':
-        return '.flac'
-    
-    return None
+    return detect_extension(content)
 
 
 def detect_extension_from_content_type(content_type):
@@ -156,54 +285,521 @@ def detect_extension_from_content_type(content_type):
     Detect file extension from HTTP Content-Type header.
     Returns the detected extension (e.g., '.mp4', '.jpg') or None if unknown.
     """
-    if not content_type:
-        return None
+    return extension_for_content_type(content_type)
+
+
+def sniff_extension(content_type, head):
+    """
+    Detect the file extension for a download.
+    Tries the HTTP Content-Type header first and falls back to the leading bytes of the file.
+    """
+    detected_ext = detect_extension_from_content_type(content_type)
     
-    # Normalize content type (remove parameters like charset)
-    content_type = content_type.split(';')[0].strip().lower()
-    
-    # Video types
-    video_types = {
-        'video/mp4': '.mp4',
-        'video/mpeg': '.mp4',
-        'video/quicktime': '.mov',
-        'video/x-msvideo': '.avi',
-        'video/x-matroska': '.mkv',
-        'video/webm': '.webm',
-        'video/x-flv': '.flv',
-        'video/x-ms-wmv': '.wmv',
-    }
+    if detected_ext:
+        print(f"  🔍 Detected extension from Content-Type '{content_type}': {detected_ext}")
+    else:
+        # Fall back to content-based detection
+        detected_ext = detect_file_extension_from_content(head)
+        if detected_ext:
+            print(f"  🔍 Detected extension from file content: {detected_ext}")
+        else:
+            print(f"  ⚠️  Could not detect file type from Content-Type or content")
     
-    # Image types
-    image_types = {
-        'image/jpeg': '.jpg',
-        'image/png': '.png',
-        'image/gif': '.gif',
-        'image/webp': '.webp',
-        'image/bmp': '.bmp',
-        'image/svg+xml': '.svg',
-        'image/x-icon': '.ico',
-    }
+    return detected_ext
+
+
+def content_type_for(filename, content_type=None):
+    """
+    Content-Type to store for a file.
     
-    # Audio types
-    audio_types = {
-        'audio/mpeg': '.mp3',
-        'audio/mp3': '.mp3',
-        'audio/wav': '.wav',
-        'audio/wave': '.wav',
-        'audio/x-wav': '.wav',
-        'audio/ogg': '.ogg',
-        'audio/flac': '.flac',
-        'audio/aac': '.aac',
-        'audio/x-m4a': '.m4a',
+    The canonical type for the file extension wins, so videos are never served as
+    application/octet-stream. For unknown extensions, a media Content-Type reported
+    by the download is used instead.
+    """
+    ext = Path(filename).suffix.lower()
+    if ext in EXTENSION_CONTENT_TYPES:
+        return EXTENSION_CONTENT_TYPES[ext]
+    reported_ext = detect_extension_from_content_type(content_type)
+    if reported_ext:
+        return EXTENSION_CONTENT_TYPES[reported_ext]
+    return DEFAULT_CONTENT_TYPE
+
+
+def object_headers(s3_key, content_type=None, immutable=True):
+    """
+    S3 object headers for an upload, following the CACHE_POLICIES entry for its media folder.
+    
+    Set immutable=False for keys that may be overwritten later; those get a short
+    max-age instead of the year-long immutable policy used for uniquely keyed objects.
+    Returns kwargs for put_object/create_multipart_upload/copy_object.
+    """
+    filename = os.path.basename(s3_key)
+    policy = CACHE_POLICIES.get(get_media_type_folder(s3_key, filename), CACHE_POLICIES['files'])
+    if immutable:
+        cache_control = f"public, max-age={policy['max_age']}, immutable"
+    else:
+        cache_control = f"public, max-age={REVALIDATE_MAX_AGE}"
+    return {
+        'ContentType': content_type_for(filename, content_type),
+        'CacheControl': cache_control,
+        'ContentDisposition': f'{policy["disposition"]}; filename="{filename}"',
     }
+
+
+def precompressed_original(s3_key):
+    """
+    (original key, Content-Encoding) when s3_key is a precompressed copy written by
+    upload_precompressed_variants (e.g. logo.svg.gz), otherwise None.
+    """
+    base_key, suffix = os.path.splitext(s3_key)
+    encoding = PRECOMPRESSED_ENCODINGS.get(suffix.lower())
+    if encoding is None:
+        return None
+    filename = os.path.basename(base_key)
+    policy = CACHE_POLICIES.get(get_media_type_folder(base_key, filename), CACHE_POLICIES['files'])
+    if Path(filename).suffix.lower() not in policy['precompress']:
+        return None
+    return base_key, encoding
+
+
+def precompressed_variants(file_content, s3_key):
+    """
+    Build gzip (and, with the brotli package, brotli) copies of text-like assets such as SVG.
+    Returns a list of (variant_key, body, content_encoding); empty for other media.
+    """
+    filename = os.path.basename(s3_key)
+    policy = CACHE_POLICIES.get(get_media_type_folder(s3_key, filename), CACHE_POLICIES['files'])
+    if Path(filename).suffix.lower() not in policy['precompress']:
+        return []
+    variants = [(s3_key + '.gz', gzip.compress(file_content, compresslevel=9, mtime=0), 'gzip')]
+    if brotli is not None:
+        variants.append((s3_key + '.br', brotli.compress(file_content), 'br'))
+    return variants
+
+
+def upload_precompressed_variants(file_content, s3_key, s3_client, bucket_name):
+    """Upload precompressed copies next to s3_key with matching Content-Type and Content-Encoding."""
+    headers = object_headers(s3_key)
+    for variant_key, body, encoding in precompressed_variants(file_content, s3_key):
+        s3_client.put_object(
+            Bucket=bucket_name,
+            Key=variant_key,
+            Body=body,
+            ContentEncoding=encoding,
+            ACL='public-read',  # Make file publicly accessible
+            **headers
+        )
+        print(f"  🗜️  Uploaded {encoding} copy: {variant_key} ({len(body)} of {len(file_content)} bytes)")
+
+
+def get_variant_widths():
+    """Responsive image widths from MEDIA_UPLOAD_VARIANT_WIDTHS; empty unless MEDIA_UPLOAD_VARIANTS is on."""
+    if not env_flag('MEDIA_UPLOAD_VARIANTS'):
+        return ()
+    value = os.environ.get('MEDIA_UPLOAD_VARIANT_WIDTHS', '')
+    widths = tuple(int(w) for w in re.findall(r'\d+', value) if int(w) > 0)
+    return widths or DEFAULT_VARIANT_WIDTHS
+
+
+def upload_image_variants(file_content, s3_key, s3_client, bucket_name, url_for, widths=DEFAULT_VARIANT_WIDTHS):
+    """
+    Encode responsive derivatives of an uploaded photo and upload them next to it in parallel.
+    Returns the srcset fields for its :::media item ({} when the image gets no derivatives).
+    """
+    variants = generate_variants(file_content, s3_key, widths)
+    if not variants:
+        return {}
+    
+    def put(variant):
+        key = variant_s3_key(s3_key, variant.width, variant.extension)
+        s3_client.put_object(
+            Bucket=bucket_name,
+            Key=key,
+            Body=variant.data,
+            ContentMD5=content_md5(variant.data),
+            ACL='public-read',  # Make file publicly accessible
+            **object_headers(key, variant.content_type)
+        )
     
-    # Check all type mappings
-    for mapping in (video_types, image_types, audio_types):
-        if content_type in mapping:
-            return mapping[content_type]
+    with ThreadPoolExecutor(max_workers=min(len(variants), DEFAULT_WORKERS)) as executor:
+        for future in [submit_in_context(executor, put, variant) for variant in variants]:
+            future.result()
     
-    return None
+    formats = sorted({variant.format for variant in variants})
+    widths_done = sorted({variant.width for variant in variants})
+    total = sum(len(variant.data) for variant in variants)
+    print(f"  🖼️  Uploaded {len(variants)} responsive variant(s): {'/'.join(formats)} at "
+          f"{', '.join(str(w) for w in widths_done)}px ({total} bytes)")
+    return srcset_fields(variants, lambda v: url_for(variant_s3_key(s3_key, v.width, v.extension)))
+
+
+def upload_audio_poster(cover, s3_key, s3_client, bucket_name, url_for):
+    """
+    Upload the cover art of an audio file as a small WebP poster next to it.
+    Returns the poster field for its :::media item ({} without cover art or Pillow).
+    """
+    poster = encode_poster(cover) if cover else None
+    if poster is None:
+        return {}
+    data, width, height = poster
+    key = poster_s3_key(s3_key)
+    s3_client.put_object(
+        Bucket=bucket_name,
+        Key=key,
+        Body=data,
+        ContentMD5=content_md5(data),
+        ACL='public-read',  # Make file publicly accessible
+        **object_headers(key, 'image/webp')
+    )
+    print(f"  🎨 Uploaded cover art poster: {key} ({width}x{height}, {len(data)} bytes)")
+    return {'poster': url_for(key)}
+
+
+def upload_converted_animation(file_content, s3_key, s3_client, bucket_name):
+    """
+    Convert an animated GIF to animated WebP or MP4 and upload it next to the GIF.
+    Returns (key, media_type) of the converted file, or None when the GIF is kept.
+    """
+    converted = convert_gif(file_content)
+    if converted is None:
+        return None
+    key = animation_s3_key(s3_key, converted.extension)
+    s3_client.put_object(
+        Bucket=bucket_name,
+        Key=key,
+        Body=converted.data,
+        ContentMD5=content_md5(converted.data),
+        ACL='public-read',  # Make file publicly accessible
+        **object_headers(key, converted.content_type)
+    )
+    print(f"  🎞️  Uploaded {converted.format} animation: {key} (GIF kept as fallback)")
+    return key, converted.media_type
+
+
+def find_near_duplicate(file_content, context):
+    """
+    Hash a photo and look it up in context.phash_index.
+    Returns (phash, NearDuplicate or None); phash is None when the photo cannot be hashed.
+    """
+    started = time.perf_counter()
+    image_phash = image_hash(file_content)
+    if image_phash is None:
+        return None, None
+    duplicate = context.phash_index.find(image_phash, context.phash_distance)
+    if duplicate is not None:
+        print(f"  🪞 Near-duplicate of {duplicate.key} ({duplicate.distance} bit(s) apart, "
+              f"{(time.perf_counter() - started) * 1000:.1f} ms)")
+    return image_phash, duplicate
+
+
+def reuse_near_duplicate(github_url, duplicate, context, uploaded_key=None):
+    """
+    Point an attachment at the already published photo it duplicates.
+
+    A copy already streamed to uploaded_key is deleted again, unless it is a
+    content-addressed key that other posts may share. The reuse is recorded in
+    context.reused_photos for report_reused_photos.
+    Returns (permanent_url, media_type).
+    """
+    context.reused_photos.append((github_url, duplicate))
+    if uploaded_key is not None and uploaded_key != duplicate.key and context.key_scheme != 'content':
+        context.s3_client.delete_object(Bucket=context.bucket_name, Key=uploaded_key)
+        print(f"  🗑️  Removed the streamed copy: {uploaded_key}")
+    if duplicate.details:
+        context.media_details[duplicate.url] = dict(duplicate.details)
+    if context.journal is not None:
+        context.journal.record(github_url, 'uploaded', s3_key=duplicate.key, permanent_url=duplicate.url,
+                               media_type='image', details=duplicate.details)
+    print(f"  🔗 Permanent URL: {duplicate.url}")
+    print(f"  📁 Media type: image")
+    return duplicate.url, 'image'
+
+
+def report_reused_photos(reused_photos):
+    """
+    List every attachment that reused a published photo, so a maintainer can
+    confirm each match. Also appended to the job summary when GITHUB_STEP_SUMMARY is set.
+    """
+    if not reused_photos:
+        return
+    print(f"\n🪞 Reused {len(reused_photos)} published photo(s) instead of uploading; check that each is the same photo:")
+    rows = []
+    for github_url, duplicate in reused_photos:
+        print(f"  - {github_url} -> {duplicate.url} ({duplicate.distance} bit(s) apart)")
+        rows.append(f"| {github_url} | {duplicate.url} | {duplicate.distance} |")
+    summary_path = os.environ.get('GITHUB_STEP_SUMMARY')
+    if summary_path:
+        with open(summary_path, 'a', encoding='utf-8') as f:
+            f.write("### 🪞 Near-duplicate photos reused\n\n"
+                    "These attachments were not uploaded; their posts link to an already published photo. "
+                    "Check that each pair is the same photo.\n\n"
+                    "| Attachment | Reused URL | Hash distance (bits) |\n|---|---|---|\n"
+                    + "\n".join(rows) + "\n\n")
+
+
+class DownloadChangedError(Exception):
+    """Raised when a resumed download no longer matches the bytes already received."""
+
+
+class ResumableDownload:
+    """
+    Iterates over a download's body, resuming with HTTP Range requests after errors.
+    
+    A timeout, connection reset or truncated body does not lose the bytes already
+    received: the request is reissued with `Range: bytes=<offset>-` (guarded by
+    If-Range on the ETag/Last-Modified validator) and iteration continues from the
+    last good offset. Servers that ignore the Range header get the already-received
+    prefix skipped instead. start/end select a byte range (end is inclusive).
+    """
+    
+    def __init__(self, url, start=0, end=None, validator=None, session=None,
+                 chunk_size=STREAM_CHUNK_SIZE, max_resumes=DEFAULT_MAX_RESUMES):
+        self._setup(url, start, end, validator, chunk_size, max_resumes)
+        self.session = session or get_http_session()
+        self._opened(self._open())
+    
+    def _setup(self, url, start, end, validator, chunk_size, max_resumes):
+        self.url = url
+        self.offset = start
+        self.end = end
+        self.validator = validator
+        self.chunk_size = chunk_size
+        self.max_resumes = max_resumes
+        self.resumes = 0
+        self._skip = 0
+    
+    def _opened(self, response):
+        self.response = response
+        self.headers = response.headers
+        self.content_type = self.headers.get('Content-Type', '')
+        self.validator = self.validator or self.headers.get('ETag') or self.headers.get('Last-Modified')
+        self.accepts_ranges = (
+            response.status_code == 206
+            or self.headers.get('Accept-Ranges', '').lower() == 'bytes'
+        )
+        self.total_size = self._parse_total_size()
+    
+    def _request_headers(self):
+        headers = {}
+        if self.offset > 0 or self.end is not None:
+            end = '' if self.end is None else self.end
+            headers['Range'] = f"bytes={self.offset}-{end}"
+            if self.validator:
+                headers['If-Range'] = self.validator
+        return headers
+    
+    def _check_response(self, response):
+        """Raise for HTTP errors and work out how much of a restarted body to skip."""
+        response.raise_for_status()
+        self._skip = 0
+        if (self.offset > 0 or self.end is not None) and response.status_code == 200:
+            # Range ignored (or If-Range failed): the body starts at byte 0 again
+            validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+            if self.offset > 0 and self.validator and validator and validator != self.validator:
+                raise DownloadChangedError(f"{self.url} changed while downloading")
+            self._skip = self.offset
+    
+    def _open(self):
+        headers = self._request_headers()
+        # Rate limited per host; 429/Retry-After responses are waited out and retried.
+        # The response holds its concurrency slot until it is closed.
+        guard = get_host_guard(urlparse(self.url).hostname)
+        response = guard.call(
+            lambda: self.session.get(self.url, stream=True, timeout=HTTP_TIMEOUT, headers=headers),
+            classify_http_response,
+            hold=True
+        )
+        try:
+            self._check_response(response)
+        except Exception:
+            response.close()
+            raise
+        return response
+    
+    def _parse_total_size(self):
+        content_range = self.headers.get('Content-Range', '')
+        if '/' in content_range and not content_range.endswith('/*'):
+            return int(content_range.rsplit('/', 1)[1])
+        content_length = self.headers.get('Content-Length')
+        if content_length is not None and self.response.status_code == 200:
+            return int(content_length)
+        return None
+    
+    @property
+    def expected_end(self):
+        """Offset one past the last byte this download should produce, if known."""
+        if self.end is not None:
+            return self.end + 1
+        return self.total_size
+    
+    def _trim(self, chunk):
+        """Drop the skipped prefix of a restarted body and anything past end; advance the offset."""
+        if self._skip:
+            dropped = min(self._skip, len(chunk))
+            chunk = chunk[dropped:]
+            self._skip -= dropped
+        if self.end is not None:
+            chunk = chunk[:max(0, self.end + 1 - self.offset)]
+        self.offset += len(chunk)
+        return chunk
+    
+    def _interruption(self):
+        """None when the body ended where it should, otherwise why it is incomplete."""
+        expected_end = self.expected_end
+        if expected_end is None or self.offset >= expected_end:
+            return None
+        return f"connection closed at byte {self.offset} of {expected_end}"
+    
+    def _count_resume(self, interruption):
+        if self.resumes >= self.max_resumes:
+            raise IOError(f"Download of {self.url} failed after {self.resumes} resume(s): {interruption}")
+        self.resumes += 1
+        print(f"  🔁 Download interrupted at byte {self.offset} ({interruption}); "
+              f"resuming ({self.resumes}/{self.max_resumes})")
+    
+    def __iter__(self):
+        while True:
+            try:
+                for chunk in self.response.iter_content(chunk_size=self.chunk_size):
+                    chunk = self._trim(chunk)
+                    if chunk:
+                        yield chunk
+                    if self.end is not None and self.offset > self.end:
+                        break
+                interruption = self._interruption()
+                if interruption is None:
+                    # Frees the host's concurrency slot even if the caller never calls close()
+                    self.response.close()
+                    return
+            except RESUMABLE_ERRORS as e:
+                interruption = e
+            
+            self.response.close()
+            self._count_resume(interruption)
+            self.response = self._open()
+    
+    def close(self):
+        self.response.close()
+
+
+def checkpoint_path_for(url, download_dir=None):
+    """Stable on-disk location for a URL's partial download, so reruns can resume it."""
+    download_dir = download_dir or os.environ.get('MEDIA_UPLOAD_DOWNLOAD_DIR') or os.path.join(tempfile.gettempdir(), 'upload-media')
+    os.makedirs(download_dir, exist_ok=True)
+    return os.path.join(download_dir, hashlib.sha256(url.encode('utf-8')).hexdigest()[:32])
+
+
+def _save_download_state(state_path, state):
+    temp_path = state_path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(temp_path, state_path)
+
+
+def download_to_file(url, dest_path, range_parts=1, min_parallel_size=DEFAULT_LARGE_FILE_MB * 1024 * 1024, initial=None):
+    """
+    Download url into dest_path, checkpointing progress so an interrupted run can resume.
+    
+    Bytes are written to `<dest_path>.part` and progress is recorded in
+    `<dest_path>.part.json` as a list of [start, end, next_offset] byte ranges. A rerun
+    picks up each range from its next offset instead of starting over. When the
+    server supports ranges and the file is at least min_parallel_size bytes, it is
+    split into range_parts byte ranges that are fetched in parallel.
+    
+    initial may be an already-open ResumableDownload for url starting at byte 0.
+    Returns a tuple of (dest_path, content_type).
+    """
+    part_path = dest_path + '.part'
+    state_path = part_path + '.json'
+    state = None
+    
+    if os.path.exists(part_path) and os.path.exists(state_path):
+        try:
+            with open(state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if state.get('url') != url:
+                state = None
+        except (OSError, ValueError):
+            state = None
+    
+    if state is not None:
+        done = sum(next_offset - start for start, _, next_offset in state['ranges'])
+        print(f"  ♻️  Resuming checkpointed download ({done} bytes already on disk)")
+        if initial is not None:
+            initial.close()
+            initial = None
+    else:
+        first = initial or ResumableDownload(url)
+        size = first.total_size
+        if range_parts > 1 and size and first.accepts_ranges and size >= min_parallel_size:
+            step = -(-size // range_parts)
+            ranges = [[start, min(start + step, size) - 1, start] for start in range(0, size, step)]
+            print(f"  🧵 Fetching {size} bytes as {len(ranges)} parallel ranges")
+        else:
+            ranges = [[0, size - 1 if size else None, 0]]
+        state = {
+            'url': url,
+            'size': size,
+            'validator': first.validator,
+            'content_type': first.content_type,
+            'ranges': ranges,
+        }
+        with open(part_path, 'wb') as f:
+            if size:
+                f.truncate(size)
+        _save_download_state(state_path, state)
+        # Reuse the open response for the first range
+        first.end = ranges[0][1]
+        initial = first
+    
+    state_lock = threading.Lock()
+    
+    def fetch_range(index, download):
+        start, end, next_offset = state['ranges'][index]
+        if end is not None and next_offset > end:
+            if download is not None:
+                download.close()
+            return
+        if download is None:
+            download = ResumableDownload(url, start=next_offset, end=end, validator=state['validator'])
+        
+        def checkpoint():
+            with state_lock:
+                state['ranges'][index][2] = download.offset
+                _save_download_state(state_path, state)
+        
+        unsaved = 0
+        with open(part_path, 'r+b') as f:
+            f.seek(next_offset)
+            try:
+                for chunk in download:
+                    f.write(chunk)
+                    unsaved += len(chunk)
+                    # Checkpoint roughly every part so a crash loses little work
+                    if unsaved >= DEFAULT_PART_SIZE:
+                        f.flush()
+                        checkpoint()
+                        unsaved = 0
+            finally:
+                # Record how far this range got, even when the download failed
+                f.flush()
+                download.close()
+                checkpoint()
+    
+    if len(state['ranges']) == 1:
+        fetch_range(0, initial)
+    else:
+        with ThreadPoolExecutor(max_workers=len(state['ranges'])) as executor:
+            futures = [
+                submit_in_context(executor, fetch_range, i, initial if i == 0 else None)
+                for i in range(len(state['ranges']))
+            ]
+            for future in futures:
+                future.result()
+    
+    os.replace(part_path, dest_path)
+    os.remove(state_path)
+    return dest_path, state.get('content_type', '')
 
 
 def download_from_github(url):
@@ -211,33 +807,84 @@ def download_from_github(url):
     Download a file from GitHub CDN.
     Returns a tuple of (file_content, detected_extension).
     The detected_extension is determined from Content-Type header and/or file content.
+    
+    Interrupted transfers resume from the last good byte. Files of at least
+    MEDIA_UPLOAD_LARGE_FILE_MB are checkpointed to disk while downloading (optionally
+    as MEDIA_UPLOAD_RANGE_PARTS parallel ranges), so a retried job resumes them.
     """
+    cache = get_download_cache()
+    if cache is not None:
+        entry = cache.lookup_url(url)
+        if entry is not None:
+            print(f"  💾 Cache hit for {url} ({entry.size} bytes, sha256 {entry.sha256[:16]}...)")
+            return cache.read(entry), entry.extension
+    
     print(f"  📥 Downloading from: {url}")
-    response = requests.get(url, timeout=30)
-    response.raise_for_status()
-    print(f"  ✅ Downloaded {len(response.content)} bytes")
+    large_file_size = env_int('MEDIA_UPLOAD_LARGE_FILE_MB', DEFAULT_LARGE_FILE_MB) * 1024 * 1024
+    range_parts = max(1, env_int('MEDIA_UPLOAD_RANGE_PARTS', 1))
+    checkpoint_path = checkpoint_path_for(url)
+    
+    download = None
+    if not os.path.exists(checkpoint_path + '.part.json'):
+        download = ResumableDownload(url, max_resumes=env_int('MEDIA_UPLOAD_MAX_RESUMES', DEFAULT_MAX_RESUMES))
+    
+    if download is None or (download.total_size or 0) >= large_file_size:
+        path, content_type = download_to_file(url, checkpoint_path, range_parts, large_file_size, initial=download)
+        with open(path, 'rb') as f:
+            file_content = f.read()
+        os.remove(path)
+    else:
+        file_content = b''.join(download)
+        content_type = download.content_type
+    print(f"  ✅ Downloaded {len(file_content)} bytes")
     
-    # Try to detect extension from Content-Type header
-    content_type = response.headers.get('Content-Type', '')
-    detected_ext = detect_extension_from_content_type(content_type)
+    # Try to detect extension from Content-Type header, then from file content
+    detected_ext = sniff_extension(content_type, file_content)
+    if faststart_enabled(detected_ext):
+        file_content = faststart_bytes(file_content)
+    if optimize_enabled(detected_ext):
+        file_content = optimize_photo(file_content, detected_ext)
     
-    if detected_ext:
-        print(f"  🔍 Detected extension from Content-Type '{content_type}': {detected_ext}")
-    else:
-        # Fall back to content-based detection
-        detected_ext = detect_file_extension_from_content(response.content)
+    if cache is not None:
+        cache.store(url, file_content, detected_ext, content_type)
+    
+    return file_content, detected_ext
+
+
+def faststart_enabled(extension):
+    """True when videos with this extension get moov moved to the front (MEDIA_UPLOAD_FASTSTART, default off)."""
+    return extension in MOVIE_EXTENSIONS and env_flag('MEDIA_UPLOAD_FASTSTART')
+
+
+def optimize_enabled(extension):
+    """True when JPEG/PNG originals are losslessly optimized before upload (MEDIA_UPLOAD_OPTIMIZE_ORIGINALS, default off)."""
+    return is_optimizable(extension) and env_flag('MEDIA_UPLOAD_OPTIMIZE_ORIGINALS')
+
+
+def resolve_attachment_filename(github_url, detected_ext, index):
+    """
+    Build the upload filename for an attachment from its GitHub URL.
+    GitHub attachment URLs usually have no extension, so the detected one is appended.
+    """
+    parsed_url = urlparse(github_url)
+    path_parts = parsed_url.path.split('/')
+    base_filename = path_parts[-1] if path_parts and path_parts[-1] else f'attachment-{index}'
+    
+    # If filename doesn't have extension, use detected extension
+    if '.' not in base_filename:
         if detected_ext:
-            print(f"  🔍 Detected extension from file content: {detected_ext}")
-        else:
-            print(f"  ⚠️  Could not detect file type from Content-Type or content")
+            print(f"  ✅ Using detected extension: {detected_ext}")
+            return base_filename + detected_ext
+        # Only default to .jpg if detection completely failed
+        print(f"  ⚠️  No extension detected, defaulting to .jpg")
+        return base_filename + '.jpg'
     
-    return response.content, detected_ext
+    return base_filename
 
 
-def upload_to_s3(file_content, filename, s3_client, bucket_name):
+def build_s3_key(filename):
     """
-    Upload file to Linode S3 with timestamp-prefixed filename.
-    Returns the S3 key (path) where the file was uploaded.
+    Build the S3 key for a file: files/{type}/{YYYYMMDD_HHMMSS}_{filename}.
     """
     # Get current timestamp for filename prefix
     now = datetime.now()
@@ -253,22 +900,487 @@ def upload_to_s3(file_content, filename, s3_client, bucket_name):
     timestamped_filename = f"{timestamp}_{clean_filename}"
     
     # Create S3 key with flat structure: /files/{type}/{timestamp}_{filename}
-    s3_key = f"files/{media_folder}/{timestamped_filename}"
+    return f"files/{media_folder}/{timestamped_filename}"
+
+
+def build_content_s3_key(filename, sha256_hex):
+    """
+    Build a content-addressed S3 key: files/{type}/{sha[:2]}/{sha[2:4]}/{sha}{ext}.
     
-    print(f"  📤 Uploading to S3: {s3_key}")
+    The same bytes always map to the same key, so a repost or a re-run reuses the
+    existing object and its CDN URL. The two shard levels keep listings small.
+    """
+    clean_filename = sanitize_filename(filename)
+    media_folder = get_media_type_folder(filename, clean_filename)
+    extension = os.path.splitext(clean_filename)[1].lower()
+    return f"files/{media_folder}/{sha256_hex[:2]}/{sha256_hex[2:4]}/{sha256_hex}{extension}"
+
+
+def build_staging_s3_key(filename):
+    """
+    Temporary key for streamed uploads under the content scheme, whose hash is only
+    known once the last byte has been read: files/{type}/incoming/{random}{ext}.
+    """
+    clean_filename = sanitize_filename(filename)
+    media_folder = get_media_type_folder(filename, clean_filename)
+    extension = os.path.splitext(clean_filename)[1].lower()
+    return f"files/{media_folder}/incoming/{uuid.uuid4().hex}{extension}"
+
+
+def get_key_scheme():
+    """S3 key scheme from MEDIA_UPLOAD_KEY_SCHEME: 'timestamp' (default) or 'content'."""
+    scheme = os.environ.get('MEDIA_UPLOAD_KEY_SCHEME', 'timestamp').strip().lower()
+    if scheme not in KEY_SCHEMES:
+        print(f"⚠️  Unknown MEDIA_UPLOAD_KEY_SCHEME '{scheme}', using 'timestamp'")
+        return 'timestamp'
+    return scheme
+
+
+def is_missing_object_error(error):
+    """True when a boto3 error means the object does not exist (404 on HEAD)."""
+    response = getattr(error, 'response', None)
+    if not isinstance(response, dict):
+        return False
+    code = str(response.get('Error', {}).get('Code', ''))
+    status = response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+    return code in ('404', 'NoSuchKey', 'NotFound') or status == 404
+
+
+def find_existing_object(s3_client, bucket_name, s3_key, size=None, md5_hex=None):
+    """
+    HEAD an object and return its metadata if it already holds the expected bytes.
     
-    # Upload to S3
-    s3_client.put_object(
+    Returns None when the key is missing, or when its size (or its ETag, for objects
+    that were not uploaded in parts) does not match - such objects are overwritten.
+    Keys covered by the inventory snapshot (MEDIA_UPLOAD_INVENTORY) are looked up
+    locally without a HEAD request.
+    """
+    inventory = get_media_inventory()
+    if inventory is not None and inventory.covers(s3_key):
+        head = inventory.lookup(s3_key)
+        if head is None:
+            return None
+    else:
+        try:
+            head = s3_client.head_object(Bucket=bucket_name, Key=s3_key)
+        except Exception as e:
+            if is_missing_object_error(e):
+                return None
+            raise
+    
+    if size is not None and head.get('ContentLength') != size:
+        print(f"  ⚠️  Existing object {s3_key} has a different size; uploading again")
+        return None
+    etag = str(head.get('ETag', '')).strip('"')
+    if md5_hex and etag and '-' not in etag and etag != md5_hex:
+        print(f"  ⚠️  Existing object {s3_key} has a different ETag; uploading again")
+        return None
+    return head
+
+
+def promote_staged_object(s3_client, bucket_name, staging_key, final_key, size):
+    """
+    Move a streamed upload from its staging key to its content-addressed key.
+    
+    If the final key already exists the staged copy is simply deleted. Objects too
+    large for a single server-side copy stay at the staging key.
+    Returns the key the object ends up under.
+    """
+    if find_existing_object(s3_client, bucket_name, final_key, size) is not None:
+        print(f"  ♻️  Already in bucket as {final_key}; dropping staged copy")
+    elif size > MAX_COPY_SIZE:
+        print(f"  ⚠️  {size} bytes is too large for a server-side copy; keeping {staging_key}")
+        return staging_key
+    else:
+        s3_client.copy_object(
+            Bucket=bucket_name,
+            Key=final_key,
+            CopySource={'Bucket': bucket_name, 'Key': staging_key},
+            MetadataDirective='REPLACE',
+            ACL='public-read',  # Make file publicly accessible
+            **object_headers(final_key)
+        )
+        print(f"  🏷️  Stored as {final_key}")
+    s3_client.delete_object(Bucket=bucket_name, Key=staging_key)
+    return final_key
+
+
+def content_md5(data):
+    """Base64-encoded MD5 digest, as expected by the S3 Content-MD5 header."""
+    return base64.b64encode(hashlib.md5(data).digest()).decode('ascii')
+
+
+def choose_transfer_settings(size):
+    """
+    Pick (part_size, concurrency) for a multipart upload of size bytes.
+    
+    Larger files get larger parts so the part count stays well under the S3 limit and
+    per-request overhead stays low; concurrency never exceeds the number of parts.
+    MEDIA_UPLOAD_PART_SIZE_MB and MEDIA_UPLOAD_PART_CONCURRENCY override the defaults.
+    """
+    mib = 1024 * 1024
+    if size < 100 * mib:
+        part_size = DEFAULT_PART_SIZE
+    elif size < 1024 * mib:
+        part_size = 16 * mib
+    else:
+        part_size = 64 * mib
+    
+    override_mb = env_int('MEDIA_UPLOAD_PART_SIZE_MB', 0)
+    if override_mb > 0:
+        part_size = override_mb * mib
+    
+    # Never fall below the S3 minimum or exceed the S3 part count limit
+    part_size = max(MIN_PART_SIZE, part_size, -(-size // MAX_PARTS))
+    part_count = max(1, -(-size // part_size))
+    concurrency = env_int('MEDIA_UPLOAD_PART_CONCURRENCY', DEFAULT_PART_CONCURRENCY)
+    return part_size, max(1, min(concurrency, part_count))
+
+
+def upload_part_with_retry(s3_client, bucket_name, s3_key, upload_id, part_number, data, retries=DEFAULT_PART_RETRIES):
+    """
+    Upload one multipart part, retrying just that part on failure.
+    Returns the part descriptor for complete_multipart_upload.
+    """
+    attempt = 0
+    while True:
+        try:
+            response = s3_client.upload_part(
+                Bucket=bucket_name,
+                Key=s3_key,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                Body=data,
+                ContentMD5=content_md5(data)
+            )
+            return {'ETag': response['ETag'], 'PartNumber': part_number}
+        except Exception as e:
+            if attempt >= retries:
+                raise
+            attempt += 1
+            delay = random.uniform(0, DEFAULT_HTTP_BACKOFF * (2 ** attempt))
+            print(f"  🔁 Part {part_number} failed ({e}); retrying in {delay:.1f}s ({attempt}/{retries})")
+            time.sleep(delay)
+
+
+def upload_multipart_parallel(file_content, s3_key, s3_client, bucket_name, part_size, concurrency):
+    """
+    Upload an in-memory file as a multipart upload with parts sent in parallel.
+    Failed parts are retried individually; if a part still fails the upload is aborted.
+    """
+    view = memoryview(file_content)
+    offsets = list(range(0, len(file_content), part_size))
+    response = s3_client.create_multipart_upload(
         Bucket=bucket_name,
         Key=s3_key,
-        Body=file_content,
-        ACL='public-read'  # Make file publicly accessible
+        ACL='public-read',  # Make file publicly accessible
+        **object_headers(s3_key)
     )
+    upload_id = response['UploadId']
+    print(f"  🧩 Multipart upload: {len(offsets)} part(s) of {part_size // (1024 * 1024)} MiB, {concurrency} in parallel")
+    
+    retries = env_int('MEDIA_UPLOAD_PART_RETRIES', DEFAULT_PART_RETRIES)
+    
+    def send(part_number, offset):
+        # Slice lazily so only in-flight parts are copied out of the file buffer
+        data = bytes(view[offset:offset + part_size])
+        return upload_part_with_retry(s3_client, bucket_name, s3_key, upload_id, part_number, data, retries)
+    
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [submit_in_context(executor, send, i, offset) for i, offset in enumerate(offsets, 1)]
+            parts = [future.result() for future in futures]
+        s3_client.complete_multipart_upload(
+            Bucket=bucket_name,
+            Key=s3_key,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': parts}
+        )
+    except Exception:
+        print(f"  🧹 Aborting multipart upload for {s3_key}")
+        try:
+            s3_client.abort_multipart_upload(Bucket=bucket_name, Key=s3_key, UploadId=upload_id)
+        except Exception as abort_error:
+            print(f"  ⚠️  Could not abort multipart upload: {abort_error}")
+        raise
+
+
+def abort_stale_multipart_uploads(s3_client, bucket_name, prefix='files/', older_than_hours=DEFAULT_STALE_UPLOAD_HOURS):
+    """
+    Abort multipart uploads under prefix that were started more than older_than_hours ago.
+    These are left behind by crashed runs and keep billing for their stored parts.
+    Returns the number of uploads aborted.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=older_than_hours)
+    aborted = 0
+    kwargs = {'Bucket': bucket_name, 'Prefix': prefix}
+    while True:
+        response = s3_client.list_multipart_uploads(**kwargs)
+        for upload in response.get('Uploads', []):
+            initiated = upload['Initiated']
+            if initiated.tzinfo is None:
+                initiated = initiated.replace(tzinfo=timezone.utc)
+            if initiated < cutoff:
+                print(f"🧹 Aborting stale multipart upload {upload['Key']} (started {initiated:%Y-%m-%d %H:%M})")
+                s3_client.abort_multipart_upload(Bucket=bucket_name, Key=upload['Key'], UploadId=upload['UploadId'])
+                aborted += 1
+        if not response.get('IsTruncated'):
+            return aborted
+        kwargs['KeyMarker'] = response.get('NextKeyMarker')
+        kwargs['UploadIdMarker'] = response.get('NextUploadIdMarker')
+
+
+def upload_to_s3(file_content, filename, s3_client, bucket_name, s3_key=None):
+    """
+    Upload file to Linode S3 with timestamp-prefixed filename.
+    Returns the S3 key (path) where the file was uploaded.
+    
+    Pass s3_key to upload under a precomputed key (e.g. a content-addressed one).
+    Files of at least MEDIA_UPLOAD_MULTIPART_THRESHOLD_MB go up as a parallel multipart
+    upload; smaller files keep the single put_object request.
+    """
+    s3_key = s3_key or build_s3_key(filename)
+    
+    print(f"  📤 Uploading to S3: {s3_key}")
+    
+    threshold = env_int('MEDIA_UPLOAD_MULTIPART_THRESHOLD_MB', DEFAULT_MULTIPART_THRESHOLD // (1024 * 1024)) * 1024 * 1024
+    if len(file_content) >= max(threshold, MIN_PART_SIZE):
+        part_size, concurrency = choose_transfer_settings(len(file_content))
+        upload_multipart_parallel(file_content, s3_key, s3_client, bucket_name, part_size, concurrency)
+    else:
+        # Upload to S3
+        s3_client.put_object(
+            Bucket=bucket_name,
+            Key=s3_key,
+            Body=file_content,
+            ACL='public-read',  # Make file publicly accessible
+            **object_headers(s3_key)
+        )
+    
+    if env_flag('MEDIA_UPLOAD_PRECOMPRESS'):
+        upload_precompressed_variants(file_content, s3_key, s3_client, bucket_name)
     
     print(f"  ✅ Uploaded successfully")
     return s3_key
 
 
+def upload_deduplicated(file_content, filename, s3_client, bucket_name):
+    """
+    Upload under a content-addressed key unless the bucket already holds these bytes.
+    Returns the S3 key, which is the same for every upload of identical content.
+    """
+    sha256_hex = hashlib.sha256(file_content).hexdigest()
+    s3_key = build_content_s3_key(filename, sha256_hex)
+    md5_hex = hashlib.md5(file_content).hexdigest()
+    if find_existing_object(s3_client, bucket_name, s3_key, len(file_content), md5_hex) is not None:
+        print(f"  ♻️  Already in bucket, skipping upload: {s3_key}")
+        return s3_key
+    return upload_to_s3(file_content, filename, s3_client, bucket_name, s3_key)
+
+
+def upload_stream_to_s3(chunks, s3_key, s3_client, bucket_name, part_size=DEFAULT_PART_SIZE):
+    """
+    Upload an iterable of byte chunks to S3 without holding the whole file in memory.
+    
+    Chunks are buffered until a full part is available and then sent as one part of a
+    multipart upload, so peak memory is bounded by part_size rather than the file size.
+    Files smaller than one part fall back to a single put_object call. The SHA-256 of the
+    whole file and a Content-MD5 for every request are computed in the same pass.
+    
+    Returns a tuple of (total_bytes, sha256_hex).
+    """
+    sha256 = hashlib.sha256()
+    buffer = bytearray()
+    total_bytes = 0
+    upload_id = None
+    parts = []
+    
+    def send_part(data):
+        part_number = len(parts) + 1
+        parts.append(upload_part_with_retry(s3_client, bucket_name, s3_key, upload_id, part_number, data, part_retries))
+        print(f"  📦 Uploaded part {part_number} ({len(data)} bytes)")
+    
+    part_retries = env_int('MEDIA_UPLOAD_PART_RETRIES', DEFAULT_PART_RETRIES)
+    try:
+        for chunk in chunks:
+            if not chunk:
+                continue
+            sha256.update(chunk)
+            total_bytes += len(chunk)
+            buffer += chunk
+            
+            while len(buffer) >= part_size:
+                if upload_id is None:
+                    response = s3_client.create_multipart_upload(
+                        Bucket=bucket_name,
+                        Key=s3_key,
+                        ACL='public-read',  # Make file publicly accessible
+                        **object_headers(s3_key)
+                    )
+                    upload_id = response['UploadId']
+                    print(f"  🧩 Started multipart upload (part size {part_size} bytes)")
+                part = bytes(buffer[:part_size])
+                del buffer[:part_size]
+                send_part(part)
+        
+        if upload_id is None:
+            # Whole file fit in a single part - use one request like upload_to_s3
+            data = bytes(buffer)
+            s3_client.put_object(
+                Bucket=bucket_name,
+                Key=s3_key,
+                Body=data,
+                ContentMD5=content_md5(data),
+                ACL='public-read',  # Make file publicly accessible
+                **object_headers(s3_key)
+            )
+        else:
+            if buffer:
+                send_part(bytes(buffer))
+            s3_client.complete_multipart_upload(
+                Bucket=bucket_name,
+                Key=s3_key,
+                UploadId=upload_id,
+                MultipartUpload={'Parts': parts}
+            )
+    except Exception:
+        if upload_id is not None:
+            print(f"  🧹 Aborting multipart upload for {s3_key}")
+            try:
+                s3_client.abort_multipart_upload(Bucket=bucket_name, Key=s3_key, UploadId=upload_id)
+            except Exception as abort_error:
+                print(f"  ⚠️  Could not abort multipart upload: {abort_error}")
+        raise
+    
+    return total_bytes, sha256.hexdigest()
+
+
+def stream_attachment_to_s3(github_url, index, s3_client, bucket_name, part_size=DEFAULT_PART_SIZE, key_scheme='timestamp',
+                            capture=None, probe=None):
+    """
+    Stream a GitHub attachment straight into S3.
+    
+    The file type is sniffed from the first bytes of the response so the S3 key is known
+    before the rest of the body arrives; the remaining chunks are piped into
+    upload_stream_to_s3 as they are downloaded. With the 'content' key scheme the
+    hash is only known at the end, so the file is streamed to a staging key and then
+    promoted to its content-addressed key.
+    
+    When capture is a bytearray, the bytes of photos that get responsive derivatives
+    and of GIFs that may be converted are collected into it as they stream past. A MediaProbe passed as probe is fed
+    the chunks to read image dimensions or a movie's moov box.
+    
+    Returns the S3 key where the file was uploaded.
+    """
+    content_keys = key_scheme == 'content'
+    cache = get_download_cache()
+    entry = cache.lookup_url(github_url) if cache is not None else None
+    if entry is not None:
+        print(f"  💾 Cache hit for {github_url} ({entry.size} bytes, sha256 {entry.sha256[:16]}...)")
+        filename = resolve_attachment_filename(github_url, entry.extension, index)
+        if capture is not None and (is_derivative_source(filename) or is_animation_source(filename)):
+            with open(entry.path, 'rb') as f:
+                capture += f.read()
+        if probe is not None:
+            probe.read_file(entry.path)
+        if content_keys:
+            s3_key = build_content_s3_key(filename, entry.sha256)
+            if find_existing_object(s3_client, bucket_name, s3_key, entry.size) is not None:
+                print(f"  ♻️  Already in bucket, skipping upload: {s3_key}")
+                return s3_key
+        else:
+            s3_key = build_s3_key(filename)
+        print(f"  📤 Streaming to S3: {s3_key}")
+        total_bytes, sha256_hex = upload_stream_to_s3(cache.iter_chunks(entry), s3_key, s3_client, bucket_name, part_size)
+        print(f"  ✅ Streamed {total_bytes} bytes (sha256 {sha256_hex[:16]}...)")
+        return s3_key
+    
+    print(f"  📥 Streaming from: {github_url}")
+    download = ResumableDownload(github_url, max_resumes=env_int('MEDIA_UPLOAD_MAX_RESUMES', DEFAULT_MAX_RESUMES))
+    cache_file, cache_temp_path = cache.new_temp_file() if cache is not None else (None, None)
+    try:
+        # Interrupted reads resume with a Range request, so the upload keeps going
+        chunks = iter(download)
+        
+        # Read just enough of the body to sniff the file type
+        head = bytearray()
+        for chunk in chunks:
+            head += chunk
+            if len(head) >= SNIFF_SIZE:
+                break
+        
+        detected_ext = sniff_extension(download.content_type, bytes(head))
+        filename = resolve_attachment_filename(github_url, detected_ext, index)
+        s3_key = build_staging_s3_key(filename) if content_keys else build_s3_key(filename)
+        
+        print(f"  📤 Streaming to S3: {s3_key}")
+        
+        def body():
+            yield bytes(head)
+            yield from chunks
+        
+        def tee(source):
+            # Copy the bytes into the download cache as they stream past
+            for chunk in source:
+                cache_file.write(chunk)
+                yield chunk
+        
+        keep = capture if capture is not None and (is_derivative_source(filename) or is_animation_source(filename)) else None
+        
+        def observe(source):
+            # Keep photo bytes for the responsive derivatives and read dimensions and durations
+            for chunk in source:
+                if keep is not None:
+                    keep.extend(chunk)
+                if probe is not None and not probe.done:
+                    probe.feed(chunk)
+                yield chunk
+        
+        stream = body()
+        if faststart_enabled(detected_ext):
+            # Spools the video to disk only when moov has to move; the cache keeps the result
+            stream = faststart_chunks(stream)
+        if optimize_enabled(detected_ext):
+            # Photos are collected and rewritten before the cache and the probe see them
+            stream = optimize_chunks(stream, detected_ext)
+        if cache_file is not None:
+            stream = tee(stream)
+        if keep is not None or probe is not None:
+            stream = observe(stream)
+        total_bytes, sha256_hex = upload_stream_to_s3(stream, s3_key, s3_client, bucket_name, part_size)
+        
+        if cache_file is not None:
+            cache_file.close()
+            cache.commit_file(github_url, cache_temp_path, sha256_hex, detected_ext, download.content_type)
+            cache_temp_path = None
+        if probe is not None:
+            probe.finish()
+    finally:
+        download.close()
+        if cache_file is not None:
+            cache_file.close()
+            if cache_temp_path is not None and os.path.exists(cache_temp_path):
+                os.remove(cache_temp_path)
+    
+    print(f"  ✅ Streamed {total_bytes} bytes (sha256 {sha256_hex[:16]}...)")
+    if content_keys:
+        s3_key = promote_staged_object(
+            s3_client, bucket_name, s3_key, build_content_s3_key(filename, sha256_hex), total_bytes
+        )
+    return s3_key
+
+
+def media_type_from_s3_key(s3_key):
+    """Map the S3 media folder of a key back to the :::media mediaType value."""
+    if '/images/' in s3_key:
+        return 'image'
+    elif '/videos/' in s3_key:
+        return 'video'
+    elif '/audio/' in s3_key:
+        return 'audio'
+    return 'file'
+
+
 def generate_permanent_url(s3_key, endpoint_url, bucket_name, custom_domain=None):
     """
     Generate the permanent CDN URL for an uploaded file.
@@ -276,16 +1388,7 @@ def generate_permanent_url(s3_key, endpoint_url, bucket_name, custom_domain=None
     If custom_domain is set, use that (e.g., https://cdn.luisquintanilla.me)
     Otherwise, use the standard Linode Object Storage URL.
     """
-    if custom_domain:
-        # Use custom domain (e.g., https://cdn.luisquintanilla.me/files/images/...)
-        return f"{custom_domain.rstrip('/')}/{s3_key}"
-    else:
-        # Use standard Linode URL (e.g., https://bucket-name.us-east-1.linodeobjects.com/files/...)
-        # Extract region from endpoint URL
-        parsed = urlparse(endpoint_url)
-        hostname = parsed.netloc
-        # Expected format: us-east-1.linodeobjects.com
-        return f"https://{bucket_name}.{hostname}/{s3_key}"
+    return public_object_url(s3_key, endpoint_url, bucket_name, custom_domain)
 
 
 def extract_github_attachments(content):
@@ -336,6 +1439,56 @@ def extract_github_attachments(content):
     return attachments
 
 
+def is_already_transformed(content):
+    """
+    True when content was already rewritten into :::media blocks by an earlier run:
+    it has media blocks and no GitHub attachments, YouTube links, bare media URLs or
+    leftover img tags left to process.
+    """
+    return (
+        ':::media' in content
+        and not extract_github_attachments(content)
+        and not extract_and_format_youtube_urls(content)
+        and not extract_direct_media_urls(content)
+        and not re.search(r'<img[^>]*>', content)
+    )
+
+
+def normalize_attachment_url(url):
+    """Canonical form of an attachment URL for duplicate detection (no query, fragment or trailing slash)."""
+    parsed = urlparse(url)
+    return f"{parsed.scheme.lower()}://{parsed.netloc.lower()}{parsed.path.rstrip('/')}"
+
+
+def collapse_duplicate_attachments(attachments):
+    """
+    Fold attachments that point at the same file into one before any download starts.
+    
+    Returns (unique_attachments, duplicates) where duplicates is a list of
+    (url, alt_text, primary_url) for every attachment folded into an earlier one.
+    """
+    primaries = {}
+    unique = []
+    duplicates = []
+    for url, alt_text in attachments:
+        key = normalize_attachment_url(url)
+        if key in primaries:
+            duplicates.append((url, alt_text, primaries[key]))
+        else:
+            primaries[key] = url
+            unique.append((url, alt_text))
+    return unique, duplicates
+
+
+def expand_duplicate_attachments(url_mapping, duplicates):
+    """Give every collapsed duplicate the permanent URL of its primary attachment."""
+    for url, alt_text, primary_url in duplicates:
+        if primary_url in url_mapping:
+            permanent_url, _, media_type = url_mapping[primary_url]
+            url_mapping[url] = (permanent_url, alt_text, media_type)
+    return url_mapping
+
+
 def extract_and_format_youtube_urls(content):
     """
     Extract YouTube URLs and convert them to Markdown thumbnail syntax.
@@ -436,6 +1589,42 @@ def extract_direct_media_urls(content):
     return direct_media
 
 
+# Direct media links whose metadata can be read with Range requests
+REMOTE_PROBE_EXTENSIONS = ('.mp4', '.mov', '.m4v', '.m4a', '.mp3', '.flac', '.ogg', '.opus', '.wav')
+
+
+def probe_remote_media(direct_media_urls, session=None, workers=DEFAULT_WORKERS):
+    """
+    Read duration, size, codecs and bitrate of linked videos and audio without downloading them.
+
+    Only headers (box headers and moov for MP4/MOV, audio headers and the last
+    few KB for audio) are fetched, with HTTP Range requests.
+    Best effort: servers without Range support and unreachable files are skipped.
+    Returns {url: :::media fields}.
+    """
+    urls = [url for url, _ in direct_media_urls
+            if urlparse(url).path.lower().endswith(REMOTE_PROBE_EXTENSIONS)]
+    if not urls:
+        return {}
+    session = session or get_http_session()
+    
+    def probe(url):
+        try:
+            info = probe_remote(HttpRangeReader(session, url))
+        except (requests.RequestException, ValueError) as e:
+            print(f"  ⚠️  Could not probe {url}: {e}")
+            return url, {}
+        return url, media_fields(info) if info is not None else {}
+    
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(urls)))) as pool:
+        for url, fields in pool.map(probe, urls):
+            if fields:
+                print(f"  📐 {url}: {describe(fields)}")
+                results[url] = fields
+    return results
+
+
 def find_all_media_positions(content, github_attachments, youtube_urls, direct_media_urls):
     """
     Find all media items in the content with their positions.
@@ -539,7 +1728,29 @@ def find_all_media_positions(content, github_attachments, youtube_urls, direct_m
     return media_items
 
 
-def transform_content_preserving_positions(content, url_mapping, youtube_urls, direct_media_urls):
+def render_media_block(url, media_type, caption, details=None):
+    """
+    Build a single-item :::media block.
+    
+    details holds extra item fields (srcsetWebp, sizes, ...) keyed by their YAML name;
+    they are written after the standard fields, and may override aspectRatio.
+    The site's block parser flattens indentation, so every value is a scalar.
+    """
+    details = details or {}
+    lines = [
+        f'- url: "{url}"',
+        f'  mediaType: "{media_type}"',
+        f'  aspectRatio: "{details.get("aspectRatio", "landscape")}"',
+        f'  caption: "{caption}"',
+    ]
+    for name, value in details.items():
+        if name == 'aspectRatio':
+            continue
+        lines.append(f'  {name}: {value}' if isinstance(value, (int, float)) else f'  {name}: "{value}"')
+    return ':::media\n' + '\n'.join(lines) + '\n:::media'
+
+
+def transform_content_preserving_positions(content, url_mapping, youtube_urls, direct_media_urls, media_details=None):
     """
     Transform content by replacing media items in-place with their corresponding
     media blocks or formatted syntax, preserving the original position of each item.
@@ -549,6 +1760,8 @@ def transform_content_preserving_positions(content, url_mapping, youtube_urls, d
         url_mapping: dict of {github_url: (permanent_url, alt_text, media_type)}
         youtube_urls: list of (original_url, formatted_markdown, video_id) tuples
         direct_media_urls: list of (url, media_type) tuples
+        media_details: optional dict of {url: {field: value}} with extra :::media
+            fields such as responsive image srcsets, keyed by permanent or direct URL
     
     Returns:
         Transformed content with media items replaced in-place
@@ -566,12 +1779,9 @@ def transform_content_preserving_positions(content, url_mapping, youtube_urls, d
             # Replace with :::media block
             github_url = data['url']
             permanent_url, alt_text, media_type_str = url_mapping[github_url]
-            media_block = f''':::media
-- url: "{permanent_url}"
-  mediaType: "{media_type_str}"
-  aspectRatio: "landscape"
-  caption: "{alt_text}"
-:::media'''
+            media_block = render_media_block(
+                permanent_url, media_type_str, alt_text, (media_details or {}).get(permanent_url)
+            )
             transformed = transformed[:position] + media_block + transformed[position + len(match_text):]
         
         elif media_type == 'youtube':
@@ -584,12 +1794,9 @@ def transform_content_preserving_positions(content, url_mapping, youtube_urls, d
             direct_url = data['url']
             media_type_str = data['media_type']
             filename = direct_url.split('/')[-1].split('?')[0]  # Extract filename from URL
-            media_block = f''':::media
-- url: "{direct_url}"
-  mediaType: "{media_type_str}"
-  aspectRatio: "landscape"
-  caption: "{filename}"
-:::media'''
+            media_block = render_media_block(
+                direct_url, media_type_str, filename, (media_details or {}).get(direct_url)
+            )
             transformed = transformed[:position] + media_block + transformed[position + len(match_text):]
     
     # Clean up extra whitespace but preserve intentional line breaks
@@ -646,6 +1853,370 @@ def transform_content_to_media_blocks(content, url_mapping):
     return transformed
 
 
+@dataclass
+class UploadContext:
+    """
+    Shared settings for processing attachments (storage target and transfer options).
+    s3_client may be a boto3 client or any backend from media_storage.py.
+    """
+    s3_client: object
+    bucket_name: str
+    endpoint_url: str
+    custom_domain: str = None
+    streaming: bool = False
+    part_size: int = DEFAULT_PART_SIZE
+    key_scheme: str = 'timestamp'
+    journal: object = None
+    # Responsive image widths; empty disables derivatives
+    variant_widths: tuple = ()
+    # Upload animated GIFs as animated WebP or MP4 as well, with the GIF as fallback
+    convert_animations: bool = False
+    # Add a BlurHash placeholder to the :::media item of every image
+    placeholders: bool = False
+    # Perceptual hash index (media_phash.PhashIndex); near-duplicate photos reuse its URL
+    phash_index: object = None
+    phash_distance: int = DEFAULT_MAX_DISTANCE
+    # (github_url, NearDuplicate) for every attachment that reused a published photo
+    reused_photos: list = field(default_factory=list)
+    # Extra :::media fields per permanent URL (srcset, ...), filled in by workers
+    media_details: dict = field(default_factory=dict)
+    
+    def keeps_source_bytes(self):
+        """True when streamed photos and GIFs are kept in memory for the stages after the upload."""
+        return bool(self.variant_widths or self.convert_animations or self.placeholders
+                    or self.phash_index is not None)
+    
+    def permanent_url(self, s3_key):
+        """Public URL of an uploaded key, from the storage backend when it provides one."""
+        url_for = getattr(self.s3_client, 'url', None)
+        if callable(url_for):
+            return url_for(s3_key)
+        return generate_permanent_url(s3_key, self.endpoint_url, self.bucket_name, self.custom_domain)
+
+
+class AttachmentCancelled(Exception):
+    """Raised when an attachment is skipped because an earlier one failed."""
+
+
+class AttachmentLogCapture:
+    """
+    Routes print() output from workers into per-attachment buffers.
+    
+    Installed as sys.stdout while attachments are processed concurrently so each
+    attachment's log can be replayed in order once it finishes, instead of
+    interleaving lines from different workers. The buffer lives in a context
+    variable, so this works for worker threads and asyncio tasks alike.
+    """
+    
+    def __init__(self, stream):
+        self._stream = stream
+        self._buffer = contextvars.ContextVar('attachment_log_buffer', default=None)
+    
+    def begin(self):
+        self._buffer.set(io.StringIO())
+    
+    def end(self):
+        buffer = self._buffer.get()
+        self._buffer.set(None)
+        return buffer.getvalue() if buffer else ''
+    
+    def write(self, text):
+        buffer = self._buffer.get()
+        return (buffer or self._stream).write(text)
+    
+    def flush(self):
+        self._stream.flush()
+
+
+def raise_if_cancelled(cancel_event):
+    """Stop between pipeline stages once an earlier attachment has failed."""
+    if cancel_event is not None and cancel_event.is_set():
+        raise AttachmentCancelled("cancelled after an earlier failure")
+
+
+def replay_attachment(github_url, context):
+    """Result of an attachment uploaded by an earlier, failed run, or None."""
+    journal = context.journal
+    replayed = journal.completed(github_url) if journal is not None else None
+    if replayed is not None:
+        print(f"  📒 Uploaded by an earlier run: {replayed[0]}")
+        details = journal.details(github_url)
+        if details:
+            context.media_details[replayed[0]] = details
+    return replayed
+
+
+def finish_streamed_attachment(github_url, s3_key, file_content, info, context, cancel_event=None):
+    """
+    Post-upload stages for a streamed attachment, shared by both engines.
+    
+    The hash needs the whole photo, so a near-duplicate is only recognised after
+    streaming it; the streamed copy is then removed again.
+    Returns a tuple of (permanent_url, media_type).
+    """
+    image_phash = None
+    if context.phash_index is not None and file_content and is_derivative_source(s3_key):
+        image_phash, duplicate = find_near_duplicate(file_content, context)
+        if duplicate is not None:
+            return reuse_near_duplicate(github_url, duplicate, context, uploaded_key=s3_key)
+    return finish_attachment(github_url, s3_key, file_content, info, context, cancel_event, image_phash)
+
+
+def finish_attachment(github_url, s3_key, file_content, info, context, cancel_event=None, image_phash=None):
+    """
+    Stages that run once an attachment is in the bucket: poster frames, placeholders,
+    responsive variants, GIF conversion, the near-duplicate index and the journal.
+    Returns a tuple of (permanent_url, media_type).
+    """
+    # Generate permanent URL
+    permanent_url = context.permanent_url(s3_key)
+    
+    # Determine media type from S3 key
+    media_type = media_type_from_s3_key(s3_key)
+    
+    # Real dimensions (and video durations) instead of the default aspect ratio,
+    # then smaller copies of photos for srcset
+    details = media_fields(info) if info is not None else {}
+    if details:
+        print(f"  📐 {describe(details)}")
+    if getattr(info, 'cover', None):
+        raise_if_cancelled(cancel_event)
+        details.update(upload_audio_poster(
+            info.cover, s3_key, context.s3_client, context.bucket_name, context.permanent_url
+        ))
+    if context.placeholders and file_content and media_type == 'image':
+        details.update(placeholder_fields(file_content))
+    if context.variant_widths and file_content and media_type == 'image':
+        raise_if_cancelled(cancel_event)
+        details.update(upload_image_variants(
+            file_content, s3_key, context.s3_client, context.bucket_name, context.permanent_url, context.variant_widths
+        ))
+    if context.convert_animations and file_content and is_animation_source(s3_key):
+        raise_if_cancelled(cancel_event)
+        converted = upload_converted_animation(file_content, s3_key, context.s3_client, context.bucket_name)
+        if converted is not None:
+            # The :::media item points at the converted file; the GIF stays as its fallback
+            details['fallback'] = permanent_url
+            s3_key, media_type = converted
+            permanent_url = context.permanent_url(s3_key)
+    if details:
+        context.media_details[permanent_url] = details
+    if image_phash is not None:
+        # Later uploads of the same photo find this copy
+        context.phash_index.add(s3_key, permanent_url, image_phash, details)
+    
+    if context.journal is not None:
+        context.journal.record(github_url, 'uploaded', s3_key=s3_key, permanent_url=permanent_url,
+                               media_type=media_type, details=details)
+    
+    print(f"  🔗 Permanent URL: {permanent_url}")
+    print(f"  📁 Media type: {media_type}")
+    return permanent_url, media_type
+
+
+def process_attachment(index, github_url, context, cancel_event=None):
+    """
+    Download one GitHub attachment and upload it to S3.
+    Returns a tuple of (permanent_url, media_type).
+    """
+    # Attachments uploaded by an earlier, failed run are replayed from the journal
+    replayed = replay_attachment(github_url, context)
+    if replayed is not None:
+        return replayed
+    
+    raise_if_cancelled(cancel_event)
+    if context.streaming:
+        probe = MediaProbe()
+        capture = bytearray() if context.keeps_source_bytes() else None
+        s3_key = stream_attachment_to_s3(
+            github_url, index, context.s3_client, context.bucket_name, context.part_size, context.key_scheme,
+            capture=capture, probe=probe
+        )
+        return finish_streamed_attachment(
+            github_url, s3_key, bytes(capture) if capture else None, probe.result, context, cancel_event
+        )
+    
+    # Download from GitHub (now returns content and detected extension)
+    file_content, detected_ext = download_from_github(github_url)
+    if context.journal is not None:
+        context.journal.record(github_url, 'downloaded', size=len(file_content), extension=detected_ext)
+    
+    # Extract filename from URL or generate one
+    filename = resolve_attachment_filename(github_url, detected_ext, index)
+    info = probe_bytes(file_content)
+    
+    # A recompressed or resized copy of a published photo reuses its URL
+    image_phash = None
+    if context.phash_index is not None and is_derivative_source(filename):
+        image_phash, duplicate = find_near_duplicate(file_content, context)
+        if duplicate is not None:
+            return reuse_near_duplicate(github_url, duplicate, context)
+    
+    # Upload to S3
+    raise_if_cancelled(cancel_event)
+    if context.key_scheme == 'content':
+        s3_key = upload_deduplicated(file_content, filename, context.s3_client, context.bucket_name)
+    else:
+        s3_key = upload_to_s3(file_content, filename, context.s3_client, context.bucket_name)
+    return finish_attachment(github_url, s3_key, file_content, info, context, cancel_event, image_phash)
+
+
+def process_attachments(attachments, context, workers=DEFAULT_WORKERS):
+    """
+    Process attachments with a bounded pool of worker threads.
+    
+    Downloads and uploads run in parallel, but each attachment's log output is
+    buffered and printed in attachment order, and url_mapping is built in the same
+    order as the attachments list. The first failure cancels every attachment that
+    has not started yet; the error is reported and the process exits with status 1.
+    
+    Returns url_mapping: dict of {github_url: (permanent_url, alt_text, media_type)}
+    """
+    total = len(attachments)
+    workers = max(1, min(workers, total))
+    cancel_event = threading.Event()
+    real_stdout = sys.stdout
+    log_capture = AttachmentLogCapture(real_stdout)
+    outcomes = {}
+    
+    def run(index, github_url):
+        log_capture.begin()
+        result, error = None, None
+        try:
+            print(f"\n📦 Processing attachment {index}/{total}")
+            result = process_attachment(index, github_url, context, cancel_event)
+        except AttachmentCancelled as e:
+            error = e
+        except Exception as e:
+            print(f"  ❌ Error processing attachment: {e}")
+            error = e
+            cancel_event.set()
+        return result, error, log_capture.end()
+    
+    print(f"⚙️  Processing {total} attachment(s) with {workers} worker(s)")
+    sys.stdout = log_capture
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(run, i, github_url): i
+                for i, (github_url, _) in enumerate(attachments, 1)
+            }
+            for future in as_completed(futures):
+                if future.cancelled():
+                    continue
+                outcomes[futures[future]] = future.result()
+                if cancel_event.is_set():
+                    for pending in futures:
+                        pending.cancel()
+    finally:
+        sys.stdout = real_stdout
+    
+    return collect_attachment_outcomes(attachments, outcomes)
+
+
+def collect_attachment_outcomes(attachments, outcomes):
+    """
+    Replay buffered logs and build url_mapping in attachment order.
+    
+    outcomes maps the 1-based attachment index to (result, error, log) for every
+    attachment that ran. Exits with status 1 if any attachment failed.
+    """
+    url_mapping = {}
+    failure = None
+    cancelled = 0
+    for i, (github_url, alt_text) in enumerate(attachments, 1):
+        if i not in outcomes:
+            cancelled += 1
+            continue
+        result, error, log = outcomes[i]
+        if isinstance(error, AttachmentCancelled):
+            cancelled += 1
+            continue
+        print(log, end='')
+        if error is not None:
+            failure = failure or error
+        elif result is not None:
+            permanent_url, media_type = result
+            url_mapping[github_url] = (permanent_url, alt_text, media_type)
+    
+    if failure is not None:
+        if cancelled:
+            print(f"\n⏹️  Cancelled {cancelled} remaining attachment(s) after the first failure")
+        print(f"❌ Error processing attachment: {failure}")
+        print_throttle_report()
+        sys.exit(1)
+    
+    return url_mapping
+
+
+def create_s3_client(endpoint_url, access_key, secret_key, max_pool_connections=10):
+    """Create the boto3 client for Linode Object Storage."""
+    # Extract region from endpoint URL (e.g., us-east-1 from us-east-1.linodeobjects.com)
+    parsed_endpoint = urlparse(endpoint_url)
+    region = parsed_endpoint.hostname.split('.')[0] if parsed_endpoint.hostname else 'us-east-1'
+    
+    # Configure boto3 for S3-compatible storage (Linode Object Storage)
+    # Using exact configuration from discord-publish-bot which is known to work
+    return boto3.client(
+        's3',
+        endpoint_url=endpoint_url,
+        aws_access_key_id=access_key,
+        aws_secret_access_key=secret_key,
+        region_name=region,
+        config=Config(
+            signature_version='s3v4',
+            s3={
+                'addressing_style': 'virtual'
+            },
+            max_pool_connections=max_pool_connections
+        )
+    )
+
+
+def load_mirror_targets(config, workers=DEFAULT_WORKERS, breaker_settings=None):
+    """
+    Build MirrorTargets from MEDIA_UPLOAD_MIRRORS: a JSON list, or the path of a JSON file.
+    
+    Each entry has a name, a kind ('s3', 'local' or 'memory') and "required": true|false
+    (default false, i.e. best-effort). S3 entries name the environment variables holding
+    their credentials, so no secret is written into the configuration:
+    
+        [{"name": "eu", "kind": "s3", "endpoint_url": "https://eu-central-1.linodeobjects.com",
+          "bucket": "media-eu", "access_key_env": "MIRROR_EU_KEY_ID",
+          "secret_key_env": "MIRROR_EU_SECRET", "custom_domain": "https://eu.cdn.example"},
+         {"name": "nas", "kind": "local", "dir": "/mnt/nas/media", "required": true}]
+    """
+    if not config:
+        return []
+    text = config.strip()
+    if not text.startswith('['):
+        with open(text, 'r', encoding='utf-8') as f:
+            text = f.read()
+    
+    targets = []
+    for entry in json.loads(text):
+        name = entry['name']
+        kind = entry.get('kind', 's3')
+        if kind == 's3':
+            endpoint_url = entry['endpoint_url']
+            client = create_s3_client(
+                endpoint_url,
+                os.environ.get(entry.get('access_key_env', ''), ''),
+                os.environ.get(entry.get('secret_key_env', ''), ''),
+                max_pool_connections=max(10, workers)
+            )
+            # Each mirror endpoint gets its own rate limiter and circuit breaker
+            guard = configure_host_guard(urlparse(endpoint_url).hostname or endpoint_url,
+                                         max_concurrency=workers, **(breaker_settings or {}))
+            backend = S3Backend(GuardedS3Client(client, guard), entry['bucket'], endpoint_url, entry.get('custom_domain'))
+            bucket_name = entry['bucket']
+        else:
+            backend = create_storage_backend(kind, base_url=entry.get('base_url'), local_dir=entry.get('dir'))
+            bucket_name = kind
+        targets.append(MirrorTarget(name, backend, bucket_name, bool(entry.get('required', False))))
+    return targets
+
+
 def main():
     if len(sys.argv) < 2:
         print("❌ Usage: python upload_media.py <issue-content-file>")
@@ -658,6 +2229,11 @@ def main():
     with open(content_file, 'r', encoding='utf-8') as f:
         content = f.read()
     
+    # A rerun after a successful rewrite has nothing left to do
+    if is_already_transformed(content):
+        print("✅ Content already contains :::media blocks and no attachments to upload; nothing to do")
+        sys.exit(0)
+    
     # Extract GitHub attachments
     print("🔍 Extracting GitHub attachments...")
     attachments = extract_github_attachments(content)
@@ -686,104 +2262,181 @@ def main():
             print("✅ Cleanup complete")
         
         # Write cleaned content back
-        with open(content_file, 'w', encoding='utf-8') as f:
-            f.write(cleaned_content)
+        write_text_atomic(content_file, cleaned_content)
         sys.exit(0)
     
     print(f"✅ Found {len(attachments)} GitHub attachment(s)")
     print(f"✅ Found {len(youtube_urls)} YouTube URL(s)")
     print(f"✅ Found {len(direct_media_urls)} direct media URL(s)")
     
+    # The same file linked twice is only downloaded and uploaded once
+    attachments, duplicate_attachments = collapse_duplicate_attachments(attachments)
+    if duplicate_attachments:
+        print(f"♻️  Collapsed {len(duplicate_attachments)} duplicate attachment link(s)")
+    
     # Process GitHub attachments (upload to S3)
     url_mapping = {}
+    media_details = {}
+    reused_photos = []
+    journal = None
     
     if attachments:
-        # Get S3 configuration from environment
-        access_key = os.environ.get('LINODE_STORAGE_ACCESS_KEY_ID')
-        secret_key = os.environ.get('LINODE_STORAGE_SECRET_ACCESS_KEY')
-        endpoint_url = os.environ.get('LINODE_STORAGE_ENDPOINT_URL')
-        bucket_name = os.environ.get('LINODE_STORAGE_BUCKET_NAME')
-        custom_domain = os.environ.get('LINODE_STORAGE_CUSTOM_DOMAIN')
+        workers = max(1, env_int('MEDIA_UPLOAD_WORKERS', DEFAULT_WORKERS))
+        
+        # Per-host rate limiting and circuit breaking for GitHub and Object Storage
+        breaker_settings = {
+            'failure_threshold': env_int('MEDIA_UPLOAD_BREAKER_THRESHOLD', DEFAULT_FAILURE_THRESHOLD),
+            'cooldown': env_float('MEDIA_UPLOAD_BREAKER_COOLDOWN', DEFAULT_COOLDOWN),
+        }
+        configure_host_guard(
+            'github.com',
+            rate=env_float('MEDIA_UPLOAD_GITHUB_RPS', DEFAULT_RATE),
+            max_concurrency=workers,
+            **breaker_settings
+        )
+        
+        storage_kind = os.environ.get('MEDIA_UPLOAD_STORAGE', 's3').strip().lower()
+        if storage_kind == 's3':
+            # Get S3 configuration from environment
+            access_key = os.environ.get('LINODE_STORAGE_ACCESS_KEY_ID')
+            secret_key = os.environ.get('LINODE_STORAGE_SECRET_ACCESS_KEY')
+            endpoint_url = os.environ.get('LINODE_STORAGE_ENDPOINT_URL')
+            bucket_name = os.environ.get('LINODE_STORAGE_BUCKET_NAME')
+            custom_domain = os.environ.get('LINODE_STORAGE_CUSTOM_DOMAIN')
+            
+            if not all([access_key, secret_key, endpoint_url, bucket_name]):
+                print("❌ Missing required environment variables:")
+                print("   - LINODE_STORAGE_ACCESS_KEY_ID")
+                print("   - LINODE_STORAGE_SECRET_ACCESS_KEY")
+                print("   - LINODE_STORAGE_ENDPOINT_URL")
+                print("   - LINODE_STORAGE_BUCKET_NAME")
+                sys.exit(1)
+            
+            # Initialize S3 client
+            print("🔧 Initializing S3 client...")
+            parsed_endpoint = urlparse(endpoint_url)
+            s3_client = create_s3_client(
+                endpoint_url, access_key, secret_key,
+                # One pooled connection per concurrent transfer
+                max_pool_connections=max(10, workers, env_int('MEDIA_UPLOAD_MAX_REQUESTS', 16))
+            )
+            s3_client = GuardedS3Client(s3_client, configure_host_guard(
+                parsed_endpoint.hostname or endpoint_url,
+                rate=env_float('MEDIA_UPLOAD_S3_RPS', DEFAULT_RATE),
+                max_concurrency=max(workers, env_int('MEDIA_UPLOAD_MAX_REQUESTS', 16)),
+                **breaker_settings
+            ))
+            storage = S3Backend(s3_client, bucket_name, endpoint_url, custom_domain)
+        else:
+            # Offline backends for previews, CI and benchmarks; no credentials needed
+            try:
+                storage = create_storage_backend(
+                    storage_kind,
+                    base_url=os.environ.get('MEDIA_UPLOAD_BASE_URL'),
+                    local_dir=os.environ.get('MEDIA_UPLOAD_LOCAL_DIR'),
+                )
+            except ValueError as e:
+                print(f"❌ {e}")
+                sys.exit(1)
+            bucket_name, endpoint_url, custom_domain = storage_kind, storage.base_url, None
+            print(f"🗄️  Using {storage_kind} storage backend ({storage.base_url})")
         
-        if not all([access_key, secret_key, endpoint_url, bucket_name]):
-            print("❌ Missing required environment variables:")
-            print("   - LINODE_STORAGE_ACCESS_KEY_ID")
-            print("   - LINODE_STORAGE_SECRET_ACCESS_KEY")
-            print("   - LINODE_STORAGE_ENDPOINT_URL")
-            print("   - LINODE_STORAGE_BUCKET_NAME")
+        # Optional mirrors receive every object at the same time as the primary target
+        try:
+            mirrors = load_mirror_targets(os.environ.get('MEDIA_UPLOAD_MIRRORS'), workers, breaker_settings)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"❌ Invalid MEDIA_UPLOAD_MIRRORS configuration: {e}")
             sys.exit(1)
+        if mirrors:
+            # Key -> {target: URL}, so the site can switch CDN origin without re-uploading
+            manifest_path = os.environ.get('MEDIA_UPLOAD_REPLICA_MANIFEST') or content_file + '.replicas.json'
+            storage = MirroredStorage(MirrorTarget('primary', storage, bucket_name), mirrors, manifest_path=manifest_path)
+            print(f"🪞 Mirroring uploads to {len(mirrors)} target(s): " + ', '.join(
+                f"{m.name} ({'required' if m.required else 'best-effort'})" for m in mirrors))
         
-        # Initialize S3 client
-        print("🔧 Initializing S3 client...")
+        # Clean up multipart uploads left behind by crashed runs (best effort)
+        stale_hours = env_int('MEDIA_UPLOAD_ABORT_STALE_HOURS', DEFAULT_STALE_UPLOAD_HOURS)
+        if stale_hours > 0:
+            try:
+                abort_stale_multipart_uploads(storage, bucket_name, 'files/', stale_hours)
+            except Exception as e:
+                print(f"⚠️  Could not check for stale multipart uploads: {e}")
         
-        # Extract region from endpoint URL (e.g., us-east-1 from us-east-1.linodeobjects.com)
-        parsed_endpoint = urlparse(endpoint_url)
-        region = parsed_endpoint.hostname.split('.')[0] if parsed_endpoint.hostname else 'us-east-1'
+        # Progress journal (next to the content file, or in MEDIA_UPLOAD_JOURNAL_DIR), so a rerun
+        # resumes where this one stops
+        journal = RunJournal.for_run(content_file, target=f"{endpoint_url}/{bucket_name}")
         
-        # Configure boto3 for S3-compatible storage (Linode Object Storage)
-        # Using exact configuration from discord-publish-bot which is known to work
-        s3_client = boto3.client(
-            's3',
+        context = UploadContext(
+            s3_client=storage,
+            bucket_name=bucket_name,
             endpoint_url=endpoint_url,
-            aws_access_key_id=access_key,
-            aws_secret_access_key=secret_key,
-            region_name=region,
-            config=Config(
-                signature_version='s3v4',
-                s3={
-                    'addressing_style': 'virtual'
-                }
-            )
+            custom_domain=custom_domain,
+            # Streaming mode pipes downloads straight into multipart uploads
+            streaming=env_flag('MEDIA_UPLOAD_STREAMING'),
+            part_size=max(MIN_PART_SIZE, env_int('MEDIA_UPLOAD_PART_SIZE_MB', DEFAULT_PART_SIZE // (1024 * 1024)) * 1024 * 1024),
+            key_scheme=get_key_scheme(),
+            journal=journal,
+            variant_widths=get_variant_widths(),
+            convert_animations=env_flag('MEDIA_UPLOAD_CONVERT_GIFS'),
+            placeholders=env_flag('MEDIA_UPLOAD_PLACEHOLDERS'),
+            phash_index=get_phash_index(),
+            phash_distance=env_int('MEDIA_UPLOAD_PHASH_DISTANCE', DEFAULT_MAX_DISTANCE),
         )
+        if context.variant_widths:
+            formats = available_formats()
+            if formats:
+                print(f"🖼️  Responsive image variants: {'/'.join(formats)} at "
+                      f"{', '.join(str(w) for w in context.variant_widths)}px")
+            else:
+                print("⚠️  Pillow is not installed; skipping responsive image variants")
+                context.variant_widths = ()
+        if context.convert_animations:
+            formats = available_animation_formats()
+            if formats:
+                print(f"🎞️  Animated GIFs converted to: {'/'.join(formats)}")
+            else:
+                print("⚠️  Neither Pillow nor ffmpeg is installed; animated GIFs are uploaded as they are")
+                context.convert_animations = False
+        if context.placeholders and not placeholders_available():
+            print("⚠️  NumPy or Pillow is not installed; skipping BlurHash placeholders")
+            context.placeholders = False
+        if context.phash_index is not None:
+            print(f"🔎 Near-duplicate photos reuse published URLs ({len(context.phash_index)} image(s) in "
+                  f"{context.phash_index.path}, up to {context.phash_distance} bit(s) apart)")
+        if context.streaming:
+            print(f"🌊 Streaming mode enabled (part size {context.part_size // (1024 * 1024)} MiB)")
+        if context.key_scheme == 'content':
+            print("#️⃣  Content-addressed keys enabled; files already in the bucket are reused")
+            if get_media_inventory() is not None:
+                print(f"🗂️  Checking for existing objects in {os.environ['MEDIA_UPLOAD_INVENTORY']} instead of HEAD requests")
         
-        # Process each attachment
-        for i, (github_url, alt_text) in enumerate(attachments, 1):
-            print(f"\n📦 Processing attachment {i}/{len(attachments)}")
-            
-            try:
-                # Download from GitHub (now returns content and detected extension)
-                file_content, detected_ext = download_from_github(github_url)
-                
-                # Extract filename from URL or generate one
-                parsed_url = urlparse(github_url)
-                path_parts = parsed_url.path.split('/')
-                base_filename = path_parts[-1] if path_parts else f'attachment-{i}'
-                
-                # If filename doesn't have extension, use detected extension
-                if '.' not in base_filename:
-                    if detected_ext:
-                        filename = base_filename + detected_ext
-                        print(f"  ✅ Using detected extension: {detected_ext}")
-                    else:
-                        # Only default to .jpg if detection completely failed
-                        filename = base_filename + '.jpg'
-                        print(f"  ⚠️  No extension detected, defaulting to .jpg")
-                else:
-                    filename = base_filename
-                
-                # Upload to S3
-                s3_key = upload_to_s3(file_content, filename, s3_client, bucket_name)
-                
-                # Generate permanent URL
-                permanent_url = generate_permanent_url(s3_key, endpoint_url, bucket_name, custom_domain)
-                
-                # Determine media type from S3 key
-                if '/images/' in s3_key:
-                    media_type = 'image'
-                elif '/videos/' in s3_key:
-                    media_type = 'video'
-                elif '/audio/' in s3_key:
-                    media_type = 'audio'
-                else:
-                    media_type = 'file'
-                
-                url_mapping[github_url] = (permanent_url, alt_text, media_type)
-                print(f"  🔗 Permanent URL: {permanent_url}")
-                print(f"  📁 Media type: {media_type}")
-                
-            except Exception as e:
-                print(f"  ❌ Error processing attachment: {e}")
-                sys.exit(1)
+        # Process attachments in parallel; output and mapping stay in attachment order
+        engine = os.environ.get('MEDIA_UPLOAD_ENGINE', 'threads').strip().lower()
+        if engine == 'async':
+            # Imported lazily so the threaded path has no dependency on the async engine
+            from upload_media_async import run_async_engine
+            url_mapping = run_async_engine(
+                attachments,
+                context,
+                max_requests=env_int('MEDIA_UPLOAD_MAX_REQUESTS', 16),
+                max_inflight_bytes=env_int('MEDIA_UPLOAD_MAX_INFLIGHT_MB', 256) * 1024 * 1024,
+            )
+        else:
+            url_mapping = process_attachments(attachments, context, workers)
+        
+        url_mapping = expand_duplicate_attachments(url_mapping, duplicate_attachments)
+        media_details = context.media_details
+        reused_photos = context.reused_photos
+        shutdown_image_pool()
+        
+        if isinstance(storage, MirroredStorage):
+            print(f"🪞 Recorded replicas for {len(storage.replicas)} object(s) in {storage.manifest_path}")
+            for key, failures in storage.failures.items():
+                print(f"  ⚠️  {key} missing on best-effort mirror(s): {', '.join(sorted(failures))}")
+    
+    if direct_media_urls and env_flag('MEDIA_UPLOAD_PROBE_REMOTE'):
+        print("\n📐 Probing linked videos and audio...")
+        media_details = {**probe_remote_media(direct_media_urls), **media_details}
     
     # Transform content to use permanent URLs and preserve positions
     print("\n🔄 Transforming content...")
@@ -793,7 +2446,9 @@ def main():
         print(f"  - {gh_url[:80]}...")
     
     try:
-        final_content = transform_content_preserving_positions(content, url_mapping, youtube_urls, direct_media_urls)
+        final_content = transform_content_preserving_positions(
+            content, url_mapping, youtube_urls, direct_media_urls, media_details
+        )
         print(f"📝 DEBUG: Transformation completed successfully")
     except Exception as e:
         print(f"❌ ERROR during transformation: {e}")
@@ -812,35 +2467,24 @@ def main():
         print(f"📝 DEBUG: Last 500 chars of transformed content:")
         print(final_content[-500:])
     
-    # Write transformed content back
+    # Write transformed content back atomically (temp file + rename), so a crash
+    # never leaves a half-written content file behind
     try:
-        with open(content_file, 'w', encoding='utf-8') as f:
-            f.write(final_content)
-        print(f"📝 DEBUG: File write completed")
+        write_text_atomic(content_file, final_content)
+        print(f"📝 DEBUG: File written atomically, {len(final_content)} chars, "
+              f"{final_content.count(':::media')} media block(s)")
     except Exception as e:
         print(f"❌ ERROR writing file: {e}")
         import traceback
         traceback.print_exc()
         sys.exit(1)
     
-    # Verify file was written
-    try:
-        with open(content_file, 'r', encoding='utf-8') as f:
-            written_content = f.read()
-        
-        print(f"📝 DEBUG: File written successfully, length: {len(written_content)} chars")
-        print(f"📝 DEBUG: Media blocks in written file: {written_content.count(':::media')}")
-        
-        if len(written_content) != len(final_content):
-            print(f"⚠️  WARNING: File length mismatch! Expected {len(final_content)}, got {len(written_content)}")
-        
-        if written_content != final_content:
-            print(f"⚠️  WARNING: File content doesn't match transformed content!")
-    except Exception as e:
-        print(f"❌ ERROR verifying file: {e}")
-        import traceback
-        traceback.print_exc()
-        sys.exit(1)
+    # Everything is in the content file now; only a cached journal is still needed (reopened issues)
+    if journal is not None:
+        if journal.replayed:
+            print(f"📒 Replayed {journal.replayed} attachment(s) from the run journal")
+        if not journal.persistent:
+            journal.remove()
     
     print("\n✅ Media upload and transformation complete!")
     print(f"📊 Uploaded {len(url_mapping)} file(s) to S3")
@@ -848,6 +2492,15 @@ def main():
     print(f"📊 Created {len(direct_media_urls)} media block(s) for direct URLs")
     print(f"📊 All media items replaced in-place, preserving original positions")
     print(f"📄 Transformed content written to: {content_file}")
+    report_reused_photos(reused_photos)
+    
+    # Throttle counters for tuning worker counts from real runs
+    print_throttle_report()
+    metrics_file = os.environ.get('MEDIA_UPLOAD_METRICS_FILE')
+    if metrics_file:
+        with open(metrics_file, 'w', encoding='utf-8') as f:
+            json.dump(throttle_report(), f, indent=2)
+        print(f"📈 Throttle counters written to: {metrics_file}")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,527 @@
+#!/usr/bin/env python3
+"""
+Asyncio Media Pipeline Engine for upload_media.py
+
+Runs the attachment pipeline (download, type sniffing, upload) as coroutines so a
+single process can keep dozens of transfers in flight during backfills without a
+thread per transfer. Two semaphores bound the work:
+- a request semaphore limits the number of attachments transferring at once
+- a byte budget limits how many bytes are buffered in memory across all transfers
+
+Downloads use httpx.AsyncClient when it is installed. With MEDIA_UPLOAD_HTTP2=true
+and the h2 package available, attachments share multiplexed HTTP/2 connections
+instead of one connection per transfer. They follow the same rules as the threaded
+pipeline: the download cache, Range resumes and the per-host rate limiter and
+circuit breaker. boto3 has no asyncio API, so each S3 request is a short blocking
+call run with asyncio.to_thread; the number of those in flight is bounded by the
+same request semaphore.
+
+Only the transfer is async. Journal replays and every stage after the upload
+(variants, placeholders, GIF conversion, near-duplicates) are the functions the
+threaded pipeline uses, run in worker threads that keep the attachment's log.
+
+Usage:
+    MEDIA_UPLOAD_ENGINE=async python upload_media.py <issue-content-file>
+"""
+
+import sys
+import asyncio
+import hashlib
+import os
+import tempfile
+import threading
+from urllib.parse import urlparse
+
+from media_animation import is_animation_source
+from media_cache import get_download_cache
+from media_faststart import SPOOL_CHUNK_SIZE, faststart_file, needs_faststart
+from media_images import MAX_OPTIMIZE_SIZE, optimize_photo
+from media_probe import MediaProbe
+from media_throttle import classify_http_response, get_host_guard
+from upload_media import (
+    DEFAULT_HTTP_RETRIES,
+    DEFAULT_MAX_RESUMES,
+    DEFAULT_PART_SIZE,
+    HTTP_TIMEOUT,
+    SNIFF_SIZE,
+    STREAM_CHUNK_SIZE,
+    AttachmentCancelled,
+    AttachmentLogCapture,
+    ResumableDownload,
+    build_content_s3_key,
+    build_s3_key,
+    build_staging_s3_key,
+    collect_attachment_outcomes,
+    content_md5,
+    env_flag,
+    env_int,
+    faststart_enabled,
+    finish_streamed_attachment,
+    is_derivative_source,
+    object_headers,
+    optimize_enabled,
+    process_attachment,
+    promote_staged_object,
+    raise_if_cancelled,
+    replay_attachment,
+    resolve_attachment_filename,
+    sniff_extension,
+    stream_attachment_to_s3,
+)
+
+try:
+    import httpx
+    ASYNC_RESUMABLE_ERRORS = (httpx.TransportError,)
+except ImportError:  # Optional dependency; fall back to the threaded pipeline per attachment
+    httpx = None
+    ASYNC_RESUMABLE_ERRORS = ()
+
+try:
+    import h2  # noqa: F401 - only needed to enable httpx's HTTP/2 support
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class ByteBudget:
+    """
+    Async semaphore measured in bytes.
+
+    acquire(n) waits until n more bytes fit under the limit. A single request larger
+    than the whole budget is let through once nothing else is in flight, so an
+    oversized part can never deadlock the pipeline.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self, size):
+        async with self._condition:
+            await self._condition.wait_for(
+                lambda: self.in_flight + size <= self.limit or self.in_flight == 0
+            )
+            self.in_flight += size
+
+    async def release(self, size):
+        async with self._condition:
+            self.in_flight -= size
+            self._condition.notify_all()
+
+
+class AsyncResumableDownload(ResumableDownload):
+    """
+    ResumableDownload over an httpx.AsyncClient.
+
+    Interrupted bodies resume with the same Range/If-Range rules, and every request
+    goes through the host's rate limiter and circuit breaker. Create one with
+    `await AsyncResumableDownload.open(...)` and read it with `async for`.
+    """
+
+    def __init__(self, url, client, start=0, end=None, validator=None,
+                 chunk_size=STREAM_CHUNK_SIZE, max_resumes=DEFAULT_MAX_RESUMES):
+        self._setup(url, start, end, validator, chunk_size, max_resumes)
+        self.client = client
+
+    @classmethod
+    async def open(cls, url, client, **settings):
+        download = cls(url, client, **settings)
+        download._opened(await download._open_async())
+        return download
+
+    async def _open_async(self):
+        request = self.client.build_request('GET', self.url, headers=self._request_headers())
+        guard = get_host_guard(urlparse(self.url).hostname)
+        response = await guard.call_async(
+            lambda: self.client.send(request, stream=True), classify_http_response, hold=True
+        )
+        try:
+            self._check_response(response)
+        except Exception:
+            await response.aclose()
+            raise
+        return response
+
+    async def __aiter__(self):
+        while True:
+            try:
+                async for chunk in self.response.aiter_bytes(chunk_size=self.chunk_size):
+                    chunk = self._trim(chunk)
+                    if chunk:
+                        yield chunk
+                    if self.end is not None and self.offset > self.end:
+                        break
+                interruption = self._interruption()
+                if interruption is None:
+                    await self.response.aclose()
+                    return
+            except ASYNC_RESUMABLE_ERRORS as e:
+                interruption = e
+
+            await self.response.aclose()
+            self._count_resume(interruption)
+            self.response = await self._open_async()
+
+    async def aclose(self):
+        await self.response.aclose()
+
+
+async def upload_stream_to_s3_async(chunks, s3_key, s3_client, bucket_name, byte_budget, part_size=DEFAULT_PART_SIZE):
+    """
+    Async counterpart of upload_media.upload_stream_to_s3.
+
+    Consumes an async iterator of byte chunks, reserving part_size bytes from the
+    shared byte budget for each part buffer before filling it.
+
+    Returns the total number of bytes uploaded.
+    """
+    buffer = bytearray()
+    total_bytes = 0
+    upload_id = None
+    parts = []
+    reserved = 0
+
+    async def call(method, **kwargs):
+        return await asyncio.to_thread(method, **kwargs)
+
+    async def send_part(data):
+        part_number = len(parts) + 1
+        response = await call(
+            s3_client.upload_part,
+            Bucket=bucket_name,
+            Key=s3_key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            Body=data,
+            ContentMD5=content_md5(data)
+        )
+        parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+        print(f"  📦 Uploaded part {part_number} ({len(data)} bytes)")
+
+    try:
+        await byte_budget.acquire(part_size)
+        reserved = part_size
+
+        async for chunk in chunks:
+            if not chunk:
+                continue
+            total_bytes += len(chunk)
+            buffer += chunk
+
+            while len(buffer) >= part_size:
+                if upload_id is None:
+                    response = await call(
+                        s3_client.create_multipart_upload,
+                        Bucket=bucket_name,
+                        Key=s3_key,
+                        ACL='public-read',  # Make file publicly accessible
+                        **object_headers(s3_key)
+                    )
+                    upload_id = response['UploadId']
+                    print(f"  🧩 Started multipart upload (part size {part_size} bytes)")
+                part = bytes(buffer[:part_size])
+                del buffer[:part_size]
+                await send_part(part)
+
+        if upload_id is None:
+            data = bytes(buffer)
+            await call(
+                s3_client.put_object,
+                Bucket=bucket_name,
+                Key=s3_key,
+                Body=data,
+                ContentMD5=content_md5(data),
+                ACL='public-read',  # Make file publicly accessible
+                **object_headers(s3_key)
+            )
+        else:
+            if buffer:
+                await send_part(bytes(buffer))
+            await call(
+                s3_client.complete_multipart_upload,
+                Bucket=bucket_name,
+                Key=s3_key,
+                UploadId=upload_id,
+                MultipartUpload={'Parts': parts}
+            )
+    except (Exception, asyncio.CancelledError):
+        if upload_id is not None:
+            print(f"  🧹 Aborting multipart upload for {s3_key}")
+            try:
+                await call(s3_client.abort_multipart_upload, Bucket=bucket_name, Key=s3_key, UploadId=upload_id)
+            except Exception as abort_error:
+                print(f"  ⚠️  Could not abort multipart upload: {abort_error}")
+        raise
+    finally:
+        if reserved:
+            await byte_budget.release(reserved)
+
+    return total_bytes
+
+
+async def faststart_async(chunks):
+    """
+    Spool a video whose moov comes last to a temp file, move moov to the front
+    (memory-mapped, in a worker thread) and stream the rewritten file back out.
+    """
+    with tempfile.TemporaryFile() as spool:
+        async for chunk in chunks:
+            spool.write(chunk)
+        await asyncio.to_thread(faststart_file, spool)
+        spool.seek(0)
+        while True:
+            chunk = await asyncio.to_thread(spool.read, SPOOL_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+async def optimize_async(chunks, extension):
+    """
+    Collect a photo and optimize it in the image process pool (see optimize_photo);
+    files over MAX_OPTIMIZE_SIZE pass through as they arrive.
+    """
+    buffered = bytearray()
+    async for chunk in chunks:
+        buffered += chunk
+        if len(buffered) > MAX_OPTIMIZE_SIZE:
+            yield bytes(buffered)
+            async for rest in chunks:
+                yield rest
+            return
+    if buffered:
+        yield await asyncio.to_thread(optimize_photo, bytes(buffered), extension)
+
+
+async def stream_attachment_to_s3_async(github_url, index, context, http_client, byte_budget, capture=None, probe=None):
+    """
+    Async counterpart of upload_media.stream_attachment_to_s3.
+
+    Sniffs the type from the first bytes, then pipes the rest of the download into
+    upload_stream_to_s3_async while it arrives, copying it into the download cache
+    on the way. Cached attachments are read from disk by the threaded function.
+
+    Returns the S3 key where the file was uploaded.
+    """
+    cache = get_download_cache()
+    if cache is not None and cache.lookup_url(github_url) is not None:
+        await byte_budget.acquire(context.part_size)
+        try:
+            return await asyncio.to_thread(
+                stream_attachment_to_s3, github_url, index, context.s3_client, context.bucket_name,
+                context.part_size, context.key_scheme, capture, probe
+            )
+        finally:
+            await byte_budget.release(context.part_size)
+
+    content_keys = context.key_scheme == 'content'
+    print(f"  📥 Streaming from: {github_url}")
+    download = await AsyncResumableDownload.open(
+        github_url, http_client, max_resumes=env_int('MEDIA_UPLOAD_MAX_RESUMES', DEFAULT_MAX_RESUMES)
+    )
+    cache_file, cache_temp_path = cache.new_temp_file() if cache is not None else (None, None)
+    try:
+        chunks = download.__aiter__()
+
+        # Read just enough of the body to sniff the file type
+        head = bytearray()
+        async for chunk in chunks:
+            head += chunk
+            if len(head) >= SNIFF_SIZE:
+                break
+
+        detected_ext = sniff_extension(download.content_type, bytes(head))
+        filename = resolve_attachment_filename(github_url, detected_ext, index)
+        # Content-addressed keys need the whole hash, so stream to a staging key first
+        s3_key = build_staging_s3_key(filename) if content_keys else build_s3_key(filename)
+        keep = capture if capture is not None and (is_derivative_source(filename) or is_animation_source(filename)) else None
+        sha256 = hashlib.sha256()
+
+        print(f"  📤 Streaming to S3: {s3_key}")
+
+        async def source():
+            yield bytes(head)
+            async for chunk in chunks:
+                yield chunk
+
+        stream = source()
+        if faststart_enabled(detected_ext) and needs_faststart(bytes(head)):
+            stream = faststart_async(stream)
+        elif optimize_enabled(detected_ext):
+            stream = optimize_async(stream, detected_ext)
+
+        async def body():
+            async for chunk in stream:
+                sha256.update(chunk)
+                if cache_file is not None:
+                    cache_file.write(chunk)
+                if keep is not None:
+                    keep.extend(chunk)
+                if probe is not None and not probe.done:
+                    probe.feed(chunk)
+                yield chunk
+
+        total_bytes = await upload_stream_to_s3_async(
+            body(), s3_key, context.s3_client, context.bucket_name, byte_budget, context.part_size
+        )
+
+        if cache_file is not None:
+            cache_file.close()
+            cache.commit_file(github_url, cache_temp_path, sha256.hexdigest(), detected_ext, download.content_type)
+            cache_temp_path = None
+        if probe is not None:
+            probe.finish()
+    finally:
+        await download.aclose()
+        if cache_file is not None:
+            cache_file.close()
+            if cache_temp_path is not None and os.path.exists(cache_temp_path):
+                os.remove(cache_temp_path)
+
+    print(f"  ✅ Streamed {total_bytes} bytes (sha256 {sha256.hexdigest()[:16]}...)")
+    if content_keys:
+        s3_key = await asyncio.to_thread(
+            promote_staged_object, context.s3_client, context.bucket_name, s3_key,
+            build_content_s3_key(filename, sha256.hexdigest()), total_bytes
+        )
+    return s3_key
+
+
+async def process_attachment_async(index, github_url, context, http_client, byte_budget, cancel_event=None):
+    """
+    Stream one GitHub attachment into S3 as a coroutine, then run the threaded
+    pipeline's post-upload stages in a worker thread.
+    Returns a tuple of (permanent_url, media_type).
+    """
+    replayed = replay_attachment(github_url, context)
+    if replayed is not None:
+        return replayed
+
+    raise_if_cancelled(cancel_event)
+    probe = MediaProbe()
+    capture = bytearray() if context.keeps_source_bytes() else None
+    s3_key = await stream_attachment_to_s3_async(
+        github_url, index, context, http_client, byte_budget, capture=capture, probe=probe
+    )
+    return await asyncio.to_thread(
+        finish_streamed_attachment, github_url, s3_key, bytes(capture) if capture else None, probe.result,
+        context, cancel_event
+    )
+
+
+async def process_attachments_async(attachments, context, max_requests=16, max_inflight_bytes=256 * 1024 * 1024, http_client=None):
+    """
+    Process every attachment as a coroutine, bounded by max_requests concurrent
+    transfers and max_inflight_bytes of buffered data.
+
+    An existing httpx.AsyncClient can be passed as http_client; otherwise one is
+    created for the run when httpx is installed.
+
+    Returns outcomes: dict of {index: (result, error, log)} for collect_attachment_outcomes.
+    """
+    total = len(attachments)
+    request_semaphore = asyncio.Semaphore(max(1, max_requests))
+    byte_budget = ByteBudget(max(context.part_size, max_inflight_bytes))
+    # Stops stages already running in worker threads, which task cancellation cannot reach
+    cancel_event = threading.Event()
+    real_stdout = sys.stdout
+    log_capture = AttachmentLogCapture(real_stdout)
+    outcomes = {}
+
+    if http_client is None and httpx is None:
+        print("⚠️  httpx is not installed; async engine will run the threaded pipeline per attachment")
+    print(f"⚡ Async engine: {total} attachment(s), up to {max_requests} transfer(s) and "
+          f"{byte_budget.limit // (1024 * 1024)} MiB in flight")
+
+    async def run(index, github_url, http_client):
+        log_capture.begin()
+        result, error = None, None
+        try:
+            async with request_semaphore:
+                print(f"\n📦 Processing attachment {index}/{total}")
+                if http_client is not None:
+                    result = await process_attachment_async(
+                        index, github_url, context, http_client, byte_budget, cancel_event
+                    )
+                else:
+                    result = await asyncio.to_thread(process_attachment, index, github_url, context, cancel_event)
+        except (asyncio.CancelledError, AttachmentCancelled):
+            error = AttachmentCancelled("cancelled after an earlier failure")
+        except Exception as e:
+            print(f"  ❌ Error processing attachment: {e}")
+            error = e
+            cancel_event.set()
+        outcomes[index] = (result, error, log_capture.end())
+        return error
+
+    async def run_all(http_client):
+        tasks = [
+            asyncio.create_task(run(i, github_url, http_client))
+            for i, (github_url, _) in enumerate(attachments, 1)
+        ]
+        for finished in asyncio.as_completed(tasks):
+            error = await finished
+            if error is not None and not isinstance(error, AttachmentCancelled):
+                # First failure cancels everything still running or waiting
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                break
+
+    sys.stdout = log_capture
+    try:
+        if http_client is not None:
+            await run_all(http_client)
+        elif httpx is not None:
+            async with build_async_http_client(max_requests) as http_client:
+                await run_all(http_client)
+        else:
+            await run_all(None)
+    finally:
+        sys.stdout = real_stdout
+
+    return outcomes
+
+
+def build_async_http_client(max_requests=16):
+    """
+    Build the shared httpx.AsyncClient for the async engine.
+    
+    Keeps up to max_requests pooled keep-alive connections, retries failed
+    connection attempts, and negotiates HTTP/2 when MEDIA_UPLOAD_HTTP2 is set and
+    the h2 package is installed.
+    """
+    http2 = env_flag('MEDIA_UPLOAD_HTTP2') and HTTP2_AVAILABLE
+    if env_flag('MEDIA_UPLOAD_HTTP2') and not HTTP2_AVAILABLE:
+        print("⚠️  MEDIA_UPLOAD_HTTP2 is set but the h2 package is not installed; using HTTP/1.1")
+    limits = httpx.Limits(max_connections=max(1, max_requests), max_keepalive_connections=max(1, max_requests))
+    transport = httpx.AsyncHTTPTransport(
+        http2=http2,
+        limits=limits,
+        retries=max(0, env_int('MEDIA_UPLOAD_HTTP_RETRIES', DEFAULT_HTTP_RETRIES))
+    )
+    connect_timeout, read_timeout = HTTP_TIMEOUT
+    return httpx.AsyncClient(
+        transport=transport,
+        follow_redirects=True,
+        timeout=httpx.Timeout(read_timeout, connect=connect_timeout)
+    )
+
+
+def run_async_engine(attachments, context, max_requests=16, max_inflight_bytes=256 * 1024 * 1024):
+    """
+    Entry point used by upload_media.main() when MEDIA_UPLOAD_ENGINE=async.
+
+    Returns url_mapping: dict of {github_url: (permanent_url, alt_text, media_type)},
+    or exits with status 1 on the first failure, matching the threaded pipeline.
+    """
+    outcomes = asyncio.run(process_attachments_async(attachments, context, max_requests, max_inflight_bytes))
+    return collect_attachment_outcomes(attachments, outcomes)
+
+
+if __name__ == '__main__':
+    import upload_media
+
+    os.environ['MEDIA_UPLOAD_ENGINE'] = 'async'
+    upload_media.main()
@@ -39,23 +39,32 @@ module MediaRenderer =
     let renderMediaItem (item: MediaItem) =
         let mediaElement =
             match item.media_type.ToLower() with
+            | "image" | "video" when HtmlHelpers.isAnimation item ->
+                HtmlHelpers.animation item item.alt_text
             | "image" ->
                 Html.selfClosingElement "img" 
                     (Html.attribute "src" item.uri + 
                      Html.attribute "alt" item.alt_text +
+                     HtmlHelpers.dimensions item +
+                     HtmlHelpers.placeholder item +
                      Html.attribute "class" "media-image")
+                |> HtmlHelpers.responsiveImage item
             | "video" ->
                 Html.element "video" 
                     (Html.attribute "src" item.uri + 
                      Html.attribute "controls" "controls" +
+                     HtmlHelpers.dimensions item +
                      Html.attribute "class" "media-video")
                     item.alt_text
+                + HtmlHelpers.duration item
             | "audio" ->
+                HtmlHelpers.poster item item.alt_text +
                 Html.element "audio"
                     (Html.attribute "src" item.uri +
                      Html.attribute "controls" "controls" +
                      Html.attribute "class" "media-audio")
                     item.alt_text
+                + HtmlHelpers.duration item
             | _ ->
                 Html.element "a"
                     (Html.attribute "href" item.uri +
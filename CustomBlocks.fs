@@ -24,6 +24,34 @@ type MediaItem = {
     caption: string
     [<YamlDotNet.Serialization.YamlMember(Alias="aspectRatio")>]
     aspect: string
+    // Intrinsic size in pixels (0 when unknown), so browsers can reserve space before loading
+    [<YamlDotNet.Serialization.YamlMember(Alias="width")>]
+    width: int
+    [<YamlDotNet.Serialization.YamlMember(Alias="height")>]
+    height: int
+    // Responsive image variants written by upload_media.py ("url 480w, url 960w")
+    [<YamlDotNet.Serialization.YamlMember(Alias="srcsetAvif")>]
+    srcset_avif: string
+    [<YamlDotNet.Serialization.YamlMember(Alias="srcsetWebp")>]
+    srcset_webp: string
+    [<YamlDotNet.Serialization.YamlMember(Alias="sizes")>]
+    sizes: string
+    // Video/audio length in seconds and RFC 6381 codecs, read from the moov box (0/empty when unknown)
+    [<YamlDotNet.Serialization.YamlMember(Alias="duration")>]
+    duration: float
+    [<YamlDotNet.Serialization.YamlMember(Alias="codecs")>]
+    codecs: string
+    // Audio bitrate in kbps and a WebP poster cut from embedded cover art (0/empty when unknown)
+    [<YamlDotNet.Serialization.YamlMember(Alias="bitrate")>]
+    bitrate: int
+    [<YamlDotNet.Serialization.YamlMember(Alias="poster")>]
+    poster: string
+    // Original GIF of an animation converted to animated WebP or MP4 (empty otherwise)
+    [<YamlDotNet.Serialization.YamlMember(Alias="fallback")>]
+    fallback: string
+    // BlurHash of the image, painted as a placeholder until it loads (empty when unknown)
+    [<YamlDotNet.Serialization.YamlMember(Alias="blurhash")>]
+    blurhash: string
 }
 
 // Base review data with common fields across all review types
@@ -394,6 +422,90 @@ module internal HtmlHelpers =
     let selfClosingElement tag attributes =
         sprintf "<%s%s />" tag attributes
 
+    /// width/height attributes for an item with known dimensions, otherwise empty
+    let dimensions (item: MediaItem) =
+        if item.width > 0 && item.height > 0 then
+            attribute "width" (string item.width) + attribute "height" (string item.height)
+        else ""
+
+    let private base83Alphabet = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+
+    /// Average color of a BlurHash (characters 2-5 hold the DC component as sRGB), e.g. "#7a6f5c"
+    let blurhashAverageColor (hash: string) =
+        if String.IsNullOrWhiteSpace(hash) || hash.Length < 6 then None
+        else
+            let digits = hash.Substring(2, 4) |> Seq.map (fun c -> base83Alphabet.IndexOf(c)) |> Seq.toList
+            if digits |> List.exists (fun d -> d < 0) then None
+            else Some (sprintf "#%06x" (digits |> List.fold (fun acc d -> acc * 83 + d) 0))
+
+    /// data-blurhash plus the average color as background, so the box is painted before the image
+    /// loads; lazy-images.js replaces the color with the decoded blur
+    let placeholder (item: MediaItem) =
+        match blurhashAverageColor item.blurhash with
+        | Some color -> attribute "data-blurhash" item.blurhash + attribute "style" (sprintf "background-color: %s" color)
+        | None -> ""
+
+    /// m:ss (or h:mm:ss) label for an item with a known duration, otherwise empty
+    let duration (item: MediaItem) =
+        if item.duration > 0.0 then
+            let length = TimeSpan.FromSeconds(Math.Round(item.duration))
+            let label =
+                if length.TotalHours >= 1.0 then length.ToString(@"h\:mm\:ss")
+                else length.ToString(@"m\:ss")
+            element "span" (attribute "class" "media-duration") label
+        else ""
+
+    /// Cover art shown above an audio player, otherwise empty
+    let poster (item: MediaItem) (alt: string) =
+        if String.IsNullOrWhiteSpace(item.poster) then ""
+        else
+            selfClosingElement "img"
+                (attribute "src" item.poster +
+                 attribute "alt" alt +
+                 attribute "loading" "lazy" +
+                 attribute "class" "media-poster")
+
+    /// True when the item is an animated GIF converted to animated WebP or MP4
+    let isAnimation (item: MediaItem) =
+        not (String.IsNullOrWhiteSpace(item.fallback))
+
+    /// Converted GIF animation: animated WebP in <picture> or a muted looping video,
+    /// with the original GIF as the fallback image
+    let animation (item: MediaItem) (alt: string) =
+        let gif =
+            selfClosingElement "img"
+                (attribute "src" item.fallback +
+                 attribute "alt" alt +
+                 dimensions item +
+                 attribute "class" "media-image")
+        if item.media_type.ToLower() = "video" then
+            element "video"
+                (attribute "src" item.uri +
+                 attribute "autoplay" "autoplay" +
+                 attribute "loop" "loop" +
+                 attribute "muted" "muted" +
+                 attribute "playsinline" "playsinline" +
+                 dimensions item +
+                 attribute "class" "media-video media-animation")
+                gif
+        else
+            element "picture" ""
+                (selfClosingElement "source" (attribute "type" "image/webp" + attribute "srcset" item.uri) + gif)
+
+    /// Wrap an image in <picture> with one <source> per responsive variant format.
+    /// Returns the image unchanged when the item has no variants.
+    let responsiveImage (item: MediaItem) (img: string) =
+        let sizes = if String.IsNullOrWhiteSpace(item.sizes) then "100vw" else item.sizes
+        let sources =
+            [ "image/avif", item.srcset_avif
+              "image/webp", item.srcset_webp ]
+            |> List.filter (fun (_, srcset) -> not (String.IsNullOrWhiteSpace(srcset)))
+            |> List.map (fun (mimeType, srcset) ->
+                selfClosingElement "source"
+                    (attribute "type" mimeType + attribute "srcset" srcset + attribute "sizes" sizes))
+        if List.isEmpty sources then img
+        else element "picture" "" (String.concat "" sources + img)
+
 /// HTML renderer for MediaBlock
 type MediaBlockHtmlRenderer() =
     inherit HtmlObjectRenderer<MediaBlock>()
@@ -409,23 +521,32 @@ type MediaBlockHtmlRenderer() =
 
             let mediaElement =
                 match mediaType.ToLower() with
+                | "image" | "video" when HtmlHelpers.isAnimation item ->
+                    HtmlHelpers.animation item alt
                 | "image" ->
                     HtmlHelpers.selfClosingElement "img" 
                         (HtmlHelpers.attribute "src" uri + 
                          HtmlHelpers.attribute "alt" alt +
+                         HtmlHelpers.dimensions item +
+                         HtmlHelpers.placeholder item +
                          HtmlHelpers.attribute "class" "media-image")
+                    |> HtmlHelpers.responsiveImage item
                 | "video" ->
                     HtmlHelpers.element "video" 
                         (HtmlHelpers.attribute "src" uri + 
                          HtmlHelpers.attribute "controls" "controls" +
+                         HtmlHelpers.dimensions item +
                          HtmlHelpers.attribute "class" "media-video")
                         alt
+                    + HtmlHelpers.duration item
                 | "audio" ->
+                    HtmlHelpers.poster item alt +
                     HtmlHelpers.element "audio"
                         (HtmlHelpers.attribute "src" uri +
                          HtmlHelpers.attribute "controls" "controls" +
                          HtmlHelpers.attribute "class" "media-audio")
                         alt
+                    + HtmlHelpers.duration item
                 | _ ->
                     HtmlHelpers.element "a"
                         (HtmlHelpers.attribute "href" uri +
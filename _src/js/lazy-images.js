@@ -12,6 +12,9 @@ class LazyImageLoader {
     }
 
     init() {
+        // Paint BlurHash placeholders before anything else loads
+        this.paintPlaceholders();
+
         // Check for Intersection Observer support
         if (!('IntersectionObserver' in window)) {
             console.log('IntersectionObserver not available - using native lazy loading fallback');
@@ -112,6 +115,24 @@ class LazyImageLoader {
         }, { once: true });
     }
 
+    paintPlaceholders() {
+        document.querySelectorAll('img[data-blurhash]').forEach(img => {
+            if (img.complete && img.naturalWidth > 0) {
+                return;
+            }
+            const preview = BlurHash.toDataUrl(img.dataset.blurhash, 32, 32);
+            if (!preview) {
+                return;
+            }
+            img.style.backgroundImage = `url(${preview})`;
+            img.style.backgroundSize = 'cover';
+            img.addEventListener('load', () => {
+                img.style.backgroundImage = '';
+                img.style.backgroundColor = '';
+            }, { once: true });
+        });
+    }
+
     useFallback() {
         // For browsers without IntersectionObserver, use native loading attribute
         const images = document.querySelectorAll('img:not([loading])');
@@ -123,6 +144,87 @@ class LazyImageLoader {
     }
 }
 
+/**
+ * BlurHash decoder (https://blurha.sh): turns the hash upload_media.py stores in
+ * :::media items into a small blurred image for the placeholder background
+ */
+const BlurHash = {
+    alphabet: '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~',
+
+    decode83(text) {
+        let value = 0;
+        for (const char of text) {
+            const digit = this.alphabet.indexOf(char);
+            if (digit < 0) return NaN;
+            value = value * 83 + digit;
+        }
+        return value;
+    },
+
+    toLinear(value) {
+        const v = value / 255;
+        return v <= 0.04045 ? v / 12.92 : Math.pow((v + 0.055) / 1.055, 2.4);
+    },
+
+    toSrgb(value) {
+        const v = Math.max(0, Math.min(1, value));
+        return v <= 0.0031308 ? Math.trunc(v * 12.92 * 255 + 0.5) : Math.trunc((1.055 * Math.pow(v, 1 / 2.4) - 0.055) * 255 + 0.5);
+    },
+
+    signPow(value, exp) {
+        return Math.sign(value) * Math.pow(Math.abs(value), exp);
+    },
+
+    toDataUrl(hash, width, height) {
+        if (!hash || hash.length < 6) return null;
+        const sizeFlag = this.decode83(hash[0]);
+        const componentsX = (sizeFlag % 9) + 1;
+        const componentsY = Math.floor(sizeFlag / 9) + 1;
+        if (hash.length !== 4 + 2 * componentsX * componentsY) return null;
+
+        const maximum = (this.decode83(hash[1]) + 1) / 166;
+        const colors = [];
+        for (let i = 0; i < componentsX * componentsY; i++) {
+            if (i === 0) {
+                const dc = this.decode83(hash.substring(2, 6));
+                colors.push([this.toLinear(dc >> 16), this.toLinear((dc >> 8) & 255), this.toLinear(dc & 255)]);
+            } else {
+                const ac = this.decode83(hash.substring(4 + i * 2, 6 + i * 2));
+                colors.push([Math.floor(ac / 361), Math.floor(ac / 19) % 19, ac % 19]
+                    .map(q => this.signPow((q - 9) / 9, 2) * maximum));
+            }
+        }
+
+        const canvas = document.createElement('canvas');
+        canvas.width = width;
+        canvas.height = height;
+        const context = canvas.getContext('2d');
+        if (!context) return null;
+        const pixels = context.createImageData(width, height);
+        for (let y = 0; y < height; y++) {
+            for (let x = 0; x < width; x++) {
+                let r = 0, g = 0, b = 0;
+                for (let j = 0; j < componentsY; j++) {
+                    for (let i = 0; i < componentsX; i++) {
+                        const basis = Math.cos(Math.PI * x * i / width) * Math.cos(Math.PI * y * j / height);
+                        const color = colors[i + j * componentsX];
+                        r += color[0] * basis;
+                        g += color[1] * basis;
+                        b += color[2] * basis;
+                    }
+                }
+                const offset = 4 * (x + y * width);
+                pixels.data[offset] = this.toSrgb(r);
+                pixels.data[offset + 1] = this.toSrgb(g);
+                pixels.data[offset + 2] = this.toSrgb(b);
+                pixels.data[offset + 3] = 255;
+            }
+        }
+        context.putImageData(pixels, 0, 0);
+        return canvas.toDataURL();
+    }
+};
+
 // Initialize when DOM is ready
 if (document.readyState === 'loading') {
     document.addEventListener('DOMContentLoaded', () => {
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Test script for the asyncio media pipeline engine.
+Uses httpx.MockTransport and a fake S3 client so no network or credentials are needed.
+"""
+
+import sys
+import os
+import io
+import time
+import asyncio
+import tempfile
+import contextlib
+
+# Add parent directory to path to import the upload_media modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '.github', 'scripts'))
+
+import upload_media_async
+from media_throttle import configure_host_guard
+from upload_media import STREAM_CHUNK_SIZE, AttachmentCancelled, UploadContext, collect_attachment_outcomes, content_md5
+from upload_media_async import ByteBudget, process_attachments_async
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+class FakeS3Client:
+    """Thread-safe enough for executor calls: records objects by key."""
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        assert kwargs.get('ContentMD5') == content_md5(Body)
+        self.objects[Key] = Body
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        upload_id = f"upload-{Key}"
+        self.uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, ContentMD5):
+        self.uploads[UploadId][PartNumber] = Body
+        return {'ETag': f'"{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        self.objects[Key] = b''.join(parts[p['PartNumber']] for p in MultipartUpload['Parts'])
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId, None)
+
+
+BODIES = {
+    'photo': b'\xff\xd8\xff\xe0' + b'j' * 3000,
+    'video': b'\x00\x00\x00\x20ftypisom' + b'v' * 20000,
+    'song': b'ID3' + b'a' * 500,
+}
+
+
+def handler(request):
+    name = request.url.path.rsplit('/', 1)[-1]
+    if name == 'broken':
+        return httpx.Response(500)
+    return httpx.Response(200, content=BODIES[name], headers={'Content-Type': 'application/octet-stream'})
+
+
+def run_engine(names, max_requests=4, handler=handler, outcomes=None):
+    attachments = [(f"https://github.com/user-attachments/assets/{n}", n) for n in names]
+    s3 = FakeS3Client()
+    context = UploadContext(s3_client=s3, bucket_name='bucket',
+                            endpoint_url='https://us-east-1.linodeobjects.com', part_size=8192)
+
+    async def go():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            result = await process_attachments_async(attachments, context, max_requests, 16384, http_client=client)
+        if outcomes is not None:
+            outcomes.update(result)
+        return result
+
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        outcomes = asyncio.run(go())
+        try:
+            mapping = collect_attachment_outcomes(attachments, outcomes)
+            exit_code = None
+        except SystemExit as e:
+            mapping, exit_code = None, e.code
+    return mapping, s3, output.getvalue(), exit_code
+
+
+def test_byte_budget():
+    """The byte budget blocks until enough bytes are released."""
+    print("Testing byte budget...")
+
+    async def go():
+        budget = ByteBudget(100)
+        await budget.acquire(60)
+        waiter = asyncio.create_task(budget.acquire(60))
+        await asyncio.sleep(0.01)
+        assert not waiter.done(), "Second acquire should wait for the budget"
+        await budget.release(60)
+        await asyncio.wait_for(waiter, 1)
+        assert budget.in_flight == 60
+        # Oversized requests pass once nothing else is in flight
+        await budget.release(60)
+        await asyncio.wait_for(budget.acquire(500), 1)
+
+    asyncio.run(go())
+    print("  ✅ Byte budget: PASSED")
+
+
+def test_async_pipeline():
+    """All attachments are uploaded and the mapping keeps attachment order."""
+    print("\nTesting async pipeline...")
+    mapping, s3, output, exit_code = run_engine(['video', 'photo', 'song'])
+
+    assert exit_code is None, f"Unexpected failure:\n{output}"
+    assert [alt for _, alt, _ in mapping.values()] == ['video', 'photo', 'song'], "Mapping order changed"
+    assert [t for _, _, t in mapping.values()] == ['video', 'image', 'audio'], f"Unexpected types: {mapping}"
+    uploaded = {key.rsplit('_', 1)[-1]: body for key, body in s3.objects.items()}
+    assert uploaded == {'video.mp4': BODIES['video'], 'photo.jpg': BODIES['photo'], 'song.mp3': BODIES['song']}
+    assert output.index('assets/video') < output.index('assets/photo') < output.index('assets/song'), \
+        "Log output is not in attachment order"
+    print("  ✅ Uploads, media types and ordering: PASSED")
+
+
+def test_async_failure():
+    """A failed download exits with status 1."""
+    print("\nTesting async failure handling...")
+    mapping, s3, output, exit_code = run_engine(['photo', 'broken', 'song'], max_requests=1)
+    assert exit_code == 1, f"Expected exit code 1, got {exit_code}"
+    assert 'Error processing attachment' in output
+    print("  ✅ Failure exits with status 1: PASSED")
+
+
+def test_stage_logs_stay_with_attachment():
+    """Output printed by stages in worker threads lands in the attachment's own log."""
+    print("\nTesting per-attachment logs...")
+    outcomes = {}
+    mapping, s3, output, exit_code = run_engine(['video', 'photo', 'song'], outcomes=outcomes)
+    assert exit_code is None, f"Unexpected failure:\n{output}"
+    for index, name in enumerate(['video', 'photo', 'song'], 1):
+        log = outcomes[index][2]
+        assert f"assets/{name}" in log and mapping[f"https://github.com/user-attachments/assets/{name}"][0] in log, \
+            f"Log of {name} is missing its permanent URL:\n{log}"
+    print("  ✅ Permanent URLs printed in worker threads are in each attachment's log: PASSED")
+
+
+class BrokenStream(httpx.AsyncByteStream if httpx else object):
+    """Async body that drops the connection after the first `cut` bytes."""
+
+    def __init__(self, body, cut):
+        self.body = body
+        self.cut = cut
+
+    async def __aiter__(self):
+        yield self.body[:self.cut]
+        raise httpx.ReadError("connection reset")
+
+
+def test_throttle_and_resume():
+    """Downloads go through the host guard and resume with a Range request after a reset."""
+    print("\nTesting throttled and interrupted downloads...")
+    guard = configure_host_guard('github.com', rate=1000)
+    body = b'\x00\x00\x00\x20ftypisom' + b'v' * 200000
+    # Bytes short of a whole chunk are still buffered by httpx when the connection drops
+    cut = STREAM_CHUNK_SIZE
+    requests = []
+
+    def flaky(request):
+        requests.append(request.headers.get('Range'))
+        headers = {'Content-Type': 'video/mp4', 'ETag': '"v1"', 'Accept-Ranges': 'bytes'}
+        if len(requests) == 1:
+            return httpx.Response(429, headers={'Retry-After': '0'})
+        if len(requests) == 2:
+            return httpx.Response(200, headers=dict(headers, **{'Content-Length': str(len(body))}),
+                                  stream=BrokenStream(body, cut))
+        start = int(request.headers['Range'].split('=')[1].rstrip('-'))
+        return httpx.Response(206, content=body[start:], headers=dict(
+            headers, **{'Content-Range': f"bytes {start}-{len(body) - 1}/{len(body)}"}))
+
+    mapping, s3, output, exit_code = run_engine(['video'], handler=flaky)
+    assert exit_code is None, f"Unexpected failure:\n{output}"
+    assert list(s3.objects.values()) == [body], "Resumed upload is not the whole file"
+    assert requests == [None, None, f'bytes={cut}-'], requests
+    assert 'resuming (1/' in output
+    assert guard.counters['throttles'] == 1 and guard.counters['requests'] == 3, guard.counters
+    print(f"  ✅ 429 waited out and reset resumed from byte {cut}: PASSED")
+
+
+def test_download_cache():
+    """A second run uploads cached attachments without downloading them again."""
+    print("\nTesting download cache...")
+    requests = []
+
+    def counting(request):
+        requests.append(request.url.path)
+        return handler(request)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['MEDIA_UPLOAD_CACHE_DIR'] = tmp
+        try:
+            run_engine(['photo', 'song'], handler=counting)
+            assert len(requests) == 2, requests
+            mapping, s3, output, exit_code = run_engine(['photo', 'song'], handler=counting)
+        finally:
+            del os.environ['MEDIA_UPLOAD_CACHE_DIR']
+    assert exit_code is None, f"Unexpected failure:\n{output}"
+    assert len(requests) == 2, f"Cached attachments were downloaded again: {requests}"
+    assert output.count('Cache hit') == 2
+    assert sorted(s3.objects.values()) == sorted([BODIES['photo'], BODIES['song']])
+    print("  ✅ Cached attachments uploaded without a download: PASSED")
+
+
+def test_fallback_gets_cancel_event():
+    """Without httpx, the threaded pipeline gets a cancel event that the first failure sets."""
+    print("\nTesting cancellation of the threaded fallback...")
+    seen = {}
+
+    def fake_process_attachment(index, github_url, context, cancel_event=None):
+        if index == 1:
+            time.sleep(0.05)
+            raise RuntimeError("upload failed")
+        seen['cancelled'] = cancel_event is not None and cancel_event.wait(2)
+        raise AttachmentCancelled("cancelled after an earlier failure")
+
+    attachments = [(f"https://github.com/user-attachments/assets/{n}", n) for n in ('a', 'b')]
+    context = UploadContext(s3_client=FakeS3Client(), bucket_name='bucket', endpoint_url='https://example.com')
+    original = upload_media_async.httpx, upload_media_async.process_attachment
+    upload_media_async.httpx, upload_media_async.process_attachment = None, fake_process_attachment
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            outcomes = asyncio.run(process_attachments_async(attachments, context, max_requests=2))
+    finally:
+        upload_media_async.httpx, upload_media_async.process_attachment = original
+    assert seen == {'cancelled': True}, seen
+    assert isinstance(outcomes[1][1], RuntimeError) and isinstance(outcomes[2][1], AttachmentCancelled)
+    print("  ✅ Running worker thread sees the cancel event: PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("Async Engine Tests")
+    print("=" * 60)
+
+    if httpx is None:
+        print("⚠️  httpx is not installed; skipping async engine tests")
+        sys.exit(0)
+
+    try:
+        test_byte_budget()
+        test_async_pipeline()
+        test_async_failure()
+        test_stage_logs_stay_with_attachment()
+        test_throttle_and_resume()
+        test_download_cache()
+        test_fallback_gets_cancel_event()
+
+        print("\n" + "=" * 60)
+        print("✅ All tests PASSED!")
+        print("=" * 60)
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ Test FAILED: {e}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n❌ Unexpected error: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Test script for audio metadata and cover art extraction (media_audio.py).
+Builds minimal MP3, FLAC, Ogg and WAV files by hand, so no sample media,
+ffmpeg or tagging library is needed.
+"""
+
+import sys
+import os
+import io
+import base64
+import struct
+
+# Add parent directory to path to import the upload_media module
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '.github', 'scripts'))
+
+import upload_media
+from media_audio import AudioProbe, probe_audio
+from media_images import Image
+from media_probe import MediaProbe, describe, media_fields, probe_bytes
+from media_storage import InMemoryBackend
+from upload_media import UploadContext, process_attachment, transform_content_preserving_positions
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz, stereo: 417-byte frames of 1152 samples
+MP3_FRAME_HEADER = b'\xff\xfb\x90\x00'
+MP3_FRAME_LENGTH = 417
+
+FRONT_COVER_BYTES = b'\x89PNG front cover'
+BACK_COVER_BYTES = b'\x89PNG back cover'
+
+
+def id3v23(frames):
+    body = b''.join(frame_id + struct.pack('>I', len(data)) + b'\x00\x00' + data for frame_id, data in frames)
+    size = len(body)
+    syncsafe = bytes([(size >> 21) & 0x7F, (size >> 14) & 0x7F, (size >> 7) & 0x7F, size & 0x7F])
+    return b'ID3\x03\x00\x00' + syncsafe + body
+
+
+def apic(picture_type, image, encoding=0):
+    description = 'Cover'.encode('utf-16') + b'\x00\x00' if encoding == 1 else b'Cover\x00'
+    return b'APIC', bytes([encoding]) + b'image/png\x00' + bytes([picture_type]) + description + image
+
+
+def mp3(frames=40, xing_frames=None, cover=None):
+    tag = b''
+    if cover is not None:
+        tag = id3v23([apic(4, BACK_COVER_BYTES), apic(3, cover, encoding=1), (b'TIT2', b'\x00Episode')])
+    audio = bytearray(MP3_FRAME_HEADER + b'\x00' * (MP3_FRAME_LENGTH - 4)) * frames
+    if xing_frames is not None:
+        # Xing header after the 32 bytes of stereo side information
+        audio[36:48] = b'Xing' + struct.pack('>II', 0x01, xing_frames)
+    return tag + bytes(audio)
+
+
+def flac_picture(picture_type, image):
+    mime = b'image/png'
+    return (struct.pack('>II', picture_type, len(mime)) + mime + struct.pack('>I', 0)
+            + b'\x00' * 16 + struct.pack('>I', len(image)) + image)
+
+
+def flac(seconds=10, sample_rate=44100, cover=None):
+    total = seconds * sample_rate
+    streaminfo = (b'\x00' * 10 + bytes([sample_rate >> 12, (sample_rate >> 4) & 0xFF,
+                                        ((sample_rate & 0x0F) << 4) | (1 << 1) | 0x01]) +
+                  bytes([(0x0F << 4) | ((total >> 32) & 0x0F)]) + struct.pack('>I', total & 0xFFFFFFFF) + b'\x00' * 16)
+    blocks = [(0, streaminfo)]
+    if cover is not None:
+        blocks.append((6, flac_picture(3, cover)))
+    data = b'fLaC'
+    for i, (block_type, payload) in enumerate(blocks):
+        last = 0x80 if i == len(blocks) - 1 else 0
+        data += bytes([last | block_type]) + len(payload).to_bytes(3, 'big') + payload
+    return data + b'\x00' * 50_000
+
+
+def ogg_page(packet, granule, serial=7, sequence=0):
+    lacing = bytes([255] * (len(packet) // 255) + [len(packet) % 255])
+    header = b'OggS\x00\x00' + struct.pack('<qIII', granule, serial, sequence, 0) + bytes([len(lacing)])
+    return header + lacing + packet
+
+
+def opus(seconds=5, pre_skip=312, cover=None, packets=50):
+    head = b'OpusHead\x01\x02' + struct.pack('<HIhB', pre_skip, 48000, 0, 0)
+    comments = []
+    if cover is not None:
+        comments.append(b'METADATA_BLOCK_PICTURE=' + base64.b64encode(flac_picture(3, cover)))
+    tags = b'OpusTags' + struct.pack('<I', 4) + b'test' + struct.pack('<I', len(comments))
+    tags += b''.join(struct.pack('<I', len(c)) + c for c in comments)
+    pages = [ogg_page(head, 0), ogg_page(tags, 0, sequence=1)]
+    audio = b'\x00' * 200
+    for i in range(packets):
+        pages.append(ogg_page(audio, (i + 1) * (seconds * 48000 // packets) + pre_skip, sequence=i + 2))
+    return b''.join(pages)
+
+
+def wav(seconds=2, sample_rate=16000, channels=1):
+    byte_rate = sample_rate * channels * 2
+    fmt = struct.pack('<HHIIHH', 1, channels, sample_rate, byte_rate, channels * 2, 16)
+    data = b'\x00' * (seconds * byte_rate)
+    body = b'WAVE' + b'fmt ' + struct.pack('<I', len(fmt)) + fmt + b'data' + struct.pack('<I', len(data)) + data
+    return b'RIFF' + struct.pack('<I', len(body)) + body
+
+
+def cover_image():
+    """A real PNG when Pillow is installed, so the poster can be encoded."""
+    if Image is None:
+        return FRONT_COVER_BYTES
+    out = io.BytesIO()
+    Image.new('RGB', (1200, 1200), (200, 40, 40)).save(out, format='PNG')
+    return out.getvalue()
+
+
+def reader(data):
+    return lambda offset, length: data[offset:offset + length]
+
+
+def test_mp3():
+    """Xing frame counts, CBR file sizes and the front cover from ID3v2."""
+    print("Testing MP3...")
+    data = mp3(frames=40, xing_frames=1000, cover=FRONT_COVER_BYTES)
+    info = probe_audio(reader(data), len(data))
+    assert info.format == 'mp3' and info.sample_rate == 44100 and info.channels == 2, info
+    assert abs(info.duration - 1000 * 1152 / 44100) < 0.001, info.duration
+    assert info.cover == FRONT_COVER_BYTES, "Front cover preferred over the back cover"
+
+    data = mp3(frames=100)
+    info = probe_audio(reader(data), len(data))
+    assert info.bitrate == 128_000 and abs(info.duration - 100 * MP3_FRAME_LENGTH * 8 / 128_000) < 0.001, info
+    assert info.cover is None
+    assert probe_audio(reader(data + b'TAG' + b'\x00' * 125), len(data) + 128).duration == info.duration, \
+        "ID3v1 tag is not counted as audio"
+    print("  ✅ Xing, CBR, APIC and ID3v1: PASSED")
+
+
+def test_flac_ogg_wav():
+    """STREAMINFO, Opus granules with pre-skip and WAV byte rates."""
+    print("\nTesting FLAC, Ogg Opus and WAV...")
+    data = flac(seconds=10, cover=FRONT_COVER_BYTES)
+    info = probe_audio(reader(data), len(data))
+    assert info.format == 'flac' and info.duration == 10 and info.channels == 2, info
+    assert info.cover == FRONT_COVER_BYTES and info.bitrate > 0
+
+    data = opus(seconds=5, cover=FRONT_COVER_BYTES)
+    info = probe_audio(reader(data), len(data))
+    assert info.format == 'opus' and abs(info.duration - 5) < 0.001, info
+    assert info.cover == FRONT_COVER_BYTES and info.codecs == 'opus'
+    assert probe_audio(reader(data), len(data), covers=False).cover is None
+
+    data = wav(seconds=2)
+    info = probe_audio(reader(data), len(data))
+    assert info.format == 'wav' and info.duration == 2 and info.bitrate == 256_000, info
+
+    assert probe_audio(reader(b'\x89PNG\r\n\x1a\n' + b'\x00' * 40)) is None
+    assert probe_audio(reader(b'fLaC\x00\x00'), 6) is None, "Truncated files return None"
+    print("  ✅ FLAC, Opus and WAV: PASSED")
+
+
+def test_streaming_probe():
+    """The streaming probe keeps the head and tail and matches random access."""
+    print("\nTesting streaming probe...")
+    for data in (mp3(frames=300, xing_frames=300, cover=FRONT_COVER_BYTES), opus(seconds=7), flac(), wav()):
+        probe = MediaProbe()
+        for i in range(0, len(data), 3001):
+            probe.feed(data[i:i + 3001])
+        assert probe.finish() == probe_bytes(data), probe.result
+
+    probe = AudioProbe(prefix=1024)
+    data = opus(seconds=70, packets=1000)
+    for i in range(0, len(data), 4096):
+        probe.feed(data[i:i + 4096])
+    assert len(probe._head) == 1024 and len(probe._tail) == 64 * 1024 < len(data) - 1024
+    assert abs(probe.finish().duration - 70) < 0.001, probe.result
+    print("  ✅ Head and tail only: PASSED")
+
+
+class RangeSession:
+    """Stands in for requests.Session, answering Range requests from bytes."""
+
+    def __init__(self, files):
+        self.files = files
+        self.ranges = []
+
+    def get(self, url, headers=None, timeout=None, stream=False):
+        data = self.files[url]
+        start, end = (int(n) for n in headers['Range'][len('bytes='):].split('-'))
+        self.ranges.append((start, end))
+        if start >= len(data):
+            return FakeResponse(416, b'')
+        return FakeResponse(206, data[start:end + 1], {'Content-Range': f"bytes {start}-{end}/{len(data)}"})
+
+
+class FakeResponse:
+    def __init__(self, status_code, body, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.raw = io.BytesIO(body)
+        self.raw.read = lambda n, decode_content=False, _read=self.raw.read: _read(n)
+
+    def raise_for_status(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_remote_audio_skips_artwork():
+    """Linked audio is probed with Range requests without downloading the cover."""
+    print("\nTesting direct audio links...")
+    url = 'https://podcasts.example.com/episode.mp3'
+    data = mp3(frames=2000, cover=b'\x89PNG' + b'\x00' * 500_000)
+    session = RangeSession({url: data})
+    details = upload_media.probe_remote_media([(url, 'audio')], session)
+    assert details[url]['bitrate'] == 128 and details[url]['codecs'] == 'mp3', details
+    fetched = sum(end - start + 1 for start, end in session.ranges)
+    assert fetched < 200_000, f"Fetched {fetched} of {len(data)} bytes"
+    print(f"  ✅ {len(session.ranges)} requests, {fetched} bytes: PASSED")
+
+
+def test_media_block_fields():
+    """Uploaded audio gets duration, codecs, bitrate and a poster in its :::media item."""
+    print("\nTesting :::media fields...")
+    storage = InMemoryBackend('https://cdn.test')
+    context = UploadContext(s3_client=storage, bucket_name='media', endpoint_url=storage.base_url)
+    github_url = 'https://github.com/user-attachments/assets/episode-1'
+    original = upload_media.download_from_github
+    upload_media.download_from_github = lambda url: (mp3(frames=500, xing_frames=500, cover=cover_image()), '.mp3')
+    try:
+        permanent_url, media_type = process_attachment(1, github_url, context)
+    finally:
+        upload_media.download_from_github = original
+
+    assert media_type == 'audio'
+    details = context.media_details[permanent_url]
+    assert describe(media_fields(probe_bytes(mp3(frames=500, xing_frames=500)))) == '0:13, mp3, 128 kbps'
+    block = transform_content_preserving_positions(
+        content=f"Episode\n\n{github_url}",
+        url_mapping={github_url: (permanent_url, 'Episode', media_type)},
+        youtube_urls=[], direct_media_urls=[], media_details=context.media_details
+    )
+    assert '  duration: 13.061\n  codecs: "mp3"' in block, block
+
+    if Image is None:
+        assert 'poster' not in details
+        print("  ⚠️  Pillow not installed; skipping cover art poster")
+        print("  ✅ duration, codecs and bitrate written: PASSED")
+        return
+    poster_url = details['poster']
+    assert poster_url == permanent_url.rsplit('.', 1)[0] + '-poster.webp', poster_url
+    assert f'  poster: "{poster_url}"' in block, block
+    poster = storage.get_object_bytes(poster_url[len('https://cdn.test/'):])
+    with Image.open(io.BytesIO(poster)) as img:
+        assert img.format == 'WEBP' and img.size == (512, 512), (img.format, img.size)
+    print("  ✅ duration, codecs, bitrate and poster written: PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("Audio Metadata Tests")
+    print("=" * 60)
+
+    try:
+        test_mp3()
+        test_flac_ogg_wav()
+        test_streaming_probe()
+        test_remote_audio_skips_artwork()
+        test_media_block_fields()
+
+        print("\n" + "=" * 60)
+        print("✅ All tests PASSED!")
+        print("=" * 60)
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ Test FAILED: {e}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n❌ Unexpected error: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
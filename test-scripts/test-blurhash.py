@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Test script for BlurHash image placeholders (media_placeholder.py).
+Generates images with Pillow; the expected hash comes from the reference
+BlurHash implementation.
+"""
+
+import sys
+import os
+import io
+import time
+
+# Add parent directory to path to import the upload_media module
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '.github', 'scripts'))
+
+import upload_media
+from media_placeholder import BASE83_ALPHABET, blurhash_encode, encode_base83, placeholder_fields, placeholders_available
+from media_storage import InMemoryBackend
+from upload_media import UploadContext, process_attachment, transform_content_preserving_positions
+
+if placeholders_available():
+    import numpy as np
+    from PIL import Image
+
+
+def decode_base83(text):
+    value = 0
+    for char in text:
+        value = value * 83 + BASE83_ALPHABET.index(char)
+    return value
+
+
+def gradient(size=(32, 24)):
+    return Image.merge('RGB', [Image.linear_gradient('L').resize(size),
+                               Image.linear_gradient('L').rotate(90).resize(size),
+                               Image.new('L', size, 120)])
+
+
+def jpeg(img, orientation=None):
+    out = io.BytesIO()
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    img.save(out, format='JPEG', quality=90, exif=exif)
+    return out.getvalue()
+
+
+def test_reference_hash():
+    """The vectorized encoder matches the reference implementation."""
+    print("Testing BlurHash encoding...")
+    assert blurhash_encode(np.asarray(gradient()), 4, 3) == 'L#HVCYl}gJnm2sWDfjWpwxjtfQjt'
+
+    solid = np.full((20, 30, 3), (200, 40, 90), dtype=np.uint8)
+    blurhash = blurhash_encode(solid, 4, 3)
+    assert len(blurhash) == 4 + 2 * 12 and blurhash[0] == encode_base83(3 + 2 * 9, 1)
+    assert decode_base83(blurhash[2:6]) == (200 << 16) + (40 << 8) + 90, "DC component is the average color"
+    print("  ✅ Reference vector and average color: PASSED")
+
+
+def test_photo_placeholder():
+    """A full-size phone photo is hashed upright in a few milliseconds."""
+    print("\nTesting photo placeholder...")
+    data = jpeg(gradient((4032, 3024)), orientation=6)
+    placeholder_fields(data)  # Warm up imports and decoders
+    started = time.perf_counter()
+    fields = placeholder_fields(data)
+    elapsed = (time.perf_counter() - started) * 1000
+    blurhash = fields['blurhash']
+    assert blurhash[0] == encode_base83(2 + 3 * 9, 1), "Portrait photos get 3x4 components"
+    assert elapsed < 250, f"{elapsed:.1f} ms"
+    assert placeholder_fields(b'\xff\xd8\xff not an image') == {}
+    print(f"  ✅ 4032x3024 JPEG in {elapsed:.1f} ms: PASSED")
+
+
+def test_media_block_field():
+    """Uploaded images get a blurhash field when placeholders are on."""
+    print("\nTesting :::media field...")
+    storage = InMemoryBackend('https://cdn.test')
+    github_url = 'https://github.com/user-attachments/assets/album-1'
+    original = upload_media.download_from_github
+    upload_media.download_from_github = lambda url: (jpeg(gradient((800, 600))), '.jpg')
+    try:
+        context = UploadContext(s3_client=storage, bucket_name='media', endpoint_url=storage.base_url,
+                                placeholders=True)
+        permanent_url, media_type = process_attachment(1, github_url, context)
+        plain = UploadContext(s3_client=storage, bucket_name='media', endpoint_url=storage.base_url)
+        plain_url, _ = process_attachment(2, github_url, plain)
+    finally:
+        upload_media.download_from_github = original
+
+    blurhash = context.media_details[permanent_url]['blurhash']
+    block = transform_content_preserving_positions(
+        f"Album\n\n![Photo]({github_url})", {github_url: (permanent_url, 'Photo', media_type)}, [], [],
+        context.media_details
+    )
+    assert f'  blurhash: "{blurhash}"' in block, block
+    assert 'blurhash' not in plain.media_details.get(plain_url, {})
+    print("  ✅ blurhash written: PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("BlurHash Placeholder Tests")
+    print("=" * 60)
+
+    if not placeholders_available():
+        print("⚠️  NumPy or Pillow is not installed; skipping BlurHash tests")
+        sys.exit(0)
+
+    try:
+        test_reference_hash()
+        test_photo_placeholder()
+        test_media_block_field()
+
+        print("\n" + "=" * 60)
+        print("✅ All tests PASSED!")
+        print("=" * 60)
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ Test FAILED: {e}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n❌ Unexpected error: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
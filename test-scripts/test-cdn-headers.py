@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Test script for the CDN caching policy applied to uploaded objects.
+Uses an in-memory fake S3 client so no credentials or network are needed.
+"""
+
+import sys
+import os
+import gzip
+
+# Add parent directory to path to import the upload_media module
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '.github', 'scripts'))
+
+from upload_media import content_type_for, object_headers, upload_stream_to_s3, upload_to_s3
+
+
+class FakeS3Client:
+    """Records the headers sent with every object."""
+
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = (Body, kwargs)
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self.objects[Key] = (None, kwargs)
+        return {'UploadId': 'u1'}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, ContentMD5):
+        return {'ETag': f'"{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        pass
+
+
+def test_content_types():
+    """Extensions map to canonical MIME types; unknown ones fall back to the download's type."""
+    print("Testing Content-Type selection...")
+    assert content_type_for('clip.mp4') == 'video/mp4'
+    assert content_type_for('clip.MOV') == 'video/quicktime'
+    assert content_type_for('song.m4a') == 'audio/mp4'
+    assert content_type_for('photo.jpeg', 'application/octet-stream') == 'image/jpeg'
+    assert content_type_for('blob', 'video/webm') == 'video/webm'
+    assert content_type_for('blob') == 'application/octet-stream'
+    print("  ✅ Content-Type table: PASSED")
+
+
+def test_cache_policy():
+    """Uniquely keyed media is immutable for a year; reusable keys revalidate."""
+    print("\nTesting Cache-Control policy...")
+    headers = object_headers('files/images/20250101_120000_photo.jpg')
+    assert headers['CacheControl'] == 'public, max-age=31536000, immutable', headers
+    assert headers['ContentDisposition'] == 'inline; filename="20250101_120000_photo.jpg"', headers
+
+    headers = object_headers('test/connection_test.txt', immutable=False)
+    assert 'immutable' not in headers['CacheControl'], headers
+    assert headers['ContentType'].startswith('text/plain')
+    print("  ✅ Immutable and revalidating policies: PASSED")
+
+
+def test_uploads_send_headers():
+    """Both the buffered and the streaming upload paths send the policy headers."""
+    print("\nTesting headers on uploads...")
+    s3 = FakeS3Client()
+    key = upload_to_s3(b'\x00\x00\x00\x18ftypisom' + os.urandom(100), 'clip.mp4', s3, 'bucket')
+    sent = s3.objects[key][1]
+    assert sent['ContentType'] == 'video/mp4', sent
+    assert sent['CacheControl'].endswith('immutable'), sent
+    print("  ✅ put_object headers: PASSED")
+
+    s3 = FakeS3Client()
+    data = os.urandom(10_000)
+    upload_stream_to_s3(iter([data]), 'files/audio/a.mp3', s3, 'bucket', part_size=4096)
+    sent = s3.objects['files/audio/a.mp3'][1]
+    assert sent['ContentType'] == 'audio/mpeg', sent
+    print("  ✅ create_multipart_upload headers: PASSED")
+
+
+def test_svg_precompressed_copy():
+    """With MEDIA_UPLOAD_PRECOMPRESS, SVGs get a gzip copy next to the original."""
+    print("\nTesting precompressed SVG copies...")
+    svg = b'<svg xmlns="http://www.w3.org/2000/svg">' + b'<rect width="1" height="1"/>' * 50 + b'</svg>'
+    os.environ['MEDIA_UPLOAD_PRECOMPRESS'] = 'true'
+    try:
+        s3 = FakeS3Client()
+        key = upload_to_s3(svg, 'logo.svg', s3, 'bucket')
+    finally:
+        del os.environ['MEDIA_UPLOAD_PRECOMPRESS']
+
+    body, sent = s3.objects[key + '.gz']
+    assert gzip.decompress(body) == svg, "gzip copy does not round-trip"
+    assert sent['ContentEncoding'] == 'gzip' and sent['ContentType'] == 'image/svg+xml', sent
+
+    s3 = FakeS3Client()
+    key = upload_to_s3(svg, 'logo.svg', s3, 'bucket')
+    assert list(s3.objects) == [key], "No copies without MEDIA_UPLOAD_PRECOMPRESS"
+    print("  ✅ gzip copy for SVG: PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("CDN Header Policy Tests")
+    print("=" * 60)
+
+    try:
+        test_content_types()
+        test_cache_policy()
+        test_uploads_send_headers()
+        test_svg_precompressed_copy()
+
+        print("\n" + "=" * 60)
+        print("✅ All tests PASSED!")
+        print("=" * 60)
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ Test FAILED: {e}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n❌ Unexpected error: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Test script for concurrent attachment processing.
+Replaces the per-attachment download/upload step with a fake so no network is needed.
+"""
+
+import sys
+import os
+import io
+import time
+import threading
+import contextlib
+
+# Add parent directory to path to import the upload_media module
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '.github', 'scripts'))
+
+import upload_media
+from media_storage import InMemoryBackend
+from upload_media import UploadContext, process_attachments, upload_multipart_parallel
+
+
+CONTEXT = UploadContext(s3_client=None, bucket_name='bucket', endpoint_url='https://us-east-1.linodeobjects.com')
+
+
+def make_attachments(count):
+    return [(f"https://github.com/user-attachments/assets/item-{i}", f"alt {i}") for i in range(1, count + 1)]
+
+
+def run_with_fake(fake, attachments, workers):
+    """Run process_attachments with a fake process_attachment, capturing stdout."""
+    original = upload_media.process_attachment
+    upload_media.process_attachment = fake
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):
+            result = process_attachments(attachments, CONTEXT, workers)
+        return result, output.getvalue(), None
+    except SystemExit as e:
+        return None, output.getvalue(), e
+    finally:
+        upload_media.process_attachment = original
+
+
+def test_parallel_order_and_speed():
+    """Attachments run in parallel but mapping and logs keep attachment order."""
+    print("Testing parallel processing order...")
+    attachments = make_attachments(6)
+    active = []
+    peak = [0]
+    lock = threading.Lock()
+
+    def fake(index, github_url, context, cancel_event=None):
+        with lock:
+            active.append(index)
+            peak[0] = max(peak[0], len(active))
+        print(f"  work for {index}")
+        # Later items finish first to shake out ordering bugs
+        time.sleep(0.05 * (7 - index))
+        with lock:
+            active.remove(index)
+        return f"https://cdn.example.com/{index}.jpg", 'image'
+
+    start = time.perf_counter()
+    mapping, output, exit_error = run_with_fake(fake, attachments, workers=6)
+    elapsed = time.perf_counter() - start
+
+    assert exit_error is None, f"Unexpected exit: {output}"
+    assert list(mapping.keys()) == [url for url, _ in attachments], "Mapping order changed"
+    assert mapping[attachments[0][0]] == ("https://cdn.example.com/1.jpg", "alt 1", "image")
+    positions = [output.index(f"work for {i}") for i in range(1, 7)]
+    assert positions == sorted(positions), "Log output is not in attachment order"
+    assert peak[0] > 1, "Attachments did not run concurrently"
+    # Sequential would take 1.05s; parallel is bounded by the slowest item (0.3s)
+    assert elapsed < 0.8, f"Expected parallel speedup, took {elapsed:.2f}s"
+    print(f"  ✅ Ordered mapping and logs ({elapsed:.2f}s, peak {peak[0]} workers): PASSED")
+
+
+def test_worker_bound():
+    """No more than the configured number of workers run at once."""
+    print("\nTesting worker bound...")
+    active = [0]
+    peak = [0]
+    lock = threading.Lock()
+
+    def fake(index, github_url, context, cancel_event=None):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.02)
+        with lock:
+            active[0] -= 1
+        return f"https://cdn.example.com/{index}.jpg", 'image'
+
+    mapping, output, exit_error = run_with_fake(fake, make_attachments(8), workers=2)
+    assert exit_error is None
+    assert len(mapping) == 8
+    assert peak[0] <= 2, f"Expected at most 2 concurrent workers, saw {peak[0]}"
+    print("  ✅ Worker bound respected: PASSED")
+
+
+def test_first_failure_cancels_rest():
+    """The first failure stops pending attachments and exits with status 1."""
+    print("\nTesting failure cancellation...")
+    started = []
+
+    def fake(index, github_url, context, cancel_event=None):
+        if cancel_event.is_set():
+            raise upload_media.AttachmentCancelled("cancelled")
+        started.append(index)
+        if index == 2:
+            raise RuntimeError("boom")
+        time.sleep(0.05)
+        return f"https://cdn.example.com/{index}.jpg", 'image'
+
+    mapping, output, exit_error = run_with_fake(fake, make_attachments(10), workers=2)
+    assert exit_error is not None and exit_error.code == 1, "Expected sys.exit(1)"
+    assert "Error processing attachment: boom" in output
+    assert len(started) < 10, f"Expected later attachments to be cancelled, ran {started}"
+    assert "Cancelled" in output
+    print(f"  ✅ Cancelled after failure (ran {len(started)}/10): PASSED")
+
+
+class FlakyBackend(InMemoryBackend):
+    """Fails the first attempt at part 2 of every upload."""
+
+    def __init__(self):
+        super().__init__('https://cdn.test')
+        self.failed = set()
+        self.failed_lock = threading.Lock()
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, ContentMD5=None):
+        with self.failed_lock:
+            fail = PartNumber == 2 and Key not in self.failed
+            if fail:
+                self.failed.add(Key)
+        if fail:
+            raise ConnectionError(f"reset while sending {Key}")
+        return super().upload_part(Bucket, Key, UploadId, PartNumber, Body, ContentMD5)
+
+
+def test_nested_worker_logs():
+    """Output from the threads sending multipart parts lands in its own attachment's log."""
+    print("\nTesting logs from nested worker threads...")
+    storage = FlakyBackend()
+
+    def fake(index, github_url, context, cancel_event=None):
+        upload_multipart_parallel(bytes(4096), f"files/item-{index}.bin", storage, 'bucket', 1024, 4)
+        return f"https://cdn.example.com/{index}.bin", 'file'
+
+    original_backoff = upload_media.DEFAULT_HTTP_BACKOFF
+    upload_media.DEFAULT_HTTP_BACKOFF = 0.01
+    try:
+        mapping, output, exit_error = run_with_fake(fake, make_attachments(6), workers=4)
+    finally:
+        upload_media.DEFAULT_HTTP_BACKOFF = original_backoff
+    assert exit_error is None and len(mapping) == 6, output
+    logs = output.split("📦 Processing attachment ")[1:]
+    for index, log in enumerate(logs, 1):
+        assert log.startswith(f"{index}/6"), log
+        assert f"reset while sending files/item-{index}.bin" in log, f"Retry line missing from log {index}:\n{log}"
+        assert log.count("Part 2 failed") == 1, f"Log {index} holds another attachment's retry:\n{log}"
+    print("  ✅ Part retries logged with their attachment: PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("Concurrent Attachment Processing Tests")
+    print("=" * 60)
+
+    try:
+        test_parallel_order_and_speed()
+        test_worker_bound()
+        test_first_failure_cancels_rest()
+        test_nested_worker_logs()
+
+        print("\n" + "=" * 60)
+        print("✅ All tests PASSED!")
+        print("=" * 60)
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ Test FAILED: {e}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n❌ Unexpected error: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
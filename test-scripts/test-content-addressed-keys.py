@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Test script for content-addressed S3 keys and upload deduplication.
+Uses an in-memory fake S3 client so no credentials or network are needed.
+"""
+
+import sys
+import os
+import hashlib
+
+# Add parent directory to path to import the upload_media module
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '.github', 'scripts'))
+
+from upload_media import (
+    build_content_s3_key,
+    collapse_duplicate_attachments,
+    expand_duplicate_attachments,
+    find_existing_object,
+    media_type_from_s3_key,
+    promote_staged_object,
+    upload_deduplicated,
+)
+
+
+class MissingKeyError(Exception):
+    """Mimics botocore's ClientError for a 404 HEAD."""
+
+    def __init__(self):
+        super().__init__("Not Found")
+        self.response = {'Error': {'Code': '404'}, 'ResponseMetadata': {'HTTPStatusCode': 404}}
+
+
+class FakeS3Client:
+    """Stores objects in a dict and records every call."""
+
+    def __init__(self):
+        self.objects = {}
+        self.calls = []
+
+    def head_object(self, Bucket, Key):
+        self.calls.append(('head_object', Key))
+        if Key not in self.objects:
+            raise MissingKeyError()
+        body = self.objects[Key]
+        return {'ContentLength': len(body), 'ETag': f'"{hashlib.md5(body).hexdigest()}"'}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.calls.append(('put_object', Key))
+        self.objects[Key] = Body
+
+    def copy_object(self, Bucket, Key, CopySource, **kwargs):
+        self.calls.append(('copy_object', Key))
+        self.objects[Key] = self.objects[CopySource['Key']]
+
+    def delete_object(self, Bucket, Key):
+        self.calls.append(('delete_object', Key))
+        self.objects.pop(Key, None)
+
+
+def test_content_key_layout():
+    """Keys are sharded by hash and keep the media folder and extension."""
+    print("Testing content key layout...")
+    sha = hashlib.sha256(b'photo').hexdigest()
+    key = build_content_s3_key('abc-123.JPG', sha)
+    assert key == f"files/images/{sha[:2]}/{sha[2:4]}/{sha}.jpg", f"Unexpected key: {key}"
+    assert media_type_from_s3_key(key) == 'image'
+    assert build_content_s3_key('clip.mp4', sha).startswith('files/videos/')
+    print("  ✅ Sharded key layout: PASSED")
+
+
+def test_upload_is_skipped_when_object_exists():
+    """A second upload of the same bytes reuses the existing object."""
+    print("\nTesting upload deduplication...")
+    s3 = FakeS3Client()
+    data = b'\xff\xd8\xff' + os.urandom(2000)
+
+    first = upload_deduplicated(data, 'one.jpg', s3, 'bucket')
+    second = upload_deduplicated(data, 'two.jpg', s3, 'bucket')
+    assert first == second, "Same content should map to the same key"
+    puts = [c for c in s3.calls if c[0] == 'put_object']
+    assert len(puts) == 1, f"Expected one upload, got {puts}"
+    print("  ✅ Repost reuses existing object: PASSED")
+
+    # An object with the same key but different bytes is overwritten
+    s3.objects[first] = b'corrupt'
+    assert find_existing_object(s3, 'bucket', first, len(data)) is None
+    upload_deduplicated(data, 'one.jpg', s3, 'bucket')
+    assert s3.objects[first] == data
+    print("  ✅ Size mismatch triggers re-upload: PASSED")
+
+
+def test_promote_staged_object():
+    """Streamed uploads move from their staging key to the content key."""
+    print("\nTesting staged object promotion...")
+    s3 = FakeS3Client()
+    data = os.urandom(500)
+    final_key = build_content_s3_key('a.mp4', hashlib.sha256(data).hexdigest())
+
+    s3.objects['files/videos/incoming/x.mp4'] = data
+    key = promote_staged_object(s3, 'bucket', 'files/videos/incoming/x.mp4', final_key, len(data))
+    assert key == final_key and s3.objects[final_key] == data
+    assert 'files/videos/incoming/x.mp4' not in s3.objects, "Staging key should be deleted"
+    print("  ✅ Promote to content key: PASSED")
+
+    # Promoting the same content again just drops the staged copy
+    s3.objects['files/videos/incoming/y.mp4'] = data
+    s3.calls.clear()
+    promote_staged_object(s3, 'bucket', 'files/videos/incoming/y.mp4', final_key, len(data))
+    assert not any(c[0] == 'copy_object' for c in s3.calls), f"Unexpected copy: {s3.calls}"
+    assert 'files/videos/incoming/y.mp4' not in s3.objects
+    print("  ✅ Existing content skips the copy: PASSED")
+
+
+def test_collapse_duplicate_attachments():
+    """Links to the same attachment are collapsed before any download."""
+    print("\nTesting duplicate attachment collapsing...")
+    base = 'https://github.com/user-attachments/assets/1111-2222'
+    attachments = [
+        (base, 'first'),
+        ('https://github.com/user-attachments/assets/3333-4444', 'other'),
+        (base + '?raw=true', 'again'),
+    ]
+    unique, duplicates = collapse_duplicate_attachments(attachments)
+    assert [url for url, _ in unique] == [base, 'https://github.com/user-attachments/assets/3333-4444']
+    assert duplicates == [(base + '?raw=true', 'again', base)], f"Unexpected duplicates: {duplicates}"
+
+    url_mapping = {base: ('https://cdn/x.jpg', 'first', 'image')}
+    expand_duplicate_attachments(url_mapping, duplicates)
+    assert url_mapping[base + '?raw=true'] == ('https://cdn/x.jpg', 'again', 'image')
+    print("  ✅ Duplicates share one upload: PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("Content-Addressed Key Tests")
+    print("=" * 60)
+
+    try:
+        test_content_key_layout()
+        test_upload_is_skipped_when_object_exists()
+        test_promote_staged_object()
+        test_collapse_duplicate_attachments()
+
+        print("\n" + "=" * 60)
+        print("✅ All tests PASSED!")
+        print("=" * 60)
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ Test FAILED: {e}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n❌ Unexpected error: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Test script for the content-addressed download cache.
+Seeds a temporary cache with fixture bytes, then runs the download path with the
+network disabled to prove a warm rerun never leaves the machine.
+"""
+
+import sys
+import os
+import time
+import hashlib
+import tempfile
+import threading
+
+# Add parent directory to path to import the upload_media modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '.github', 'scripts'))
+
+import upload_media
+import media_cache
+from media_cache import DownloadCache
+
+JPEG = b'\xff\xd8\xff\xe0\x00\x10JFIF' + b'j' * 2000
+PNG = b'\x89PNG\r\n\x1a\n' + b'p' * 3000
+
+
+class NoNetwork:
+    """Stand-in HTTP session that fails the test if anything touches the network."""
+
+    def get(self, *args, **kwargs):
+        raise AssertionError(f"Unexpected network request: {args[0] if args else kwargs}")
+
+
+def test_store_and_lookup():
+    """Entries are found by URL and by content hash; identical bytes are stored once."""
+    print("Testing store and lookup...")
+    with tempfile.TemporaryDirectory() as root:
+        cache = DownloadCache(root)
+        entry = cache.store('https://github.com/user-attachments/assets/a', JPEG, '.jpg', 'image/jpeg')
+        assert entry.sha256 == hashlib.sha256(JPEG).hexdigest()
+
+        hit = cache.lookup_url('https://github.com/user-attachments/assets/a')
+        assert hit is not None and cache.read(hit) == JPEG
+        assert hit.extension == '.jpg' and hit.content_type == 'image/jpeg'
+        assert cache.lookup_hash(entry.sha256).path == entry.path
+        assert cache.lookup_url('https://github.com/user-attachments/assets/missing') is None
+
+        cache.store('https://github.com/user-attachments/assets/b', JPEG, '.jpg', 'image/jpeg')
+        objects = [n for _, _, files in os.walk(cache.objects_dir) for n in files if not n.endswith('.json')]
+        assert len(objects) == 1, f"Expected one stored object, found {objects}"
+    print("  ✅ URL and hash lookup, dedup by content: PASSED")
+
+
+def test_lru_eviction():
+    """Least recently used objects are evicted past the size cap."""
+    print("\nTesting LRU eviction...")
+    with tempfile.TemporaryDirectory() as root:
+        cache = DownloadCache(root, max_bytes=len(JPEG) + len(PNG) + 10)
+        cache.store('u1', JPEG, '.jpg')
+        time.sleep(0.01)
+        cache.store('u2', PNG, '.png')
+        time.sleep(0.01)
+        cache.lookup_url('u1')  # u1 becomes most recently used
+        time.sleep(0.01)
+        cache.store('u3', b'x' * 500, '.bin')
+
+        assert cache.lookup_url('u1') is not None, "Recently used entry was evicted"
+        assert cache.lookup_url('u2') is None, "Least recently used entry should be evicted"
+        assert cache.lookup_url('u3') is not None
+    print("  ✅ LRU eviction under size cap: PASSED")
+
+
+def test_concurrent_writers():
+    """Parallel stores of the same and different files leave a consistent cache."""
+    print("\nTesting concurrent writers...")
+    with tempfile.TemporaryDirectory() as root:
+        cache = DownloadCache(root)
+        errors = []
+
+        def worker(i):
+            try:
+                content = JPEG if i % 2 else PNG
+                cache.store(f'url-{i}', content, '.jpg' if i % 2 else '.png')
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(16)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert not errors, f"Concurrent stores failed: {errors}"
+        for i in range(16):
+            entry = cache.lookup_url(f'url-{i}')
+            assert cache.read(entry) == (JPEG if i % 2 else PNG)
+        leftovers = [n for _, _, files in os.walk(root) for n in files if n.endswith(('.tmp', '.incoming'))]
+        assert not leftovers, f"Temp files left behind: {leftovers}"
+    print("  ✅ 16 concurrent stores: PASSED")
+
+
+def test_warm_rerun_skips_network():
+    """download_from_github serves cached fixtures without any HTTP request."""
+    print("\nTesting warm rerun against cached fixtures...")
+    url = 'https://github.com/user-attachments/assets/0b1c2d3e-fixture'
+    with tempfile.TemporaryDirectory() as root:
+        os.environ['MEDIA_UPLOAD_CACHE_DIR'] = root
+        media_cache._cache = None
+        try:
+            media_cache.get_download_cache().store(url, PNG, '.png', 'image/png')
+            upload_media._http_session = NoNetwork()
+            content, ext = upload_media.download_from_github(url)
+            assert content == PNG and ext == '.png'
+            assert media_cache.get_download_cache().hits == 1
+        finally:
+            upload_media._http_session = None
+            media_cache._cache = None
+            del os.environ['MEDIA_UPLOAD_CACHE_DIR']
+    print("  ✅ Cache hit with network disabled: PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("Download Cache Tests")
+    print("=" * 60)
+
+    try:
+        test_store_and_lookup()
+        test_lru_eviction()
+        test_concurrent_writers()
+        test_warm_rerun_skips_network()
+
+        print("\n" + "=" * 60)
+        print("✅ All tests PASSED!")
+        print("=" * 60)
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ Test FAILED: {e}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n❌ Unexpected error: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Test script for MP4 faststart rewriting (media_faststart.py).
+Builds minimal movies by hand and serves them from a local HTTP server,
+so no sample media, ffmpeg or network access is needed.
+"""
+
+import sys
+import os
+import io
+import struct
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Add parent directory to path to import the upload_media module
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '.github', 'scripts'))
+
+import upload_media
+from media_faststart import (
+    faststart_bytes,
+    faststart_chunks,
+    faststart_file,
+    first_frame_bytes,
+    needs_faststart,
+    shift_chunk_offsets,
+)
+from media_probe import file_reader, iter_top_level_boxes, probe_bytes
+from media_storage import InMemoryBackend
+
+CHUNK_MARKERS = [b'VIDEO-CHUNK-%d' % i for i in range(3)] + [b'AUDIO-CHUNK-%d' % i for i in range(2)]
+
+
+def box(box_type, payload, version=None):
+    if version is not None:
+        payload = bytes([version, 0, 0, 0]) + payload
+    return struct.pack('>I', len(payload) + 8) + box_type + payload
+
+
+def trak(handler, offsets, sample_size, table=b'stco'):
+    fmt = '>%dI' if table == b'stco' else '>%dQ'
+    chunk_offsets = box(table, struct.pack('>I', len(offsets)) + struct.pack(fmt % len(offsets), *offsets), 0)
+    stsz = box(b'stsz', struct.pack('>II', sample_size, len(offsets)), 0)
+    mvhd = box(b'tkhd', b'\x00' * 80, 0)
+    mdia = box(b'hdlr', b'\x00' * 4 + handler + b'\x00' * 12, 0) + box(b'minf', box(b'stbl', stsz + chunk_offsets))
+    return box(b'trak', mvhd + box(b'mdia', mdia))
+
+
+def movie(moov_first=False, table=b'stco', gap=100_000):
+    """A movie whose chunk offsets point at recognisable markers inside mdat."""
+    ftyp = box(b'ftyp', b'isom\x00\x00\x02\x00isomiso2mp41')
+    mdat_payload = b''.join(marker + b'\x00' * gap for marker in CHUNK_MARKERS)
+    relative = [i * (len(CHUNK_MARKERS[0]) + gap) for i in range(len(CHUNK_MARKERS))]
+
+    def build(mdat_offset):
+        offsets = [mdat_offset + 8 + r for r in relative]
+        mvhd = box(b'mvhd', struct.pack('>IIII', 0, 0, 1000, 5000) + b'\x00' * 80, 0)
+        return box(b'moov', mvhd + trak(b'vide', offsets[:3], 1000, table) + trak(b'soun', offsets[3:], 400, table))
+
+    mdat = box(b'mdat', mdat_payload)
+    if moov_first:
+        moov = build(len(ftyp) + len(build(0)))
+        return ftyp + moov + mdat
+    return ftyp + mdat + build(len(ftyp))
+
+
+def top_level(data):
+    reader = lambda offset, length: data[offset:offset + length]
+    return [box_type for box_type, *_ in iter_top_level_boxes(reader, len(data))]
+
+
+def chunk_offsets(data):
+    """Chunk offsets of every track, read back from the rewritten file."""
+    reader = lambda offset, length: data[offset:offset + length]
+    for box_type, offset, header_size, box_size in iter_top_level_boxes(reader, len(data)):
+        if box_type == b'moov':
+            moov = data[offset:offset + box_size]
+    offsets = []
+    for table in (b'stco', b'co64'):
+        pos = moov.find(table)
+        while pos != -1:
+            count = struct.unpack_from('>I', moov, pos + 8)[0]
+            width = 4 if table == b'stco' else 8
+            offsets += struct.unpack_from('>%d%s' % (count, 'I' if width == 4 else 'Q'), moov, pos + 12)
+            pos = moov.find(table, pos + 1)
+    return offsets
+
+
+def assert_markers(data):
+    offsets = chunk_offsets(data)
+    assert len(offsets) == len(CHUNK_MARKERS), offsets
+    for offset, marker in zip(offsets, CHUNK_MARKERS):
+        assert data[offset:offset + len(marker)] == marker, (offset, data[offset:offset + len(marker)])
+
+
+def test_rewrite_in_place():
+    """moov moves in front of mdat and every chunk offset still points at its samples."""
+    print("Testing in-place rewrite...")
+    for table in (b'stco', b'co64'):
+        original = movie(table=table)
+        assert needs_faststart(original[:4096]) and top_level(original) == [b'ftyp', b'mdat', b'moov']
+        assert_markers(original)
+        with tempfile.TemporaryFile() as f:
+            f.write(original)
+            assert faststart_file(f)
+            f.seek(0)
+            rewritten = f.read()
+        assert len(rewritten) == len(original)
+        assert top_level(rewritten) == [b'ftyp', b'moov', b'mdat'], top_level(rewritten)
+        assert_markers(rewritten)
+        assert not needs_faststart(rewritten[:4096])
+        assert probe_bytes(rewritten).duration == 5
+    print("  ✅ stco and co64 offsets patched: PASSED")
+
+    already = movie(moov_first=True)
+    assert_markers(already)
+    assert faststart_bytes(already) is already, "Files that already start with moov are untouched"
+    assert faststart_bytes(b'\xff\xd8\xff\xe0 not a movie') == b'\xff\xd8\xff\xe0 not a movie'
+    fragmented = movie() + box(b'moof', b'\x00' * 16)
+    assert faststart_bytes(fragmented) == fragmented, "Fragmented files are left alone"
+    print("  ✅ Faststart, non-movie and fragmented files untouched: PASSED")
+
+
+def test_offset_overflow():
+    """A shift that no longer fits a 32-bit stco leaves moov unchanged."""
+    print("\nTesting stco overflow...")
+    moov = bytearray(box(b'moov', trak(b'vide', [0xFFFFFF00], 10)))
+    before = bytes(moov)
+    try:
+        shift_chunk_offsets(moov, 8, 0x1000, 0, 1 << 40)
+        raise AssertionError("Expected OverflowError")
+    except OverflowError:
+        pass
+    assert bytes(moov) == before
+    print("  ✅ Overflow detected before any change: PASSED")
+
+
+def test_streaming_rewrite():
+    """Chunked input is spooled to disk only when moov has to move."""
+    print("\nTesting streamed rewrite...")
+    original = movie()
+    chunks = [original[i:i + 7_001] for i in range(0, len(original), 7_001)]
+    assert b''.join(faststart_chunks(chunks)) == faststart_bytes(original)
+
+    already = movie(moov_first=True)
+    pieces = list(faststart_chunks(iter([already[:100], already[100:]])))
+    assert b''.join(pieces) == already and len(pieces) == 1, "Passed through without spooling"
+    print("  ✅ Spooled rewrite matches the in-memory one: PASSED")
+
+
+def test_first_frame_benchmark():
+    """A sequential player needs the whole file before, and only moov plus one sample after."""
+    print("\nTesting bytes to first frame...")
+    original = movie()
+    before = first_frame_bytes(file_reader(io.BytesIO(original)), len(original))
+    rewritten = faststart_bytes(original)
+    after = first_frame_bytes(file_reader(io.BytesIO(rewritten)), len(rewritten))
+    assert before == len(original), before
+    moov_end = rewritten.index(b'mdat') - 4
+    assert after == moov_end + 8 + 1000, (after, moov_end)
+    print(f"  ✅ {before} bytes before, {after} after: PASSED")
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    body = b''
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Length', str(len(Handler.body)))
+        self.end_headers()
+        self.wfile.write(Handler.body)
+
+
+def test_uploads_are_faststart():
+    """With MEDIA_UPLOAD_FASTSTART=1 both download paths upload the rewritten file; it is off by default."""
+    print("\nTesting upload pipeline...")
+    Handler.body = movie()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/clip"
+    storage = InMemoryBackend('https://cdn.test')
+    try:
+        content, _ = upload_media.download_from_github(url)
+        assert content == Handler.body, "Videos are uploaded unchanged by default"
+
+        os.environ['MEDIA_UPLOAD_FASTSTART'] = '1'
+        try:
+            key = upload_media.stream_attachment_to_s3(url, 1, storage, 'media')
+            content, extension = upload_media.download_from_github(url)
+        finally:
+            del os.environ['MEDIA_UPLOAD_FASTSTART']
+        streamed = storage.get_object_bytes(key)
+        assert key.endswith('.mp4') and top_level(streamed) == [b'ftyp', b'moov', b'mdat'], key
+        assert_markers(streamed)
+        assert extension == '.mp4' and content == streamed
+    finally:
+        server.shutdown()
+    print("  ✅ Streamed and buffered uploads start with moov: PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("MP4 Faststart Tests")
+    print("=" * 60)
+
+    try:
+        test_rewrite_in_place()
+        test_offset_overflow()
+        test_streaming_rewrite()
+        test_first_frame_benchmark()
+        test_uploads_are_faststart()
+
+        print("\n" + "=" * 60)
+        print("✅ All tests PASSED!")
+        print("=" * 60)
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ Test FAILED: {e}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n❌ Unexpected error: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
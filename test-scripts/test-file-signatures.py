@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Test script for the media format registry (media_formats.py): signature
+detection for every format, the ftyp brand and EBML DocType sub-parsers, the
+folder and Content-Type lookups, and a detection microbenchmark.
+"""
+
+import sys
+import os
+
+# Add parent directory to path to import the upload_media module
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '.github', 'scripts'))
+
+from media_formats import (
+    EBML_DOCTYPES, FORMATS, FORMATS_BY_EXTENSION, FTYP_BRANDS, SIGNATURES, benchmark, detect_extension
+)
+from upload_media import (
+    content_type_for, detect_extension_from_content_type, detect_file_extension_from_content, get_media_type_folder
+)
+
+
+def ftyp(major, *compatible):
+    body = major + b'\x00\x00\x00\x00' + b''.join(compatible)
+    return (8 + len(body)).to_bytes(4, 'big') + b'ftyp' + body
+
+
+def ebml(doctype):
+    """EBML header with EBMLVersion, DocType and DocTypeVersion elements."""
+    elements = b'\x42\x86\x81\x01' + b'\x42\x82' + bytes([0x80 | len(doctype)]) + doctype + b'\x42\x87\x81\x04'
+    return b'\x1a\x45\xdf\xa3' + bytes([0x80 | len(elements)]) + elements + b'\x18\x53\x80\x67'
+
+
+# The first bytes of one file per format, as a download would start
+SAMPLES = {
+    'jpg': b'\xff\xd8\xff\xe0\x00\x10JFIF\x00',
+    'png': b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR',
+    'gif87a': b'GIF87a\x01\x00\x01\x00',
+    'gif': b'GIF89a\x01\x00\x01\x00\x80\x00\x00',
+    'webp': b'RIFF\x00\x00\x00\x00WEBPVP8 ',
+    'avif': ftyp(b'avif', b'avif', b'mif1', b'miaf'),
+    'heic': ftyp(b'heic', b'mif1', b'heic'),
+    'heif avif': ftyp(b'mif1', b'mif1', b'avif'),
+    'heif heic': ftyp(b'mif1', b'mif1', b'heic'),
+    'heif': ftyp(b'mif1', b'mif1'),
+    'bmp': b'BM\x36\x00\x0c\x00\x00\x00',
+    'mp4': ftyp(b'isom', b'isom', b'iso2', b'avc1', b'mp41'),
+    'm4v': ftyp(b'M4V ', b'M4V ', b'isom', b'mp42'),
+    'm4a': ftyp(b'M4A ', b'M4A ', b'isom', b'mp42'),
+    'mov': ftyp(b'qt  ', b'qt  '),
+    'mov without ftyp': b'\x00\x00\x00\x08wide\x00\x12\x34\x56mdat',
+    'webm': ebml(b'webm'),
+    'mkv': ebml(b'matroska'),
+    'avi': b'RIFF\x00\x00\x00\x00AVI LIST',
+    'flv': b'FLV\x01\x05\x00\x00\x00\x09',
+    'wmv': b'\x30\x26\xb2\x75\x8e\x66\xcf\x11\xa6\xd9\x00\xaa\x00\x62\xce\x6c',
+    'mp3': b'ID3\x03\x00\x00\x00\x00\x00\x00',
+    'mp3 frame': b'\xff\xfb\x90\x00\x00\x00\x00\x00',
+    'wav': b'RIFF\x00\x00\x00\x00WAVEfmt ',
+    'ogg': b'OggS\x00\x02\x00\x00\x00\x00',
+    'flac': b'fLaC\x00\x00\x00\x22',
+    'aac': b'\xff\xf1\x50\x80\x02\x1f\xfc',
+}
+
+EXPECTED = {
+    'gif87a': '.gif', 'heif avif': '.avif', 'heif heic': '.heic', 'mov without ftyp': '.mov', 'mp3 frame': '.mp3',
+}
+
+
+def test_every_format():
+    """Each sample is detected as its own format."""
+    print("Testing signature detection...")
+    for name, head in SAMPLES.items():
+        expected = EXPECTED.get(name, '.' + name)
+        result = detect_file_extension_from_content(head + b'\x00' * 4096)
+        assert result == expected, f"{name}: expected {expected}, got {result}"
+        assert detect_extension(bytearray(head)) == expected, f"{name} from a bytearray"
+    print(f"  ✅ {len(SAMPLES)} samples detected: PASSED")
+
+
+def test_sub_parsers():
+    """M4V/M4A brands are reachable, WebM is not Matroska, phone stills are not video."""
+    print("\nTesting ftyp brands and EBML DocType...")
+    assert get_media_type_folder('', 'clip' + detect_extension(SAMPLES['m4v'])) == 'videos'
+    assert get_media_type_folder('', 'song' + detect_extension(SAMPLES['m4a'])) == 'audio'
+    assert get_media_type_folder('', 'photo' + detect_extension(SAMPLES['heic'])) == 'images'
+    assert content_type_for('clip' + detect_extension(SAMPLES['webm'])) == 'video/webm'
+    assert detect_extension(ftyp(b'3gp4', b'isom')) == '.mp4', "Unknown brands are MP4"
+    assert detect_extension(SAMPLES['mkv'][:6]) == '.mkv', "A cut-off EBML header is still Matroska"
+    assert detect_extension(SAMPLES['heic'][:10]) == '.mp4'
+    assert detect_extension(b'\x00\x01\x02\x03\x04\x05\x06\x07\x08\x09\x0a\x0b') is None
+    assert detect_extension(b'') is None
+    print("  ✅ Brands and DocTypes: PASSED")
+
+
+def test_registry_is_consistent():
+    """Every extension the signatures produce is a registered format, and lookups agree with the table."""
+    print("\nTesting registry lookups...")
+    produced = {s.extension for s in SIGNATURES} | set(FTYP_BRANDS.values()) | set(EBML_DOCTYPES.values())
+    assert produced <= set(FORMATS_BY_EXTENSION), produced - set(FORMATS_BY_EXTENSION)
+    for fmt in FORMATS:
+        assert get_media_type_folder('', 'name' + fmt.extension.upper()) == fmt.folder, fmt
+        assert content_type_for('name' + fmt.extension) == fmt.content_type, fmt
+        if fmt.folder != 'files':
+            for content_type in (fmt.content_type, *fmt.aliases):
+                detected = FORMATS_BY_EXTENSION[detect_extension_from_content_type(content_type)]
+                assert detected.content_type == fmt.content_type, (content_type, detected)
+    assert detect_extension_from_content_type('image/heic') == '.heic'
+    assert detect_extension_from_content_type('audio/mp4') == '.m4a'
+    assert detect_extension_from_content_type('Video/MP4; codecs="avc1"') == '.mp4'
+    assert detect_extension_from_content_type('text/plain') is None, "Only media Content-Types are trusted"
+    assert get_media_type_folder('', 'notes.pdf') == 'files'
+    print(f"  ✅ {len(FORMATS)} formats, {len(SIGNATURES)} signatures: PASSED")
+
+
+def test_microbenchmark():
+    """Detection takes a few microseconds per file for every format."""
+    print("\nBenchmarking detection...")
+    results = benchmark({name: head + b'\x00' * 4096 for name, head in SAMPLES.items()}, rounds=2000)
+    for name, (extension, nanoseconds) in results.items():
+        print(f"  {name:>16}: {extension:<6} {nanoseconds:>8,.0f} ns")
+    slowest = max(nanoseconds for _, nanoseconds in results.values())
+    assert slowest < 50_000, f"{slowest:,.0f} ns"
+    print(f"  ✅ Slowest format {slowest / 1000:.1f} µs: PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("File Signature Registry Tests")
+    print("=" * 60)
+
+    try:
+        test_every_format()
+        test_sub_parsers()
+        test_registry_is_consistent()
+        test_microbenchmark()
+
+        print("\n" + "=" * 60)
+        print("✅ All tests PASSED!")
+        print("=" * 60)
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ Test FAILED: {e}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n❌ Unexpected error: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
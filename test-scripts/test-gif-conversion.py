@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Test script for animated GIF conversion (media_animation.py).
+Generates GIFs with Pillow; the MP4 path runs against a stand-in ffmpeg script
+so it is exercised whether or not ffmpeg is installed.
+"""
+
+import sys
+import os
+import io
+import stat
+import tempfile
+
+# Add parent directory to path to import the upload_media module
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '.github', 'scripts'))
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+import upload_media
+from media_animation import convert_gif, encode_animated_webp, gif_frame_count, is_animated_gif
+from media_images import shutdown_image_pool
+from media_storage import InMemoryBackend
+from upload_media import UploadContext, process_attachment, transform_content_preserving_positions
+
+
+def animated_gif(frames=12, size=(160, 120)):
+    """A screen-recording-like GIF: a dithered gradient with a moving box, varying durations."""
+    background = Image.merge('RGB', [Image.linear_gradient('L').resize(size)] * 2 + [Image.new('L', size, 90)])
+    images = []
+    for i in range(frames):
+        frame = background.copy()
+        frame.paste((230, 40, 40), (i * 10, 40, i * 10 + 30, 70))
+        images.append(frame.convert('P'))
+    out = io.BytesIO()
+    durations = [40 if i % 2 else 120 for i in range(frames)]
+    images[0].save(out, format='GIF', save_all=True, append_images=images[1:], duration=durations, loop=0)
+    return out.getvalue()
+
+
+def still_gif():
+    out = io.BytesIO()
+    Image.new('P', (64, 64)).save(out, format='GIF')
+    return out.getvalue()
+
+
+def fake_ffmpeg(directory):
+    """A stand-in ffmpeg that writes a small 'MP4' to its last argument."""
+    path = os.path.join(directory, 'ffmpeg')
+    with open(path, 'w') as f:
+        f.write('#!/bin/sh\nfor last; do :; done\nprintf "\\000\\000\\000\\030ftypisom fake mp4" > "$last"\n')
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    return path
+
+
+def test_frame_count():
+    """Frames are counted from the GIF block structure without decoding."""
+    print("Testing GIF frame count...")
+    data = animated_gif(frames=12)
+    assert gif_frame_count(data) == 12 and is_animated_gif(data)
+    assert gif_frame_count(still_gif()) == 1 and not is_animated_gif(still_gif())
+    assert gif_frame_count(b'\x89PNG\r\n\x1a\n') == 0
+    assert gif_frame_count(data[:len(data) // 3]) >= 2, "A truncated GIF still counts what it has"
+    print("  ✅ Animated, still, truncated and non-GIF files: PASSED")
+
+
+def test_animated_webp():
+    """Animated WebP keeps every frame and its duration, and is smaller."""
+    print("\nTesting animated WebP...")
+    data = animated_gif()
+    encoded = encode_animated_webp(data)
+    with Image.open(io.BytesIO(encoded)) as img:
+        assert img.format == 'WEBP' and img.n_frames == 12, (img.format, img.n_frames)
+        durations = []
+        for i in range(img.n_frames):
+            img.seek(i)
+            img.load()
+            durations.append(img.info['duration'])
+    assert durations == [40 if i % 2 else 120 for i in range(12)], durations
+
+    converted = convert_gif(data, formats=['webp'])
+    assert converted.format == 'webp' and len(converted.data) < len(data) and converted.media_type == 'image'
+    assert convert_gif(still_gif(), formats=['webp']) is None, "Still GIFs are not converted"
+    print(f"  ✅ {len(data)} -> {len(converted.data)} bytes: PASSED")
+
+
+def test_smallest_format_wins():
+    """With an MP4 encoder available the smaller MP4 is picked."""
+    print("\nTesting format choice...")
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['MEDIA_UPLOAD_FFMPEG'] = fake_ffmpeg(tmp)
+        try:
+            converted = convert_gif(animated_gif(), formats=['webp', 'mp4'])
+        finally:
+            del os.environ['MEDIA_UPLOAD_FFMPEG']
+    assert converted.format == 'mp4' and converted.media_type == 'video' and b'ftyp' in converted.data
+    print("  ✅ MP4 chosen when smaller: PASSED")
+
+
+def upload_gif(context, github_url):
+    original = upload_media.download_from_github
+    upload_media.download_from_github = lambda url: (animated_gif(), '.gif')
+    try:
+        return process_attachment(1, github_url, context)
+    finally:
+        upload_media.download_from_github = original
+
+
+def test_media_block_points_at_conversion():
+    """The :::media item uses the converted file and keeps the GIF as fallback."""
+    print("\nTesting :::media fields...")
+    storage = InMemoryBackend('https://cdn.test')
+    context = UploadContext(s3_client=storage, bucket_name='media', endpoint_url=storage.base_url,
+                            convert_animations=True)
+    github_url = 'https://github.com/user-attachments/assets/recording-1'
+    os.environ['MEDIA_UPLOAD_FFMPEG'] = '/nonexistent/ffmpeg'
+    try:
+        permanent_url, media_type = upload_gif(context, github_url)
+    finally:
+        del os.environ['MEDIA_UPLOAD_FFMPEG']
+    assert permanent_url.endswith('.webp') and media_type == 'image', (permanent_url, media_type)
+    details = context.media_details[permanent_url]
+    gif_url = details['fallback']
+    assert gif_url == permanent_url[:-len('.webp')] + '.gif', gif_url
+    assert storage.get_object_bytes(gif_url[len('https://cdn.test/'):])[:6] == b'GIF89a', "GIF kept as fallback"
+    assert details['width'] == 160 and details['height'] == 120, details
+
+    block = transform_content_preserving_positions(
+        content=f"Recording\n\n{github_url}",
+        url_mapping={github_url: (permanent_url, 'Recording', media_type)},
+        youtube_urls=[], direct_media_urls=[], media_details=context.media_details
+    )
+    assert f'- url: "{permanent_url}"' in block and f'  fallback: "{gif_url}"' in block, block
+    print("  ✅ Animated WebP with GIF fallback: PASSED")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['MEDIA_UPLOAD_FFMPEG'] = fake_ffmpeg(tmp)
+        try:
+            permanent_url, media_type = upload_gif(context, 'https://github.com/user-attachments/assets/recording-2')
+        finally:
+            del os.environ['MEDIA_UPLOAD_FFMPEG']
+    assert permanent_url.endswith('.mp4') and media_type == 'video', (permanent_url, media_type)
+    assert context.media_details[permanent_url]['fallback'].endswith('.gif')
+    print("  ✅ Muted looping MP4 with GIF fallback: PASSED")
+
+    plain = UploadContext(s3_client=storage, bucket_name='media', endpoint_url=storage.base_url)
+    permanent_url, media_type = upload_gif(plain, 'https://github.com/user-attachments/assets/recording-3')
+    assert permanent_url.endswith('.gif') and media_type == 'image'
+    print("  ✅ Conversion off keeps the GIF: PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("GIF Conversion Tests")
+    print("=" * 60)
+
+    if Image is None:
+        print("⚠️  Pillow is not installed; skipping GIF conversion tests")
+        sys.exit(0)
+
+    try:
+        test_frame_count()
+        test_animated_webp()
+        test_smallest_format_wins()
+        test_media_block_points_at_conversion()
+
+        print("\n" + "=" * 60)
+        print("✅ All tests PASSED!")
+        print("=" * 60)
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ Test FAILED: {e}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n❌ Unexpected error: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+    finally:
+        shutdown_image_pool()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Test script for the pooled, retrying HTTP session used for attachment downloads.
+Runs a local HTTP server, so no external network is needed.
+"""
+
+import sys
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Add parent directory to path to import the upload_media module
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '.github', 'scripts'))
+
+import upload_media
+from upload_media import build_http_session, get_http_session, download_from_github
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    failures_left = 0
+    client_ports = []
+    requests_seen = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        Handler.client_ports.append(self.client_address[1])
+        Handler.requests_seen.append(self.path)
+        if self.path.startswith('/user-attachments/'):
+            # GitHub redirects attachment URLs to a storage host
+            self.send_response(302)
+            self.send_header('Location', '/storage' + self.path)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if Handler.failures_left > 0:
+            Handler.failures_left -= 1
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = b'\x89PNG\r\n\x1a\n' + b'p' * 100
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def reset(failures=0):
+    Handler.failures_left = failures
+    Handler.client_ports = []
+    Handler.requests_seen = []
+
+
+def test_shared_session():
+    """get_http_session returns one shared session."""
+    print("Testing shared session...")
+    upload_media._http_session = None
+    assert get_http_session() is get_http_session(), "Expected a single shared session"
+    adapter = get_http_session().get_adapter('https://github.com')
+    assert adapter.max_retries.total == upload_media.DEFAULT_HTTP_RETRIES
+    assert 503 in adapter.max_retries.status_forcelist
+    print("  ✅ Shared session and retry policy: PASSED")
+
+
+def test_retry_on_5xx(base_url):
+    """Transient 503 responses are retried."""
+    print("\nTesting retry on 5xx...")
+    session = build_http_session(retries=3, backoff_factor=0.01)
+    reset(failures=2)
+    response = session.get(f"{base_url}/storage/file", timeout=5)
+    assert response.status_code == 200, f"Expected 200, got {response.status_code}"
+    assert len(Handler.requests_seen) == 3, f"Expected 3 attempts, got {len(Handler.requests_seen)}"
+    print("  ✅ Retried 503 twice then succeeded: PASSED")
+
+    reset(failures=5)
+    response = session.get(f"{base_url}/storage/file", timeout=5)
+    assert response.status_code == 503, "Exhausted retries should hand back the last response"
+    print("  ✅ Gives up after the retry budget: PASSED")
+
+
+def test_keep_alive_across_redirects(base_url):
+    """Redirected downloads reuse pooled connections."""
+    print("\nTesting connection reuse...")
+    upload_media._http_session = build_http_session(retries=0)
+    reset()
+    for i in range(5):
+        content, ext = download_from_github(f"{base_url}/user-attachments/assets/{i}")
+        assert ext == '.png', f"Expected .png, got {ext}"
+    assert len(Handler.requests_seen) == 10, f"Expected 10 requests, got {len(Handler.requests_seen)}"
+    assert len(set(Handler.client_ports)) == 1, f"Expected one connection, saw {len(set(Handler.client_ports))}"
+    upload_media._http_session = None
+    print("  ✅ 10 requests over one keep-alive connection: PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("HTTP Session Tests")
+    print("=" * 60)
+
+    server, base_url = start_server()
+    try:
+        test_shared_session()
+        test_retry_on_5xx(base_url)
+        test_keep_alive_across_redirects(base_url)
+
+        print("\n" + "=" * 60)
+        print("✅ All tests PASSED!")
+        print("=" * 60)
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ Test FAILED: {e}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n❌ Unexpected error: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+    finally:
+        server.shutdown()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Test script for JPEG/PNG optimization before upload (media_images.py).
+Generates photos with Pillow and serves them from a local HTTP server. JPEGs run
+against a stand-in jpegtran script, and against the real one when it is installed.
+"""
+
+import sys
+import os
+import io
+import stat
+import shutil
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Add parent directory to path to import the upload_media module
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '.github', 'scripts'))
+
+try:
+    from PIL import Image, PngImagePlugin
+except ImportError:
+    Image = None
+
+import upload_media
+from media_images import jpeg_metadata, jpeg_segments, optimize_jpeg, optimize_photo, shutdown_image_pool
+from media_storage import InMemoryBackend
+
+ICC_PROFILE = b'fake icc profile ' * 40
+
+
+def photo(width=640, height=480):
+    """A noisy photo-like image, so encoders have real work to do."""
+    img = Image.effect_noise((width, height), 40).convert('RGB')
+    return Image.merge('RGB', (img.getchannel(0), img.getchannel(0).rotate(90, expand=False), img.getchannel(0)))
+
+
+def phone_jpeg(orientation=6):
+    """A baseline JPEG with an orientation flag, copyright, ICC profile and bulky EXIF."""
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    exif[0x8298] = 'Copyright 2026 Luis Quintanilla'
+    exif[0x010F] = 'PhoneMaker'
+    exif[0x010E] = 'x' * 20_000  # Stands in for MakerNote and thumbnail data
+    out = io.BytesIO()
+    photo().save(out, format='JPEG', quality=90, exif=exif, icc_profile=ICC_PROFILE, comment=b'camera app')
+    return out.getvalue()
+
+
+def uncompressed_png():
+    info = PngImagePlugin.PngInfo()
+    info.add_text('Copyright', 'CC BY 4.0')
+    info.add_text('Software', 'Screenshot tool')
+    out = io.BytesIO()
+    Image.new('RGB', (400, 300), (30, 120, 200)).save(out, format='PNG', compress_level=0, pnginfo=info)
+    return out.getvalue()
+
+
+STAND_IN_JPEGTRAN = """#!{python}
+# Stand-in jpegtran: logs its arguments, refuses -perfect when asked to, and mimics
+# '-copy none' by dropping APP1-APP15 and COM segments. The scan data is passed through.
+import os, sys
+with open(os.environ['JPEGTRAN_LOG'], 'a') as log:
+    log.write(' '.join(sys.argv[1:]) + '\\n')
+if '-perfect' in sys.argv and os.environ.get('JPEGTRAN_IMPERFECT'):
+    sys.stderr.write('transformation is not perfect\\n')
+    sys.exit(1)
+data = sys.stdin.buffer.read()
+out, pos = bytearray(data[:2]), 2
+while data[pos + 1] != 0xDA:
+    length = int.from_bytes(data[pos + 2:pos + 4], 'big')
+    if not (0xE1 <= data[pos + 1] <= 0xEF or data[pos + 1] == 0xFE):
+        out += data[pos:pos + 2 + length]
+    pos += 2 + length
+sys.stdout.buffer.write(bytes(out) + data[pos:])
+"""
+
+
+def stand_in_jpegtran(directory):
+    path = os.path.join(directory, 'jpegtran')
+    with open(path, 'w') as f:
+        f.write(STAND_IN_JPEGTRAN.format(python=sys.executable))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    os.environ['JPEGTRAN_LOG'] = os.path.join(directory, 'calls.log')
+    return path
+
+
+def jpegtran_calls():
+    with open(os.environ['JPEGTRAN_LOG']) as f:
+        return f.read().splitlines()
+
+
+def scan_data(data):
+    """Everything from the first start-of-scan marker on: the compressed pixels."""
+    return data[data.index(b'\xff\xda'):]
+
+
+def test_jpeg_metadata():
+    """Orientation, copyright and the ICC profile are read and written back without Pillow."""
+    print("Testing JPEG metadata...")
+    original = phone_jpeg()
+    orientation, kept, order, icc = jpeg_metadata(original)
+    assert orientation == 6 and set(kept) == {0x8298}, (orientation, kept)
+    assert b''.join(chunk[14:] for chunk in icc) == ICC_PROFILE
+    try:
+        jpeg_segments(b'GIF89a')
+        raise AssertionError("Expected ValueError")
+    except ValueError:
+        pass
+    print("  ✅ Orientation 6, copyright and ICC profile found: PASSED")
+
+
+def test_jpeg_stand_in():
+    """jpegtran gets a lossless transform; only the ICC profile and copyright are copied back."""
+    print("\nTesting JPEG optimization with a stand-in jpegtran...")
+    original = phone_jpeg()
+    with tempfile.TemporaryDirectory() as tmp:
+        jpegtran = stand_in_jpegtran(tmp)
+        result = optimize_jpeg(original, jpegtran)
+        assert jpegtran_calls() == ['-copy none -optimize -progressive -rotate 90 -perfect'], jpegtran_calls()
+        assert result.rotated and result.saved > 20_000, (result.rotated, result.saved)
+        assert scan_data(result.data) == scan_data(original), "Compressed pixels are only touched by jpegtran"
+        with Image.open(io.BytesIO(result.data)) as after:
+            exif = after.getexif()
+            assert dict(exif) == {0x8298: 'Copyright 2026 Luis Quintanilla'}, dict(exif)
+            assert after.info.get('icc_profile') == ICC_PROFILE
+            assert 'comment' not in after.info
+        print(f"  ✅ {result.original_size} -> {len(result.data)} bytes, rotated with -rotate 90: PASSED")
+
+        os.environ['JPEGTRAN_IMPERFECT'] = '1'
+        try:
+            result = optimize_jpeg(original, jpegtran)
+        finally:
+            del os.environ['JPEGTRAN_IMPERFECT']
+        assert jpegtran_calls()[1:] == ['-copy none -optimize -progressive -rotate 90 -perfect',
+                                        '-copy none -optimize -progressive'], jpegtran_calls()
+        assert not result.rotated
+        with Image.open(io.BytesIO(result.data)) as after:
+            assert after.getexif()[0x0112] == 6, "Unrotated photos keep their orientation flag"
+        del os.environ['JPEGTRAN_LOG']
+    print("  ✅ No perfect transform: left unrotated with its orientation flag: PASSED")
+
+    assert optimize_jpeg(b'\xff\xd8\xff not really a jpeg', '/nonexistent/jpegtran') is None
+    assert optimize_photo(original, '.gif') is original
+    print("  ✅ Unreadable and other files untouched: PASSED")
+
+
+def test_jpeg_real_jpegtran():
+    """With jpegtran installed the result is a progressive, upright JPEG of the same quality."""
+    print("\nTesting JPEG optimization with jpegtran...")
+    jpegtran = shutil.which('jpegtran')
+    if jpegtran is None:
+        print("  ⚠️  jpegtran is not installed; skipping")
+        return
+    original = phone_jpeg()
+    result = optimize_jpeg(original, jpegtran)
+    assert result.rotated and result.saved > 20_000, (result.rotated, result.saved)
+    with Image.open(io.BytesIO(original)) as before, Image.open(io.BytesIO(result.data)) as after:
+        assert after.size == (480, 640), after.size
+        assert after.info.get('progressive') or after.info.get('progression'), after.info
+        assert after.quantization == before.quantization, "Quantization tables are untouched"
+        assert after.info.get('icc_profile') == ICC_PROFILE
+    print(f"  ✅ {result.original_size} -> {len(result.data)} bytes, upright and progressive: PASSED")
+
+
+def test_png():
+    """PNGs are recompressed without changing a single pixel."""
+    print("\nTesting PNG optimization...")
+    original = uncompressed_png()
+    optimized = optimize_photo(original, '.png')
+    assert len(optimized) < len(original) / 10, (len(original), len(optimized))
+    with Image.open(io.BytesIO(original)) as before, Image.open(io.BytesIO(optimized)) as after:
+        assert before.tobytes() == after.tobytes()
+        assert after.info.get('Copyright') == 'CC BY 4.0' and 'Software' not in after.info, after.info
+    assert optimize_photo(optimized, '.png') is optimized, "Files that do not shrink are left alone"
+    print(f"  ✅ {len(original)} -> {len(optimized)} bytes, pixels identical: PASSED")
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    body = b''
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(Handler.body)))
+        self.end_headers()
+        self.wfile.write(Handler.body)
+
+
+def test_uploads_are_optimized():
+    """Originals are uploaded byte for byte unless MEDIA_UPLOAD_OPTIMIZE_ORIGINALS=1 is set."""
+    print("\nTesting upload pipeline...")
+    Handler.body = phone_jpeg()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/photo"
+    storage = InMemoryBackend('https://cdn.test')
+    try:
+        content, _ = upload_media.download_from_github(url)
+        key = upload_media.stream_attachment_to_s3(url, 1, storage, 'media')
+        assert content == Handler.body and storage.get_object_bytes(key) == Handler.body, "Originals kept by default"
+
+        with tempfile.TemporaryDirectory() as tmp:
+            os.environ['MEDIA_UPLOAD_JPEGTRAN'] = shutil.which('jpegtran') or stand_in_jpegtran(tmp)
+            os.environ['MEDIA_UPLOAD_OPTIMIZE_ORIGINALS'] = '1'
+            try:
+                key = upload_media.stream_attachment_to_s3(url, 2, storage, 'media')
+                content, extension = upload_media.download_from_github(url)
+            finally:
+                for name in ('MEDIA_UPLOAD_JPEGTRAN', 'MEDIA_UPLOAD_OPTIMIZE_ORIGINALS', 'JPEGTRAN_LOG'):
+                    os.environ.pop(name, None)
+        streamed = storage.get_object_bytes(key)
+        assert key.endswith('.jpg') and len(streamed) < len(Handler.body), key
+        with Image.open(io.BytesIO(streamed)) as img:
+            assert 0x0112 not in img.getexif(), "Orientation applied"
+        assert extension == '.jpg' and content == streamed
+    finally:
+        server.shutdown()
+    print("  ✅ Originals kept by default, streamed and buffered uploads optimized on request: PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("Image Optimization Tests")
+    print("=" * 60)
+
+    if Image is None:
+        print("⚠️  Pillow is not installed; skipping image optimization tests")
+        sys.exit(0)
+
+    try:
+        test_jpeg_metadata()
+        test_jpeg_stand_in()
+        test_jpeg_real_jpegtran()
+        test_png()
+        test_uploads_are_optimized()
+
+        print("\n" + "=" * 60)
+        print("✅ All tests PASSED!")
+        print("=" * 60)
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ Test FAILED: {e}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n❌ Unexpected error: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+    finally:
+        shutdown_image_pool()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Test script for header-only image dimension probing (media_probe.py).
+Builds minimal file headers by hand, so no image library is needed.
+"""
+
+import sys
+import os
+import struct
+
+# Add parent directory to path to import the upload_media module
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '.github', 'scripts'))
+
+import upload_media
+from media_probe import ImageProbe, aspect_ratio_name, probe_image
+from media_storage import InMemoryBackend
+from upload_media import UploadContext, process_attachment, transform_content_preserving_positions
+
+
+def png(width, height):
+    ihdr = struct.pack('>II', width, height) + b'\x08\x02\x00\x00\x00'
+    return b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' + ihdr + b'\x00' * 4 + b'\x00' * 100
+
+
+def gif(width, height):
+    return b'GIF89a' + struct.pack('<HH', width, height) + b'\x00' * 50
+
+
+def webp(chunk, payload):
+    body = b'WEBP' + chunk + struct.pack('<I', len(payload)) + payload
+    return b'RIFF' + struct.pack('<I', len(body)) + body
+
+
+def webp_vp8(width, height):
+    return webp(b'VP8 ', b'\x00\x00\x00' + b'\x9d\x01\x2a' + struct.pack('<HH', width, height) + b'\x00' * 20)
+
+
+def webp_vp8l(width, height):
+    bits = (width - 1) | ((height - 1) << 14)
+    return webp(b'VP8L', b'\x2f' + bits.to_bytes(4, 'little') + b'\x00' * 20)
+
+
+def webp_vp8x(width, height):
+    return webp(b'VP8X', b'\x00' * 4 + (width - 1).to_bytes(3, 'little') + (height - 1).to_bytes(3, 'little'))
+
+
+def jpeg(width, height, orientation=None, padding=0):
+    data = b'\xff\xd8'
+    if orientation:
+        ifd = struct.pack('<H', 1) + struct.pack('<HHIHH', 0x0112, 3, 1, orientation, 0) + b'\x00' * 4
+        tiff = b'II*\x00' + struct.pack('<I', 8) + ifd
+        app1 = b'Exif\x00\x00' + tiff
+        data += b'\xff\xe1' + struct.pack('>H', len(app1) + 2) + app1
+    if padding:
+        # A large APP2 segment (like an embedded ICC profile) before the frame header
+        data += b'\xff\xe2' + struct.pack('>H', padding + 2) + b'\x00' * padding
+    sof = b'\x08' + struct.pack('>HH', height, width) + b'\x03' + b'\x00' * 9
+    data += b'\xff\xc2' + struct.pack('>H', len(sof) + 2) + sof
+    return data + b'\xff\xda' + b'\x00' * 100
+
+
+def box(box_type, payload, full=False):
+    if full:
+        payload = b'\x00\x00\x00\x00' + payload
+    return struct.pack('>I', len(payload) + 8) + box_type + payload
+
+
+def avif(width, height, rotation=0, tile=None):
+    properties = box(b'ispe', struct.pack('>II', width, height), full=True)
+    if tile:
+        properties += box(b'ispe', struct.pack('>II', *tile), full=True)
+    if rotation:
+        properties += box(b'irot', bytes([rotation]))
+    meta = box(b'meta', box(b'hdlr', b'\x00' * 20, full=True) + box(b'iprp', box(b'ipco', properties)), full=True)
+    return box(b'ftyp', b'avif\x00\x00\x00\x00mif1') + meta + box(b'mdat', b'\x00' * 64)
+
+
+def test_formats():
+    """Every supported header yields the stored size."""
+    print("Testing header formats...")
+    cases = {
+        'png': png(640, 480),
+        'gif': gif(320, 200),
+        'webp VP8': webp_vp8(1024, 768),
+        'webp VP8L': webp_vp8l(1024, 768),
+        'webp VP8X': webp_vp8x(5000, 3000),
+        'jpeg': jpeg(4032, 3024),
+        'avif': avif(1920, 1080, tile=(512, 512)),
+    }
+    expected = {
+        'png': (640, 480), 'gif': (320, 200), 'webp VP8': (1024, 768), 'webp VP8L': (1024, 768),
+        'webp VP8X': (5000, 3000), 'jpeg': (4032, 3024), 'avif': (1920, 1080),
+    }
+    for name, data in cases.items():
+        info = probe_image(data)
+        assert info is not None and info.display_size == expected[name], f"{name}: {info}"
+    assert probe_image(b'%PDF-1.7 not an image at all') is None
+    assert probe_image(b'\x89PNG\r\n\x1a\n') is None, "Truncated header without partial=True returns None"
+    print("  ✅ JPEG, PNG, GIF, WebP and AVIF: PASSED")
+
+
+def test_rotation():
+    """EXIF orientation and irot swap the displayed width and height."""
+    print("\nTesting rotation...")
+    assert probe_image(jpeg(4032, 3024, orientation=6)).display_size == (3024, 4032)
+    assert probe_image(jpeg(4032, 3024, orientation=3)).display_size == (4032, 3024)
+    assert probe_image(avif(1920, 1080, rotation=1)).display_size == (1080, 1920)
+    print("  ✅ Portrait phone photos: PASSED")
+
+
+def test_streaming_prefix():
+    """The probe answers from the first chunks and needs more when the header is cut off."""
+    print("\nTesting streaming probe...")
+    data = jpeg(3000, 2000, orientation=6, padding=20_000)
+    probe = ImageProbe()
+    fed = 0
+    for i in range(0, len(data), 4096):
+        fed += 1
+        if probe.feed(data[i:i + 4096]) is not None:
+            break
+    assert probe.result.display_size == (2000, 3000) and fed == 5, (probe.result, fed)
+
+    probe = ImageProbe(limit=1024)
+    probe.feed(jpeg(10, 10, padding=5000)[:2048])
+    assert probe.done and probe.result is None, "Probing stops at the limit"
+    print("  ✅ Prefix-only probing: PASSED")
+
+
+def test_aspect_ratio_thresholds():
+    """Names follow detectAspectRatioFromDimensions in MediaTypes.fs."""
+    print("\nTesting aspect ratio names...")
+    assert aspect_ratio_name(1000, 1000) == 'square'
+    assert aspect_ratio_name(1050, 1000) == 'square'
+    assert aspect_ratio_name(2560, 1080) == 'cinematic'
+    assert aspect_ratio_name(4032, 3024) == 'landscape'
+    assert aspect_ratio_name(3024, 4032) == 'portrait'
+    assert aspect_ratio_name(1150, 1000) == 'unknown'
+    print("  ✅ Square, cinematic, landscape, portrait: PASSED")
+
+
+def test_media_block_fields():
+    """Uploaded images get width, height and aspectRatio in their :::media item."""
+    print("\nTesting :::media fields...")
+    storage = InMemoryBackend('https://cdn.test')
+    context = UploadContext(s3_client=storage, bucket_name='media', endpoint_url=storage.base_url)
+    github_url = 'https://github.com/user-attachments/assets/portrait-1'
+    original = upload_media.download_from_github
+    upload_media.download_from_github = lambda url: (jpeg(4032, 3024, orientation=6), '.jpg')
+    try:
+        permanent_url, media_type = process_attachment(1, github_url, context)
+    finally:
+        upload_media.download_from_github = original
+
+    content = f"Phone shot\n\n![Portrait]({github_url})"
+    block = transform_content_preserving_positions(
+        content, {github_url: (permanent_url, 'Portrait', media_type)}, [], [], context.media_details
+    )
+    assert '  aspectRatio: "portrait"' in block, block
+    assert '  width: 3024\n  height: 4032' in block, block
+    print("  ✅ width, height and aspectRatio written: PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("Image Probe Tests")
+    print("=" * 60)
+
+    try:
+        test_formats()
+        test_rotation()
+        test_streaming_prefix()
+        test_aspect_ratio_thresholds()
+        test_media_block_fields()
+
+        print("\n" + "=" * 60)
+        print("✅ All tests PASSED!")
+        print("=" * 60)
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ Test FAILED: {e}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n❌ Unexpected error: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
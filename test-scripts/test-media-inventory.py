@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Test script for the bucket inventory in media_inventory.py.
+Uses the in-memory storage backend, so no credentials or network are needed.
+"""
+
+import sys
+import os
+import tempfile
+from pathlib import Path
+
+# Add parent directory to path to import the scripts
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '.github', 'scripts'))
+
+import upload_media
+from media_inventory import MediaInventory, build_report, find_media_references
+from media_storage import InMemoryBackend
+
+
+class CountingBackend(InMemoryBackend):
+    """In-memory backend that counts listing and HEAD calls."""
+
+    def __init__(self, base_url):
+        super().__init__(base_url)
+        self.calls = {'list_objects_v2': 0, 'head_object': 0}
+
+    def list_objects_v2(self, Bucket, **kwargs):
+        self.calls['list_objects_v2'] += 1
+        return super().list_objects_v2(Bucket, **kwargs)
+
+    def head_object(self, Bucket, Key):
+        self.calls['head_object'] += 1
+        return super().head_object(Bucket, Key)
+
+
+def seed(storage, count=5):
+    for i in range(count):
+        storage.put_object(Bucket='media', Key=f"files/images/2024010{i}_photo.jpg", Body=b'x' * (100 + i))
+    storage.put_object(Bucket='media', Key='files/videos/20240101_clip.mp4', Body=b'v' * 1000)
+    storage.put_object(Bucket='media', Key='files/images/logo.svg', Body=b'<svg/>')
+    storage.put_object(Bucket='media', Key='files/images/logo.svg.gz', Body=b'gz')
+    storage.put_object(Bucket='media', Key='other/readme.txt', Body=b'not media')
+
+
+def test_delimited_listing():
+    """The backends roll keys up into common prefixes and paginate over them."""
+    print("Testing delimited listing...")
+    storage = InMemoryBackend('https://cdn.test')
+    seed(storage)
+    response = storage.list_objects_v2(Bucket='media', Prefix='files/', Delimiter='/', MaxKeys=1)
+    assert [p['Prefix'] for p in response['CommonPrefixes']] == ['files/images/'], response
+    response = storage.list_objects_v2(Bucket='media', Prefix='files/', Delimiter='/', MaxKeys=1,
+                                       ContinuationToken=response['NextContinuationToken'])
+    assert [p['Prefix'] for p in response['CommonPrefixes']] == ['files/videos/'], response
+    assert not response['IsTruncated']
+    print("  ✅ CommonPrefixes and continuation: PASSED")
+
+
+def test_sync_is_incremental():
+    """A second sync only writes what changed in the bucket."""
+    print("\nTesting snapshot sync...")
+    storage = CountingBackend('https://cdn.test')
+    seed(storage)
+    with tempfile.TemporaryDirectory() as tmp:
+        db = os.path.join(tmp, 'inventory.sqlite')
+        inventory = MediaInventory(db)
+        stats = inventory.sync(storage, 'media', workers=4, page_size=2)
+        assert stats == {'added': 8, 'updated': 0, 'removed': 0, 'unchanged': 0}, stats
+        assert inventory.lookup('files/videos/20240101_clip.mp4')['ContentLength'] == 1000
+        assert inventory.lookup('other/readme.txt') is None, "Keys outside the prefix are not inventoried"
+        assert inventory.bytes_by_folder('files/')['videos'] == (1, 1000)
+        print("  ✅ Initial snapshot: PASSED")
+
+        storage.put_object(Bucket='media', Key='files/audio/20240102_song.mp3', Body=b'a' * 50)
+        storage.put_object(Bucket='media', Key='files/images/20240100_photo.jpg', Body=b'changed')
+        storage.delete_object(Bucket='media', Key='files/images/20240104_photo.jpg')
+        inventory.close()
+
+        # Reopening picks up the saved snapshot and applies just the difference
+        inventory = MediaInventory(db)
+        stats = inventory.sync(storage, 'media', workers=4)
+        assert stats == {'added': 1, 'updated': 1, 'removed': 1, 'unchanged': 6}, stats
+        assert inventory.lookup('files/images/20240104_photo.jpg') is None
+        assert inventory.lookup('files/images/20240100_photo.jpg')['ContentLength'] == len(b'changed')
+        inventory.close()
+        print("  ✅ Incremental sync: PASSED")
+
+
+def test_orphan_and_missing_report():
+    """Objects and :::media URLs are cross-referenced in both directions."""
+    print("\nTesting orphan and missing report...")
+    storage = InMemoryBackend('https://cdn.test')
+    seed(storage)
+    with tempfile.TemporaryDirectory() as tmp:
+        src = Path(tmp) / '_src' / 'media'
+        src.mkdir(parents=True)
+        (src / 'post.md').write_text(
+            '---\ntitle: Post\n---\n\n'
+            ':::media\n'
+            '- url: "https://cdn.test/files/images/20240100_photo.jpg"\n'
+            '  mediaType: "image"\n'
+            '- url: "https://cdn.test/files/images/logo.svg"\n'
+            '  mediaType: "image"\n'
+            '- url: "https://cdn.test/files/videos/gone.mp4"\n'
+            '  mediaType: "video"\n'
+            ':::media\n\n'
+            'Elsewhere: https://cdn.test/files/images/20240101_photo.jpg is not in a media block\n',
+            encoding='utf-8'
+        )
+        (src / 'other.md').write_text(
+            ':::media\n- url: "https://example.com/files/images/20240102_photo.jpg"\n:::media\n', encoding='utf-8'
+        )
+
+        inventory = MediaInventory(os.path.join(tmp, 'inventory.sqlite'))
+        inventory.sync(storage, 'media')
+        references = find_media_references(Path(tmp) / '_src')
+        report = build_report(inventory, references, hosts={'cdn.test'})
+        inventory.close()
+
+        assert report['missing'] == {'files/videos/gone.mp4': ['media/post.md']}, report['missing']
+        assert 'files/images/logo.svg.gz' not in report['orphaned'], "Precompressed copies follow their original"
+        assert 'files/images/20240101_photo.jpg' in report['orphaned'], "Only :::media blocks count as references"
+        assert 'files/images/20240102_photo.jpg' in report['orphaned'], "Other hosts do not reference this bucket"
+        assert 'files/videos/20240101_clip.mp4' in report['orphaned']
+        assert report['folders']['images']['bytes'] == sum(100 + i for i in range(5)) + len(b'<svg/>') + 2
+        print("  ✅ Orphaned, missing and bytes per folder: PASSED")
+
+
+def test_dedup_uses_snapshot():
+    """With MEDIA_UPLOAD_INVENTORY set, dedup checks do not send HEAD requests."""
+    print("\nTesting dedup against the snapshot...")
+    storage = CountingBackend('https://cdn.test')
+    with tempfile.TemporaryDirectory() as tmp:
+        db = os.path.join(tmp, 'inventory.sqlite')
+        existing = b'\x89PNG\r\n\x1a\n' + b'old' * 100
+        key = upload_media.upload_deduplicated(existing, 'a.png', storage, 'media')
+        MediaInventory(db).sync(storage, 'media')
+        storage.calls['head_object'] = 0
+
+        os.environ['MEDIA_UPLOAD_INVENTORY'] = db
+        try:
+            assert upload_media.upload_deduplicated(existing, 'b.png', storage, 'media') == key
+            new = b'\x89PNG\r\n\x1a\n' + b'new' * 100
+            new_key = upload_media.upload_deduplicated(new, 'c.png', storage, 'media')
+        finally:
+            del os.environ['MEDIA_UPLOAD_INVENTORY']
+        assert storage.calls['head_object'] == 0, storage.calls
+        assert storage.get_object_bytes(new_key) == new
+        print("  ✅ Local index replaces HEAD requests: PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("Media Inventory Tests")
+    print("=" * 60)
+
+    try:
+        test_delimited_listing()
+        test_sync_is_incremental()
+        test_orphan_and_missing_report()
+        test_dedup_uses_snapshot()
+
+        print("\n" + "=" * 60)
+        print("✅ All tests PASSED!")
+        print("=" * 60)
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ Test FAILED: {e}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n❌ Unexpected error: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Test script for backfill_media_metadata.py.
+Uses an in-memory fake S3 client so no credentials or network are needed.
+"""
+
+import sys
+import os
+import json
+import tempfile
+import threading
+
+# Add parent directory to path to import the scripts
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '.github', 'scripts'))
+
+from backfill_media_metadata import backfill
+from upload_media import object_headers
+
+
+class FakeS3Client:
+    """Bucket of objects with headers, paginated listings and optional failing keys."""
+
+    def __init__(self, keys, fail_keys=()):
+        self.lock = threading.Lock()
+        self.objects = {key: {'ContentLength': 100, 'Metadata': {'origin': 'discord'}} for key in keys}
+        self.fail_keys = set(fail_keys)
+        self.copies = []
+
+    def list_objects_v2(self, Bucket, Prefix, MaxKeys, StartAfter=None, ContinuationToken=None):
+        keys = sorted(k for k in self.objects if k.startswith(Prefix))
+        start = ContinuationToken or StartAfter
+        if start:
+            keys = [k for k in keys if k > start]
+        page = keys[:MaxKeys]
+        return {
+            'Contents': [{'Key': k} for k in page],
+            'IsTruncated': len(keys) > MaxKeys,
+            'NextContinuationToken': page[-1] if page else None,
+        }
+
+    def head_object(self, Bucket, Key):
+        if Key in self.fail_keys:
+            raise ConnectionError("simulated reset")
+        return dict(self.objects[Key])
+
+    def copy_object(self, Bucket, Key, CopySource, MetadataDirective, Metadata, ACL, **headers):
+        assert CopySource == {'Bucket': Bucket, 'Key': Key}
+        assert MetadataDirective == 'REPLACE' and ACL == 'public-read'
+        with self.lock:
+            self.copies.append(Key)
+            self.objects[Key].update(headers, Metadata=Metadata)
+
+
+KEYS = [f"files/images/2024{i:04d}_photo.jpg" for i in range(7)] + ['files/videos/20240101_clip.mp4']
+
+
+def test_dry_run_reports_without_writing():
+    """A dry run lists every planned change and copies nothing."""
+    print("Testing dry run...")
+    s3 = FakeS3Client(KEYS)
+    report = backfill(s3, 'bucket', workers=4, dry_run=True, page_size=3)
+    assert report['counts'] == {'would-update': len(KEYS)}, report['counts']
+    assert report['folders'] == {'images': 7, 'videos': 1}, report['folders']
+    changes = report['changes']['files/videos/20240101_clip.mp4']['changes']
+    assert changes['ContentType'] == (None, 'video/mp4'), changes
+    assert s3.copies == [], "Dry run must not rewrite objects"
+    print("  ✅ Dry-run report: PASSED")
+
+
+def test_backfill_rewrites_metadata():
+    """Objects get the policy headers, keep their user metadata and are skipped next time."""
+    print("\nTesting metadata rewrite...")
+    s3 = FakeS3Client(KEYS)
+    report = backfill(s3, 'bucket', workers=4, page_size=3)
+    assert report['counts'] == {'updated': len(KEYS)}, report['counts']
+    obj = s3.objects['files/videos/20240101_clip.mp4']
+    for name, value in object_headers('files/videos/20240101_clip.mp4').items():
+        assert obj[name] == value, f"{name}: {obj.get(name)!r}"
+    assert obj['Metadata'] == {'origin': 'discord'}, "User metadata must be preserved"
+
+    report = backfill(s3, 'bucket', workers=4, page_size=3)
+    assert report['counts'] == {'unchanged': len(KEYS)}, report['counts']
+    print("  ✅ Rewrite and idempotence: PASSED")
+
+
+def test_precompressed_and_unmanaged_headers():
+    """Precompressed copies keep their original's type and encoding; unmanaged headers survive the copy."""
+    print("\nTesting precompressed copies and carried headers...")
+    svg = 'files/images/20240101_logo.svg'
+    s3 = FakeS3Client([svg, svg + '.gz', svg + '.br', 'files/20240101_notes.txt', 'files/20240101_data.json.gz'])
+    for key, encoding in ((svg + '.gz', 'gzip'), (svg + '.br', 'br')):
+        s3.objects[key].update(object_headers(svg), ContentEncoding=encoding)
+    s3.objects['files/20240101_notes.txt'].update(ContentLanguage='es', ContentEncoding='identity')
+    s3.objects['files/20240101_data.json.gz']['ContentEncoding'] = 'gzip'
+
+    report = backfill(s3, 'bucket', workers=2)
+    assert svg + '.gz' not in s3.copies and svg + '.br' not in s3.copies, s3.copies
+    assert report['counts'] == {'unchanged': 2, 'updated': 3}, report['counts']
+
+    notes = s3.objects['files/20240101_notes.txt']
+    assert notes['ContentLanguage'] == 'es' and notes['ContentEncoding'] == 'identity', notes
+    assert notes['ContentType'] == object_headers('files/20240101_notes.txt')['ContentType']
+    data = s3.objects['files/20240101_data.json.gz']
+    assert data['ContentEncoding'] == 'gzip', "Uploaded archives keep their own Content-Encoding"
+
+    del s3.objects[svg + '.br']['ContentEncoding']
+    backfill(s3, 'bucket', workers=2)
+    assert s3.objects[svg + '.br']['ContentEncoding'] == 'br', "A missing Content-Encoding is restored"
+    assert s3.objects[svg + '.br']['ContentType'] == 'image/svg+xml'
+    print("  ✅ Precompressed copies and unmanaged headers preserved: PASSED")
+
+
+def test_checkpoint_resume():
+    """An interrupted backfill resumes from the checkpoint and retries failed objects."""
+    print("\nTesting checkpoint and resume...")
+    with tempfile.TemporaryDirectory() as tmp:
+        checkpoint = os.path.join(tmp, 'checkpoint.json')
+        failing = KEYS[4]
+        s3 = FakeS3Client(KEYS, fail_keys=[failing])
+        report = backfill(s3, 'bucket', workers=2, checkpoint_path=checkpoint, page_size=3)
+        assert report['counts']['failed'] == 1
+
+        with open(checkpoint, encoding='utf-8') as f:
+            saved = json.load(f)
+        assert saved['last_key'] == KEYS[3], f"Checkpoint moved past the failure: {saved['last_key']}"
+
+        s3.fail_keys.clear()
+        s3.copies.clear()
+        backfill(s3, 'bucket', workers=2, checkpoint_path=checkpoint, page_size=3)
+        assert s3.copies[0] == failing, f"Resume should start at the failed key: {s3.copies}"
+        assert KEYS[0] not in s3.copies, "Objects before the checkpoint must not be revisited"
+        print("  ✅ Resume from checkpoint: PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("Metadata Backfill Tests")
+    print("=" * 60)
+
+    try:
+        test_dry_run_reports_without_writing()
+        test_backfill_rewrites_metadata()
+        test_precompressed_and_unmanaged_headers()
+        test_checkpoint_resume()
+
+        print("\n" + "=" * 60)
+        print("✅ All tests PASSED!")
+        print("=" * 60)
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ Test FAILED: {e}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n❌ Unexpected error: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
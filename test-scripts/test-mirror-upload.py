@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Test script for fan-out uploads to mirror storage targets.
+Uses the in-memory and local-directory backends, so no credentials or network are needed.
+"""
+
+import sys
+import os
+import json
+import tempfile
+
+# Add parent directory to path to import the upload_media module
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '.github', 'scripts'))
+
+from media_storage import InMemoryBackend, LocalDirectoryBackend, MirrorError, MirroredStorage, MirrorTarget
+from upload_media import (
+    build_content_s3_key, build_staging_s3_key, load_mirror_targets, promote_staged_object,
+    upload_stream_to_s3, upload_to_s3,
+)
+
+
+class FlakyBackend(InMemoryBackend):
+    """In-memory backend whose part uploads fail from a given part number on."""
+
+    def __init__(self, fail_from_part):
+        super().__init__('https://flaky.test')
+        self.fail_from_part = fail_from_part
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, ContentMD5=None):
+        if PartNumber >= self.fail_from_part:
+            raise ConnectionError("mirror unreachable")
+        return super().upload_part(Bucket, Key, UploadId, PartNumber, Body, ContentMD5)
+
+
+def test_put_fans_out_to_every_target():
+    """A single put lands on the primary and every mirror, and the replica map records it."""
+    print("Testing put fan-out...")
+    with tempfile.TemporaryDirectory() as tmp:
+        primary = InMemoryBackend('https://cdn.test')
+        nas = LocalDirectoryBackend(os.path.join(tmp, 'nas'), base_url='http://nas.local/media')
+        manifest = os.path.join(tmp, 'replicas.json')
+        storage = MirroredStorage(
+            MirrorTarget('primary', primary, 'media'),
+            [MirrorTarget('nas', nas, 'local', required=True)],
+            manifest_path=manifest,
+        )
+
+        data = b'\xff\xd8\xff' + os.urandom(2000)
+        key = upload_to_s3(data, 'photo.jpg', storage, 'media')
+        assert primary.get_object_bytes(key) == data
+        assert nas.get_object_bytes(key) == data
+        assert nas.head_object('local', key)['ContentType'] == 'image/jpeg', "Headers should be mirrored too"
+        assert storage.url(key) == f"https://cdn.test/{key}"
+
+        with open(manifest, encoding='utf-8') as f:
+            recorded = json.load(f)
+        assert recorded[key] == {'primary': f"https://cdn.test/{key}", 'nas': f"http://nas.local/media/{key}"}, recorded
+        print("  ✅ Object and replica map on every target: PASSED")
+
+
+def test_multipart_reads_stream_once():
+    """Each streamed part is sent to every target from the same buffer."""
+    print("\nTesting multipart fan-out...")
+    primary = InMemoryBackend('https://cdn.test')
+    mirror = InMemoryBackend('https://mirror.test')
+    storage = MirroredStorage(MirrorTarget('primary', primary, 'media'), [MirrorTarget('eu', mirror, 'media-eu')])
+
+    reads = []
+    data = os.urandom(10_000)
+
+    def chunks():
+        for i in range(0, len(data), 1000):
+            reads.append(i)
+            yield data[i:i + 1000]
+
+    upload_stream_to_s3(chunks(), 'files/videos/clip.mp4', storage, 'media', part_size=4096)
+    assert len(reads) == 10, "The source stream must be read exactly once"
+    assert primary.get_object_bytes('files/videos/clip.mp4') == data
+    assert mirror.get_object_bytes('files/videos/clip.mp4') == data
+    assert set(storage.replicas['files/videos/clip.mp4']) == {'primary', 'eu'}
+    print("  ✅ Parts fanned out from one read: PASSED")
+
+
+def test_best_effort_mirror_failure():
+    """A failing best-effort mirror is dropped and reported; the upload still succeeds."""
+    print("\nTesting best-effort mirror failure...")
+    primary = InMemoryBackend('https://cdn.test')
+    flaky = FlakyBackend(fail_from_part=2)
+    storage = MirroredStorage(MirrorTarget('primary', primary, 'media'),
+                              [MirrorTarget('flaky', flaky, 'x', required=False)])
+
+    data = os.urandom(10_000)
+    upload_stream_to_s3(iter([data]), 'files/videos/a.mp4', storage, 'media', part_size=4096)
+    assert primary.get_object_bytes('files/videos/a.mp4') == data
+    assert 'files/videos/a.mp4' not in flaky.objects
+    assert flaky.list_multipart_uploads(Bucket='x')['Uploads'] == [], "Failed mirror upload should be aborted"
+    assert 'flaky' in storage.failures['files/videos/a.mp4']
+    assert storage.replicas['files/videos/a.mp4'] == {'primary': 'https://cdn.test/files/videos/a.mp4'}
+    print("  ✅ Best-effort failure recorded: PASSED")
+
+
+def test_required_mirror_failure():
+    """A failing required mirror fails the upload and aborts it everywhere."""
+    print("\nTesting required mirror failure...")
+    primary = InMemoryBackend('https://cdn.test')
+    flaky = FlakyBackend(fail_from_part=2)
+    storage = MirroredStorage(MirrorTarget('primary', primary, 'media'),
+                              [MirrorTarget('flaky', flaky, 'x', required=True)])
+    try:
+        upload_stream_to_s3(iter([os.urandom(10_000)]), 'files/videos/b.mp4', storage, 'media', part_size=4096)
+        raise AssertionError("Expected MirrorError")
+    except MirrorError:
+        pass
+    assert 'files/videos/b.mp4' not in primary.objects
+    assert primary.list_multipart_uploads(Bucket='media')['Uploads'] == [], "Primary upload should be aborted"
+    print("  ✅ Required failure aborts the upload: PASSED")
+
+
+def test_mirror_configuration():
+    """MEDIA_UPLOAD_MIRRORS entries become targets with their success policy."""
+    print("\nTesting mirror configuration...")
+    with tempfile.TemporaryDirectory() as tmp:
+        config = json.dumps([
+            {'name': 'nas', 'kind': 'local', 'dir': tmp, 'required': True},
+            {'name': 'scratch', 'kind': 'memory'},
+        ])
+        targets = load_mirror_targets(config)
+        assert [(t.name, t.required) for t in targets] == [('nas', True), ('scratch', False)]
+        assert isinstance(targets[0].backend, LocalDirectoryBackend)
+
+        path = os.path.join(tmp, 'mirrors.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(config)
+        assert len(load_mirror_targets(path)) == 2, "A file path should be accepted too"
+    print("  ✅ JSON and file configuration: PASSED")
+
+def test_promoted_upload_leaves_only_final_key():
+    """Promoting a staged upload drops the staging key from the replica map."""
+    print("\nTesting staged promotion through mirrors...")
+    with tempfile.TemporaryDirectory() as tmp:
+        primary = InMemoryBackend('https://cdn.test')
+        mirror = InMemoryBackend('https://mirror.test')
+        manifest = os.path.join(tmp, 'replicas.json')
+        storage = MirroredStorage(
+            MirrorTarget('primary', primary, 'media'),
+            [MirrorTarget('mirror', mirror, 'media', required=True)],
+            manifest_path=manifest,
+        )
+
+        data = os.urandom(3000)
+        staging_key = build_staging_s3_key('clip.mp4')
+        size, digest = upload_stream_to_s3([data], staging_key, storage, 'media')
+        final_key = build_content_s3_key('clip.mp4', digest)
+        assert promote_staged_object(storage, 'media', staging_key, final_key, size) == final_key
+
+        with open(manifest, encoding='utf-8') as f:
+            recorded = json.load(f)
+        assert set(recorded) == {final_key}, recorded
+        assert staging_key not in storage.replicas
+        assert mirror.get_object_bytes(final_key) == data
+        print("  ✅ Only the final key is in the replica map: PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("Mirror Upload Tests")
+    print("=" * 60)
+
+    try:
+        test_put_fans_out_to_every_target()
+        test_multipart_reads_stream_once()
+        test_best_effort_mirror_failure()
+        test_required_mirror_failure()
+        test_promoted_upload_leaves_only_final_key()
+        test_mirror_configuration()
+
+        print("\n" + "=" * 60)
+        print("✅ All tests PASSED!")
+        print("=" * 60)
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ Test FAILED: {e}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n❌ Unexpected error: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
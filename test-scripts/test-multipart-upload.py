@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Test script for parallel multipart uploads in upload_to_s3.
+Uses an in-memory fake S3 client so no credentials or network are needed.
+"""
+
+import sys
+import os
+import time
+import threading
+from datetime import datetime, timedelta, timezone
+
+# Add parent directory to path to import the upload_media module
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '.github', 'scripts'))
+
+import upload_media
+from upload_media import abort_stale_multipart_uploads, choose_transfer_settings, upload_to_s3
+
+MIB = 1024 * 1024
+
+
+class FakeS3Client:
+    """Thread-safe fake that tracks part concurrency and can fail parts."""
+
+    def __init__(self, failures=None):
+        self.lock = threading.Lock()
+        self.objects = {}
+        self.uploads = {}
+        self.calls = []
+        self.failures = dict(failures or {})  # part number -> remaining failures
+        self.active = 0
+        self.peak = 0
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.calls.append('put_object')
+        self.objects[Key] = Body
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self.calls.append('create_multipart_upload')
+        self.uploads['u1'] = {}
+        return {'UploadId': 'u1'}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, ContentMD5):
+        with self.lock:
+            self.calls.append(('upload_part', PartNumber))
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            fail = self.failures.get(PartNumber, 0) > 0
+            if fail:
+                self.failures[PartNumber] -= 1
+        try:
+            time.sleep(0.02)
+            if fail:
+                raise ConnectionError(f"reset on part {PartNumber}")
+            self.uploads[UploadId][PartNumber] = Body
+            return {'ETag': f'"{PartNumber}"'}
+        finally:
+            with self.lock:
+                self.active -= 1
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self.calls.append('complete_multipart_upload')
+        parts = self.uploads.pop(UploadId)
+        self.objects[Key] = b''.join(parts[p['PartNumber']] for p in MultipartUpload['Parts'])
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.calls.append(('abort_multipart_upload', Key))
+        self.uploads.pop(UploadId, None)
+
+
+def with_env(**env):
+    """Set environment variables for the duration of a test."""
+    class Env:
+        def __enter__(self):
+            self.saved = {k: os.environ.get(k) for k in env}
+            os.environ.update({k: str(v) for k, v in env.items()})
+
+        def __exit__(self, *exc):
+            for k, v in self.saved.items():
+                if v is None:
+                    os.environ.pop(k, None)
+                else:
+                    os.environ[k] = v
+    return Env()
+
+
+def test_transfer_settings():
+    """Part size grows with file size; concurrency is capped by part count."""
+    print("Testing size-aware transfer settings...")
+    assert choose_transfer_settings(20 * MIB) == (8 * MIB, 3)
+    assert choose_transfer_settings(500 * MIB)[0] == 16 * MIB
+    assert choose_transfer_settings(4 * 1024 * MIB)[0] == 64 * MIB
+    part_size, _ = choose_transfer_settings(1000 * 1024 * MIB)
+    assert -(-1000 * 1024 * MIB // part_size) <= 10000, "Part count must stay under the S3 limit"
+    with with_env(MEDIA_UPLOAD_PART_SIZE_MB=5, MEDIA_UPLOAD_PART_CONCURRENCY=2):
+        assert choose_transfer_settings(20 * MIB) == (5 * MIB, 2)
+    print("  ✅ Part size tiers and overrides: PASSED")
+
+
+def test_small_file_single_put():
+    """Files under the threshold keep the single put_object path."""
+    print("\nTesting small file path...")
+    s3 = FakeS3Client()
+    key = upload_to_s3(b'\xff\xd8\xff' + b'x' * 1000, 'photo.jpg', s3, 'bucket')
+    assert s3.calls == ['put_object'], f"Unexpected calls: {s3.calls}"
+    assert key.startswith('files/images/')
+    print("  ✅ Single put_object: PASSED")
+
+
+def test_parallel_parts_with_retry():
+    """Large files are uploaded in parallel parts; a failed part is retried on its own."""
+    print("\nTesting parallel multipart upload...")
+    data = os.urandom(21 * MIB)
+    s3 = FakeS3Client(failures={2: 1})
+    with with_env(MEDIA_UPLOAD_MULTIPART_THRESHOLD_MB=6, MEDIA_UPLOAD_PART_SIZE_MB=5,
+                  MEDIA_UPLOAD_PART_CONCURRENCY=4):
+        original_backoff = upload_media.DEFAULT_HTTP_BACKOFF
+        upload_media.DEFAULT_HTTP_BACKOFF = 0.001
+        try:
+            key = upload_to_s3(data, 'clip.mp4', s3, 'bucket')
+        finally:
+            upload_media.DEFAULT_HTTP_BACKOFF = original_backoff
+
+    assert s3.objects[key] == data, "Reassembled object does not match"
+    part_calls = [c[1] for c in s3.calls if isinstance(c, tuple) and c[0] == 'upload_part']
+    assert sorted(part_calls) == [1, 2, 2, 3, 4, 5], f"Expected part 2 retried once, got {part_calls}"
+    assert s3.peak > 1, "Parts were not uploaded in parallel"
+    print(f"  ✅ 5 parts, peak {s3.peak} in parallel, part 2 retried: PASSED")
+
+
+def test_persistent_failure_aborts():
+    """A part that keeps failing aborts the whole upload."""
+    print("\nTesting abort on persistent failure...")
+    s3 = FakeS3Client(failures={3: 99})
+    with with_env(MEDIA_UPLOAD_MULTIPART_THRESHOLD_MB=6, MEDIA_UPLOAD_PART_SIZE_MB=5,
+                  MEDIA_UPLOAD_PART_RETRIES=1):
+        original_backoff = upload_media.DEFAULT_HTTP_BACKOFF
+        upload_media.DEFAULT_HTTP_BACKOFF = 0.001
+        try:
+            upload_to_s3(os.urandom(12 * MIB), 'clip.mp4', s3, 'bucket')
+            raise AssertionError("Expected ConnectionError")
+        except ConnectionError:
+            pass
+        finally:
+            upload_media.DEFAULT_HTTP_BACKOFF = original_backoff
+    assert any(isinstance(c, tuple) and c[0] == 'abort_multipart_upload' for c in s3.calls), "Upload not aborted"
+    assert not s3.objects
+    print("  ✅ Aborted after retries: PASSED")
+
+
+def test_abort_stale_uploads():
+    """Multipart uploads older than the cutoff are aborted across listing pages."""
+    print("\nTesting stale upload cleanup...")
+    now = datetime.now(timezone.utc)
+
+    class ListingClient(FakeS3Client):
+        pages = [
+            {'Uploads': [{'Key': 'files/videos/old.mp4', 'UploadId': 'a', 'Initiated': now - timedelta(days=3)},
+                         {'Key': 'files/videos/new.mp4', 'UploadId': 'b', 'Initiated': now - timedelta(minutes=5)}],
+             'IsTruncated': True, 'NextKeyMarker': 'files/videos/new.mp4', 'NextUploadIdMarker': 'b'},
+            {'Uploads': [{'Key': 'files/images/older.jpg', 'UploadId': 'c', 'Initiated': now - timedelta(days=30)}],
+             'IsTruncated': False},
+        ]
+
+        def list_multipart_uploads(self, **kwargs):
+            return self.pages[1 if 'KeyMarker' in kwargs else 0]
+
+    s3 = ListingClient()
+    aborted = abort_stale_multipart_uploads(s3, 'bucket', 'files/', 24)
+    assert aborted == 2, f"Expected 2 stale uploads aborted, got {aborted}"
+    assert ('abort_multipart_upload', 'files/videos/new.mp4') not in s3.calls
+    print("  ✅ Aborted 2 stale uploads, kept the recent one: PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("Multipart Upload Tests")
+    print("=" * 60)
+
+    try:
+        test_transfer_settings()
+        test_small_file_single_put()
+        test_parallel_parts_with_retry()
+        test_persistent_failure_aborts()
+        test_abort_stale_uploads()
+
+        print("\n" + "=" * 60)
+        print("✅ All tests PASSED!")
+        print("=" * 60)
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ Test FAILED: {e}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n❌ Unexpected error: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
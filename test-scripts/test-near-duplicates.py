@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+Test script for perceptual-hash near-duplicate detection (media_phash.py).
+Generates photos with Pillow and uses the in-memory storage backend, so no
+credentials or network are needed.
+"""
+
+import sys
+import os
+import io
+import time
+import random
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# Add parent directory to path to import the upload_media module
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '.github', 'scripts'))
+
+import sqlite3
+import upload_media
+from media_images import shutdown_image_pool
+from media_inventory import find_media_items
+from media_phash import (
+    DEFAULT_MAX_DISTANCE, HammingIndex, PhashIndex, build_index, hamming, hashing_available, image_hash,
+    indexed_images
+)
+from media_storage import InMemoryBackend
+from upload_media import UploadContext, process_attachment, report_reused_photos
+
+if hashing_available():
+    from PIL import Image, ImageDraw, ImageFilter
+
+
+def scene(seed, size=(640, 480)):
+    """A photo-like image: a blurred noise background with a few colored shapes."""
+    rng = random.Random(seed)
+    background = Image.effect_noise(size, 60).filter(ImageFilter.GaussianBlur(25))
+    img = Image.merge('RGB', [background.point(lambda v, o=rng.randint(-60, 60): v + o), background,
+                              background.rotate(180)])
+    draw = ImageDraw.Draw(img)
+    for _ in range(8):
+        x, y, s = rng.randint(0, size[0] - 40), rng.randint(0, size[1] - 40), rng.randint(30, 200)
+        draw.ellipse((x, y, x + s, y + s), fill=tuple(rng.randint(0, 255) for _ in range(3)))
+    return img
+
+
+def jpeg(img, quality=90, orientation=None):
+    out = io.BytesIO()
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    img.save(out, format='JPEG', quality=quality, exif=exif)
+    return out.getvalue()
+
+
+def png(img):
+    out = io.BytesIO()
+    img.save(out, format='PNG')
+    return out.getvalue()
+
+
+def test_multi_index_search():
+    """The multi-index finds exactly what a linear scan finds, in well under a millisecond."""
+    print("Testing multi-index Hamming search...")
+    rng = random.Random(7)
+    values = [rng.getrandbits(64) for _ in range(30_000)]
+    index = HammingIndex()
+    for item, value in enumerate(values):
+        index.add(value, item)
+
+    query = values[42] ^ 0b1000_0000_0100_0001  # 3 bits away from entry 42
+    for max_distance in (3, DEFAULT_MAX_DISTANCE, 10):
+        expected = sorted((hamming(query, v), i) for i, v in enumerate(values) if hamming(query, v) <= max_distance)
+        assert sorted(index.search(query, max_distance)) == expected, max_distance
+    assert index.search(query, DEFAULT_MAX_DISTANCE)[0] == (3, 42)
+
+    started = time.perf_counter()
+    for _ in range(100):
+        index.search(rng.getrandbits(64), DEFAULT_MAX_DISTANCE)
+    elapsed = (time.perf_counter() - started) * 10
+    assert elapsed < 1, f"{elapsed:.3f} ms per lookup"
+    print(f"  ✅ Matches a linear scan, {elapsed:.3f} ms per lookup at {len(index)} hashes: PASSED")
+
+
+def test_hash_robustness():
+    """Recompressed, resized and EXIF-rotated copies stay close; different photos do not."""
+    print("\nTesting perceptual hashes...")
+    photo = scene(1)
+    original = image_hash(jpeg(photo))
+    copies = {
+        'quality 40': jpeg(photo, quality=40),
+        'half size': jpeg(photo.resize((320, 240)), quality=70),
+        'PNG': png(photo),
+        'rotated with EXIF': jpeg(photo.rotate(90, expand=True), orientation=6),
+    }
+    for name, data in copies.items():
+        distance = hamming(original, image_hash(data))
+        assert distance <= DEFAULT_MAX_DISTANCE, (name, distance)
+    others = [image_hash(jpeg(scene(seed))) for seed in range(2, 12)]
+    closest = min(hamming(original, other) for other in others)
+    assert closest > 2 * DEFAULT_MAX_DISTANCE, closest
+    assert image_hash(b'\xff\xd8\xff not an image') is None
+    print(f"  ✅ Copies within {DEFAULT_MAX_DISTANCE} bits, other photos at least {closest} apart: PASSED")
+
+
+def screenshot(seed):
+    """A text screenshot: lines of black words on white, which gradient hashes cannot tell apart."""
+    rng = random.Random(seed)
+    words = "the quick brown fox jumps over lazy dog media upload cache index hash photo site post".split()
+    img = Image.new('RGB', (1200, 800), 'white')
+    draw = ImageDraw.Draw(img)
+    y = 20
+    while y < 780:
+        draw.text((20 + rng.randint(0, 40), y), ' '.join(rng.choice(words) for _ in range(rng.randint(3, 14))),
+                  fill='black')
+        y += rng.randint(14, 30)
+    return png(img)
+
+
+def test_screenshots_do_not_match():
+    """Unrelated text screenshots never match each other."""
+    print("\nTesting text screenshots...")
+    with tempfile.TemporaryDirectory() as tmp:
+        index = PhashIndex(os.path.join(tmp, 'phash.sqlite'))
+        shots = [image_hash(screenshot(seed)) for seed in range(10)]
+        for seed, shot in enumerate(shots):
+            assert index.find(shot) is None, f"Screenshot {seed} matched {index.find(shot)}"
+            index.add(f"files/images/shot-{seed}.png", f"https://cdn.test/shot-{seed}.png", shot)
+        index.close()
+    closest = min(hamming(a, b) for i, a in enumerate(shots) for b in shots[i + 1:])
+    print(f"  ✅ 10 screenshots, closest pair {closest} bits apart: PASSED")
+
+
+def test_old_index_is_rebuilt():
+    """An index file from an older schema is emptied instead of failing."""
+    print("\nTesting old index files...")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'phash.sqlite')
+        db = sqlite3.connect(path)
+        db.execute('CREATE TABLE images (key TEXT PRIMARY KEY, url TEXT NOT NULL, dhash TEXT NOT NULL, '
+                   'phash TEXT, details TEXT NOT NULL)')
+        db.execute("INSERT INTO images VALUES ('files/images/a.jpg', 'https://cdn.test/a.jpg', '0', NULL, '{}')")
+        db.commit()
+        db.close()
+        index = PhashIndex(path)
+        assert len(index) == 0
+        index.add('files/images/b.jpg', 'https://cdn.test/b.jpg', image_hash(jpeg(scene(1))))
+        assert index.keys() == {'files/images/b.jpg'}
+        index.close()
+    print("  ✅ Old index emptied and rebuilt: PASSED")
+
+
+def stored_keys(storage):
+    return {obj['Key'] for obj in storage.list_objects_v2(Bucket='media')['Contents']}
+
+
+def media_post(url, width=640, height=480):
+    return (f"Photo\n\n:::media\n- url: \"{url}\"\n  mediaType: \"image\"\n  aspectRatio: \"landscape\"\n"
+            f"  caption: \"Sunset\"\n  width: {width}\n  height: {height}\n:::media\n")
+
+
+def seed_site(tmp, storage, seeds):
+    """Store one photo per seed in the bucket and reference it from a post under _src."""
+    src = Path(tmp) / '_src' / 'media'
+    src.mkdir(parents=True)
+    for seed in seeds:
+        key = f"files/images/2024010{seed}_photo.jpg"
+        storage.put_object(Bucket='media', Key=key, Body=jpeg(scene(seed)))
+        (src / f"post-{seed}.md").write_text(media_post(storage.url(key)), encoding='utf-8')
+    return str(Path(tmp) / '_src')
+
+
+def test_index_build():
+    """The build hashes referenced images once and drops the ones no longer referenced."""
+    print("\nTesting index build...")
+    storage = InMemoryBackend('https://cdn.test')
+    with tempfile.TemporaryDirectory() as tmp:
+        src = seed_site(tmp, storage, range(1, 6))
+        storage.put_object(Bucket='media', Key='files/images/unreferenced.jpg', Body=jpeg(scene(9)))
+        index = PhashIndex(os.path.join(tmp, 'phash.sqlite'))
+        images = indexed_images(find_media_items(src), 'files/')
+        stats = build_index(index, storage, 'media', images, workers=4)
+        assert stats == {'added': 5, 'removed': 0, 'unchanged': 0, 'failed': 0}, stats
+
+        os.remove(os.path.join(src, 'media', 'post-5.md'))
+        images = indexed_images(find_media_items(src), 'files/')
+        stats = build_index(index, storage, 'media', images, workers=4)
+        assert stats == {'added': 0, 'removed': 1, 'unchanged': 4, 'failed': 0}, stats
+        assert index.keys() == {f"files/images/2024010{seed}_photo.jpg" for seed in range(1, 5)}
+
+        match = index.find(image_hash(jpeg(scene(3).resize((400, 300)), quality=60)))
+        assert match.key == 'files/images/20240103_photo.jpg', match
+        assert match.details == {'aspectRatio': 'landscape', 'width': 640, 'height': 480}, match.details
+        assert index.find(image_hash(jpeg(scene(5)))) is None, "Dropped images no longer match"
+        index.close()
+    print("  ✅ Incremental build and lookup: PASSED")
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    body = b''
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(Handler.body)))
+        self.end_headers()
+        self.wfile.write(Handler.body)
+
+
+def test_uploads_reuse_published_photos():
+    """A reposted photo reuses the published URL in buffered and streaming mode; new photos join the index."""
+    print("\nTesting upload pipeline...")
+    storage = InMemoryBackend('https://cdn.test')
+    with tempfile.TemporaryDirectory() as tmp:
+        src = seed_site(tmp, storage, [1])
+        index = PhashIndex(os.path.join(tmp, 'phash.sqlite'))
+        build_index(index, storage, 'media', indexed_images(find_media_items(src), 'files/'), workers=1)
+        published = storage.url('files/images/20240101_photo.jpg')
+        context = UploadContext(s3_client=storage, bucket_name='media', endpoint_url=storage.base_url,
+                                phash_index=index)
+
+        repost = jpeg(scene(1).resize((480, 360)), quality=50)
+        original = upload_media.download_from_github
+        upload_media.download_from_github = lambda url: (repost, '.jpg')
+        try:
+            before = stored_keys(storage)
+            url, media_type = process_attachment(1, 'https://github.com/user-attachments/assets/repost-1', context)
+            assert (url, media_type) == (published, 'image'), url
+            assert stored_keys(storage) == before, "Nothing new is uploaded"
+            assert context.media_details[published]['width'] == 640
+            print("  ✅ Buffered repost reuses the published URL: PASSED")
+
+            upload_media.download_from_github = lambda url: (jpeg(scene(20)), '.jpg')
+            url, _ = process_attachment(2, 'https://github.com/user-attachments/assets/new-1', context)
+            assert url != published and len(index) == 2, "New photos are added to the index"
+            upload_media.download_from_github = lambda url: (jpeg(scene(20), quality=60), '.jpg')
+            again, _ = process_attachment(3, 'https://github.com/user-attachments/assets/new-2', context)
+            assert again == url
+            print("  ✅ New photo indexed and matched by the next upload: PASSED")
+        finally:
+            upload_media.download_from_github = original
+
+        Handler.body = repost
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        context.streaming = True
+        try:
+            before = stored_keys(storage)
+            url, _ = process_attachment(4, f"http://127.0.0.1:{server.server_address[1]}/repost", context)
+        finally:
+            server.shutdown()
+        assert url == published and stored_keys(storage) == before, "The streamed copy is removed again"
+        index.close()
+    print("  ✅ Streamed repost reuses the published URL: PASSED")
+
+    reused = [github_url for github_url, _ in context.reused_photos]
+    assert reused == ['https://github.com/user-attachments/assets/repost-1',
+                      'https://github.com/user-attachments/assets/new-2',
+                      f"http://127.0.0.1:{server.server_address[1]}/repost"], reused
+    with tempfile.TemporaryDirectory() as tmp:
+        summary = os.path.join(tmp, 'summary.md')
+        os.environ['GITHUB_STEP_SUMMARY'] = summary
+        try:
+            report_reused_photos(context.reused_photos)
+        finally:
+            del os.environ['GITHUB_STEP_SUMMARY']
+        with open(summary, encoding='utf-8') as f:
+            text = f.read()
+    assert text.count(published) == 2 and 'repost-1' in text, text
+    print("  ✅ Every reuse reported in the job summary: PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("Near-Duplicate Detection Tests")
+    print("=" * 60)
+
+    if not hashing_available():
+        print("⚠️  NumPy or Pillow is not installed; skipping near-duplicate tests")
+        sys.exit(0)
+
+    try:
+        test_multi_index_search()
+        test_hash_robustness()
+        test_screenshots_do_not_match()
+        test_old_index_is_rebuilt()
+        test_index_build()
+        test_uploads_reuse_published_photos()
+
+        print("\n" + "=" * 60)
+        print("✅ All tests PASSED!")
+        print("=" * 60)
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ Test FAILED: {e}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n❌ Unexpected error: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+    finally:
+        shutdown_image_pool()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Test script for responsive image derivatives (media_images.py).
+Encodes small generated photos and uploads them to the in-memory storage backend.
+"""
+
+import sys
+import os
+import io
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+# Add parent directory to path to import the upload_media module
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '.github', 'scripts'))
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+import upload_media
+from media_images import available_formats, generate_variants, image_dimensions, variant_s3_key
+from media_journal import RunJournal
+from media_storage import InMemoryBackend
+from upload_media import UploadContext, process_attachment, render_media_block
+
+
+def make_jpeg(width, height, orientation=None):
+    img = Image.new('RGB', (width, height), (200, 80, 40))
+    out = io.BytesIO()
+    if orientation:
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        img.save(out, format='JPEG', exif=exif)
+    else:
+        img.save(out, format='JPEG')
+    return out.getvalue()
+
+
+def test_variant_widths_and_formats():
+    """Every configured width below the original is produced in each available format."""
+    print("Testing variant generation...")
+    # A thread pool keeps the test fast; the pipeline uses the shared process pool
+    with ThreadPoolExecutor() as pool:
+        variants = generate_variants(make_jpeg(2000, 1000), 'photo.jpg', (480, 960, 1600, 4000), pool=pool)
+        formats = available_formats()
+        assert 'webp' in formats
+        assert len(variants) == 3 * len(formats), [(v.format, v.width) for v in variants]
+        for variant in variants:
+            with Image.open(io.BytesIO(variant.data)) as img:
+                assert img.format == variant.format.upper()
+                assert img.size == (variant.width, variant.width // 2), img.size
+        print(f"  ✅ {'/'.join(formats)} at 480/960/1600, no upscaling: PASSED")
+
+        small = generate_variants(make_jpeg(300, 200), 'small.png', (480, 960), pool=pool)
+        assert small == [], "Images narrower than every width get no variants"
+        assert generate_variants(b'<svg/>', 'logo.svg', pool=pool) == []
+        assert generate_variants(b'not an image', 'broken.jpg', pool=pool) == []
+        print("  ✅ Small, vector and unreadable images skipped: PASSED")
+
+
+def test_exif_orientation():
+    """Phone photos stored sideways are resized upright."""
+    print("\nTesting EXIF orientation...")
+    data = make_jpeg(1200, 800, orientation=6)
+    assert image_dimensions(data) == (800, 1200)
+    with ThreadPoolExecutor() as pool:
+        variants = generate_variants(data, 'portrait.jpg', (480,), formats=['webp'], pool=pool)
+    assert [(v.width, v.height) for v in variants] == [(480, 720)], variants
+    print("  ✅ Portrait output: PASSED")
+
+
+def test_pipeline_uploads_variants():
+    """process_attachment uploads variants next to the original and records srcset fields."""
+    print("\nTesting pipeline integration...")
+    storage = InMemoryBackend('https://cdn.test')
+    photo = make_jpeg(1400, 700)
+    with tempfile.TemporaryDirectory() as tmp:
+        journal = RunJournal(os.path.join(tmp, 'journal.json'))
+        context = UploadContext(s3_client=storage, bucket_name='media', endpoint_url=storage.base_url,
+                                journal=journal, variant_widths=(480, 960))
+        original = upload_media.download_from_github
+        upload_media.download_from_github = lambda url: (photo, '.jpg')
+        try:
+            permanent_url, media_type = process_attachment(1, 'https://github.com/user-attachments/assets/a-1', context)
+        finally:
+            upload_media.download_from_github = original
+
+        key = permanent_url[len('https://cdn.test/'):]
+        webp_key = variant_s3_key(key, 960, '.webp')
+        assert storage.head_object('media', webp_key)['ContentType'] == 'image/webp'
+        assert 'immutable' in storage.head_object('media', webp_key)['CacheControl']
+        details = context.media_details[permanent_url]
+        assert details['srcsetWebp'] == (f"https://cdn.test/{variant_s3_key(key, 480, '.webp')} 480w, "
+                                         f"https://cdn.test/{webp_key} 960w"), details
+        print("  ✅ Variants uploaded with headers: PASSED")
+
+        # A rerun replays the srcset from the journal without encoding again
+        rerun = UploadContext(s3_client=storage, bucket_name='media', endpoint_url=storage.base_url,
+                              journal=RunJournal(os.path.join(tmp, 'journal.json')), variant_widths=(480, 960))
+        assert process_attachment(1, 'https://github.com/user-attachments/assets/a-1', rerun)[0] == permanent_url
+        assert rerun.media_details[permanent_url] == details
+        print("  ✅ Journal replay keeps srcset: PASSED")
+
+        block = render_media_block(permanent_url, media_type, 'Sunset', details)
+        assert f'  srcsetWebp: "{details["srcsetWebp"]}"' in block
+        assert '  sizes: "' in block and block.startswith(':::media\n- url: ') and block.endswith('\n:::media')
+        print("  ✅ :::media block lists the variants: PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("Responsive Image Tests")
+    print("=" * 60)
+
+    if Image is None:
+        print("⚠️  Pillow is not installed; skipping responsive image tests")
+        sys.exit(0)
+
+    try:
+        test_variant_widths_and_formats()
+        test_exif_orientation()
+        test_pipeline_uploads_variants()
+
+        print("\n" + "=" * 60)
+        print("✅ All tests PASSED!")
+        print("=" * 60)
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ Test FAILED: {e}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n❌ Unexpected error: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Test script for resumable Range-based downloads.
+Runs a local HTTP server that drops connections mid-body, so no external network is needed.
+"""
+
+import sys
+import os
+import re
+import json
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Add parent directory to path to import the upload_media module
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '.github', 'scripts'))
+
+import upload_media
+from media_throttle import get_host_guard
+from upload_media import ResumableDownload, build_http_session, download_to_file
+
+PAYLOAD = bytes(range(256)) * 4096  # 1 MiB of recognisable bytes
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    drops_left = 0          # Number of responses to cut short
+    drop_after = 100_000    # Bytes sent before cutting a response short
+    honor_ranges = True
+    ranges_seen = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        start, end = 0, len(PAYLOAD) - 1
+        range_header = self.headers.get('Range')
+        status = 200
+        if range_header and Handler.honor_ranges:
+            match = re.match(r'bytes=(\d+)-(\d*)', range_header)
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else end
+            status = 206
+            Handler.ranges_seen.append((start, end))
+        body = PAYLOAD[start:end + 1]
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Accept-Ranges', 'bytes' if Handler.honor_ranges else 'none')
+        self.send_header('ETag', '"payload-v1"')
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(PAYLOAD)}')
+        self.end_headers()
+
+        with lock:
+            drop = Handler.drops_left > 0 and len(body) > Handler.drop_after
+            if drop:
+                Handler.drops_left -= 1
+        if drop:
+            self.wfile.write(body[:Handler.drop_after])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+lock = threading.Lock()
+
+
+def start_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/video"
+
+
+def reset(drops=0, honor_ranges=True):
+    Handler.drops_left = drops
+    Handler.honor_ranges = honor_ranges
+    Handler.ranges_seen = []
+
+
+def test_resume_in_memory(url):
+    """A body cut short is resumed from the last good offset."""
+    print("Testing in-memory resume...")
+    reset(drops=2)
+    download = ResumableDownload(url)
+    data = b''.join(download)
+    assert data == PAYLOAD, "Resumed body does not match"
+    assert download.resumes == 2, f"Expected 2 resumes, got {download.resumes}"
+    assert get_host_guard('127.0.0.1')._in_flight == 0, "A fully read body should give back its slot"
+    # Resumes start at the last whole chunk delivered before the drop at byte 100000
+    assert 0 < Handler.ranges_seen[0][0] <= 100_000, f"Unexpected resume offset: {Handler.ranges_seen}"
+    print(f"  ✅ Resumed {download.resumes} time(s) with Range {Handler.ranges_seen}: PASSED")
+
+
+def test_resume_without_range_support(url):
+    """Servers that ignore Range get the already-received prefix skipped."""
+    print("\nTesting resume against a server without Range support...")
+    reset(drops=1, honor_ranges=False)
+    data = b''.join(ResumableDownload(url))
+    assert data == PAYLOAD, "Body does not match after skipping the prefix"
+    print("  ✅ Prefix skipped on full re-download: PASSED")
+
+
+def test_gives_up_after_max_resumes(url):
+    """Persistent failures raise once the resume budget is exhausted."""
+    print("\nTesting resume budget...")
+    reset(drops=10)
+    try:
+        b''.join(ResumableDownload(url, max_resumes=2))
+        raise AssertionError("Expected IOError")
+    except IOError as e:
+        assert 'after 2 resume' in str(e), str(e)
+    print("  ✅ Raises after max resumes: PASSED")
+
+
+def test_checkpoint_resume_across_runs(url):
+    """A checkpointed download resumes from its saved offset on the next run."""
+    print("\nTesting checkpoint resume across runs...")
+    with tempfile.TemporaryDirectory() as tmp:
+        dest = os.path.join(tmp, 'video.mp4')
+        reset(drops=10)
+        try:
+            download_to_file(url, dest, initial=ResumableDownload(url, max_resumes=0))
+            raise AssertionError("Expected the first run to fail")
+        except IOError:
+            pass
+        with open(dest + '.part.json', encoding='utf-8') as f:
+            saved = json.load(f)
+        assert os.path.exists(dest + '.part'), "Partial file should be kept"
+
+        reset()
+        path, content_type = download_to_file(url, dest)
+        with open(path, 'rb') as f:
+            assert f.read() == PAYLOAD, "Resumed file does not match"
+        assert content_type == 'video/mp4'
+        assert Handler.ranges_seen[0][0] == saved['ranges'][0][2], \
+            f"Expected resume at {saved['ranges'][0][2]}, got {Handler.ranges_seen}"
+        assert not os.path.exists(dest + '.part.json'), "Checkpoint should be removed"
+    print(f"  ✅ Second run resumed at byte {saved['ranges'][0][2]}: PASSED")
+
+
+def test_parallel_ranges(url):
+    """Large files can be fetched as parallel byte ranges."""
+    print("\nTesting parallel range download...")
+    with tempfile.TemporaryDirectory() as tmp:
+        dest = os.path.join(tmp, 'video.mp4')
+        reset(drops=1)
+        path, _ = download_to_file(url, dest, range_parts=4, min_parallel_size=1024)
+        with open(path, 'rb') as f:
+            assert f.read() == PAYLOAD, "Parallel download does not match"
+        starts = sorted(start for start, _ in Handler.ranges_seen)
+        assert {262144, 524288, 786432}.issubset(starts), f"Expected 4 ranges, saw {Handler.ranges_seen}"
+        assert get_host_guard('127.0.0.1')._in_flight == 0, "Every range should give back its slot"
+    print("  ✅ Four parallel ranges reassembled: PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("Resumable Download Tests")
+    print("=" * 60)
+
+    server, url = start_server()
+    upload_media._http_session = build_http_session(retries=0)
+    try:
+        test_resume_in_memory(url)
+        test_resume_without_range_support(url)
+        test_gives_up_after_max_resumes(url)
+        test_checkpoint_resume_across_runs(url)
+        test_parallel_ranges(url)
+
+        print("\n" + "=" * 60)
+        print("✅ All tests PASSED!")
+        print("=" * 60)
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ Test FAILED: {e}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n❌ Unexpected error: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+    finally:
+        server.shutdown()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Test script for the crash-safe run journal and atomic content writes.
+No network or S3 access is needed.
+"""
+
+import sys
+import os
+import io
+import json
+import tempfile
+import contextlib
+
+# Add parent directory to path to import the upload_media module
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '.github', 'scripts'))
+
+import upload_media
+from media_journal import RunJournal, write_text_atomic
+from upload_media import (
+    UploadContext,
+    is_already_transformed,
+    process_attachment,
+    transform_content_preserving_positions,
+)
+
+URL_A = 'https://github.com/user-attachments/assets/aaaa-1111'
+URL_B = 'https://github.com/user-attachments/assets/bbbb-2222'
+
+
+def test_journal_round_trip():
+    """Steps are flushed to disk and replayed by a new journal instance."""
+    print("Testing journal persistence...")
+    with tempfile.TemporaryDirectory() as tmp:
+        content_file = os.path.join(tmp, 'content.txt')
+        journal = RunJournal.for_content_file(content_file, target='endpoint/bucket')
+        journal.record(URL_A, 'downloaded', size=10, extension='.jpg')
+        journal.record(URL_A, 'uploaded', s3_key='files/images/a.jpg',
+                       permanent_url='https://cdn/files/images/a.jpg', media_type='image')
+        journal.record(URL_B, 'downloaded', size=20, extension='.png')
+
+        with open(content_file + '.upload-journal.json', encoding='utf-8') as f:
+            data = json.load(f)
+        assert data['entries'][URL_A]['step'] == 'uploaded'
+
+        resumed = RunJournal.for_content_file(content_file, target='endpoint/bucket')
+        assert resumed.completed(URL_A) == ('https://cdn/files/images/a.jpg', 'image')
+        assert resumed.completed(URL_B) is None, "Downloaded-only entries must be uploaded again"
+        assert resumed.replayed == 1
+        print("  ✅ Uploaded entries are replayed: PASSED")
+
+        other = RunJournal.for_content_file(content_file, target='endpoint/other-bucket')
+        assert other.completed(URL_A) is None, "Journal for another bucket must be ignored"
+        print("  ✅ Journal for another target is ignored: PASSED")
+
+        resumed.remove()
+        assert not os.path.exists(content_file + '.upload-journal.json')
+        print("  ✅ Journal removed after completion: PASSED")
+
+
+def test_process_attachment_replays_journal():
+    """A journaled attachment is not downloaded or uploaded again."""
+    print("\nTesting attachment replay...")
+    with tempfile.TemporaryDirectory() as tmp:
+        journal = RunJournal(os.path.join(tmp, 'journal.json'))
+        journal.record(URL_A, 'uploaded', s3_key='files/images/a.jpg',
+                       permanent_url='https://cdn/files/images/a.jpg', media_type='image')
+        context = UploadContext(s3_client=None, bucket_name='bucket', endpoint_url='https://x', journal=journal)
+
+        original = upload_media.download_from_github
+        upload_media.download_from_github = lambda url: (_ for _ in ()).throw(AssertionError("downloaded again"))
+        try:
+            result = process_attachment(1, URL_A, context)
+        finally:
+            upload_media.download_from_github = original
+        assert result == ('https://cdn/files/images/a.jpg', 'image'), f"Unexpected result: {result}"
+        print("  ✅ Replay skips download and upload: PASSED")
+
+
+def run_main(content_file, download):
+    """Run upload_media.main() on content_file with download_from_github replaced; returns (exit code, output)."""
+    original_download, original_argv = upload_media.download_from_github, sys.argv
+    upload_media.download_from_github = download
+    sys.argv = ['upload_media.py', content_file]
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):
+            upload_media.main()
+        return 0, output.getvalue()
+    except SystemExit as e:
+        return e.code, output.getvalue()
+    finally:
+        upload_media.download_from_github, sys.argv = original_download, original_argv
+
+
+def test_journal_dir_survives_fresh_content_file():
+    """A retry with a rebuilt content file replays uploads recorded in MEDIA_UPLOAD_JOURNAL_DIR."""
+    print("\nTesting journal directory across runs...")
+    content = f"Two photos\n\n![a]({URL_A})\n\n![b]({URL_B})\n"
+    downloads = []
+
+    def download(url, fail=()):
+        downloads.append(url)
+        if url in fail:
+            raise IOError("connection reset")
+        return b'\xff\xd8\xff\xe0' + url.encode() * 50, '.jpg'
+
+    settings = {'MEDIA_UPLOAD_STORAGE': 'memory', 'MEDIA_UPLOAD_JOURNAL_KEY': 'issue-42',
+                'MEDIA_UPLOAD_WORKERS': '1', 'MEDIA_UPLOAD_ABORT_STALE_HOURS': '0'}
+    with tempfile.TemporaryDirectory() as tmp:
+        settings['MEDIA_UPLOAD_JOURNAL_DIR'] = os.path.join(tmp, 'journal')
+        os.environ.update(settings)
+        try:
+            def fresh_content_file(run):
+                # The workflow rebuilds the content file from the issue body on every run
+                path = os.path.join(tmp, f"run-{run}", 'media_content.txt')
+                os.makedirs(os.path.dirname(path))
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(content)
+                return path
+
+            code, output = run_main(fresh_content_file(1), lambda url: download(url, fail=(URL_B,)))
+            assert code == 1, f"First run should fail:\n{output}"
+            journal_path = os.path.join(tmp, 'journal', 'issue-42-media_content.txt.upload-journal.json')
+            assert os.path.exists(journal_path), os.listdir(os.path.join(tmp, 'journal'))
+
+            downloads.clear()
+            retry = fresh_content_file(2)
+            code, output = run_main(retry, download)
+            assert code == 0, f"Retry failed:\n{output}"
+            assert downloads == [URL_B], f"Only the failed attachment is downloaded again: {downloads}"
+            assert 'Replayed 1 attachment(s)' in output
+            with open(retry, encoding='utf-8') as f:
+                assert f.read().count('mediaType: "image"') == 2
+
+            # A reopened issue rebuilds the content file again and replays both uploads
+            downloads.clear()
+            code, output = run_main(fresh_content_file(3), download)
+            assert code == 0 and downloads == [], f"Reopened issue downloaded again: {downloads}\n{output}"
+        finally:
+            for name in settings:
+                del os.environ[name]
+    print("  ✅ Retry and reopened issue replay from the saved journal: PASSED")
+
+
+def test_atomic_write():
+    """write_text_atomic replaces the file and leaves no temp files behind."""
+    print("\nTesting atomic write...")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'content.txt')
+        write_text_atomic(path, 'first')
+        write_text_atomic(path, 'second ✨')
+        with open(path, encoding='utf-8') as f:
+            assert f.read() == 'second ✨'
+        assert os.listdir(tmp) == ['content.txt'], f"Leftover files: {os.listdir(tmp)}"
+        print("  ✅ Atomic replace: PASSED")
+
+
+def test_already_transformed_detection():
+    """Content rewritten into :::media blocks is detected on a rerun."""
+    print("\nTesting already-transformed detection...")
+    content = f"Look at this\n\n![sunset]({URL_A})\n\nNice"
+    assert not is_already_transformed(content)
+
+    url_mapping = {URL_A: ('https://cdn.example.com/files/images/a.jpg', 'sunset', 'image')}
+    transformed = transform_content_preserving_positions(content, url_mapping, [], [])
+    assert ':::media' in transformed
+    assert is_already_transformed(transformed), "Transformed content should be detected"
+    assert not is_already_transformed(transformed + f"\n\n![more]({URL_B})"), \
+        "New attachments still need processing"
+    assert not is_already_transformed(transformed + "\n\nhttps://www.youtube.com/watch?v=dQw4w9WgXcQ"), \
+        "YouTube links still need formatting"
+    print("  ✅ Transformed content detected: PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("Run Journal Tests")
+    print("=" * 60)
+
+    try:
+        test_journal_round_trip()
+        test_process_attachment_replays_journal()
+        test_journal_dir_survives_fresh_content_file()
+        test_atomic_write()
+        test_already_transformed_detection()
+
+        print("\n" + "=" * 60)
+        print("✅ All tests PASSED!")
+        print("=" * 60)
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ Test FAILED: {e}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n❌ Unexpected error: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
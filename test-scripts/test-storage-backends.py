@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Test script for the pluggable storage backends in media_storage.py.
+Runs the real upload functions against the local-directory and in-memory
+backends, so no credentials or network are needed.
+"""
+
+import sys
+import os
+import tempfile
+from datetime import timedelta
+
+# Add parent directory to path to import the upload_media module
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '.github', 'scripts'))
+
+import upload_media
+from media_storage import InMemoryBackend, LocalDirectoryBackend, S3Backend, create_storage_backend
+from upload_media import (
+    UploadContext,
+    abort_stale_multipart_uploads,
+    find_existing_object,
+    process_attachment,
+    upload_stream_to_s3,
+    upload_to_s3,
+)
+
+
+def exercise_backend(name, storage):
+    """Put, multipart, head, list, copy, delete and URL generation through one backend."""
+    print(f"Testing {name} backend...")
+
+    small = b'\xff\xd8\xff' + os.urandom(1000)
+    key = upload_to_s3(small, 'photo.jpg', storage, 'bucket')
+    assert storage.get_object_bytes(key) == small
+    head = find_existing_object(storage, 'bucket', key, len(small))
+    assert head is not None and head['ContentType'] == 'image/jpeg', head
+    print("  ✅ put_object and head_object: PASSED")
+
+    data = os.urandom(10_000)
+    total, _ = upload_stream_to_s3(iter([data[:3000], data[3000:]]), 'files/videos/clip.mp4', storage, 'bucket',
+                                   part_size=4096)
+    assert total == len(data) and storage.get_object_bytes('files/videos/clip.mp4') == data
+    assert storage.head_object('bucket', 'files/videos/clip.mp4')['ETag'].endswith('-3"'), "Expected a 3-part ETag"
+    print("  ✅ Multipart upload: PASSED")
+
+    storage.copy_object(Bucket='bucket', Key='files/videos/copy.mp4',
+                        CopySource={'Bucket': 'bucket', 'Key': 'files/videos/clip.mp4'})
+    pages, kwargs = [], {'Bucket': 'bucket', 'Prefix': 'files/', 'MaxKeys': 2}
+    while True:
+        response = storage.list_objects_v2(**kwargs)
+        pages.append([obj['Key'] for obj in response['Contents']])
+        if not response['IsTruncated']:
+            break
+        kwargs['ContinuationToken'] = response['NextContinuationToken']
+    listed = [k for page in pages for k in page]
+    assert listed == sorted([key, 'files/videos/clip.mp4', 'files/videos/copy.mp4']), listed
+    assert len(pages) == 2, f"Expected 2 pages, got {pages}"
+    print("  ✅ Paginated listing and copy: PASSED")
+
+    storage.delete_object(Bucket='bucket', Key='files/videos/copy.mp4')
+    assert find_existing_object(storage, 'bucket', 'files/videos/copy.mp4') is None
+    print("  ✅ delete_object: PASSED")
+
+    upload_id = storage.create_multipart_upload(Bucket='bucket', Key='files/videos/stale.mp4')['UploadId']
+    storage._uploads[upload_id]['Initiated'] -= timedelta(days=2)
+    assert abort_stale_multipart_uploads(storage, 'bucket', 'files/', 24) == 1
+    assert storage.list_multipart_uploads(Bucket='bucket', Prefix='files/')['Uploads'] == []
+    print("  ✅ Stale multipart cleanup: PASSED")
+
+    assert storage.url(key) == f"{storage.base_url}/{key}"
+    print("  ✅ URL generation: PASSED")
+
+
+def test_in_memory_backend():
+    exercise_backend('in-memory', InMemoryBackend('https://media.test'))
+
+
+def test_local_backend():
+    print()
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = LocalDirectoryBackend(tmp, base_url='http://localhost:8080/media')
+        exercise_backend('local-directory', storage)
+
+        # Objects are plain files a static server can serve directly
+        keys = [k for k in storage._keys() if k.startswith('files/images/')]
+        assert os.path.isfile(os.path.join(tmp, keys[0])), "Object should be a regular file"
+
+        # Reopening the directory sees the same objects and headers
+        reopened = LocalDirectoryBackend(tmp)
+        assert reopened.head_object('bucket', keys[0])['ContentType'] == 'image/jpeg'
+        assert reopened.url(keys[0]).startswith('file://')
+        print("  ✅ Persistent local objects: PASSED")
+
+
+def test_pipeline_against_backend():
+    """process_attachment uploads through the backend and returns its URL."""
+    print("\nTesting attachment pipeline on the in-memory backend...")
+    storage = create_storage_backend('memory', base_url='https://preview.local')
+    context = UploadContext(s3_client=storage, bucket_name='memory', endpoint_url=storage.base_url)
+    png = b'\x89PNG\r\n\x1a\n' + os.urandom(500)
+
+    original = upload_media.download_from_github
+    upload_media.download_from_github = lambda url: (png, '.png')
+    try:
+        permanent_url, media_type = process_attachment(1, 'https://github.com/user-attachments/assets/abc-123', context)
+    finally:
+        upload_media.download_from_github = original
+
+    assert media_type == 'image'
+    assert permanent_url.startswith('https://preview.local/files/images/'), permanent_url
+    key = permanent_url[len('https://preview.local/'):]
+    assert storage.get_object_bytes(key) == png
+    print("  ✅ End-to-end upload without credentials: PASSED")
+
+
+def test_s3_backend_url():
+    """The S3 backend passes calls through and keeps the CDN URL format."""
+    print("\nTesting S3 backend wrapper...")
+
+    class Client:
+        def head_object(self, Bucket, Key):
+            return {'Key': Key}
+
+    storage = S3Backend(Client(), 'media', 'https://us-east-1.linodeobjects.com', 'https://cdn.lqdev.tech/')
+    assert storage.head_object(Bucket='media', Key='k') == {'Key': 'k'}
+    assert storage.url('files/images/a.jpg') == 'https://cdn.lqdev.tech/files/images/a.jpg'
+    storage = S3Backend(Client(), 'media', 'https://us-east-1.linodeobjects.com')
+    assert storage.url('files/images/a.jpg') == 'https://media.us-east-1.linodeobjects.com/files/images/a.jpg'
+    print("  ✅ S3 pass-through and URLs: PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("Storage Backend Tests")
+    print("=" * 60)
+
+    try:
+        test_in_memory_backend()
+        test_local_backend()
+        test_pipeline_against_backend()
+        test_s3_backend_url()
+
+        print("\n" + "=" * 60)
+        print("✅ All tests PASSED!")
+        print("=" * 60)
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ Test FAILED: {e}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n❌ Unexpected error: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
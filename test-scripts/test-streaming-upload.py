@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Test script for streaming multipart uploads.
+Uses an in-memory fake S3 client so no credentials or network are needed.
+"""
+
+import sys
+import os
+import hashlib
+
+# Add parent directory to path to import the upload_media module
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '.github', 'scripts'))
+
+from upload_media import upload_stream_to_s3, content_md5
+
+
+class FakeS3Client:
+    """Records S3 calls and assembles multipart uploads in memory."""
+
+    def __init__(self, fail_on_part=None):
+        self.objects = {}
+        self.calls = []
+        self.uploads = {}
+        self.fail_on_part = fail_on_part
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.calls.append(('put_object', Key, kwargs))
+        assert kwargs.get('ContentMD5') == content_md5(Body), "Content-MD5 mismatch"
+        self.objects[Key] = Body
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self.calls.append(('create_multipart_upload', Key, kwargs))
+        upload_id = f"upload-{len(self.uploads) + 1}"
+        self.uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, ContentMD5):
+        self.calls.append(('upload_part', Key, {'PartNumber': PartNumber, 'Size': len(Body)}))
+        assert ContentMD5 == content_md5(Body), "Content-MD5 mismatch"
+        if self.fail_on_part == PartNumber:
+            raise ConnectionError("simulated reset")
+        self.uploads[UploadId][PartNumber] = Body
+        return {'ETag': f'"etag-{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self.calls.append(('complete_multipart_upload', Key, MultipartUpload))
+        parts = self.uploads.pop(UploadId)
+        numbers = [p['PartNumber'] for p in MultipartUpload['Parts']]
+        self.objects[Key] = b''.join(parts[n] for n in numbers)
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.calls.append(('abort_multipart_upload', Key, {}))
+        self.uploads.pop(UploadId, None)
+
+
+def chunked(data, size):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+def test_small_file_single_put():
+    """Files smaller than one part use a single put_object."""
+    print("Testing small file upload...")
+    data = b'\xff\xd8\xff' + os.urandom(1000)
+    s3 = FakeS3Client()
+    total, sha = upload_stream_to_s3(chunked(data, 128), 'files/images/a.jpg', s3, 'bucket', part_size=4096)
+
+    assert total == len(data), f"Expected {len(data)} bytes, got {total}"
+    assert sha == hashlib.sha256(data).hexdigest(), "SHA-256 mismatch"
+    assert [c[0] for c in s3.calls] == ['put_object'], f"Unexpected calls: {s3.calls}"
+    assert s3.objects['files/images/a.jpg'] == data
+    print("  ✅ Single put_object: PASSED")
+
+
+def test_multipart_upload():
+    """Large streams are split into parts of part_size bytes."""
+    print("\nTesting multipart upload...")
+    data = os.urandom(10_000)
+    s3 = FakeS3Client()
+    total, sha = upload_stream_to_s3(chunked(data, 700), 'files/videos/b.mp4', s3, 'bucket', part_size=4096)
+
+    assert total == len(data)
+    assert sha == hashlib.sha256(data).hexdigest(), "SHA-256 mismatch"
+    part_sizes = [c[2]['Size'] for c in s3.calls if c[0] == 'upload_part']
+    assert part_sizes == [4096, 4096, 1808], f"Unexpected part sizes: {part_sizes}"
+    assert s3.objects['files/videos/b.mp4'] == data, "Reassembled object does not match"
+    print("  ✅ Multipart split and reassembly: PASSED")
+
+    # Exact multiple of the part size must not send an empty trailing part
+    data = os.urandom(8192)
+    s3 = FakeS3Client()
+    upload_stream_to_s3(chunked(data, 1000), 'files/videos/c.mp4', s3, 'bucket', part_size=4096)
+    part_sizes = [c[2]['Size'] for c in s3.calls if c[0] == 'upload_part']
+    assert part_sizes == [4096, 4096], f"Unexpected part sizes: {part_sizes}"
+    assert s3.objects['files/videos/c.mp4'] == data
+    print("  ✅ Exact part multiple: PASSED")
+
+
+def test_failed_part_aborts_upload():
+    """A failing part aborts the multipart upload and re-raises."""
+    print("\nTesting failure handling...")
+    data = os.urandom(10_000)
+    s3 = FakeS3Client(fail_on_part=2)
+    try:
+        upload_stream_to_s3(chunked(data, 512), 'files/videos/d.mp4', s3, 'bucket', part_size=4096)
+        raise AssertionError("Expected ConnectionError")
+    except ConnectionError:
+        pass
+
+    assert s3.calls[-1][0] == 'abort_multipart_upload', f"Expected abort, got {s3.calls[-1]}"
+    assert 'files/videos/d.mp4' not in s3.objects
+    print("  ✅ Abort on failure: PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("Streaming Upload Tests")
+    print("=" * 60)
+
+    try:
+        test_small_file_single_put()
+        test_multipart_upload()
+        test_failed_part_aborts_upload()
+
+        print("\n" + "=" * 60)
+        print("✅ All tests PASSED!")
+        print("=" * 60)
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ Test FAILED: {e}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n❌ Unexpected error: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
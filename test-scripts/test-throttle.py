@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Test script for the adaptive rate limiter and circuit breaker.
+Uses a fake clock so the tests do not actually sleep.
+"""
+
+import sys
+import os
+import asyncio
+
+# Add parent directory to path to import the media_throttle module
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '.github', 'scripts'))
+
+from media_throttle import (
+    CircuitOpenError,
+    GuardedS3Client,
+    HostGuard,
+    classify_http_response,
+    classify_s3_call,
+    parse_retry_after,
+)
+from botocore.exceptions import ClientError
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+        self.slept += seconds
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeAsyncResponse(FakeResponse):
+    async def aclose(self):
+        self.closed = True
+
+
+def make_guard(**settings):
+    clock = FakeClock()
+    guard = HostGuard('example.com', clock=clock, sleep=clock.sleep, **settings)
+    return guard, clock
+
+
+def slow_down_error():
+    return ClientError(
+        {'Error': {'Code': 'SlowDown', 'Message': 'Please reduce your request rate.'},
+         'ResponseMetadata': {'HTTPStatusCode': 503, 'HTTPHeaders': {}}},
+        'PutObject'
+    )
+
+
+def test_retry_after_parsing():
+    print("Testing Retry-After parsing...")
+    assert parse_retry_after('3') == 3.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0, "Past dates clamp to 0"
+    assert parse_retry_after('soon') is None
+    print("  ✅ Seconds, dates and garbage: PASSED")
+
+
+def test_token_bucket_rate():
+    """Requests beyond the burst are spaced out at the configured rate."""
+    print("\nTesting token bucket...")
+    guard, clock = make_guard(rate=10, max_concurrency=2)
+    for _ in range(12):
+        guard.acquire()
+        guard.release()
+    # 2 tokens of burst, then 10 more at 10/s -> ~1 second
+    assert 0.9 <= clock.slept <= 1.1, f"Expected ~1s of waiting, got {clock.slept:.2f}s"
+    print(f"  ✅ 12 requests at 10/s waited {clock.slept:.2f}s: PASSED")
+
+
+def test_throttle_adapts_and_recovers():
+    """429 with Retry-After halves concurrency, waits, retries; successes raise it again."""
+    print("\nTesting adaptive throttling...")
+    guard, clock = make_guard(rate=100, max_concurrency=8)
+    responses = [FakeResponse(429, {'Retry-After': '2'}), FakeResponse(200)]
+    result = guard.call(lambda: responses.pop(0), classify_http_response)
+
+    assert result.status_code == 200, "Throttled request should be retried"
+    assert guard.counters['throttles'] == 1
+    assert guard.concurrency == 4, f"Expected concurrency 4, got {guard.concurrency}"
+    assert clock.slept >= 2.0, f"Expected to honor Retry-After, slept {clock.slept:.2f}s"
+
+    for _ in range(40):
+        guard.call(lambda: FakeResponse(200), classify_http_response)
+    assert guard.concurrency == 6, f"Expected concurrency to recover to 6, got {guard.concurrency}"
+    print(f"  ✅ Throttled to {guard.counters['min_concurrency']}, recovered to {guard.concurrency}: PASSED")
+
+
+def test_s3_slowdown_is_throttle():
+    """S3 SlowDown errors are treated as throttling, 404s as healthy answers."""
+    print("\nTesting S3 error classification...")
+    assert classify_s3_call(None, slow_down_error())[0] == 'throttle'
+    not_found = ClientError({'Error': {'Code': '404'}, 'ResponseMetadata': {'HTTPStatusCode': 404}}, 'HeadObject')
+    assert classify_s3_call(None, not_found)[0] == 'ok'
+    assert classify_s3_call(None, ConnectionError('reset'))[0] == 'failure'
+
+    class Client:
+        def __init__(self):
+            self.calls = 0
+            self.meta = 'meta'
+
+        def put_object(self, **kwargs):
+            self.calls += 1
+            if self.calls == 1:
+                raise slow_down_error()
+            return {'ETag': '"x"'}
+
+    guard, clock = make_guard(rate=100)
+    client = GuardedS3Client(Client(), guard)
+    assert client.put_object(Bucket='b', Key='k') == {'ETag': '"x"'}
+    assert client.meta == 'meta', "Non-callable attributes should pass through"
+    assert guard.counters['throttles'] == 1
+    print("  ✅ SlowDown retried through GuardedS3Client: PASSED")
+
+
+def test_circuit_breaker():
+    """Consecutive failures open the circuit, which fails fast until the cooldown ends."""
+    print("\nTesting circuit breaker...")
+    guard, clock = make_guard(rate=100, failure_threshold=3, cooldown=30)
+    calls = [0]
+
+    def failing():
+        calls[0] += 1
+        raise ConnectionError('endpoint down')
+
+    for _ in range(3):
+        try:
+            guard.call(failing, classify_http_response)
+        except ConnectionError:
+            pass
+    assert guard.state == 'open', f"Expected open circuit, got {guard.state}"
+
+    try:
+        guard.call(failing, classify_http_response)
+        raise AssertionError("Expected CircuitOpenError")
+    except CircuitOpenError:
+        pass
+    assert calls[0] == 3, "Open circuit must not call the endpoint"
+
+    clock.now += 31
+    result = guard.call(lambda: FakeResponse(200), classify_http_response)
+    assert result.status_code == 200 and guard.state == 'closed', "Trial success should close the circuit"
+    assert guard.counters['circuit_rejections'] == 1
+    print("  ✅ Opens, rejects, and closes after a successful trial: PASSED")
+
+
+def test_throttled_trial():
+    """A 429 on the half-open trial closes the breaker and the retry goes through after the pause."""
+    print("\nTesting throttled half-open trial...")
+    guard, clock = make_guard(rate=100, failure_threshold=1, cooldown=30)
+    guard.call(lambda: FakeResponse(500), classify_http_response)
+    assert guard.state == 'open'
+
+    clock.now += 31
+    responses = iter([FakeResponse(429, {'Retry-After': '5'}), FakeResponse(200)])
+    result = guard.call(lambda: next(responses), classify_http_response)
+    assert result.status_code == 200 and guard.state == 'closed', guard.state
+    assert clock.slept >= 5.0, f"Expected to honor Retry-After, slept {clock.slept:.2f}s"
+
+    result = guard.call(lambda: FakeResponse(200), classify_http_response)
+    assert result.status_code == 200, "Later calls are not rejected"
+    assert guard.counters['circuit_rejections'] == 0
+    print("  ✅ Throttled trial closes the breaker and later calls go through: PASSED")
+
+def test_streamed_response_holds_slot():
+    """With hold=True the slot stays taken until the response is closed, and is freed only once."""
+    print("\nTesting slots held by streamed responses...")
+    guard, clock = make_guard(rate=100, max_concurrency=2)
+    responses = [FakeResponse(429, {'Retry-After': '1'}), FakeResponse(200)]
+    response = guard.call(lambda: responses.pop(0), classify_http_response, hold=True)
+    assert response.status_code == 200
+    assert guard._in_flight == 1, f"Open body should hold one slot, got {guard._in_flight}"
+
+    response.close()
+    response.close()
+    assert response.closed and guard._in_flight == 0, f"Close should free the slot once, got {guard._in_flight}"
+
+    guard.call(lambda: FakeResponse(200), classify_http_response)
+    assert guard._in_flight == 0, "Calls without hold free the slot right away"
+    print("  ✅ Slot held until close, throttled attempt released: PASSED")
+
+
+def test_async_streamed_response_holds_slot():
+    """An async caller waits for a slot held by another open body."""
+    print("\nTesting async slots held by streamed responses...")
+    # Real clock: async waits use asyncio.sleep, which the fake clock cannot see
+    guard = HostGuard('example.com', rate=100, max_concurrency=1)
+
+    async def send():
+        return FakeAsyncResponse(200)
+
+    async def scenario():
+        first = await guard.call_async(send, classify_http_response, hold=True)
+        waiter = asyncio.create_task(guard.call_async(send, classify_http_response, hold=True))
+        await asyncio.sleep(0.2)
+        assert not waiter.done(), "Second request should wait while the first body is open"
+        await first.aclose()
+        second = await asyncio.wait_for(waiter, 1)
+        assert guard._in_flight == 1
+        await second.aclose()
+        assert guard._in_flight == 0
+
+        # Cancelling a waiting caller leaves no slot behind
+        first = await guard.call_async(send, classify_http_response, hold=True)
+        waiter = asyncio.create_task(guard.call_async(send, classify_http_response, hold=True))
+        await asyncio.sleep(0.1)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        await first.aclose()
+        assert guard._in_flight == 0, f"Expected no slots in use, got {guard._in_flight}"
+
+    asyncio.run(scenario())
+    print("  ✅ Waits on the event loop until aclose(): PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("Rate Limiter and Circuit Breaker Tests")
+    print("=" * 60)
+
+    try:
+        test_retry_after_parsing()
+        test_token_bucket_rate()
+        test_throttle_adapts_and_recovers()
+        test_s3_slowdown_is_throttle()
+        test_circuit_breaker()
+        test_throttled_trial()
+        test_streamed_response_holds_slot()
+        test_async_streamed_response_holds_slot()
+
+        print("\n" + "=" * 60)
+        print("✅ All tests PASSED!")
+        print("=" * 60)
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ Test FAILED: {e}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n❌ Unexpected error: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
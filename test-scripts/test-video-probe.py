@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Test script for the MP4/MOV box walker in media_probe.py.
+Builds minimal movie files by hand, so no sample media or ffmpeg is needed.
+"""
+
+import sys
+import os
+import io
+import struct
+
+# Add parent directory to path to import the upload_media module
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '.github', 'scripts'))
+
+import upload_media
+from media_probe import MediaProbe, MovieProbe, file_reader, format_duration, parse_movie, probe_movie
+from media_storage import InMemoryBackend
+from upload_media import UploadContext, process_attachment, transform_content_preserving_positions
+
+IDENTITY = (0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+ROTATE_90 = (0, 0x10000, 0, -0x10000, 0, 0, 0, 0, 0x40000000)
+
+
+def box(box_type, payload, version=None):
+    if version is not None:
+        payload = bytes([version, 0, 0, 0]) + payload
+    return struct.pack('>I', len(payload) + 8) + box_type + payload
+
+
+def mvhd(timescale, duration, version=0):
+    if version == 1:
+        fields = struct.pack('>QQIQ', 0, 0, timescale, duration)
+    else:
+        fields = struct.pack('>IIII', 0, 0, timescale, duration)
+    return box(b'mvhd', fields + b'\x00' * 80, version)
+
+
+def tkhd(width, height, matrix=IDENTITY):
+    fields = struct.pack('>IIIII', 0, 0, 1, 0, 0) + b'\x00' * 16 + struct.pack('>9i', *matrix)
+    return box(b'tkhd', fields + struct.pack('>II', width << 16, height << 16), 0)
+
+
+def video_trak(width, height, matrix=IDENTITY):
+    entry = b'\x00' * 8 + b'\x00' * 16 + struct.pack('>HH', width, height) + b'\x00' * 50
+    entry += box(b'avcC', b'\x01\x64\x00\x1f\xff')
+    stsd = box(b'stsd', struct.pack('>I', 1) + box(b'avc1', entry), 0)
+    mdia = box(b'hdlr', b'\x00' * 4 + b'vide' + b'\x00' * 12, 0) + box(b'minf', box(b'stbl', stsd))
+    return box(b'trak', tkhd(width, height, matrix) + box(b'mdia', mdia))
+
+
+def audio_trak():
+    # ES_Descriptor > DecoderConfigDescriptor (AAC) > AudioSpecificConfig (AAC-LC)
+    decoder_info = b'\x05\x02\x12\x10'
+    decoder_config = b'\x04' + bytes([13 + len(decoder_info)]) + b'\x40\x15' + b'\x00' * 11 + decoder_info
+    es = b'\x03' + bytes([3 + len(decoder_config)]) + b'\x00\x01\x00' + decoder_config
+    entry = b'\x00' * 8 + b'\x00' * 20 + box(b'esds', es, 0)
+    stsd = box(b'stsd', struct.pack('>I', 1) + box(b'mp4a', entry), 0)
+    mdia = box(b'hdlr', b'\x00' * 4 + b'soun' + b'\x00' * 12, 0) + box(b'minf', box(b'stbl', stsd))
+    return box(b'trak', tkhd(0, 0) + box(b'mdia', mdia))
+
+
+def movie(width=1920, height=1080, seconds=83.5, moov_first=True, matrix=IDENTITY, mdat_size=200_000, audio=True):
+    ftyp = box(b'ftyp', b'isom\x00\x00\x02\x00isomiso2avc1mp41')
+    moov = box(b'moov', mvhd(600, int(seconds * 600)) + video_trak(width, height, matrix)
+               + (audio_trak() if audio else b''))
+    mdat = box(b'mdat', b'\x00' * mdat_size)
+    return ftyp + (moov + mdat if moov_first else mdat + moov)
+
+
+class RangeSession:
+    """Stands in for requests.Session, answering Range requests from bytes."""
+
+    def __init__(self, files, supports_range=True):
+        self.files = files
+        self.supports_range = supports_range
+        self.ranges = []
+
+    def get(self, url, headers=None, timeout=None, stream=False):
+        data = self.files[url]
+        start, end = (int(n) for n in headers['Range'][len('bytes='):].split('-'))
+        self.ranges.append((start, end))
+        if not self.supports_range:
+            return FakeResponse(200, data)
+        if start >= len(data):
+            return FakeResponse(416, b'')
+        return FakeResponse(206, data[start:end + 1], {'Content-Range': f"bytes {start}-{end}/{len(data)}"})
+
+
+class FakeResponse:
+    def __init__(self, status_code, body, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.raw = io.BytesIO(body)
+        self.raw.read = lambda n, decode_content=False, _read=self.raw.read: _read(n)
+
+    def raise_for_status(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class RecordingReader:
+    """read_at over bytes that remembers how much was read, like counting Range requests."""
+
+    def __init__(self, data):
+        self.data = data
+        self.requests = []
+
+    def __call__(self, offset, length):
+        self.requests.append((offset, length))
+        return self.data[offset:offset + length]
+
+
+def test_moov_fields():
+    """Duration, display size and codecs come out of mvhd, tkhd and stsd."""
+    print("Testing moov parsing...")
+    reader = RecordingReader(movie())
+    info = probe_movie(reader, len(reader.data))
+    assert info.brand == 'isom' and abs(info.duration - 83.5) < 0.001, info
+    assert info.display_size == (1920, 1080), info
+    assert info.codecs == 'avc1.64001F, mp4a.40.2', info.codecs
+    assert format_duration(info.duration) == '1:24' and format_duration(3725) == '1:02:05'
+    print("  ✅ mvhd, tkhd, avcC and esds: PASSED")
+
+    moov = mvhd(1000, 5 * 3600 * 1000, version=1)
+    assert parse_movie(moov).duration == 5 * 3600, "64-bit mvhd"
+    assert parse_movie(box(b'mvhd', b'\x00' * 4, 0)) is None, "Truncated mvhd is rejected"
+    print("  ✅ Version 1 and malformed boxes: PASSED")
+
+
+def test_rotation():
+    """A 90 degree matrix swaps the displayed width and height."""
+    print("\nTesting rotation matrix...")
+    data = movie(1920, 1080, matrix=ROTATE_90)
+    info = probe_movie(file_reader(io.BytesIO(data)), len(data))
+    assert info.display_size == (1080, 1920), info
+    print("  ✅ Portrait phone video: PASSED")
+
+
+def test_range_reads_skip_mdat():
+    """With moov at the end, random access jumps over mdat instead of reading it."""
+    print("\nTesting random access...")
+    reader = RecordingReader(movie(moov_first=False, mdat_size=5_000_000))
+    info = probe_movie(reader, len(reader.data))
+    assert info is not None and info.width == 1920
+    read = sum(min(length, len(reader.data) - offset) for offset, length in reader.requests)
+    assert read < 2_000, f"Read {read} bytes of {len(reader.data)}"
+    assert len(reader.requests) <= 6, reader.requests
+    print(f"  ✅ {len(reader.requests)} reads, {read} bytes: PASSED")
+
+
+def test_streaming_probe():
+    """The streaming probe keeps only ftyp and moov, wherever moov is."""
+    print("\nTesting streaming probe...")
+    for moov_first in (True, False):
+        data = movie(1280, 720, seconds=12, moov_first=moov_first)
+        probe = MovieProbe()
+        for i in range(0, len(data), 4093):
+            probe.feed(data[i:i + 4093])
+        assert probe.finish() is not None and probe.result.display_size == (1280, 720), moov_first
+        assert probe.result.duration == 12
+    probe = MovieProbe(max_moov=100)
+    probe.feed(movie())
+    assert probe.done and probe.result is None, "Oversized moov is not buffered"
+
+    # MediaProbe picks the movie or image parser from the first bytes
+    probe = MediaProbe()
+    data = movie(640, 480, moov_first=False)
+    for i in range(0, len(data), 7):
+        if probe.feed(data[i:i + 7]):
+            break
+    assert probe.result.display_size == (640, 480)
+    probe = MediaProbe()
+    probe.feed(b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' + struct.pack('>II', 30, 20) + b'\x00' * 20)
+    assert probe.result.display_size == (30, 20)
+    print("  ✅ moov before and after mdat, images still probed: PASSED")
+
+
+def test_direct_links_probed_with_ranges():
+    """Linked MP4s are probed with Range requests; servers without Range support are skipped."""
+    print("\nTesting direct media links...")
+    url = 'https://videos.example.com/talk.mp4'
+    session = RangeSession({url: movie(seconds=600, moov_first=False, mdat_size=1_000_000)})
+    details = upload_media.probe_remote_media([(url, 'video'), ('https://example.com/a.jpg', 'image')], session)
+    assert details[url]['duration'] == 600 and details[url]['width'] == 1920, details
+    assert sum(end - start + 1 for start, end in session.ranges) < 2_000, session.ranges
+
+    block = transform_content_preserving_positions(f"Talk: {url}", {}, [], [(url, 'video')], details)
+    assert '  duration: 600' in block, block
+
+    no_range = RangeSession(session.files, supports_range=False)
+    assert upload_media.probe_remote_media([(url, 'video')], no_range) == {}
+    assert len(no_range.ranges) == 1, "Gives up instead of downloading the whole file"
+    print("  ✅ Range reads for remote files: PASSED")
+
+
+def test_media_block_fields():
+    """Uploaded videos get duration, codecs and their size in the :::media item."""
+    print("\nTesting :::media fields...")
+    storage = InMemoryBackend('https://cdn.test')
+    context = UploadContext(s3_client=storage, bucket_name='media', endpoint_url=storage.base_url)
+    github_url = 'https://github.com/user-attachments/assets/clip-1'
+    original = upload_media.download_from_github
+    upload_media.download_from_github = lambda url: (movie(1920, 1080, moov_first=False, matrix=ROTATE_90), '.mp4')
+    try:
+        permanent_url, media_type = process_attachment(1, github_url, context)
+    finally:
+        upload_media.download_from_github = original
+
+    assert media_type == 'video'
+    block = transform_content_preserving_positions(
+        content=f"Clip\n\n{github_url}",
+        url_mapping={github_url: (permanent_url, 'Clip', media_type)},
+        youtube_urls=[], direct_media_urls=[], media_details=context.media_details
+    )
+    assert '  aspectRatio: "portrait"' in block, block
+    assert '  width: 1080\n  height: 1920\n  duration: 83.5\n  codecs: "avc1.64001F, mp4a.40.2"' in block, block
+    print("  ✅ duration and codecs written: PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("Video Probe Tests")
+    print("=" * 60)
+
+    try:
+        test_moov_fields()
+        test_rotation()
+        test_range_reads_skip_mdat()
+        test_streaming_probe()
+        test_direct_links_probed_with_ranges()
+        test_media_block_fields()
+
+        print("\n" + "=" * 60)
+        print("✅ All tests PASSED!")
+        print("=" * 60)
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ Test FAILED: {e}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n❌ Unexpected error: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)